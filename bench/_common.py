@@ -0,0 +1,149 @@
+"""
+benchmark 公共工具（只用于 bench/ 下的脚本，不属于服务代码）
+
+- setup(): 把 src 加入 sys.path，数据库、锁文件放到临时目录（不会改动 data/ 中的数据库）；必须在导入项目模块之前调用
+- load_module_at(): 从 git 历史中加载某个版本的模块，和当前实现对比
+- MockUpstream: 在子进程中启动 mock 上游（bench/mock_upstream.py），并把 OpenAI / Anthropic 上游地址指向它
+- app_client(): 在进程内启动应用（执行 lifespan），写入测试 Key 并补充 Key 池，返回直连应用的 httpx 客户端
+"""
+
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import types
+from contextlib import asynccontextmanager
+from pathlib import Path
+from typing import List, Optional
+
+
+BENCH_DIR = Path(__file__).resolve().parent
+ROOT_DIR = BENCH_DIR.parent
+SRC_DIR = ROOT_DIR / "src"
+
+
+def setup(db_dir: Optional[str] = None) -> str:
+    """
+    准备运行环境
+
+    Args:
+        db_dir: 数据库目录，为空时使用新建的临时目录
+
+    Returns:
+        数据库目录
+    """
+    if str(SRC_DIR) not in sys.path:
+        sys.path.insert(0, str(SRC_DIR))
+    # 不使用 .env 中的 API 鉴权
+    os.environ["API_SECRET"] = ""
+
+    db_dir = db_dir or tempfile.mkdtemp(prefix="amp-bench-")
+    from configs.config import Settings
+    Settings.DATABASE_DIR = property(lambda self: db_dir)
+    return db_dir
+
+
+def load_module_at(rev: str, path: str, name: str) -> types.ModuleType:
+    """
+    加载 git 历史中某个版本的模块（模块中的 import 按当前 src 解析）
+
+    Args:
+        rev: git 版本，例如 "b36b369^"
+        path: 相对项目根目录的文件路径
+        name: 模块名
+    """
+    source = subprocess.check_output(["git", "-C", str(ROOT_DIR), "show", f"{rev}:{path}"]).decode()
+    module = types.ModuleType(name)
+    module.__file__ = f"{rev}:{path}"
+    exec(compile(source, module.__file__, "exec"), module.__dict__)
+    return module
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+class MockUpstream:
+    """
+    mock 上游（OpenAI Chat Completions / Anthropic Messages，支持流式）
+
+    Args:
+        delay: 每个请求响应前的等待秒数
+        chunks: 流式响应的内容块数
+        slow_delay: API Key 以 slow 开头时额外等待的秒数
+    """
+
+    def __init__(self, delay: float = 0.0, chunks: int = 5, slow_delay: float = 0.0):
+        self.port = _free_port()
+        self.base_url = f"http://127.0.0.1:{self.port}"
+        self._env = {**os.environ, "MOCK_DELAY": str(delay), "MOCK_CHUNKS": str(chunks), "MOCK_SLOW_DELAY": str(slow_delay)}
+        self._process: Optional[subprocess.Popen] = None
+
+    def __enter__(self) -> "MockUpstream":
+        self._process = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "mock_upstream:app", "--port", str(self.port), "--log-level", "warning"],
+            cwd=str(BENCH_DIR),
+            env=self._env,
+        )
+        deadline = time.monotonic() + 15
+        while True:
+            try:
+                socket.create_connection(("127.0.0.1", self.port), timeout=0.2).close()
+                break
+            except OSError:
+                if self._process.poll() is not None or time.monotonic() > deadline:
+                    raise RuntimeError("mock 上游启动失败")
+                time.sleep(0.05)
+
+        # RequestContext 创建时才从 constants 读取上游地址，导入应用前后修改都生效
+        import constants
+        import constants.constants as constant_values
+        for module in (constants, constant_values):
+            module.OPENAI_API_URL = f"{self.base_url}/openai/v1/chat/completions"
+            module.ANTHROPIC_API_URL = f"{self.base_url}/anthropic/v1/messages"
+        return self
+
+    def __exit__(self, *exc):
+        self._process.terminate()
+        self._process.wait()
+
+
+@asynccontextmanager
+async def app_client(keys: List[str], timeout: float = 120):
+    """
+    在进程内启动应用，写入测试 Key（余额 10）并补充 Key 池
+
+    Yields:
+        直连应用（ASGI）的 httpx.AsyncClient
+    """
+    import httpx
+    from app import app
+    from entity.databases.api_key import APIKey
+    from entity.databases.database import SessionLocal
+    from service import refill_task
+
+    async with app.router.lifespan_context(app):
+        db = SessionLocal()
+        try:
+            db.add_all([
+                APIKey(name=f"bench-{i}", api_key=key, ua="bench", proxy="", enabled=True, balance=10, total_balance=10)
+                for i, key in enumerate(keys)
+            ])
+            db.commit()
+        finally:
+            db.close()
+        await refill_task.get_refiller().refill()
+
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=timeout) as client:
+            yield client
+
+
+def quiet():
+    """关闭服务日志输出（benchmark 只打印结果）"""
+    import logging
+    logging.disable(logging.CRITICAL)
@@ -0,0 +1,146 @@
+"""
+余额重算 benchmark：逐 Key SUM 循环（改造前）vs 分组聚合 + 批量 UPDATE（当前 update_all_keys_balance）
+
+在 SQLite（WAL）中生成 N 个 Key 和 M 条请求日志，分别运行：
+- 改造前的实现（从 git 历史加载 d9b0e76^:src/service/databases/key_service.py），每个 Key 一次 SUM 查询；
+  没有索引时每次都是全表扫描，只对前 --old-sample 个 Key 运行并按比例推算
+- 当前实现，有 / 没有覆盖索引 idx_request_log_key_cost 各运行一次
+最后检查两种实现对抽样 Key 算出的余额一致（按余额列精度 DECIMAL(10, 2) 比较：改造前写入未舍入的浮点数）。
+
+生成大数据量较慢，可以用 --db 指定文件重复使用（已存在时不重新生成）。
+
+运行：python bench/bench_balance.py [--keys 2000] [--rows 1000000] [--old-sample 20] [--db /tmp/balance.db]
+"""
+
+import argparse
+import os
+import random
+import sqlite3
+import time
+
+import _common
+
+
+OLD_REV = "d9b0e76^"
+INDEX_SQL = "CREATE INDEX IF NOT EXISTS idx_request_log_key_cost ON api_request_log (key_id, status, cost)"
+
+
+def build(path: str, keys: int, rows: int):
+    """生成测试数据库（Key 余额和总额度都是 10，日志的 key_id / 状态 / 花费随机）"""
+    from sqlalchemy import create_engine
+    import entity.databases  # noqa: F401  注册所有模型
+    from entity.databases.database import Base
+
+    engine = create_engine(f"sqlite:///{path}")
+    Base.metadata.create_all(engine)
+    engine.dispose()
+
+    con = sqlite3.connect(path)
+    con.execute("PRAGMA journal_mode=WAL")
+    con.execute("PRAGMA synchronous=OFF")
+    now = "2026-01-01 00:00:00"
+    con.executemany(
+        "INSERT INTO api_keys (name, api_key, ua, proxy, enabled, balance, total_balance, create_time, update_time) "
+        "VALUES (?, ?, ?, ?, 1, 10, 10, ?, ?)",
+        [(f"bench-{i}", f"sk-{i}", "bench", "", now, now) for i in range(keys)],
+    )
+    rnd = random.Random(1)
+    statuses = ["success"] * 8 + ["error", "cancelled"]
+    start = time.perf_counter()
+    for offset in range(0, rows, 500_000):
+        con.executemany(
+            "INSERT INTO api_request_log (key_id, status, cost, model, provider, create_time, update_time) "
+            "VALUES (?, ?, ?, 'gpt-4o-mini', 'openai', ?, ?)",
+            ((rnd.randint(1, keys), rnd.choice(statuses), round(rnd.random() * 0.001, 6), now, now)
+             for _ in range(min(500_000, rows - offset))),
+        )
+        con.commit()
+    con.close()
+    print(f"generated {keys} keys, {rows:,} log rows in {time.perf_counter() - start:.1f}s")
+
+
+def set_index(path: str, enabled: bool):
+    con = sqlite3.connect(path)
+    if enabled:
+        start = time.perf_counter()
+        con.execute(INDEX_SQL)
+        print(f"index built in {time.perf_counter() - start:.1f}s")
+    else:
+        con.execute("DROP INDEX IF EXISTS idx_request_log_key_cost")
+    con.execute("ANALYZE")
+    con.commit()
+    con.close()
+
+
+def run(path: str, update, label: str, enabled_ids: int = 0) -> float:
+    """
+    运行一次余额重算
+
+    Args:
+        enabled_ids: 大于 0 时只启用 ID 不超过该值的 Key（改造前的实现抽样运行），运行后恢复
+    """
+    from sqlalchemy import create_engine, text
+    from sqlalchemy.orm import sessionmaker
+
+    engine = create_engine(f"sqlite:///{path}")
+    db = sessionmaker(bind=engine)()
+    try:
+        if enabled_ids:
+            db.execute(text("UPDATE api_keys SET enabled = (id <= :n)"), {"n": enabled_ids})
+            db.commit()
+        start = time.perf_counter()
+        stats = update(db)
+        elapsed = time.perf_counter() - start
+        print(f"{label:<32} {elapsed:8.2f}s  keys={stats['total_keys']} updated={stats['updated_keys']} failed={stats['failed_keys']}")
+        if enabled_ids:
+            db.execute(text("UPDATE api_keys SET enabled = 1"))
+            db.commit()
+        return elapsed
+    finally:
+        db.close()
+        engine.dispose()
+
+
+def balances(path: str, limit: int) -> list:
+    con = sqlite3.connect(path)
+    rows = con.execute("SELECT id, ROUND(balance, 2) FROM api_keys WHERE id <= ? ORDER BY id", (limit,)).fetchall()
+    con.close()
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--keys", type=int, default=2000, help="Key 数")
+    parser.add_argument("--rows", type=int, default=1_000_000, help="请求日志行数")
+    parser.add_argument("--old-sample", type=int, default=20, help="改造前的实现只对前 N 个 Key 运行（没有索引时）")
+    parser.add_argument("--db", help="测试数据库文件（已存在时直接使用）")
+    args = parser.parse_args()
+
+    db_dir = _common.setup()
+    _common.quiet()
+    from configs.config import init_database
+    init_database()
+    from service.databases import key_service
+    old_update = _common.load_module_at(OLD_REV, "src/service/databases/key_service.py", "old_key_service").update_all_keys_balance
+
+    path = args.db or os.path.join(db_dir, "balance.db")
+    if not os.path.exists(path):
+        build(path, args.keys, args.rows)
+    keys = sqlite3.connect(path).execute("SELECT COUNT(*) FROM api_keys").fetchone()[0]
+    sample = min(args.old_sample, keys)
+
+    set_index(path, False)
+    elapsed = run(path, old_update, f"old loop, no index ({sample} keys)", sample)
+    print(f"{'':<32} -> {elapsed / sample * 1000:.0f} ms/key, ~{elapsed / sample * keys:.0f}s for {keys} keys")
+    expected = balances(path, sample)
+    run(path, key_service.update_all_keys_balance, "grouped + bulk, no index")
+
+    set_index(path, True)
+    run(path, old_update, "old loop, with index")
+    run(path, key_service.update_all_keys_balance, "grouped + bulk, with index")
+
+    print("balances match old loop:", balances(path, sample) == expected)
+
+
+if __name__ == "__main__":
+    main()
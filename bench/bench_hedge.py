@@ -0,0 +1,71 @@
+"""
+对冲请求 benchmark：Key 池中有一个慢 Key 时，关闭 / 开启对冲的非流式请求尾延迟
+
+mock 上游中 slow 开头的 Key 额外慢 --slow-delay 秒，其余 Key 只有 --delay 延迟。
+依次发送 N 个非流式请求（同一进程中先关闭对冲、再开启对冲，各自使用新的对冲控制器），
+前一半请求积累延迟样本，统计后一半请求的 p50 / 最大延迟和对冲统计。
+
+运行：python bench/bench_hedge.py [-n 60] [--keys 3] [--slow-keys 1] [--slow-delay 3] [--percentile 50] [--min-delay 0.3] [--max-ratio 0.5]
+"""
+
+import argparse
+import asyncio
+import time
+
+import _common
+
+
+BODY = {"model": "gpt-4o-mini", "messages": [{"role": "user", "content": "hi"}]}
+
+
+async def run_mode(client, enabled: bool, args):
+    from service import hedge_service
+
+    # 每种模式使用新的对冲控制器（延迟样本和统计从零开始）
+    hedge_service._controller = hedge_service.HedgeController(
+        enabled=enabled, percentile=args.percentile, max_ratio=args.max_ratio, min_delay=args.min_delay,
+    )
+    latencies = []
+    statuses = set()
+    for _ in range(args.n):
+        start = time.perf_counter()
+        response = await client.post("/v1/chat/completions", json=BODY)
+        latencies.append(time.perf_counter() - start)
+        statuses.add(response.status_code)
+
+    tail = sorted(latencies[args.n // 2:])
+    stats = hedge_service.get_stats()
+    label = "hedge on" if enabled else "hedge off"
+    print(f"{label:<9}  second half p50 {tail[len(tail) // 2]:.2f}s  max {tail[-1]:.2f}s  statuses {sorted(statuses)}  "
+          f"hedged {stats['hedged']} hedge wins {stats['hedge_wins']} cancelled {stats['cancelled']}")
+
+
+async def run(args):
+    keys = [f"bench-key-{i}" for i in range(args.keys)] + [f"slow-key-{i}" for i in range(args.slow_keys)]
+    async with _common.app_client(keys) as client:
+        print(f"keys={args.keys} slow={args.slow_keys} (+{args.slow_delay}s) requests={args.n} "
+              f"percentile=p{args.percentile} min_delay={args.min_delay}s max_ratio={args.max_ratio}")
+        for enabled in (False, True):
+            await run_mode(client, enabled, args)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("-n", type=int, default=60, help="请求数（每种模式）")
+    parser.add_argument("--keys", type=int, default=3, help="正常 Key 数")
+    parser.add_argument("--slow-keys", type=int, default=1, help="慢 Key 数")
+    parser.add_argument("--delay", type=float, default=0.05, help="mock 上游响应延迟（秒）")
+    parser.add_argument("--slow-delay", type=float, default=3.0, help="慢 Key 额外延迟（秒）")
+    parser.add_argument("--percentile", type=float, default=50, help="对冲触发分位数")
+    parser.add_argument("--min-delay", type=float, default=0.3, help="对冲触发延迟下限（秒）")
+    parser.add_argument("--max-ratio", type=float, default=0.5, help="对冲请求比例上限")
+    args = parser.parse_args()
+
+    _common.setup()
+    _common.quiet()
+    with _common.MockUpstream(delay=args.delay, slow_delay=args.slow_delay):
+        asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
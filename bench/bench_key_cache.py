@@ -0,0 +1,77 @@
+"""
+KeyCache micro-benchmark：改造前（列表 + 每次复制 / 遍历）vs 当前实现（槽位表 + 不可变快照）
+
+改造前的实现从 git 历史中加载（b36b369^:src/entity/context/key_cache.py），两者使用相同的 KeyRecord。
+输出每次调用的微秒数：随机选 Key（排除 3 个 ID）、取两个候选、get_all_keys、删除再添加一个 Key，
+以及在 batch() 中删除再添加（改造前没有 batch()，与单独写入相同）。
+
+当前实现每次单独写入都在锁内重建快照（tuple、id -> key 字典、余额索引），耗时随 Key 池大小线性增长；批量写入只在结束时重建一次。
+
+运行：python bench/bench_key_cache.py [--sizes 100,1000,10000,50000]
+"""
+
+import argparse
+import contextlib
+import timeit
+from decimal import Decimal
+
+import _common
+
+
+OLD_REV = "b36b369^"
+
+
+def make_key(key_id: int):
+    from entity.context import KeyRecord
+    return KeyRecord(key_id, f"bench-{key_id}", f"sk-{key_id}", None, None, Decimal(key_id % 100))
+
+
+def per_call_us(fn, number: int) -> float:
+    return timeit.timeit(fn, number=number) / number * 1e6
+
+
+def measure(cache_cls, size: int) -> dict:
+    cache = cache_cls()
+    with getattr(cache, 'batch', contextlib.nullcontext)():
+        for key_id in range(1, size + 1):
+            cache.add_key(make_key(key_id))
+    exclude = {1, 2, 3}
+    number = 20000 if size <= 1000 else 2000
+    middle = size // 2
+    replacement = make_key(middle)
+
+    def remove_add():
+        cache.remove_key(middle)
+        cache.add_key(replacement)
+
+    result = {
+        'select': per_call_us(lambda: cache.get_random_key(exclude), number),
+        'sample2': per_call_us(lambda: cache.sample_keys(2, exclude), number),
+        'get_all': per_call_us(cache.get_all_keys, number),
+        'remove+add': per_call_us(remove_add, 200),
+    }
+    with getattr(cache, 'batch', contextlib.nullcontext)():
+        result['batched'] = per_call_us(remove_add, 200)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sizes", default="100,1000,10000,50000", help="Key 池大小，逗号分隔")
+    args = parser.parse_args()
+
+    _common.setup()
+    from entity.context.key_cache import KeyCache
+    OldKeyCache = _common.load_module_at(OLD_REV, "src/entity/context/key_cache.py", "old_key_cache").KeyCache
+
+    print(f"us per call, old ({OLD_REV}) -> new")
+    columns = ('select', 'sample2', 'get_all', 'remove+add', 'batched')
+    print(f"{'pool':>7}  " + "  ".join(f"{name:>20}" for name in columns))
+    for size in (int(s) for s in args.sizes.split(",")):
+        old, new = measure(OldKeyCache, size), measure(KeyCache, size)
+        cells = [f"{old[name]:8.2f} -> {new[name]:7.2f}" for name in columns]
+        print(f"{size:>7}  " + "  ".join(f"{cell:>20}" for cell in cells))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,47 @@
+"""
+批量测活 benchmark：POST /api/keys/batchCheck 在不同并发数下的总耗时
+
+mock 上游每个请求延迟 --delay 秒，对 N 个 Key 分别以 --parallelism 中的每个并发数测活一次
+（并发 1 相当于改造前的串行测活）。所有 Key 都测活成功，不会被禁用。
+
+运行：python bench/bench_key_check.py [--keys 20] [--delay 1] [--parallelism 1,10]
+"""
+
+import argparse
+import asyncio
+import time
+
+import _common
+
+
+async def run(args):
+    from utils.jwt_utils import create_access_token
+
+    keys = [f"bench-key-{i}" for i in range(args.keys)]
+    async with _common.app_client(keys) as client:
+        client.cookies.set("auth", create_access_token("admin"))
+        key_ids = list(range(1, args.keys + 1))
+        print(f"keys={args.keys} delay={args.delay}s")
+        for parallelism in (int(p) for p in args.parallelism.split(",")):
+            start = time.perf_counter()
+            response = await client.post("/api/keys/batchCheck", json={"key_ids": key_ids, "parallelism": parallelism, "async_job": False})
+            elapsed = time.perf_counter() - start
+            data = response.json().get("data") or {}
+            print(f"parallelism {parallelism:>3}  {elapsed:6.2f}s  success {data.get('success_count')}  fail {data.get('fail_count')}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--keys", type=int, default=20, help="测活的 Key 数")
+    parser.add_argument("--delay", type=float, default=1.0, help="mock 上游响应延迟（秒）")
+    parser.add_argument("--parallelism", default="1,10", help="测活并发数，逗号分隔")
+    args = parser.parse_args()
+
+    _common.setup()
+    _common.quiet()
+    with _common.MockUpstream(delay=args.delay):
+        asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
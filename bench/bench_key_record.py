@@ -0,0 +1,87 @@
+"""
+Key 池记录 benchmark：ORM APIKey 实例 vs KeyRecord（__slots__ 不可变记录）
+
+内存 SQLite 中写入 N 个 Key，分别按 Key 池原来的方式（ORM 查询）和当前方式
+（api_key_mapper.query_available_keys_after，按列查询后构建 KeyRecord）加载：
+- 每个缓存 Key 的内存占用（tracemalloc，Session 关闭后仍存活的对象）
+- 属性访问耗时（选 Key / 发送请求时读取的 api_key、proxy、id）
+- 分页加载 200 个 Key 的耗时（Key 池补充的单页大小）
+
+运行：python bench/bench_key_record.py [--keys 10000]
+"""
+
+import argparse
+import gc
+import timeit
+import tracemalloc
+
+import _common
+
+
+def per_object_bytes(session_factory, load) -> tuple:
+    """加载 Key 并关闭 Session，返回 (对象列表, 每个对象占用的字节数)"""
+    gc.collect()
+    tracemalloc.start()
+    db = session_factory()
+    objects = load(db)
+    db.close()
+    gc.collect()
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return objects, current / len(objects)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--keys", type=int, default=10000, help="Key 数")
+    args = parser.parse_args()
+
+    _common.setup()
+    from sqlalchemy import create_engine
+    from sqlalchemy.orm import sessionmaker
+    import entity.databases  # noqa: F401  注册所有模型
+    from entity.databases.api_key import APIKey
+    from entity.databases.database import Base
+    from mapper import api_key_mapper
+
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(engine)
+    Session = sessionmaker(bind=engine)
+    db = Session()
+    db.add_all([
+        APIKey(name=f"bench-{i}", api_key=f"sk-{'x' * 40}{i}", ua="Mozilla/5.0 bench",
+               proxy=f"http://10.0.0.{i % 250}:8080", enabled=True, balance=10, total_balance=10)
+        for i in range(args.keys)
+    ])
+    db.commit()
+    db.close()
+
+    orm_keys, orm_bytes = per_object_bytes(Session, lambda db: db.query(APIKey).filter(APIKey.enabled == True).all())
+    records, record_bytes = per_object_bytes(Session, lambda db: api_key_mapper.query_available_keys_after(db, 0, args.keys))
+    print(f"keys={args.keys}")
+    print(f"memory per cached key   ORM APIKey {orm_bytes:7.0f} B    KeyRecord {record_bytes:7.0f} B")
+
+    orm_key, record = orm_keys[len(orm_keys) // 2], records[len(records) // 2]
+    number = 1_000_000
+    for attr in ("api_key", "proxy", "id"):
+        orm_ns = timeit.timeit(f"key.{attr}", globals={"key": orm_key}, number=number) / number * 1e9
+        record_ns = timeit.timeit(f"key.{attr}", globals={"key": record}, number=number) / number * 1e9
+        print(f"attribute .{attr:<8}      ORM {orm_ns:10.0f} ns    KeyRecord {record_ns:7.0f} ns")
+
+    def load_orm_page():
+        db = Session()
+        db.query(APIKey).filter(APIKey.id > 0, APIKey.enabled == True).order_by(APIKey.id).limit(200).all()
+        db.close()
+
+    def load_record_page():
+        db = Session()
+        api_key_mapper.query_available_keys_after(db, 0, 200)
+        db.close()
+
+    orm_ms = timeit.timeit(load_orm_page, number=50) / 50 * 1e3
+    record_ms = timeit.timeit(load_record_page, number=50) / 50 * 1e3
+    print(f"load 200 keys           ORM {orm_ms:9.2f} ms    KeyRecord {record_ms:6.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
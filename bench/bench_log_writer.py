@@ -0,0 +1,171 @@
+"""
+请求日志写入吞吐 benchmark：改造前的 5 线程池逐条写入 vs 批量写入线程（RequestLogWriter）
+
+在临时目录的 SQLite（WAL）数据库中写入 N 条日志，计时从第一次提交到全部提交入库：
+- pool: 改造前的方式，每条日志提交到 5 线程的线程池，各自打开会话、插入、提交、refresh
+- writer: 当前方式，提交到队列，由写入线程按批量大小 / 最长等待时间凑批后一次插入、一次提交
+--rate 按固定速率提交（模拟请求到达速率），0 表示尽快提交。
+两种方式写入同一个数据库，按写入前后的行数差检查是否全部入库。
+队列上限默认等于日志条数（只测写入速度）；调小后超出的日志进入溢出缓冲区 / 溢出文件，
+溢出缓冲区也满时丢弃；溢出文件在队列追上时导入，停止前未导入的由重新启动的写入线程导入（单独计时）。
+--lock-seconds 在开始提交时用另一个连接持有数据库写锁（BEGIN EXCLUSIVE）指定秒数，模拟数据库卡住：
+提交耗时（p99 / 最大）应保持在微秒级，锁释放后所有日志仍然入库。
+
+运行：python bench/bench_log_writer.py [-n 5000] [--rate 0] [--batch-size 200] [--latency-ms 50] [--queue-size 0]
+      [--lock-seconds 0] [--mode pool,writer]
+"""
+
+import argparse
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+
+import _common
+
+
+def make_row(i: int) -> dict:
+    """与 build_log_data_from_context 生成的字段一致的日志（不记录请求 / 响应内容）"""
+    return {
+        'request_id': f"{i:032x}", 'attempt': 1, 'key_id': i % 100 + 1,
+        'model': 'gpt-4o-mini', 'res_model': 'gpt-4o-mini', 'provider': 'openai', 'latency_ms': 123, 'proxy': None,
+        'prompt_tokens': 10, 'completion_tokens': 20, 'total_tokens': 30,
+        'input_tokens': 0, 'output_tokens': 0, 'cache_creation_input_tokens': 0, 'cache_read_input_tokens': 0,
+        'cost': Decimal('0.002'), 'request_body': None, 'response_body': None, 'status': 'success', 'http_status_code': 200,
+    }
+
+
+def submit_all(submit, count: int, rate: float) -> str:
+    """按速率提交 count 条日志，返回提交耗时和单次提交耗时（p99 / 最大）"""
+    calls = []
+    start = time.perf_counter()
+    for i in range(count):
+        row = make_row(i)
+        call_start = time.perf_counter()
+        submit(row)
+        calls.append(time.perf_counter() - call_start)
+        if rate:
+            delay = start + (i + 1) / rate - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+    elapsed = time.perf_counter() - start
+    calls.sort()
+    return (f"submit {elapsed:.2f}s, per call p99 {calls[int(len(calls) * 0.99) - 1] * 1e6:.0f}us "
+            f"max {calls[-1] * 1e6:.0f}us")
+
+
+def hold_write_lock(seconds: float) -> threading.Thread:
+    """用另一个连接持有数据库写锁指定秒数（返回时已加锁）"""
+    from configs.config import settings
+
+    locked = threading.Event()
+
+    def hold():
+        con = sqlite3.connect(settings.DATABASE_PATH, isolation_level=None)
+        con.execute("BEGIN EXCLUSIVE")
+        locked.set()
+        time.sleep(seconds)
+        con.execute("COMMIT")
+        con.close()
+
+    thread = threading.Thread(target=hold, name="bench-lock", daemon=True)
+    thread.start()
+    locked.wait()
+    return thread
+
+
+def count_rows() -> int:
+    from entity.databases.database import SessionLocal
+    from entity.databases.request_log import RequestLog
+
+    db = SessionLocal()
+    try:
+        return db.query(RequestLog).count()
+    finally:
+        db.close()
+
+
+def run_pool(args) -> tuple:
+    """改造前：5 线程池，每条日志一个会话、一次提交"""
+    from entity.databases.database import SessionLocal
+    from service.databases import request_log_service
+
+    def save(log_data: dict):
+        db = SessionLocal()
+        try:
+            request_log_service.create_log_from_data(db, log_data)
+        finally:
+            db.close()
+
+    pool = ThreadPoolExecutor(max_workers=5, thread_name_prefix="log-worker")
+    start = time.perf_counter()
+    submitted = submit_all(lambda row: pool.submit(save, row), args.n, args.rate)
+    pool.shutdown(wait=True)
+    return submitted, time.perf_counter() - start
+
+
+def run_writer(args, spill_dir: str) -> tuple:
+    """当前：批量写入线程"""
+    from service.log_writer_service import RequestLogWriter
+
+    writer = RequestLogWriter(args.batch_size, args.latency_ms, args.queue_size or args.n, spill_dir, 0)
+    writer.start()
+    start = time.perf_counter()
+    if args.lock_seconds:
+        hold_write_lock(args.lock_seconds)
+    submitted = submit_all(writer.submit, args.n, args.rate)
+    writer.stop()
+    elapsed = time.perf_counter() - start
+    stats = writer.get_stats()
+    return (f"{submitted}, batches {stats['batches']}, avg batch {stats['avg_batch']}, "
+            f"max batch {stats['max_batch']}, overflowed {stats['overflowed']}, spilled {stats['spilled']}, "
+            f"replayed {stats['replayed']} at {stats['last_replay_rate']:,.0f} rows/s, dropped {stats['spill_dropped']}"), elapsed
+
+
+def replay_leftover(spill_dir: str) -> tuple:
+    """重新启动写入线程，导入停止前未导入的溢出文件"""
+    from service.log_writer_service import RequestLogWriter
+
+    writer = RequestLogWriter(200, 50, 10000, spill_dir, 0)
+    start = time.perf_counter()
+    writer.start()
+    writer.stop()
+    return writer.get_stats()['replayed'], time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("-n", type=int, default=5000, help="日志条数")
+    parser.add_argument("--rate", type=float, default=0, help="每秒提交条数，0 表示尽快提交")
+    parser.add_argument("--batch-size", type=int, default=200, help="写入线程每批最多条数")
+    parser.add_argument("--latency-ms", type=float, default=50, help="写入线程凑批最长等待（毫秒）")
+    parser.add_argument("--queue-size", type=int, default=0, help="写入线程队列上限，0 表示等于日志条数")
+    parser.add_argument("--lock-seconds", type=float, default=0, help="写入线程模式下持有数据库写锁的秒数")
+    parser.add_argument("--mode", default="pool,writer", help="运行的方式，逗号分隔")
+    args = parser.parse_args()
+
+    db_dir = _common.setup()
+    _common.quiet()
+    from configs.config import init_database
+    init_database()
+
+    print(f"rows={args.n} rate={args.rate or 'unthrottled'}")
+    for mode in args.mode.split(","):
+        before = count_rows()
+        if mode == "pool":
+            detail, elapsed = run_pool(args)
+        else:
+            spill_dir = os.path.join(db_dir, "log_spill")
+            detail, elapsed = run_writer(args, spill_dir)
+        written = count_rows() - before
+        print(f"{mode:<7} {elapsed:7.2f}s  {written / elapsed:9,.0f} rows/s  written {written}/{args.n}  ({detail})")
+        if mode == "writer" and written < args.n:
+            replayed, replay_elapsed = replay_leftover(spill_dir)
+            print(f"{'':<7} restart imported {replayed} leftover rows in {replay_elapsed:.2f}s, "
+                  f"total written {count_rows() - before}/{args.n}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+"""
+选 Key 策略仿真：随机选择 vs 延迟感知（两次随机选择，key_selection_strategy = 3）
+
+直接驱动 LatencyTracker 和 inflight_service，不发起网络请求：
+- Key 池：70% 平均延迟 20ms，20% 60ms，10% 200ms 且 30% 失败（失败后换 Key 重试，最多 3 次）
+- 每次尝试的延迟按 对数正态分布 x Key 平均延迟 随机生成，固定随机种子
+- 输出每种策略请求总耗时（包含重试）的 p50 / p95 / p99 / 平均值
+
+运行：python bench/bench_p2c.py [--keys 30] [--requests 3000] [--concurrency 60] [--seed 1]
+"""
+
+import argparse
+import asyncio
+import random
+import statistics
+import time
+import types
+
+import _common
+
+
+def build_keys(count: int, rnd: random.Random) -> list:
+    keys = []
+    for i in range(count):
+        r = rnd.random()
+        mean = 0.02 if r < 0.7 else (0.06 if r < 0.9 else 0.2)
+        keys.append(types.SimpleNamespace(
+            id=i + 1, name=f"bench-{i}", api_key="bench", proxy=f"http://proxy-{i % 6}",
+            mean=mean, error_rate=0.3 if mean == 0.2 else 0.01,
+        ))
+    return keys
+
+
+async def simulate(strategy: str, keys: list, args) -> list:
+    from service import inflight_service
+    from service.latency_service import LatencyTracker
+
+    rnd = random.Random(args.seed)
+    tracker = LatencyTracker()
+    semaphore = asyncio.Semaphore(args.concurrency)
+    latencies = []
+
+    async def one():
+        async with semaphore:
+            start = time.monotonic()
+            for _ in range(3):
+                key = tracker.choose(rnd.sample(keys, 2)) if strategy == "p2c" else rnd.choice(keys)
+                inflight_service.acquire(key.id)
+                attempt_start = time.monotonic()
+                await asyncio.sleep(rnd.lognormvariate(0, 0.5) * key.mean)
+                success = rnd.random() >= key.error_rate
+                inflight_service.release(key.id)
+                context = types.SimpleNamespace(api_key_entity=key, api_key_from_pool=True, retryable=not success, proxy=key.proxy)
+                tracker.record_result(context, success, time.monotonic() - attempt_start)
+                if success:
+                    break
+            latencies.append(time.monotonic() - start)
+
+    await asyncio.gather(*[one() for _ in range(args.requests)])
+    return sorted(latencies)
+
+
+def report(strategy: str, latencies: list):
+    def quantile(p: float) -> float:
+        return latencies[int(len(latencies) * p) - 1] * 1000
+
+    print(f"{strategy:7s} p50 {quantile(0.5):6.1f}ms  p95 {quantile(0.95):6.1f}ms  "
+          f"p99 {quantile(0.99):6.1f}ms  mean {statistics.mean(latencies) * 1000:6.1f}ms")
+
+
+async def run(args):
+    keys = build_keys(args.keys, random.Random(args.seed))
+    print(f"keys={args.keys} requests={args.requests} concurrency={args.concurrency} seed={args.seed}")
+    for strategy in ("random", "p2c"):
+        report(strategy, await simulate(strategy, keys, args))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--keys", type=int, default=30, help="Key 数")
+    parser.add_argument("--requests", type=int, default=3000, help="请求数")
+    parser.add_argument("--concurrency", type=int, default=60, help="并发数")
+    parser.add_argument("--seed", type=int, default=1, help="随机种子")
+    args = parser.parse_args()
+
+    _common.setup()
+    _common.quiet()
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+"""
+余额预留选 Key 开销 benchmark：每次选 Key 时查找可用余额不足的 Key
+
+- full scan: 遍历整个 Key 池计算可用余额（余额 - 待写入花费 - 已预留）
+- bisect: 当前的 reservation_service.short_key_ids，在缓存维护的余额索引中二分查找，
+  只检查余额低于 预估花费 + 最大待写入花费 + 最大预留 的 Key
+Key 池中 --low-fraction 比例的 Key 余额很低（0 ~ 0.2），其余 1 ~ 10；--reserved 个 Key 上有进行中的预留。
+两种方式的结果一致时才输出耗时。
+
+运行：python bench/bench_reservation.py [--sizes 100,1000,10000,50000] [--low-fraction 0.02] [--reserved 50]
+"""
+
+import argparse
+import random
+import timeit
+from decimal import Decimal
+
+import _common
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sizes", default="100,1000,10000,50000", help="Key 池大小，逗号分隔（递增）")
+    parser.add_argument("--low-fraction", type=float, default=0.02, help="低余额 Key 的比例")
+    parser.add_argument("--reserved", type=int, default=50, help="有进行中预留的 Key 数")
+    parser.add_argument("--cost", type=float, default=0.05, help="本次请求的预估花费")
+    args = parser.parse_args()
+
+    _common.setup()
+    from entity.context import KeyRecord
+    from service import cache_service, spend_ledger_task
+    from service.reservation_service import BalanceReservations
+
+    rnd = random.Random(1)
+    ledger = spend_ledger_task.get_ledger()
+
+    def full_scan(reservations: BalanceReservations, cost: float):
+        short, exhausted = set(), set()
+        for key in cache_service.get_all_keys():
+            if key.balance is None:
+                continue
+            available = float(key.balance) - ledger.unflushed(key.id) - reservations._reserved.get(key.id, 0.0)
+            if available < cost:
+                short.add(key.id)
+                if available <= 0:
+                    exhausted.add(key.id)
+        return short, exhausted
+
+    print(f"us per selection, cost={args.cost}, low balance {args.low_fraction:.0%}, {args.reserved} keys reserved")
+    print(f"{'pool':>7}  {'full scan':>10}  {'bisect':>8}  {'examined':>9}  {'short':>6}")
+    size = 0
+    for target in (int(s) for s in args.sizes.split(",")):
+        with cache_service.batch():
+            while size < target:
+                size += 1
+                low = rnd.random() < args.low_fraction
+                balance = round(rnd.uniform(0, 0.2) if low else rnd.uniform(1, 10), 2)
+                cache_service.add_key(KeyRecord(size, f"bench-{size}", f"sk-{size}", None, None, Decimal(str(balance))))
+
+        reservations = BalanceReservations(enabled=True, default_cost=args.cost)
+        for key in rnd.sample(cache_service.get_all_keys(), min(args.reserved, size)):
+            reservations.reserve(key, args.cost)
+
+        expected = full_scan(reservations, args.cost)
+        assert reservations.short_key_ids(args.cost) == expected, "bisect 结果与全量遍历不一致"
+
+        number = 2000 if size <= 1000 else 200
+        scan_us = timeit.timeit(lambda: full_scan(reservations, args.cost), number=number) / number * 1e6
+        bisect_us = timeit.timeit(lambda: reservations.short_key_ids(args.cost), number=number) / number * 1e6
+        bound = args.cost + ledger.max_unflushed() + max(reservations._reserved.values(), default=0.0)
+        examined = sum(1 for balance, _ in cache_service.get_funded_keys() if balance < bound)
+        print(f"{size:>7}  {scan_us:10.1f}  {bisect_us:8.1f}  {examined:>9}  {len(expected[0]):>6}")
+
+
+if __name__ == "__main__":
+    main()
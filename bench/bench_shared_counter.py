@@ -0,0 +1,108 @@
+"""
+跨进程 Key 计数 benchmark（shared_counter_service，共享内存）
+
+- 选 Key / 请求结束时的计数开销：on_acquire + on_release 一对，对比进程内的 inflight_service
+- 跨 worker 读取：get_inflight（汇总所有存活分区）
+- 可见延迟：一个进程写入进行中请求数，另一个进程轮询读到的时间差
+
+启动第二个进程（--role reader）作为另一个 worker，两个进程使用同一个临时数据库目录（同一个共享内存段）。
+只支持有 POSIX 共享内存的系统。
+
+运行：python bench/bench_shared_counter.py [--pairs 200000] [--reads 100000] [--rounds 20]
+"""
+
+import argparse
+import subprocess
+import sys
+import time
+
+import _common
+
+
+def per_call_us(fn, number: int) -> float:
+    start = time.perf_counter()
+    for _ in range(number):
+        fn()
+    return (time.perf_counter() - start) / number * 1e6
+
+
+def reader(args):
+    """另一个 worker：轮询可见延迟，再测量跨分区读取"""
+    _common.setup(args.db_dir)
+    _common.quiet()
+    from service import shared_counter_service
+
+    shared_counter_service.start()
+    print("ready", flush=True)
+    for round_id in range(args.rounds):
+        key_id = 1000 + round_id
+        while shared_counter_service.get_inflight(key_id) == 0:
+            pass
+        print(f"seen {time.perf_counter_ns()}", flush=True)
+    read_us = per_call_us(lambda: shared_counter_service.get_inflight(7), args.reads)
+    print(f"read {read_us}", flush=True)
+    sys.stdin.readline()
+    shared_counter_service.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--pairs", type=int, default=200000, help="计数测量次数")
+    parser.add_argument("--reads", type=int, default=100000, help="读取测量次数")
+    parser.add_argument("--rounds", type=int, default=20, help="可见延迟测量轮数")
+    parser.add_argument("--role", default="writer", help=argparse.SUPPRESS)
+    parser.add_argument("--db-dir", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.role == "reader":
+        reader(args)
+        return
+
+    db_dir = _common.setup()
+    _common.quiet()
+    from service import inflight_service, shared_counter_service
+
+    shared_counter_service.start()
+    if not shared_counter_service.is_active():
+        print("shared counters are not available on this system")
+        return
+
+    def shared_pair():
+        shared_counter_service.on_acquire(7)
+        shared_counter_service.on_release(7)
+
+    def local_pair():
+        inflight_service.acquire(7)
+        inflight_service.release(7)
+
+    print(f"acquire+release pair   shared {per_call_us(shared_pair, args.pairs):6.2f} us    "
+          f"local in-flight dict {per_call_us(local_pair, args.pairs):6.2f} us")
+    print(f"get_inflight, 1 worker {per_call_us(lambda: shared_counter_service.get_inflight(7), args.reads):6.2f} us")
+
+    child = subprocess.Popen(
+        [sys.executable, __file__, "--role", "reader", "--db-dir", db_dir,
+         "--rounds", str(args.rounds), "--reads", str(args.reads)],
+        stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True,
+    )
+    assert child.stdout.readline().strip() == "ready"
+    deltas = []
+    for round_id in range(args.rounds):
+        written = time.perf_counter_ns()
+        shared_counter_service.on_acquire(1000 + round_id)
+        seen = int(child.stdout.readline().split()[1])
+        deltas.append((seen - written) / 1000)
+        time.sleep(0.01)
+    read_us = float(child.stdout.readline().split()[1])
+    workers = len(shared_counter_service.get_stats()['workers'])
+    child.stdin.write("\n")
+    child.stdin.flush()
+    child.wait()
+    shared_counter_service.stop()
+
+    deltas.sort()
+    print(f"get_inflight, {workers} workers {read_us:6.2f} us (read in the second process)")
+    print(f"cross-process visibility  p50 {deltas[len(deltas) // 2]:.1f} us  max {deltas[-1]:.1f} us  ({args.rounds} rounds)")
+
+
+if __name__ == "__main__":
+    main()
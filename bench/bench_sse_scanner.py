@@ -0,0 +1,123 @@
+"""
+SSE 透传 benchmark：逐事件 SDK 解析 + 重新序列化（改造前）vs 字节透传 + 旁路扫描（AnthropicSSEScanner / OpenAISSEScanner）
+
+生成一个 Anthropic / OpenAI 流式响应的字节流（N 个内容块事件和 usage），按 --chunk-size 切分后：
+- sdk: 改造前的方式，每个事件 json.loads -> SDK 事件对象（与 SDK 流式解析相同的 construct_type）
+  -> model_dump_json() 重新序列化（不包含 SDK 自身的 SSE 行解析，改造前的实际开销更高）
+- scanner: 当前方式，字节原样转发，扫描器只解析带 usage 的事件；collect 表示同时累积响应内容（记录响应内容时）
+输出每个事件的微秒数。
+
+运行：python bench/bench_sse_scanner.py [--events 200] [--chunk-size 0] [--route anthropic|openai]
+"""
+
+import argparse
+import json
+import timeit
+
+import _common
+
+
+def anthropic_events(count: int) -> list:
+    events = [
+        ("message_start", {"type": "message_start", "message": {
+            "id": "msg_bench", "type": "message", "role": "assistant", "model": "claude-3-haiku", "content": [],
+            "stop_reason": None, "stop_sequence": None,
+            "usage": {"input_tokens": 120, "output_tokens": 1, "cache_read_input_tokens": 64},
+        }}),
+        ("content_block_start", {"type": "content_block_start", "index": 0, "content_block": {"type": "text", "text": ""}}),
+    ]
+    events += [
+        ("content_block_delta", {"type": "content_block_delta", "index": 0, "delta": {"type": "text_delta", "text": f" token{i}"}})
+        for i in range(count)
+    ]
+    events += [
+        ("content_block_stop", {"type": "content_block_stop", "index": 0}),
+        ("message_delta", {"type": "message_delta", "delta": {"stop_reason": "end_turn", "stop_sequence": None},
+                           "usage": {"output_tokens": count, "credits": 0.001}}),
+        ("message_stop", {"type": "message_stop"}),
+    ]
+    return events
+
+
+def openai_events(count: int) -> list:
+    base = {"id": "chatcmpl-bench", "object": "chat.completion.chunk", "created": 1, "model": "gpt-4o-mini"}
+    events = [
+        (None, {**base, "choices": [{"index": 0, "delta": {"content": f" token{i}"}, "finish_reason": None}]})
+        for i in range(count)
+    ]
+    events.append((None, {**base, "choices": [], "usage": {"prompt_tokens": 120, "completion_tokens": count, "total_tokens": 120 + count}}))
+    return events
+
+
+def encode(events: list) -> bytes:
+    return b"".join(
+        (f"event: {name}\n" if name else "").encode() + f"data: {json.dumps(data)}\n\n".encode()
+        for name, data in events
+    )
+
+
+def split(stream: bytes, events: list, chunk_size: int) -> list:
+    """按事件（chunk_size 为 0）或固定大小切分字节流"""
+    if chunk_size:
+        return [stream[i:i + chunk_size] for i in range(0, len(stream), chunk_size)]
+    return [encode([event]) for event in events]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--events", type=int, default=200, help="内容块事件数")
+    parser.add_argument("--chunk-size", type=int, default=0, help="上游字节块大小，0 表示每个事件一块")
+    parser.add_argument("--route", choices=("anthropic", "openai"), default="anthropic")
+    args = parser.parse_args()
+
+    _common.setup()
+    from anthropic._models import construct_type
+    from anthropic.types import RawMessageStreamEvent
+    from openai._models import construct_type as openai_construct_type
+    from openai.types.chat import ChatCompletionChunk
+    from utils.sse_utils import AnthropicSSEScanner, OpenAISSEScanner
+
+    events = anthropic_events(args.events) if args.route == "anthropic" else openai_events(args.events)
+    stream = encode(events)
+    chunks = split(stream, events, args.chunk_size)
+    payloads = [json.dumps(data) for _, data in events]
+
+    if args.route == "anthropic":
+        def sdk():
+            out = []
+            for payload in payloads:
+                event = construct_type(type_=RawMessageStreamEvent, value=json.loads(payload))
+                out.append(f"event: {event.type}\ndata: {event.model_dump_json()}\n\n")
+            return out
+        scanner_cls = AnthropicSSEScanner
+    else:
+        def sdk():
+            out = []
+            for payload in payloads:
+                chunk = openai_construct_type(type_=ChatCompletionChunk, value=json.loads(payload))
+                out.append(f"data: {chunk.model_dump_json()}\n\n")
+            return out
+        scanner_cls = OpenAISSEScanner
+
+    def scan(collect: bool):
+        def run():
+            scanner = scanner_cls(collect_content=collect)
+            for chunk in chunks:
+                scanner.feed(chunk)
+            return scanner
+        return run
+
+    # 校验扫描结果
+    scanner = scan(True)()
+    assert scanner.usage is not None and len(scanner.content) == args.events, "扫描结果不完整"
+
+    count = len(events)
+    number = max(10, 20000 // count)
+    print(f"route={args.route} events={count} bytes={len(stream):,} chunks={len(chunks)}")
+    for label, fn in (("sdk parse + dump", sdk), ("scanner", scan(False)), ("scanner, collect", scan(True))):
+        per_event = timeit.timeit(fn, number=number) / number / count * 1e6
+        print(f"  {label:<18} {per_event:7.2f} us/event")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+"""
+流式转发 benchmark：N 个并发 SSE 流经过代理转发到 mock 上游
+
+流式响应在事件循环中逐块转发，不经过 anyio 线程池，并发流数不受线程池上限（约 40）限制；
+线程池只执行每个请求 get_db 依赖的打开 / 关闭（很短），峰值线程数来自这部分。
+输出总耗时、每秒转发块数、每块 CPU 时间（包含本进程中发起请求的 httpx 客户端）和峰值线程数。
+
+运行：python bench/bench_streams.py [-n 500] [--chunks 20] [--delay 0] [--route openai|anthropic]
+"""
+
+import argparse
+import asyncio
+import resource
+import threading
+import time
+
+import _common
+
+
+OPENAI_BODY = {"model": "gpt-4o-mini", "stream": True, "messages": [{"role": "user", "content": "hi"}]}
+ANTHROPIC_BODY = {"model": "claude-3-haiku", "max_tokens": 20, "stream": True, "messages": [{"role": "user", "content": "hi"}]}
+
+
+def _cpu_seconds() -> float:
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+
+async def run(args):
+    keys = [f"bench-key-{i}" for i in range(args.keys)]
+    path, body = ("/v1/messages", ANTHROPIC_BODY) if args.route == "anthropic" else ("/v1/chat/completions", OPENAI_BODY)
+    chunks = 0
+    failed = 0
+    peak_threads = threading.active_count()
+
+    async def one():
+        nonlocal chunks, failed, peak_threads
+        async with client.stream("POST", path, json=body) as response:
+            if response.status_code != 200:
+                failed += 1
+                return
+            async for line in response.aiter_lines():
+                if line.startswith("data:"):
+                    chunks += 1
+                    peak_threads = max(peak_threads, threading.active_count())
+
+    async with _common.app_client(keys) as client:
+        # 预热连接池
+        async with client.stream("POST", path, json=body) as response:
+            await response.aread()
+
+        start, cpu = time.perf_counter(), _cpu_seconds()
+        await asyncio.gather(*[one() for _ in range(args.n)])
+        elapsed, cpu = time.perf_counter() - start, _cpu_seconds() - cpu
+
+        from service import inflight_service
+        inflight = inflight_service.get_stats()["total_inflight"]
+
+    print(f"route={args.route} streams={args.n} failed={failed} chunks={chunks} delay={args.delay * 1000:.0f}ms")
+    print(f"  total {elapsed:.2f}s  ->  {chunks / elapsed:,.0f} chunks/s, cpu {cpu:.2f}s ({cpu / max(chunks, 1) * 1e6:.0f} us/chunk), "
+          f"peak threads {peak_threads}, in-flight after run {inflight}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("-n", type=int, default=500, help="并发流数")
+    parser.add_argument("--chunks", type=int, default=20, help="每个流的内容块数")
+    parser.add_argument("--delay", type=float, default=0.0, help="mock 上游首块延迟（秒）")
+    parser.add_argument("--keys", type=int, default=10, help="Key 池中的 Key 数")
+    parser.add_argument("--route", choices=("openai", "anthropic"), default="openai")
+    args = parser.parse_args()
+
+    _common.setup()
+    _common.quiet()
+    with _common.MockUpstream(delay=args.delay, chunks=args.chunks):
+        asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,57 @@
+"""
+上游并发 benchmark：N 个并发非流式请求经过代理转发到固定延迟的 mock 上游
+
+上游调用在事件循环中 await（AsyncOpenAI / AsyncAnthropic），总耗时应远小于串行下限 N x 延迟；
+同时输出上游客户端注册表的命中率和打开的连接数（同一代理的请求复用连接池）。
+
+运行：python bench/bench_upstream.py [-n 50] [--delay 0.2] [--keys 10] [--route openai|anthropic]
+"""
+
+import argparse
+import asyncio
+import time
+
+import _common
+
+
+OPENAI_BODY = {"model": "gpt-4o-mini", "messages": [{"role": "user", "content": "hi"}]}
+ANTHROPIC_BODY = {"model": "claude-3-haiku", "max_tokens": 20, "messages": [{"role": "user", "content": "hi"}]}
+
+
+async def run(args):
+    keys = [f"bench-key-{i}" for i in range(args.keys)]
+    path, body = ("/v1/messages", ANTHROPIC_BODY) if args.route == "anthropic" else ("/v1/chat/completions", OPENAI_BODY)
+    async with _common.app_client(keys) as client:
+        # 预热连接池
+        await client.post(path, json=body)
+
+        start = time.perf_counter()
+        responses = await asyncio.gather(*[client.post(path, json=body) for _ in range(args.n)])
+        elapsed = time.perf_counter() - start
+
+        from service import http_client_service
+        clients = http_client_service.get_stats()
+
+    ok = sum(1 for r in responses if r.status_code == 200)
+    print(f"route={args.route} requests={args.n} ok={ok} delay={args.delay * 1000:.0f}ms")
+    print(f"  total {elapsed:.2f}s  ->  {args.n / elapsed:.1f} req/s  (serial lower bound {args.n * args.delay:.1f}s)")
+    print(f"  upstream clients: hit rate {clients['hit_rate']}%, sdk clients {clients['sdk_clients']}, "
+          f"http pools {clients['http_pools']}, open connections {clients['open_connections']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("-n", type=int, default=50, help="并发请求数")
+    parser.add_argument("--delay", type=float, default=0.2, help="mock 上游响应延迟（秒）")
+    parser.add_argument("--keys", type=int, default=10, help="Key 池中的 Key 数")
+    parser.add_argument("--route", choices=("openai", "anthropic"), default="openai")
+    args = parser.parse_args()
+
+    _common.setup()
+    _common.quiet()
+    with _common.MockUpstream(delay=args.delay):
+        asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+"""
+mock 上游（只用于 benchmark）：OpenAI Chat Completions / Anthropic Messages，支持流式
+
+环境变量：
+- MOCK_DELAY: 每个请求响应前的等待秒数（默认 0）
+- MOCK_CHUNKS: 流式响应的内容块数（默认 5）
+- MOCK_SLOW_DELAY: API Key 以 slow 开头时额外等待的秒数（默认 0，模拟慢 Key）
+
+单独启动：cd bench && python -m uvicorn mock_upstream:app --port 18080
+"""
+
+import asyncio
+import json
+import os
+
+from fastapi import FastAPI, Request
+from fastapi.responses import StreamingResponse
+
+
+app = FastAPI()
+
+DELAY = float(os.getenv("MOCK_DELAY", "0"))
+CHUNKS = int(os.getenv("MOCK_CHUNKS", "5"))
+SLOW_DELAY = float(os.getenv("MOCK_SLOW_DELAY", "0"))
+
+
+async def _wait(request: Request):
+    """模拟上游延迟（慢 Key 额外等待）"""
+    api_key = request.headers.get("x-api-key") or request.headers.get("authorization", "").removeprefix("Bearer ")
+    await asyncio.sleep(DELAY + (SLOW_DELAY if api_key.startswith("slow") else 0))
+
+
+@app.post("/openai/v1/chat/completions")
+async def chat_completions(request: Request):
+    body = await request.json()
+    await _wait(request)
+    if body.get("stream"):
+        async def events():
+            for i in range(CHUNKS):
+                chunk = {
+                    "id": "bench", "object": "chat.completion.chunk", "created": 1, "model": body["model"],
+                    "choices": [{"index": 0, "delta": {"content": f"t{i}"}, "finish_reason": None}],
+                }
+                yield f"data: {json.dumps(chunk)}\n\n"
+            usage = {
+                "id": "bench", "object": "chat.completion.chunk", "created": 1, "model": body["model"], "choices": [],
+                "usage": {"prompt_tokens": 3, "completion_tokens": CHUNKS, "total_tokens": 3 + CHUNKS, "credits": 0.0001},
+            }
+            yield f"data: {json.dumps(usage)}\n\n"
+            yield "data: [DONE]\n\n"
+        return StreamingResponse(events(), media_type="text/event-stream")
+    return {
+        "id": "bench", "object": "chat.completion", "created": 1, "model": body["model"],
+        "choices": [{"index": 0, "message": {"role": "assistant", "content": "hi"}, "finish_reason": "stop"}],
+        "usage": {"prompt_tokens": 3, "completion_tokens": 1, "total_tokens": 4, "credits": 0.0001},
+    }
+
+
+@app.post("/anthropic/v1/messages")
+async def messages(request: Request):
+    body = await request.json()
+    await _wait(request)
+    if body.get("stream"):
+        async def events():
+            items = [
+                ("message_start", {"type": "message_start", "message": {
+                    "id": "bench", "type": "message", "role": "assistant", "model": body["model"], "content": [],
+                    "stop_reason": None, "stop_sequence": None, "usage": {"input_tokens": 3, "output_tokens": 1},
+                }}),
+                ("content_block_start", {"type": "content_block_start", "index": 0, "content_block": {"type": "text", "text": ""}}),
+            ]
+            items += [
+                ("content_block_delta", {"type": "content_block_delta", "index": 0, "delta": {"type": "text_delta", "text": f"t{i}"}})
+                for i in range(CHUNKS)
+            ]
+            items += [
+                ("content_block_stop", {"type": "content_block_stop", "index": 0}),
+                ("message_delta", {"type": "message_delta", "delta": {"stop_reason": "end_turn", "stop_sequence": None},
+                                   "usage": {"output_tokens": CHUNKS, "credits": 0.0001}}),
+                ("message_stop", {"type": "message_stop"}),
+            ]
+            for name, data in items:
+                yield f"event: {name}\ndata: {json.dumps(data)}\n\n"
+        return StreamingResponse(events(), media_type="text/event-stream")
+    return {
+        "id": "bench", "type": "message", "role": "assistant", "model": body["model"],
+        "content": [{"type": "text", "text": "hi"}], "stop_reason": "end_turn", "stop_sequence": None,
+        "usage": {"input_tokens": 3, "output_tokens": 1, "credits": 0.0001},
+    }
@@ -3,6 +3,7 @@
  */
 
 import request, { BaseResponse } from '@/utils/request';
+import type { Job } from '@/api/jobs';
 
 /**
  * 今日总览数据
@@ -132,15 +133,12 @@ export const dashboardApi = {
   },
 
   /**
-   * 手动更新 Key 余额
+   * 手动更新 Key 余额（后台任务，返回任务，通过 jobsApi.wait 等待结果）
    */
   updateKeysBalance: () => {
-    return request.post<BaseResponse<{
-      total_keys: number;
-      updated_keys: number;
-      failed_keys: number;
-      errors: string[];
-    }>>('/api/dashboard/update-keys-balance', {});
+    return request.post<BaseResponse<Job>>('/api/dashboard/update-keys-balance', {
+      async_job: true,
+    });
   },
 };
 
@@ -0,0 +1,84 @@
+/**
+ * 后台任务 API
+ */
+
+import request, { BaseResponse } from '@/utils/request';
+
+/**
+ * 后台任务状态
+ */
+export type JobStatus = 'pending' | 'running' | 'succeeded' | 'failed' | 'cancelled';
+
+/**
+ * 后台任务结果（计数和明细，明细最多保留一部分）
+ */
+export interface JobResult<T = any> {
+  total: number;
+  processed: number;
+  success_count: number;
+  fail_count: number;
+  items: T[];
+}
+
+/**
+ * 后台任务
+ */
+export interface Job<T = any> {
+  id: number;
+  create_time: string | null;
+  update_time: string | null;
+  job_type: string;
+  status: JobStatus;
+  total: number;
+  processed: number;
+  success_count: number;
+  fail_count: number;
+  progress: number;
+  cancel_requested: boolean;
+  worker: string | null;
+  result: JobResult<T> | null;
+  error: string | null;
+  start_time: string | null;
+  finish_time: string | null;
+}
+
+// 轮询任务状态的间隔（毫秒）
+const POLL_INTERVAL = 1000;
+
+/**
+ * 后台任务 API
+ */
+export const jobsApi = {
+  /**
+   * 获取后台任务状态
+   */
+  get: (jobId: number) => {
+    return request.post<BaseResponse<Job>>('/api/jobs/get', {
+      job_id: jobId,
+    });
+  },
+
+  /**
+   * 取消后台任务
+   */
+  cancel: (jobId: number) => {
+    return request.post<BaseResponse<Job>>('/api/jobs/cancel', {
+      job_id: jobId,
+    });
+  },
+
+  /**
+   * 轮询直到任务结束（成功 / 失败 / 取消），返回结束时的任务
+   */
+  wait: async <T = any>(jobId: number, onProgress?: (job: Job<T>) => void): Promise<Job<T>> => {
+    while (true) {
+      const response = await jobsApi.get(jobId);
+      const job = response.data as Job<T>;
+      if (job.status !== 'pending' && job.status !== 'running') {
+        return job;
+      }
+      onProgress?.(job);
+      await new Promise((resolve) => setTimeout(resolve, POLL_INTERVAL));
+    }
+  },
+};
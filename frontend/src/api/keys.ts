@@ -3,6 +3,7 @@
  */
 
 import request, { BaseResponse, PageResponse } from '@/utils/request';
+import type { Job } from '@/api/jobs';
 
 /**
  * API Key 数据类型
@@ -59,16 +60,6 @@ export interface QueryKeysParams {
   min_balance?: number;  // 最小余额
 }
 
-/**
- * 批量创建结果
- */
-export interface BatchCreateResult {
-  success_count: number;
-  fail_count: number;
-  total_count: number;
-  success_keys: APIKey[];
-}
-
 /**
  * 单个密钥测活结果
  */
@@ -79,16 +70,6 @@ export interface KeyCheckResult {
   message: string;
 }
 
-/**
- * 批量测活结果
- */
-export interface BatchCheckResult {
-  success_count: number;
-  fail_count: number;
-  total_count: number;
-  results: KeyCheckResult[];
-}
-
 /**
  * Key 管理 API
  */
@@ -122,12 +103,13 @@ export const keysApi = {
   },
 
   /**
-   * 批量创建 API Keys
+   * 批量创建 API Keys（后台任务，返回任务，通过 jobsApi.wait 等待结果）
    */
   batchCreate: (batchName: string, apiKeys: string[]) => {
-    return request.post<BaseResponse<BatchCreateResult>>('/api/keys/batchCreate', {
+    return request.post<BaseResponse<Job>>('/api/keys/batchCreate', {
       batch_name: batchName,
       api_keys: apiKeys,
+      async_job: true,
     });
   },
 
@@ -151,30 +133,22 @@ export const keysApi = {
   },
 
   /**
-   * 批量测活 API Keys
+   * 批量测活 API Keys（后台任务，任务结果的明细为测活失败的密钥）
    */
   batchCheck: (keyIds: number[]) => {
-    return request.post<BaseResponse<BatchCheckResult>>(
-      '/api/keys/batchCheck',
-      {
-        key_ids: keyIds,
-      },
-      {
-        timeout: 3600000, // 3600秒 = 1小时
-      }
-    );
+    return request.post<BaseResponse<Job<KeyCheckResult>>>('/api/keys/batchCheck', {
+      key_ids: keyIds,
+      async_job: true,
+    });
   },
 
   /**
-   * 批量删除 API Keys
+   * 批量删除 API Keys（后台任务）
    */
   batchDelete: (keyIds: number[]) => {
-    return request.post<BaseResponse<{
-      success_count: number;
-      fail_count: number;
-      total_count: number;
-    }>>('/api/keys/batchDelete', {
+    return request.post<BaseResponse<Job>>('/api/keys/batchDelete', {
       key_ids: keyIds,
+      async_job: true,
     });
   },
 };
@@ -270,14 +270,16 @@ const ConfigManagement: React.FC = () => {
                 >
                   <Select
                     style={{ width: '100%' }}
-                    disabled
                     options={[
                       { value: '0', label: '随机选择' },
+                      { value: '1', label: '轮询' },
+                      { value: '2', label: '最少使用' },
+                      { value: '3', label: '延迟感知（EWMA + 二选一）' },
                     ]}
                   />
                 </Form.Item>
                 <Alert
-                  message="选择如何从 Key 池中选择 API Key。当前仅支持随机选择策略。"
+                  message="选择如何从 Key 池中选择 API Key，保存后立即生效。轮询依次使用池中的 Key；最少使用选择近期请求数最少的 Key；延迟感知策略按各 Key / 代理近期的延迟、错误率和进行中请求数，从随机抽取的两个 Key 中选择更优的一个。"
                   type="info"
                   showIcon
                   style={{ marginBottom: 16 }}
@@ -23,6 +23,7 @@ import {
 } from '@ant-design/icons';
 import type { ColumnsType } from 'antd/es/table';
 import { dashboardApi, type TodayOverview, type ModelDistribution, type ProviderDistribution, type ErrorStats, type KeyBalanceStats } from '@/api/dashboard';
+import { waitJob } from '@/utils/job';
 
 const DashboardPage: React.FC = () => {
   const [loading, setLoading] = useState(false);
@@ -98,12 +99,16 @@ const DashboardPage: React.FC = () => {
     setRefreshing(true);
     try {
       const response = await dashboardApi.updateKeysBalance();
-      if (response.success) {
-        const { updated_keys, failed_keys } = response.data;
-        if (failed_keys > 0) {
-          message.warning(`余额更新完成，成功 ${updated_keys} 个，失败 ${failed_keys} 个`);
-        } else {
-          message.success(`余额更新成功，共更新 ${updated_keys} 个 Key`);
+      if (response.success && response.data) {
+        // 后台任务执行，轮询直到结束
+        const job = await waitJob(response.data, '正在更新余额');
+        if (job?.result) {
+          const { success_count, fail_count } = job.result;
+          if (fail_count > 0) {
+            message.warning(`余额更新完成，成功 ${success_count} 个，失败 ${fail_count} 个`);
+          } else {
+            message.success(`余额更新成功，共更新 ${success_count} 个 Key`);
+          }
         }
         // 立即刷新数据
         loadData();
@@ -32,7 +32,8 @@ import {
 import type { ColumnsType } from 'antd/es/table';
 import type { UploadFile } from 'antd/es/upload/interface';
 import dayjs from 'dayjs';
-import { keysApi, type APIKey, type CreateAPIKeyRequest, type UpdateAPIKeyRequest, type BatchCheckResult } from '@/api/keys';
+import { keysApi, type APIKey, type CreateAPIKeyRequest, type UpdateAPIKeyRequest } from '@/api/keys';
+import { waitJob } from '@/utils/job';
 import { configsApi } from '@/api/configs';
 
 const { Title } = Typography;
@@ -250,43 +251,44 @@ const KeyManagement: React.FC = () => {
       okText: '确定',
       cancelText: '取消',
       onOk: async () => {
-        const hide = message.loading('正在测活中...', 0);
         try {
+          // 提交后台任务后关闭确认框，轮询任务进度
           const response = await keysApi.batchCheck(selectedRowKeys as number[]);
-          hide();
+          if (!response.success || !response.data) {
+            return;
+          }
+          setSelectedRowKeys([]);
           
-          if (response.success && response.data) {
-            const result = response.data;
-            
-            // 显示详细结果
-            Modal.info({
-              title: '批量测活结果',
-              width: 600,
-              content: (
-                <div>
-                  <p>总数量：{result.total_count}</p>
-                  <p style={{ color: '#52c41a' }}>成功：{result.success_count}</p>
-                  <p style={{ color: '#ff4d4f' }}>失败：{result.fail_count}</p>
-                  <div style={{ marginTop: 16, maxHeight: 300, overflow: 'auto' }}>
-                    {result.results.map((item, index) => (
-                      <div key={index} style={{ marginBottom: 8 }}>
-                        <Tag color={item.success ? 'green' : 'red'}>
-                          {item.success ? '成功' : '失败'}
-                        </Tag>
-                        <span>{item.key_name}: {item.message}</span>
-                      </div>
-                    ))}
+          waitJob(response.data, '正在测活中').then((job) => {
+            if (job?.result) {
+              const result = job.result;
+              
+              // 显示详细结果（明细只包含测活失败的密钥）
+              Modal.info({
+                title: '批量测活结果',
+                width: 600,
+                content: (
+                  <div>
+                    <p>总数量：{result.total}</p>
+                    <p style={{ color: '#52c41a' }}>成功：{result.success_count}</p>
+                    <p style={{ color: '#ff4d4f' }}>失败：{result.fail_count}</p>
+                    <div style={{ marginTop: 16, maxHeight: 300, overflow: 'auto' }}>
+                      {result.items.map((item, index) => (
+                        <div key={index} style={{ marginBottom: 8 }}>
+                          <Tag color="red">失败</Tag>
+                          <span>{item.key_name}: {item.message}</span>
+                        </div>
+                      ))}
+                    </div>
                   </div>
-                </div>
-              ),
-            });
-            
-            // 清空选中项并刷新列表
-            setSelectedRowKeys([]);
+                ),
+              });
+            }
             loadData();
-          }
+          }).catch((error) => {
+            console.error('批量测活失败:', error);
+          });
         } catch (error) {
-          hide();
           console.error('批量测活失败:', error);
         }
       },
@@ -314,27 +316,31 @@ const KeyManagement: React.FC = () => {
       cancelText: '取消',
       okButtonProps: { danger: true },
       onOk: async () => {
-        const hide = message.loading('正在删除中...', 0);
         try {
+          // 提交后台任务后关闭确认框，轮询任务进度
           const response = await keysApi.batchDelete(selectedRowKeys as number[]);
-          hide();
+          if (!response.success || !response.data) {
+            return;
+          }
+          // 清空选中
+          setSelectedRowKeys([]);
           
-          if (response.success && response.data) {
-            const result = response.data;
-            
-            if (result.fail_count > 0) {
-              message.warning(`删除完成：成功 ${result.success_count} 个，失败 ${result.fail_count} 个`);
-            } else {
-              message.success(`成功删除 ${result.success_count} 个密钥`);
+          waitJob(response.data, '正在删除中').then((job) => {
+            if (job?.result) {
+              const result = job.result;
+              if (result.fail_count > 0) {
+                message.warning(`删除完成：成功 ${result.success_count} 个，失败 ${result.fail_count} 个`);
+              } else {
+                message.success(`成功删除 ${result.success_count} 个密钥`);
+              }
             }
-            
-            // 清空选中
-            setSelectedRowKeys([]);
             // 刷新列表
             loadData();
-          }
+          }).catch((error) => {
+            console.error('批量删除失败:', error);
+            message.error('批量删除失败');
+          });
         } catch (error) {
-          hide();
           console.error('批量删除失败:', error);
           message.error('批量删除失败');
         }
@@ -364,28 +370,34 @@ const KeyManagement: React.FC = () => {
       const response = await keysApi.batchCreate(batchName, apiKeys);
       
       if (response.success && response.data) {
-        const result = response.data;
-        message.success(response.msg);
-        
-        // 显示详细结果
-        Modal.info({
-          title: '批量导入结果',
-          content: (
-            <div>
-              <p>总数量：{result.total_count}</p>
-              <p style={{ color: '#52c41a' }}>✅ 成功导入：{result.success_count}</p>
-              {result.fail_count > 0 && (
-                <p style={{ color: '#faad14' }}>
-                  ⚠️ 跳过：{result.fail_count}（重复或已存在）
-                </p>
-              )}
-            </div>
-          ),
-        });
-        
+        // 后台任务已提交：关闭弹窗，轮询任务进度
         setIsBatchModalVisible(false);
         batchForm.resetFields();
-        loadData();
+        
+        waitJob(response.data, '正在导入中').then((job) => {
+          if (job?.result) {
+            const result = job.result;
+            
+            // 显示详细结果
+            Modal.info({
+              title: '批量导入结果',
+              content: (
+                <div>
+                  <p>总数量：{result.total}</p>
+                  <p style={{ color: '#52c41a' }}>✅ 成功导入：{result.success_count}</p>
+                  {result.fail_count > 0 && (
+                    <p style={{ color: '#faad14' }}>
+                      ⚠️ 跳过：{result.fail_count}（重复或已存在）
+                    </p>
+                  )}
+                </div>
+              ),
+            });
+          }
+          loadData();
+        }).catch((error) => {
+          console.error('批量导入失败:', error);
+        });
       }
     } catch (error) {
       console.error('批量导入失败:', error);
@@ -0,0 +1,27 @@
+import { message } from 'antd';
+import { jobsApi, type Job } from '@/api/jobs';
+
+/**
+ * 等待后台任务结束，期间在顶部提示中显示进度
+ *
+ * 任务成功时返回结束时的任务；失败或取消时提示原因并返回 null（已处理的批次不会回滚）
+ */
+export async function waitJob<T = any>(job: Job<T>, label: string): Promise<Job<T> | null> {
+  const key = `job-${job.id}`;
+  message.loading({ content: `${label}...`, key, duration: 0 });
+  try {
+    const finished = await jobsApi.wait<T>(job.id, (current) => {
+      message.loading({ content: `${label}... ${current.processed}/${current.total}`, key, duration: 0 });
+    });
+    message.destroy(key);
+    if (finished.status !== 'succeeded') {
+      const status = finished.status === 'cancelled' ? '已取消' : '失败';
+      message.error(`${label}${status}${finished.error ? `：${finished.error}` : ''}`);
+      return null;
+    }
+    return finished;
+  } catch (error) {
+    message.destroy(key);
+    throw error;
+  }
+}
@@ -35,15 +35,45 @@ async def lifespan(app: FastAPI):
     finally:
         db.close()
     
-    # 启动统计任务
-    from service.stats_task import start_stats_task, stop_stats_task
-    await start_stats_task()
-    print("✅ 统计任务已启动")
+    # 连接跨进程 Key 计数（共享内存）
+    from service import shared_counter_service
+    shared_counter_service.start()
+    
+    # 启动 Key 池补充任务（启动时先补充一次）
+    from service.refill_task import start_refill_task, stop_refill_task
+    await start_refill_task()
+    print("✅ Key 池补充任务已启动")
+    
+    # 启动请求日志写入线程
+    from service import log_writer_service
+    log_writer_service.start()
+    print("✅ 请求日志写入线程已启动")
+    
+    # 启动 Key 花费账本
+    from service.spend_ledger_task import start_ledger_task, stop_ledger_task
+    await start_ledger_task()
+    print("✅ Key 花费账本已启动")
+    
+    # 启动多 worker 协调任务（只有 leader 运行统计任务）
+    from service.coordination_task import start_coordination_task, stop_coordination_task, get_coordinator
+    await start_coordination_task()
+    print(f"✅ 协调任务已启动（leader: {get_coordinator().get_stats()['is_leader']}）")
     
     yield
     
-    # 关闭时执行
-    await stop_stats_task()
+    # 关闭时执行（先中止后台任务、写入剩余花费和日志，在释放协调状态之前写入数据库）
+    from service.job_task import stop_job_runner
+    await stop_job_runner()
+    await stop_ledger_task()
+    from service import log_service
+    log_service.shutdown()
+    await stop_coordination_task()
+    await stop_refill_task()
+    shared_counter_service.stop()
+    
+    # 关闭上游连接池
+    from service import http_client_service
+    await http_client_service.close_all()
     print("👋 应用关闭")
 
 
@@ -88,7 +118,7 @@ async def health_check():
 
 # 注册路由
 from controller.api_controller import router as api_router
-from controller.web import key_router, config_router, request_log_router, dashboard_router, auth_router
+from controller.web import key_router, config_router, request_log_router, dashboard_router, auth_router, pool_router, job_router
 
 # API 路由（支持动态前缀）
 app.include_router(api_router, prefix=settings.API_PREFIX)
@@ -102,12 +132,16 @@ app.include_router(key_router, prefix=settings.ADMIN_PREFIX)
 app.include_router(config_router, prefix=settings.ADMIN_PREFIX)
 app.include_router(request_log_router, prefix=settings.ADMIN_PREFIX)
 app.include_router(dashboard_router, prefix=settings.ADMIN_PREFIX)
+app.include_router(pool_router, prefix=settings.ADMIN_PREFIX)
+app.include_router(job_router, prefix=settings.ADMIN_PREFIX)
 
 # 为前端静态文件模式提供不带前缀的 API 路由
 app.include_router(key_router)
 app.include_router(config_router)
 app.include_router(request_log_router)
 app.include_router(dashboard_router)
+app.include_router(pool_router)
+app.include_router(job_router)
 
 
 # 前端静态文件服务（如果存在 frontend/dist 目录）
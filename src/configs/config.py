@@ -80,6 +80,82 @@ class Settings:
     
     # 数据库连接配置
     DB_ECHO: bool = os.getenv("DB_ECHO", "false").lower() == "true"  # 是否打印 SQL 语句
+    
+    # 请求日志批量写入配置（专用线程按批插入，每批一个事务）
+    LOG_BATCH_SIZE: int = int(os.getenv("LOG_BATCH_SIZE", "200"))  # 每批最多写入的日志条数
+    LOG_BATCH_LATENCY_MS: float = float(os.getenv("LOG_BATCH_LATENCY_MS", "50"))  # 凑批的最长等待时间（毫秒），即日志入库的最大额外延迟
+    LOG_QUEUE_SIZE: int = int(os.getenv("LOG_QUEUE_SIZE", "10000"))  # 内存中等待写入的日志上限，超过时放入同样大小的溢出缓冲区，由溢出线程写入溢出文件（data/log_spill），缓冲区也满时丢弃
+    LOG_SPILL_MAX_MB: float = float(os.getenv("LOG_SPILL_MAX_MB", "1024"))  # 每个 worker 溢出文件的大小上限（MB，0 表示不限制），超过时丢弃日志
+
+    # 上游连接池配置
+    UPSTREAM_MAX_CLIENTS: int = int(os.getenv("UPSTREAM_MAX_CLIENTS", "1024"))  # 缓存的 SDK 客户端上限（LRU 淘汰）
+    UPSTREAM_CLIENT_IDLE_TIMEOUT: float = float(os.getenv("UPSTREAM_CLIENT_IDLE_TIMEOUT", "300"))  # 代理连接池空闲关闭时间（秒）
+    UPSTREAM_MAX_CONNECTIONS: int = int(os.getenv("UPSTREAM_MAX_CONNECTIONS", "200"))  # 每个代理的最大连接数
+    UPSTREAM_MAX_KEEPALIVE_CONNECTIONS: int = int(os.getenv("UPSTREAM_MAX_KEEPALIVE_CONNECTIONS", "50"))  # 每个代理保持的空闲长连接数
+    UPSTREAM_KEEPALIVE_EXPIRY: float = float(os.getenv("UPSTREAM_KEEPALIVE_EXPIRY", "60"))  # 空闲长连接保持时间（秒）
+    UPSTREAM_HTTP2: bool = os.getenv("UPSTREAM_HTTP2", "false").lower() == "true"  # 是否启用 HTTP/2（需要安装 h2）
+
+    # Key 并发控制
+    KEY_MAX_INFLIGHT: int = int(os.getenv("KEY_MAX_INFLIGHT", "10"))  # 单个 Key 同时进行的最大请求数（0 表示不限制）
+    KEY_WAIT_QUEUE_SIZE: int = int(os.getenv("KEY_WAIT_QUEUE_SIZE", "1000"))  # 所有 Key 饱和时最多排队的请求数（超出返回 429）
+    KEY_WAIT_TIMEOUT: float = float(os.getenv("KEY_WAIT_TIMEOUT", "10"))  # 排队等待可用 Key 的最长时间（秒，超时返回 503）
+    
+    # Key 池补充配置（后台任务补充缓存，请求路径不查询数据库）
+    KEY_REFILL_INTERVAL: float = float(os.getenv("KEY_REFILL_INTERVAL", "30"))  # 定时检查间隔（秒），低于 key_pool_size 时补充
+    KEY_POOL_LOW_WATERMARK: float = float(os.getenv("KEY_POOL_LOW_WATERMARK", "0.8"))  # 低水位比例：Key 被移除后缓存低于 key_pool_size × 该比例时立即补充
+    
+    # Key 花费账本配置（请求花费在内存中累加，定期写入 spent / balance）
+    KEY_SPEND_FLUSH_INTERVAL: float = float(os.getenv("KEY_SPEND_FLUSH_INTERVAL", "5"))  # 写入数据库的间隔（秒），余额耗尽时提前写入
+    
+    # Key 余额预留配置（选中 Key 时按预估花费预留余额，可用余额不够的 Key 不再被选中）
+    KEY_RESERVATION_ENABLED: bool = os.getenv("KEY_RESERVATION_ENABLED", "true").lower() == "true"  # 是否启用
+    KEY_RESERVE_DEFAULT_COST: float = float(os.getenv("KEY_RESERVE_DEFAULT_COST", "0.05"))  # 模型还没有花费样本时的预估花费（美元）
+    
+    # 批量测活配置
+    KEY_CHECK_PARALLELISM: int = int(os.getenv("KEY_CHECK_PARALLELISM", "10"))  # 同时测活的密钥数
+    KEY_CHECK_TIMEOUT: float = float(os.getenv("KEY_CHECK_TIMEOUT", "30"))  # 单个密钥的测活超时（秒）
+    
+    # 后台任务配置（批量创建 / 测活 / 删除、余额更新）
+    JOB_MAX_CONCURRENCY: int = int(os.getenv("JOB_MAX_CONCURRENCY", "2"))  # 每个 worker 同时执行的任务数，超出的任务排队等待
+    JOB_CHUNK_SIZE: int = int(os.getenv("JOB_CHUNK_SIZE", "500"))  # 每批处理的密钥数（每批提交一次事务并更新进度）
+    
+    # Key 用量统计窗口（最少使用策略）
+    KEY_USAGE_WINDOW: float = float(os.getenv("KEY_USAGE_WINDOW", "60"))  # 按该时间窗口（秒）统计每个 Key 的请求数和花费
+    
+    # 熔断配置（按 Key 和代理统计滚动错误率）
+    BREAKER_ENABLED: bool = os.getenv("BREAKER_ENABLED", "true").lower() == "true"  # 是否启用熔断
+    BREAKER_WINDOW: float = float(os.getenv("BREAKER_WINDOW", "60"))  # 错误率统计窗口（秒）
+    BREAKER_MIN_REQUESTS: int = int(os.getenv("BREAKER_MIN_REQUESTS", "5"))  # 窗口内请求数达到该值才计算错误率
+    BREAKER_ERROR_RATE: float = float(os.getenv("BREAKER_ERROR_RATE", "0.5"))  # 错误率达到该值时熔断
+    BREAKER_COOLDOWN: float = float(os.getenv("BREAKER_COOLDOWN", "30"))  # 熔断冷却时间（秒），之后放行一个探测请求
+    
+    # 全局请求调度配置
+    SCHEDULER_MAX_CONCURRENCY: int = int(os.getenv("SCHEDULER_MAX_CONCURRENCY", "500"))  # 同时处理的最大请求数（0 表示不限制）
+    SCHEDULER_QUEUE_SIZE: int = int(os.getenv("SCHEDULER_QUEUE_SIZE", "1000"))  # 超出并发上限时最多排队的请求数（超出返回 429）
+    SCHEDULER_QUEUE_TIMEOUT: float = float(os.getenv("SCHEDULER_QUEUE_TIMEOUT", "5"))  # 每个请求最长排队时间（秒，超时返回 429）
+    
+    # 多 worker 协调配置（多个 worker 进程通过 SQLite 协调表选主、同步配置版本和 Key 变更）
+    COORDINATION_INTERVAL: float = float(os.getenv("COORDINATION_INTERVAL", "2"))  # 协调检查间隔（秒）：续约、同步配置、读取其他 worker 的 Key 变更
+    LEADER_LEASE_TTL: float = float(os.getenv("LEADER_LEASE_TTL", "15"))  # leader 租约时长（秒），leader 退出后其他 worker 最迟该时间后接管统计任务
+    KEY_CHANGE_RETENTION: float = float(os.getenv("KEY_CHANGE_RETENTION", "600"))  # Key 变更记录保留时间（秒）
+    
+    # 跨进程 Key 计数（共享内存，各 worker 可读取所有 worker 的进行中请求数、错误数和花费）
+    SHARED_COUNTERS_ENABLED: bool = os.getenv("SHARED_COUNTERS_ENABLED", "true").lower() == "true"  # 是否启用
+    SHARED_COUNTER_CAPACITY: int = int(os.getenv("SHARED_COUNTER_CAPACITY", "4096"))  # 每个 worker 最多计数的 Key 数（应为 Key 池大小的数倍）
+    SHARED_COUNTER_MAX_WORKERS: int = int(os.getenv("SHARED_COUNTER_MAX_WORKERS", "16"))  # 最多 worker 进程数
+
+    # 故障转移配置（仅对从池中选择的 Key 生效）
+    UPSTREAM_MAX_ATTEMPTS: int = int(os.getenv("UPSTREAM_MAX_ATTEMPTS", "3"))  # 单个请求最多尝试次数（含第一次）
+    UPSTREAM_RETRY_DEADLINE: float = float(os.getenv("UPSTREAM_RETRY_DEADLINE", "30"))  # 超过该时间（秒）后不再发起新的尝试
+
+    # 对冲请求配置（仅非流式请求，默认关闭）
+    UPSTREAM_HEDGE_ENABLED: bool = os.getenv("UPSTREAM_HEDGE_ENABLED", "false").lower() == "true"  # 是否启用对冲请求
+    UPSTREAM_HEDGE_PERCENTILE: float = float(os.getenv("UPSTREAM_HEDGE_PERCENTILE", "95"))  # 超过该模型近期延迟的该分位数时发起对冲
+    UPSTREAM_HEDGE_MAX_RATIO: float = float(os.getenv("UPSTREAM_HEDGE_MAX_RATIO", "0.05"))  # 对冲请求占非流式请求的比例上限
+    UPSTREAM_HEDGE_MIN_DELAY: float = float(os.getenv("UPSTREAM_HEDGE_MIN_DELAY", "1"))  # 对冲触发延迟下限（秒）
+
+    # 响应透传配置
+    RESPONSE_PASSTHROUGH: bool = os.getenv("RESPONSE_PASSTHROUGH", "true").lower() == "true"  # 无需格式转换的响应直接转发上游字节（不解析/重新序列化）
 
 
 settings = Settings()
@@ -89,13 +165,59 @@ settings = Settings()
 def init_database():
     """初始化数据库（创建所有表）"""
     from entity.databases.database import Base, engine
-    from entity.databases import APIKey, RequestLog, RequestStats, Config
+    from entity.databases import APIKey, RequestLog, RequestStats, Config, Coordination, KeyChange, AdminJob
+    
+    import time
+    from sqlalchemy.exc import OperationalError
+    
+    # WAL 模式：多个 worker 进程同时读写时读写互不阻塞（设置持久化在数据库文件中）
+    with engine.connect() as conn:
+        conn.exec_driver_sql("PRAGMA journal_mode=WAL")
     
-    # 创建所有表
-    Base.metadata.create_all(bind=engine)
+    # 多个 worker 同时启动时，表 / 列可能刚被其他进程创建，冲突后重新检查
+    for attempt in range(1, 6):
+        try:
+            # 创建所有表
+            Base.metadata.create_all(bind=engine)
+            
+            # 补充已有表中缺失的列（create_all 不会修改已存在的表）
+            _add_missing_columns(engine, Base.metadata)
+            break
+        except OperationalError as e:
+            if attempt == 5:
+                raise
+            print(f"⚠️  数据库初始化冲突，重试: {str(e).splitlines()[0]}")
+            time.sleep(0.2 * attempt)
     print(f"✅ 数据库初始化完成: {settings.DATABASE_PATH}")
 
 
+def _add_missing_columns(engine, metadata):
+    """
+    为已存在的表补充模型中新增的列（项目没有迁移工具，新增字段时自动 ALTER TABLE）
+    
+    注意：只处理新增列，不处理改名/删除/类型变更
+    """
+    from sqlalchemy import inspect, text
+    
+    inspector = inspect(engine)
+    with engine.begin() as conn:
+        for table in metadata.sorted_tables:
+            existing = {col['name'] for col in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing:
+                    continue
+                column_type = column.type.compile(dialect=engine.dialect)
+                conn.execute(text(f'ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}'))
+                print(f"✅ 已添加字段: {table.name}.{column.name}")
+            
+            # 新增列上的索引
+            existing_indexes = {idx['name'] for idx in inspector.get_indexes(table.name)}
+            for index in table.indexes:
+                if index.name not in existing_indexes:
+                    index.create(bind=conn)
+                    print(f"✅ 已创建索引: {index.name}")
+
+
 def drop_database():
     """删除所有表（慎用）"""
     from entity.databases.database import Base, engine
@@ -4,6 +4,10 @@ from constants.constants import (
     CONFIG_KEY_SELECTION_STRATEGY,
     CONFIG_KEY_POOL_SIZE,
     DEFAULT_POOL_SIZE,
+    STRATEGY_RANDOM,
+    STRATEGY_ROUND_ROBIN,
+    STRATEGY_LEAST_USED,
+    STRATEGY_LATENCY_P2C,
     PROVIDER_OPENAI,
     PROVIDER_ANTHROPIC,
     OPENAI_API_URL,
@@ -25,6 +29,10 @@ __all__ = [
     'CONFIG_KEY_SELECTION_STRATEGY',
     'CONFIG_KEY_POOL_SIZE',
     'DEFAULT_POOL_SIZE',
+    'STRATEGY_RANDOM',
+    'STRATEGY_ROUND_ROBIN',
+    'STRATEGY_LEAST_USED',
+    'STRATEGY_LATENCY_P2C',
     'PROVIDER_OPENAI',
     'PROVIDER_ANTHROPIC',
     'OPENAI_API_URL',
@@ -79,7 +79,7 @@ CONFIG_KEY_DESCRIPTIONS = {
     CONFIG_KEY_POOL_SIZE: "Key 池大小，控制同时活跃的 API Key 数量",
     CONFIG_KEY_UA_LIST: "User Agent 列表，用于请求时随机选择",
     CONFIG_KEY_PROXY_LIST: "代理服务器列表，格式：http://host:port",
-    CONFIG_KEY_SELECTION_STRATEGY: "Key 选择策略：0-随机",
+    CONFIG_KEY_SELECTION_STRATEGY: "Key 选择策略：0-随机，1-轮询，2-最少使用，3-延迟感知（EWMA + 二选一）",
     CONFIG_LOG_CONVERSATION_CONTENT: "是否记录对话内容（request_body 和 response_body）：true-记录，false-不记录",
     CONFIG_KEY_OPENAI_MODELS: "OpenAI 支持的模型列表，每行一个模型名称",
     CONFIG_KEY_ANTHROPIC_MODELS: "Anthropic 支持的模型列表，每行一个模型名称",
@@ -16,6 +16,7 @@ DEFAULT_POOL_SIZE = 5
 STRATEGY_RANDOM = 0
 STRATEGY_ROUND_ROBIN = 1
 STRATEGY_LEAST_USED = 2
+STRATEGY_LATENCY_P2C = 3  # 延迟感知：EWMA 延迟 / 错误率 + 二选一
 
 
 # ==================== Provider 相关常量 ====================
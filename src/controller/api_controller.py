@@ -1,23 +1,28 @@
 """API 控制器 - 对外接口"""
 
+import asyncio
 from typing import Optional, Tuple
 from fastapi import APIRouter, Depends, Request
 from fastapi.responses import StreamingResponse, JSONResponse
 from sqlalchemy.orm import Session
 
-from constants import PROVIDER_ANTHROPIC, get_provider_by_model
+from configs.config import settings
+from constants import PROVIDER_OPENAI, PROVIDER_ANTHROPIC, get_provider_by_model
 from entity.databases.database import get_db
 from entity.req import ChatCompletionRequest
 from entity.req.anthropic import AnthropicRequest
 from entity.res import ChatCompletionResponse, ErrorResponse
 from entity.context import RequestContext
-from service import lb_service, api_service
+from service import lb_service, api_service, scheduler_service
 from utils.logger import logger
 from utils.auth import verify_api_secret
 from utils.response_utils import (
     handle_openai_compatible_stream,
     handle_openai_compatible_response,
     handle_anthropic_native_stream,
+    handle_anthropic_passthrough_stream,
+    handle_openai_passthrough_stream,
+    handle_openai_passthrough_response,
     handle_anthropic_native_response,
     build_error_response
 )
@@ -118,12 +123,37 @@ async def chat_completions(
     context = RequestContext(request, db)
     context.init()
     
+    # OpenAI provider 无需格式转换，开启透传时直接转发上游字节
+    context.passthrough = context.provider == PROVIDER_OPENAI and settings.RESPONSE_PASSTHROUGH
+    
     logger.info(f"收到请求: model={request.model}, stream={context.is_stream}, provider={context.provider}, proxy={context.proxy}")
     
-    # 3. 获取可用的 key
-    api_key_string = lb_service.get_key(context)
+    # 3. 准入控制（超过全局并发上限时排队，队列已满或排队超时直接返回 429）
+    if not await scheduler_service.admit(context):
+        return build_error_response(
+            status_code=429,
+            error_type="rate_limit_error",
+            message=context.error,
+            code="server_overloaded",
+            headers={"Retry-After": str(context.retry_after)}
+        )
+    
+    # 4. 获取可用的 key（所有 key 并发已满时排队等待）
+    try:
+        api_key_string = await lb_service.get_key(context)
+    except asyncio.CancelledError:
+        api_service.release_request(context)
+        raise
     
     if not api_key_string:
+        api_service.release_request(context)
+        if context.admission_status:
+            return build_error_response(
+                status_code=context.admission_status,
+                error_type="rate_limit_error" if context.admission_status == 429 else "service_unavailable",
+                message=context.error,
+                code="key_pool_busy"
+            )
         return build_error_response(
             status_code=503,
             error_type="service_unavailable",
@@ -131,11 +161,12 @@ async def chat_completions(
             code="no_available_key"
         )
 
-    # 4. 发送请求（使用官方 SDK）
-    success = api_service.send_request(context)
+    # 5. 发送请求（使用官方异步 SDK，池中的 Key 失败时自动换 Key 重试）
+    success = await api_service.send_with_failover(context)
     
     # 检查请求是否成功
     if not success:
+        api_service.release_request(context)
         return build_error_response(
             status_code=502,
             error_type="upstream_error",
@@ -143,7 +174,12 @@ async def chat_completions(
             code="upstream_request_failed"
         )
 
-    # 5. 返回响应
+    # 6. 返回响应
+    if context.passthrough:
+        if context.is_stream:
+            return handle_openai_passthrough_stream(context)
+        return handle_openai_passthrough_response(context)
+    
     if context.is_stream:
         return handle_openai_compatible_stream(context)
     else:
@@ -216,12 +252,37 @@ async def anthropic_messages(
     from constants import ANTHROPIC_API_URL
     context.url = ANTHROPIC_API_URL
     
+    # 流式响应开启透传：上游 SSE 字节原样转发
+    context.passthrough = context.is_stream and settings.RESPONSE_PASSTHROUGH
+    
     logger.info(f"收到 Anthropic 原生请求: model={request.model}, stream={context.is_stream}")
     
-    # 3. 获取可用的 key
-    api_key_string = lb_service.get_key(context)
+    # 3. 准入控制（超过全局并发上限时排队，队列已满或排队超时直接返回 429）
+    if not await scheduler_service.admit(context):
+        return build_error_response(
+            status_code=429,
+            error_type="rate_limit_error",
+            message=context.error,
+            format="anthropic",
+            headers={"Retry-After": str(context.retry_after)}
+        )
+    
+    # 4. 获取可用的 key（所有 key 并发已满时排队等待）
+    try:
+        api_key_string = await lb_service.get_key(context)
+    except asyncio.CancelledError:
+        api_service.release_request(context)
+        raise
     
     if not api_key_string:
+        api_service.release_request(context)
+        if context.admission_status:
+            return build_error_response(
+                status_code=context.admission_status,
+                error_type="rate_limit_error" if context.admission_status == 429 else "overloaded_error",
+                message=context.error,
+                format="anthropic"
+            )
         return build_error_response(
             status_code=503,
             error_type="api_error",
@@ -229,11 +290,12 @@ async def anthropic_messages(
             format="anthropic"
         )
     
-    # 4. 发送请求（使用 Anthropic SDK）
-    success = api_service.send_request(context)
+    # 5. 发送请求（使用 Anthropic 异步 SDK，池中的 Key 失败时自动换 Key 重试）
+    success = await api_service.send_with_failover(context)
     
     # 检查请求是否成功
     if not success:
+        api_service.release_request(context)
         return build_error_response(
             status_code=502,
             error_type="api_error",
@@ -241,8 +303,10 @@ async def anthropic_messages(
             format="anthropic"
         )
     
-    # 5. 返回响应（Anthropic 原生格式）
+    # 6. 返回响应（Anthropic 原生格式）
     if context.is_stream:
+        if context.passthrough:
+            return handle_anthropic_passthrough_stream(context)
         return handle_anthropic_native_stream(context)
     else:
         return handle_anthropic_native_response(context)
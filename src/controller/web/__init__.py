@@ -5,6 +5,8 @@ from .config_controller import router as config_router
 from .request_log_controller import router as request_log_router
 from .dashboard_controller import router as dashboard_router
 from .auth_controller import router as auth_router
+from .pool_controller import router as pool_router
+from .job_controller import router as job_router
 
-__all__ = ['key_router', 'config_router', 'request_log_router', 'dashboard_router', 'auth_router']
+__all__ = ['key_router', 'config_router', 'request_log_router', 'dashboard_router', 'auth_router', 'pool_router', 'job_router']
 
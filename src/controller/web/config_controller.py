@@ -8,7 +8,8 @@ from pydantic import BaseModel, Field
 
 from entity.databases.database import get_db
 from entity.res.base import Response
-from service.databases import config_service
+from service import key_event_service
+from service.databases import config_service, key_service
 from constants.config_key import CONFIG_KEY_UA_LIST, CONFIG_KEY_PROXY_LIST, READONLY_CONFIG_KEYS
 from utils.logger import logger
 from utils.admin_auth import verify_admin_token
@@ -78,6 +79,14 @@ async def save_system_configs(
         global_config.reload(db)
         logger.info("全局配置已重新加载")
         
+        # 通知其他 worker 重新加载配置
+        from service.coordination_task import notify_config_saved
+        notify_config_saved(db)
+        
+        # Key 池大小可能变化，通知后台任务补充
+        from service.refill_task import trigger_refill
+        trigger_refill()
+        
         # 检查并更新启用的key的UA和proxy
         await _update_enabled_keys_config(db, request.configs)
         
@@ -126,8 +135,10 @@ async def _update_enabled_keys_config(db: Session, configs: Dict[str, str]):
         enabled_keys = db.query(APIKey).filter(APIKey.enabled == True).all()
         
         updated_count = 0
+        updated_keys = []  # (Key, 修改前的 KeyRecord)
         for key in enabled_keys:
             need_update = False
+            previous = key_service.to_key_record(key)
             
             # 检查UA是否在配置列表中
             if key.ua not in ua_list:
@@ -152,10 +163,14 @@ async def _update_enabled_keys_config(db: Session, configs: Dict[str, str]):
             if need_update:
                 key.update_time = datetime.now()
                 updated_count += 1
+                updated_keys.append((key, previous))
         
         # 提交更新
         if updated_count > 0:
             db.commit()
+            # 通知缓存和上游客户端（代理变化的 Key 立即使用新代理）
+            for key, previous in updated_keys:
+                key_service.notify_key_changed(key_event_service.KEY_UPDATED, key, previous)
             logger.info(f"已更新 {updated_count} 个启用的key的配置")
         else:
             logger.info("所有启用的key配置都是有效的，无需更新")
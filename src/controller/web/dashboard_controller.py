@@ -1,12 +1,16 @@
 """Web Dashboard 控制器"""
 
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, Depends, Body
 from sqlalchemy.orm import Session
 from sqlalchemy import func
 
 from entity.databases.database import get_db
 from entity.databases.api_key import APIKey
+from entity.req.key import APIKeyBalanceUpdateRequest
 from entity.res.base import Response
+from entity.res.job import JobResponse
+from service import job_task, spend_ledger_task
+from service.job_task import JobContext
 from service.databases import stats_service, key_service
 from service.stats_task import trigger_stats_now
 from utils.logger import logger
@@ -183,15 +187,15 @@ async def get_key_balance_stats(db: Session = Depends(get_db)):
 
 
 @router.post("/update-keys-balance", summary="手动更新 Key 余额")
-async def update_keys_balance(db: Session = Depends(get_db)):
+async def update_keys_balance(request: APIKeyBalanceUpdateRequest = Body(None)):
     """
-    手动触发更新所有可用 Key 的余额
+    手动触发更新所有可用 Key 的余额（默认作为后台任务执行，返回任务；async_job=false 时在请求内执行）
     
     逻辑：
-    1. 获取所有可用的 Key（enabled=True）
-    2. 对每个 Key，统计所有请求日志的成本总和
-    3. 计算余额：balance = total_balance - sum(cost)
-    4. 更新 balance 和 balance_last_update
+    1. 暂停花费账本写入，等待本进程已提交的请求日志全部入库
+    2. 获取所有可用的 Key（enabled=True），统计每个 Key 所有请求日志的成本总和
+    3. 计算余额：balance = total_balance - sum(cost)，更新 spent、balance 和 balance_last_update
+    4. 丢弃账本中已计入日志的待写入花费（见 spend_ledger_task.reconcile_balances）
     
     返回:
     - total_keys: 处理的 Key 总数
@@ -200,8 +204,12 @@ async def update_keys_balance(db: Session = Depends(get_db)):
     - errors: 错误信息列表
     """
     try:
+        if request is None or request.async_job:
+            job = await job_task.submit_job(job_task.JOB_UPDATE_BALANCE, request)
+            return Response.ok(data=JobResponse(**job.to_dict()), msg=f"已提交后台任务: {job.id}")
+        
         logger.info("手动触发 Key 余额更新")
-        stats = key_service.update_all_keys_balance(db)
+        stats = await spend_ledger_task.reconcile_balances()
         
         if stats['failed_keys'] > 0:
             return Response.ok(
@@ -217,3 +225,15 @@ async def update_keys_balance(db: Session = Depends(get_db)):
         logger.error(f"手动更新 Key 余额失败: {str(e)}")
         return Response.fail(msg=str(e))
 
+
+async def _update_balance_job(job: JobContext, request: APIKeyBalanceUpdateRequest):
+    """余额更新后台任务：在日志写入线程中执行（不阻塞事件循环，与花费账本对齐），失败明细写入结果"""
+    stats = await spend_ledger_task.reconcile_balances()
+    for error in stats['errors']:
+        job.add_item({'error': error})
+    job.total = stats['total_keys']
+    await job.report(stats['total_keys'], stats['updated_keys'], stats['failed_keys'])
+
+
+# 注册后台任务类型
+job_task.register_job_type(job_task.JOB_UPDATE_BALANCE, APIKeyBalanceUpdateRequest, lambda r: 0, _update_balance_job)
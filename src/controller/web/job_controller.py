@@ -0,0 +1,128 @@
+"""Web 后台任务控制器"""
+
+from fastapi import APIRouter, Depends, Body
+from pydantic import ValidationError
+from sqlalchemy.orm import Session
+
+from entity.databases.database import get_db
+from entity.req.job import JobSubmitRequest, JobGetRequest, JobCancelRequest, JobQueryRequest
+from entity.res.job import JobResponse
+from entity.res.base import Response, PageResponse
+from service import job_task
+from service.databases import job_service
+from utils.logger import logger
+from utils.admin_auth import verify_admin_token
+
+router = APIRouter(prefix="/api/jobs", tags=["Job Management"], dependencies=[Depends(verify_admin_token)])
+
+
+@router.post("/submit", response_model=Response[JobResponse], summary="提交后台任务")
+async def submit_job(request: JobSubmitRequest = Body(...)):
+    """
+    提交后台任务（立即返回任务，任务在当前 worker 后台分批执行）
+    
+    - batch_create: 参数同 /api/keys/batchCreate
+    - batch_check: 参数同 /api/keys/batchCheck
+    - batch_delete: 参数同 /api/keys/batchDelete
+    - update_balance: 无参数，同 /api/dashboard/update-keys-balance
+    """
+    try:
+        request_model = job_task.get_job_runner().get_request_model(request.job_type)
+        try:
+            params = request_model(**request.params)
+        except ValidationError as e:
+            return Response[JobResponse].fail(msg=f"任务参数错误: {str(e)}", code=400)
+        
+        job = await job_task.submit_job(request.job_type, params)
+        return Response[JobResponse].ok(data=JobResponse(**job.to_dict()), msg=f"已提交后台任务: {job.id}")
+    except ValueError as e:
+        return Response[JobResponse].fail(msg=str(e), code=400)
+    except Exception as e:
+        logger.error(f"提交后台任务失败: {str(e)}")
+        return Response[JobResponse].fail(msg=str(e))
+
+
+@router.post("/get", response_model=Response[JobResponse], summary="获取后台任务状态")
+async def get_job(
+    request: JobGetRequest = Body(...),
+    db: Session = Depends(get_db)
+):
+    """获取后台任务的状态、进度和结果"""
+    try:
+        job = job_service.get_job_by_id(db, request.job_id)
+        
+        if not job:
+            return Response[JobResponse].fail(msg="任务不存在", code=404)
+        
+        return Response[JobResponse].ok(data=JobResponse(**job.to_dict()), msg="获取成功")
+    except Exception as e:
+        logger.error(f"获取后台任务失败: {str(e)}")
+        return Response[JobResponse].fail(msg=str(e))
+
+
+@router.post("/list", response_model=PageResponse[JobResponse], summary="查询后台任务列表")
+async def list_jobs(
+    request: JobQueryRequest = Body(...),
+    db: Session = Depends(get_db)
+):
+    """查询后台任务列表（按创建时间倒序，支持按类型和状态筛选）"""
+    try:
+        items, total = job_service.query_jobs(
+            db=db,
+            page=request.page,
+            page_size=request.page_size,
+            job_type=request.job_type,
+            status=request.status
+        )
+        
+        return PageResponse[JobResponse].ok(
+            items=[JobResponse(**item.to_dict()) for item in items],
+            total=total,
+            page=request.page,
+            page_size=request.page_size
+        )
+    except Exception as e:
+        logger.error(f"查询后台任务列表失败: {str(e)}")
+        return PageResponse[JobResponse].fail(msg=str(e))
+
+
+@router.post("/cancel", response_model=Response[JobResponse], summary="取消后台任务")
+async def cancel_job(request: JobCancelRequest = Body(...)):
+    """
+    取消后台任务
+    
+    排队中的任务不再执行；执行中的任务在处理完当前这一批后停止（已处理的批次不回滚）。
+    任务在其他 worker 上执行时，由该 worker 在下一批之前读取取消标记
+    """
+    try:
+        job = await job_task.cancel_job(request.job_id)
+        
+        if not job:
+            return Response[JobResponse].fail(msg="任务不存在", code=404)
+        
+        if job.status not in job_service.ACTIVE_STATUSES:
+            return Response[JobResponse].fail_ok(msg=f"任务已结束: {job.status}", data=JobResponse(**job.to_dict()))
+        
+        logger.info(f"已请求取消后台任务: id={job.id}")
+        return Response[JobResponse].ok(data=JobResponse(**job.to_dict()), msg="已请求取消")
+    except Exception as e:
+        logger.error(f"取消后台任务失败: {str(e)}")
+        return Response[JobResponse].fail(msg=str(e))
+
+
+@router.post("/runner", summary="获取后台任务执行器状态")
+async def get_runner_stats():
+    """
+    获取当前 worker 的后台任务执行器状态
+    
+    返回:
+    - max_concurrency / chunk_size: 并发上限和每批数量
+    - running / queued: 执行中和排队中的任务数
+    - jobs: 当前 worker 上未结束的任务 ID
+    - submitted / finished: 累计提交数和按状态统计的结束数
+    """
+    try:
+        return Response.ok(data=job_task.get_job_runner().get_stats(), msg="获取成功")
+    except Exception as e:
+        logger.error(f"获取后台任务执行器状态失败: {str(e)}")
+        return Response.fail(msg=str(e))
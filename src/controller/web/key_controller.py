@@ -1,9 +1,16 @@
 """Web API Key 管理控制器"""
 
+import asyncio
+import json
+from typing import List, Optional, Tuple, Union
+
 from fastapi import APIRouter, Depends, Body
 from sqlalchemy.orm import Session
 
+from configs.config import settings
+from constants.config_key import CONFIG_KEY_UA_LIST, CONFIG_KEY_PROXY_LIST
 from entity.databases.database import get_db
+from entity.databases.api_key import APIKey
 from entity.req.key import (
     APIKeyCreateRequest,
     APIKeyUpdateRequest,
@@ -16,10 +23,13 @@ from entity.req.key import (
     APIKeyBatchDeleteRequest
 )
 from entity.req.api import ChatCompletionRequest, ChatMessage
+from entity.context import RequestContext
 from entity.res.key import APIKeyResponse, BatchCreateResult, BatchCheckResult, KeyCheckResult
+from entity.res.job import JobResponse
 from entity.res.base import Response, PageResponse
-from service.databases import key_service
-from controller import api_controller
+from service import job_task, api_service, log_service
+from service.job_task import JobContext
+from service.databases import key_service, config_service
 from utils.logger import logger
 from utils.admin_auth import verify_admin_token
 
@@ -141,37 +151,18 @@ async def delete_key(
         return Response[None].fail(msg=str(e))
 
 
-@router.post("/batchCreate", response_model=Response[BatchCreateResult], summary="批量创建 API Key")
+@router.post("/batchCreate", response_model=Response[Union[BatchCreateResult, JobResponse]], summary="批量创建 API Key")
 async def batch_create_keys(
     request: APIKeyBatchCreateRequest = Body(...),
     db: Session = Depends(get_db)
 ):
-    """批量创建 API Keys"""
+    """批量创建 API Keys（默认作为后台任务分批执行，返回任务；async_job=false 时在请求内执行）"""
     try:
-        # 从配置中获取UA和proxy列表
-        from service.databases import config_service
-        import json
-        from constants.config_key import CONFIG_KEY_UA_LIST, CONFIG_KEY_PROXY_LIST
-        
-        configs = config_service.get_all_system_configs(db)
-        
-        # 解析UA列表
-        ua_list_str = configs.get(CONFIG_KEY_UA_LIST, "[]")
-        try:
-            ua_list = json.loads(ua_list_str)
-            if not isinstance(ua_list, list) or len(ua_list) == 0:
-                ua_list = ["Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36"]
-        except:
-            ua_list = ["Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36"]
+        if request.async_job:
+            job = await job_task.submit_job(job_task.JOB_BATCH_CREATE, request)
+            return Response[JobResponse].ok(data=JobResponse(**job.to_dict()), msg=f"已提交后台任务: {job.id}")
         
-        # 解析代理列表
-        proxy_list_str = configs.get(CONFIG_KEY_PROXY_LIST, "[]")
-        try:
-            proxy_list = json.loads(proxy_list_str)
-            if not isinstance(proxy_list, list):
-                proxy_list = []
-        except:
-            proxy_list = []
+        ua_list, proxy_list = _load_ua_proxy_lists(db)
         
         # 批量创建
         success_keys, success_count, fail_count = key_service.batch_create_api_keys(db, request, ua_list, proxy_list)
@@ -199,87 +190,60 @@ async def batch_create_keys(
         return Response[BatchCreateResult].fail(msg=str(e))
 
 
-@router.post("/batchCheck", response_model=Response[BatchCheckResult], summary="批量测活 API Key")
-async def batch_check_keys(
-    request: APIKeyBatchCheckRequest = Body(...),
-    db: Session = Depends(get_db)
-):
-    """批量测活 API Keys"""
+def _load_ua_proxy_lists(db: Session) -> Tuple[List[str], List[str]]:
+    """从配置中获取 UA 和代理列表（批量创建时随机分配）"""
+    configs = config_service.get_all_system_configs(db)
+    
+    # 解析UA列表
+    ua_list_str = configs.get(CONFIG_KEY_UA_LIST, "[]")
     try:
-        total_count = len(request.key_ids)
-        success_count = 0
-        fail_count = 0
-        results = []
-        
-        logger.info(f"开始批量测活: 总共 {total_count} 个密钥")
-        
-        for key_id in request.key_ids:
-            # 获取密钥信息
-            api_key = key_service.get_api_key_by_id(db, key_id)
-            
-            if not api_key:
-                results.append(KeyCheckResult(
-                    key_id=key_id,
-                    key_name="未知",
-                    success=False,
-                    message="密钥不存在"
-                ))
-                fail_count += 1
-                continue
-            
-            # 测活
-            check_success, message = await _check_key_alive(api_key, db)
-            
-            results.append(KeyCheckResult(
-                key_id=key_id,
-                key_name=api_key.name,
-                success=check_success,
-                message=message
-            ))
-            
-            if check_success:
-                success_count += 1
-                logger.info(f"密钥 {api_key.name} (ID: {key_id}) 测活成功")
-            else:
-                fail_count += 1
-                # 测活失败，禁用该密钥，并根据错误信息设置 error_code
-                error_code = "CHECK_FAILED"  # 默认错误代码
-                
-                # 根据错误消息判断错误类型
-                message_lower = message.lower()
-                if "unauthorized" in message_lower or "401" in message_lower or "authentication" in message_lower or "invalid api key" in message_lower:
-                    error_code = "UNAUTHORIZED"
-                elif "rate limit" in message_lower or "429" in message_lower:
-                    error_code = "RATE_LIMIT"
-                elif "insufficient" in message_lower or "quota" in message_lower or "balance" in message_lower:
-                    error_code = "INSUFFICIENT_QUOTA"
-                elif "timeout" in message_lower:
-                    error_code = "TIMEOUT"
-                
-                # 使用 disable_api_key 函数禁用密钥并设置 error_code（批量操作不自动提交）
-                key_service.disable_api_key(
-                    db, 
-                    key_id, 
-                    reason=f"批量测活失败: {message}",
-                    error_code=error_code,
-                    auto_commit=False  # 批量操作时不自动提交
-                )
-                logger.warning(f"密钥 {api_key.name} (ID: {key_id}) 测活失败，已禁用 (error_code: {error_code}): {message}")
-        
-        # 批量操作结束后统一提交
-        db.commit()
-        logger.info(f"批量测活完成: 成功 {success_count} 个, 失败 {fail_count} 个")
-        
-        result = BatchCheckResult(
-            success_count=success_count,
-            fail_count=fail_count,
-            total_count=total_count,
-            results=results
+        ua_list = json.loads(ua_list_str)
+        if not isinstance(ua_list, list) or len(ua_list) == 0:
+            ua_list = ["Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36"]
+    except:
+        ua_list = ["Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36"]
+    
+    # 解析代理列表
+    proxy_list_str = configs.get(CONFIG_KEY_PROXY_LIST, "[]")
+    try:
+        proxy_list = json.loads(proxy_list_str)
+        if not isinstance(proxy_list, list):
+            proxy_list = []
+    except:
+        proxy_list = []
+    
+    return ua_list, proxy_list
+
+
+async def _batch_create_job(job: JobContext, request: APIKeyBatchCreateRequest):
+    """批量创建后台任务：每批在线程中创建并提交一次（名称序号跨批连续）"""
+    ua_list, proxy_list = await job_task.run_db(_load_ua_proxy_lists)
+    
+    for chunk in job.chunks(request.api_keys):
+        chunk_request = APIKeyBatchCreateRequest(batch_name=request.batch_name, api_keys=chunk)
+        _, success_count, fail_count = await job_task.run_db(
+            key_service.batch_create_api_keys, chunk_request, ua_list, proxy_list, start_index=job.success_count
+        )
+        await job.report(len(chunk), success_count, fail_count)
+
+
+@router.post("/batchCheck", response_model=Response[Union[BatchCheckResult, JobResponse]], summary="批量测活 API Key")
+async def batch_check_keys(request: APIKeyBatchCheckRequest = Body(...)):
+    """批量测活 API Keys（有上限的并发测活，失败的密钥在最后统一禁用并提交；默认作为后台任务分批执行，async_job=false 时在请求内执行）"""
+    try:
+        if request.async_job:
+            job = await job_task.submit_job(job_task.JOB_BATCH_CHECK, request)
+            return Response[JobResponse].ok(data=JobResponse(**job.to_dict()), msg=f"已提交后台任务: {job.id}")
+        
+        result = await _run_batch_check(
+            request.key_ids,
+            parallelism=request.parallelism or settings.KEY_CHECK_PARALLELISM,
+            timeout=request.timeout or settings.KEY_CHECK_TIMEOUT,
         )
         
         return Response[BatchCheckResult].ok(
             data=result,
-            msg=f"测活完成：成功 {success_count} 个，失败 {fail_count} 个"
+            msg=f"测活完成：成功 {result.success_count} 个，失败 {result.fail_count} 个"
         )
         
     except Exception as e:
@@ -287,16 +251,130 @@ async def batch_check_keys(
         return Response[BatchCheckResult].fail(msg=str(e))
 
 
-async def _check_key_alive(api_key, db: Session) -> tuple[bool, str]:
+async def _run_batch_check(key_ids: List[int], parallelism: int, timeout: float) -> BatchCheckResult:
     """
-    测试单个密钥是否活跃（直接复用 api_controller.chat_completions）
+    并发测活（同时最多 parallelism 个，每个密钥最多 timeout 秒）
     
-    返回: (是否成功, 消息)
+    - 测活请求直接调用 api_service.send_request（不经过全局调度和 Key 池准入），复用共享的上游异步客户端，不阻塞事件循环
+    - 结果按完成顺序汇总并输出进度，返回时按请求顺序排列
+    - 上游返回失败的密钥在全部完成后一次性禁用，只提交一次事务；本地异常和超时只计入失败，不禁用
+    - 查询密钥和禁用提交都在线程中执行（job_task.run_db），数据库繁忙时不阻塞事件循环
     """
-    try:
-        import json
-        from fastapi.responses import JSONResponse
+    total_count = len(key_ids)
+    logger.info(f"开始批量测活: 总共 {total_count} 个密钥, 并发 {parallelism}, 超时 {timeout}秒")
+    
+    # 一次查询所有密钥
+    keys = {k.id: k for k in await job_task.run_db(key_service.get_api_keys_by_ids, list(set(key_ids)))}
+    semaphore = asyncio.Semaphore(parallelism)
+    
+    async def check(index: int, key_id: int):
+        api_key = keys.get(key_id)
+        if not api_key:
+            return index, KeyCheckResult(key_id=key_id, key_name="未知", success=False, message="密钥不存在"), None
         
+        async with semaphore:
+            try:
+                check_success, message, upstream = await asyncio.wait_for(_check_key_alive(api_key), timeout=timeout)
+            except asyncio.TimeoutError:
+                # 本地的超时时间到了，不是上游的结论（可能只是测活并发高、超时设得短），只计入失败，不禁用
+                check_success, message, upstream = False, f"测活超时（timeout {timeout}s）", False
+        
+        # 只有上游返回的失败才禁用密钥（第三项为需要禁用的密钥）
+        item = KeyCheckResult(key_id=key_id, key_name=api_key.name, success=check_success, message=message)
+        return index, item, api_key if upstream else None
+    
+    results: List[Optional[KeyCheckResult]] = [None] * total_count
+    failed = []  # (密钥, 失败信息)
+    success_count = 0
+    fail_count = 0
+    progress_step = max(total_count // 10, 1)
+    
+    for done, future in enumerate(asyncio.as_completed([check(i, key_id) for i, key_id in enumerate(key_ids)]), start=1):
+        index, item, api_key = await future
+        results[index] = item
+        
+        if item.success:
+            success_count += 1
+            logger.info(f"密钥 {item.key_name} (ID: {item.key_id}) 测活成功")
+        else:
+            fail_count += 1
+            if api_key is not None:
+                failed.append((api_key, item.message))
+        
+        if done % progress_step == 0 or done == total_count:
+            logger.info(f"批量测活进度: {done}/{total_count}, 成功 {success_count} 个, 失败 {fail_count} 个")
+    
+    if failed:
+        await job_task.run_db(_disable_failed_keys, failed)
+    logger.info(f"批量测活完成: 成功 {success_count} 个, 失败 {fail_count} 个")
+    
+    return BatchCheckResult(
+        success_count=success_count,
+        fail_count=fail_count,
+        total_count=total_count,
+        results=results
+    )
+
+
+def _disable_failed_keys(db: Session, failed: List[Tuple[APIKey, str]]):
+    """禁用测活失败的密钥，并根据错误信息设置 error_code（批量操作不自动提交，最后统一提交）"""
+    disabled_ids = set()
+    for api_key, message in failed:
+        if api_key.id in disabled_ids:
+            continue
+        disabled_ids.add(api_key.id)
+        error_code = _check_error_code(message)
+        key_service.disable_api_key(
+            db,
+            api_key.id,
+            reason=f"批量测活失败: {message}",
+            error_code=error_code,
+            auto_commit=False  # 批量操作时不自动提交
+        )
+        logger.warning(f"密钥 {api_key.name} (ID: {api_key.id}) 测活失败，已禁用 (error_code: {error_code}): {message}")
+    
+    # 批量操作结束后统一提交
+    db.commit()
+
+
+async def _batch_check_job(job: JobContext, request: APIKeyBatchCheckRequest):
+    """批量测活后台任务：每批并发测活，批内失败的密钥统一禁用并提交（在线程中执行），结果只保留失败明细"""
+    parallelism = request.parallelism or settings.KEY_CHECK_PARALLELISM
+    timeout = request.timeout or settings.KEY_CHECK_TIMEOUT
+    
+    for chunk in job.chunks(request.key_ids):
+        result = await _run_batch_check(chunk, parallelism, timeout)
+        for item in result.results:
+            if not item.success:
+                job.add_item(item.dict())
+        await job.report(len(chunk), result.success_count, result.fail_count)
+
+
+def _check_error_code(message: str) -> str:
+    """根据测活失败信息判断错误类型"""
+    message_lower = message.lower()
+    if "unauthorized" in message_lower or "401" in message_lower or "authentication" in message_lower or "invalid api key" in message_lower:
+        return "UNAUTHORIZED"
+    if "rate limit" in message_lower or "429" in message_lower:
+        return "RATE_LIMIT"
+    if "insufficient" in message_lower or "quota" in message_lower or "balance" in message_lower:
+        return "INSUFFICIENT_QUOTA"
+    if "timeout" in message_lower:
+        return "TIMEOUT"
+    return "CHECK_FAILED"  # 默认错误代码
+
+
+async def _check_key_alive(api_key: APIKey) -> Tuple[bool, str, bool]:
+    """
+    测试单个密钥是否活跃（直接调用 api_service.send_request）
+    
+    - 不经过全局调度和 Key 池准入：管理端测活不占用调度名额，本地限流也不会让健康的密钥测活失败
+    - 测活请求照常记录日志
+    - 请求上下文不带数据库会话：测活的密钥直接传入，不会在事件循环中访问数据库
+    
+    返回: (是否成功, 消息, 是否为上游结果)；只有上游返回的失败（错误状态码或无法识别的响应）才禁用密钥
+    """
+    try:
         # 构建测活请求（使用 gpt-4o-mini 模型和简单的提示词）
         request = ChatCompletionRequest(
             model="gpt-4o-mini",
@@ -306,81 +384,56 @@ async def _check_key_alive(api_key, db: Session) -> tuple[bool, str]:
             api_key=api_key.api_key,
             proxy=api_key.proxy if api_key.proxy else None
         )
+        context = RequestContext(request)
+        context.init()
         
-        # 直接调用 api_controller.chat_completions（复用完整的请求处理逻辑）
-        response = await api_controller.chat_completions(request, db)
+        success = await api_service.send_request(context)
+        try:
+            log_service.log(context)
+        except Exception as log_err:
+            logger.error(f"记录测活请求日志失败: {str(log_err)}")
         
-        # chat_completions 返回的是 JSONResponse 对象
-        if isinstance(response, JSONResponse):
-            # 获取响应体内容
-            body = response.body
-            if isinstance(body, bytes):
-                body = body.decode('utf-8')
-            
-            response_data = json.loads(body)
-            
-            # 检查是否成功（有 choices 字段）
-            if 'choices' in response_data and len(response_data['choices']) > 0:
-                content = response_data['choices'][0].get('message', {}).get('content', '')
-                logger.info(f"密钥 {api_key.name} 测活成功: {content}")
-                return True, f"测活成功，返回内容: {content}"
-            
-            # 检查是否有错误信息
-            if 'error' in response_data:
-                error_info = response_data['error']
-                if isinstance(error_info, dict):
-                    error_msg = error_info.get('message', str(error_info))
-                else:
-                    error_msg = str(error_info)
-                logger.error(f"密钥 {api_key.name} 测活失败: {error_msg}")
-                return False, error_msg
-            
-            # 其他未知错误
-            error_msg = f"未知响应格式: {body[:200]}"  # 只取前200字符
+        if not success:
+            error_msg = context.error or "上游请求失败"
             logger.error(f"密钥 {api_key.name} 测活失败: {error_msg}")
-            return False, error_msg
+            # 只有上游返回了错误状态码才是上游的结论；连接失败 / SDK 超时没有状态码，不禁用
+            return False, error_msg, context.upstream_status_code is not None
         
-        # 不应该到这里
-        error_msg = f"意外的响应类型: {type(response)}"
-        logger.error(f"密钥 {api_key.name} 测活失败: {error_msg}")
-        return False, error_msg
+        # 检查是否成功（有 choices 字段）
+        choices = getattr(context.response, 'choices', None)
+        if not choices:
+            error_msg = f"未知响应格式: {str(context.response)[:200]}"  # 只取前200字符
+            logger.error(f"密钥 {api_key.name} 测活失败: {error_msg}")
+            return False, error_msg, True
+        
+        content = choices[0].message.content if choices[0].message else ''
+        logger.info(f"密钥 {api_key.name} 测活成功: {content}")
+        return True, f"测活成功，返回内容: {content}", True
             
     except Exception as e:
+        # 本地异常（不是上游返回的结果），不禁用密钥
         error_msg = str(e)
         logger.error(f"密钥 {api_key.name} 测活异常: {error_msg}")
-        return False, error_msg
+        return False, error_msg, False
 
 
-@router.post("/batchDelete", response_model=Response[dict], summary="批量删除 API Key")
+@router.post("/batchDelete", response_model=Response[Union[dict, JobResponse]], summary="批量删除 API Key")
 async def batch_delete_keys(
     request: APIKeyBatchDeleteRequest = Body(...),
     db: Session = Depends(get_db)
 ):
-    """批量删除 API Keys"""
+    """批量删除 API Keys（默认作为后台任务分批执行；async_job=false 时在请求内一次提交）"""
     try:
-        total_count = len(request.key_ids)
-        success_count = 0
-        fail_count = 0
+        if request.async_job:
+            job = await job_task.submit_job(job_task.JOB_BATCH_DELETE, request)
+            return Response[JobResponse].ok(data=JobResponse(**job.to_dict()), msg=f"已提交后台任务: {job.id}")
         
+        total_count = len(request.key_ids)
         logger.info(f"开始批量删除: 总共 {total_count} 个密钥")
         
-        for key_id in request.key_ids:
-            try:
-                # 检查密钥是否存在
-                api_key = key_service.get_api_key_by_id(db, key_id)
-                if not api_key:
-                    logger.warning(f"密钥不存在: ID={key_id}")
-                    fail_count += 1
-                    continue
-                
-                # 删除密钥
-                key_service.delete_api_key(db, key_id)
-                success_count += 1
-                logger.info(f"密钥 {api_key.name} (ID: {key_id}) 删除成功")
-                
-            except Exception as e:
-                logger.error(f"删除密钥 ID={key_id} 失败: {str(e)}")
-                fail_count += 1
+        # 不存在（或重复）的 ID 计为失败
+        success_count = key_service.batch_delete_api_keys(db, request.key_ids)
+        fail_count = total_count - success_count
         
         logger.info(f"批量删除完成: 成功 {success_count} 个, 失败 {fail_count} 个")
         
@@ -398,3 +451,16 @@ async def batch_delete_keys(
     except Exception as e:
         logger.error(f"批量删除失败: {str(e)}")
         return Response[dict].fail(msg=str(e))
+
+
+async def _batch_delete_job(job: JobContext, request: APIKeyBatchDeleteRequest):
+    """批量删除后台任务：每批在线程中删除并提交一次"""
+    for chunk in job.chunks(request.key_ids):
+        success_count = await job_task.run_db(key_service.batch_delete_api_keys, chunk)
+        await job.report(len(chunk), success_count, len(chunk) - success_count)
+
+
+# 注册后台任务类型
+job_task.register_job_type(job_task.JOB_BATCH_CREATE, APIKeyBatchCreateRequest, lambda r: len(r.api_keys), _batch_create_job)
+job_task.register_job_type(job_task.JOB_BATCH_CHECK, APIKeyBatchCheckRequest, lambda r: len(r.key_ids), _batch_check_job)
+job_task.register_job_type(job_task.JOB_BATCH_DELETE, APIKeyBatchDeleteRequest, lambda r: len(r.key_ids), _batch_delete_job)
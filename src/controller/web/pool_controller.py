@@ -0,0 +1,301 @@
+"""Web Key 池运行状态控制器"""
+
+from fastapi import APIRouter, Depends
+
+from entity.res.base import Response
+from service import refill_task, coordination_task, shared_counter_service, spend_ledger_task, reservation_service, log_writer_service, key_event_service, http_client_service, hedge_service, inflight_service, scheduler_service, breaker_service, latency_service, key_usage_service
+from utils.logger import logger
+from utils.admin_auth import verify_admin_token
+
+router = APIRouter(prefix="/api/pool", tags=["Pool Runtime"], dependencies=[Depends(verify_admin_token)])
+
+
+@router.post("/upstream-clients", summary="获取上游连接池统计")
+async def get_upstream_clients():
+    """
+    获取上游 HTTP 客户端注册表统计
+    
+    返回:
+    - hits / misses / hit_rate: SDK 客户端复用命中情况
+    - evictions: LRU 淘汰次数
+    - key_evictions: Key 删除 / 禁用 / 修改密钥或代理后移除的 SDK 客户端数
+    - sdk_clients: 当前缓存的 SDK 客户端数
+    - http_pools: 当前的代理连接池数
+    - open_connections: 已建立的上游连接数
+    - pools: 各代理连接池详情
+    """
+    try:
+        data = http_client_service.get_stats()
+        return Response.ok(data=data, msg="获取成功")
+    except Exception as e:
+        logger.error(f"获取上游连接池统计失败: {str(e)}")
+        return Response.fail(msg=str(e))
+
+
+@router.post("/hedge", summary="获取对冲请求统计")
+async def get_hedge_stats():
+    """
+    获取对冲请求统计
+    
+    返回:
+    - eligible / hedged / hedge_rate: 可对冲请求数、实际对冲次数及比例
+    - hedge_wins / primary_wins: 对冲方 / 主请求胜出次数
+    - cancelled: 被取消的尝试数
+    - rejected_by_cap: 因比例上限未对冲的次数
+    - models: 各模型延迟样本数和当前对冲触发延迟
+    """
+    try:
+        data = hedge_service.get_stats()
+        return Response.ok(data=data, msg="获取成功")
+    except Exception as e:
+        logger.error(f"获取对冲统计失败: {str(e)}")
+        return Response.fail(msg=str(e))
+
+
+@router.post("/inflight", summary="获取 Key 并发统计")
+async def get_inflight_stats():
+    """
+    获取每个 Key 的进行中请求数和等待队列状态
+    
+    返回:
+    - max_inflight: 单个 Key 的并发上限（0 表示不限制）
+    - total_inflight: 所有 Key 进行中的请求总数
+    - saturated_keys: 已达到并发上限的 Key 数
+    - waiting / queue_size: 当前排队的请求数 / 队列上限
+    - waited / wait_timeouts / rejected_queue_full: 累计排队、等待超时、队列已满被拒绝的请求数
+    - keys: 各 Key 的进行中请求数（按并发数降序）
+    """
+    try:
+        data = inflight_service.get_stats()
+        return Response.ok(data=data, msg="获取成功")
+    except Exception as e:
+        logger.error(f"获取 Key 并发统计失败: {str(e)}")
+        return Response.fail(msg=str(e))
+
+
+@router.post("/scheduler", summary="获取全局请求调度统计")
+async def get_scheduler_stats():
+    """
+    获取全局请求调度器的并发、排队和拒绝情况
+    
+    返回:
+    - max_concurrency / active: 全局并发上限（0 表示不限制）/ 当前进行中的请求数
+    - queue_depth / queue_size / queue_timeout: 当前排队的请求数 / 队列上限 / 最长排队时间
+    - admitted / queued: 累计准入、排队的请求数
+    - shed_queue_full / shed_timeout: 因队列已满、排队超时被拒绝（429）的请求数
+    - wait_ms_avg / wait_ms_p50 / wait_ms_p95 / wait_ms_p99 / wait_ms_max: 最近请求的排队耗时
+    - avg_hold_ms: 请求平均占用时长（EWMA）
+    - retry_after: 当前拒绝时返回的 Retry-After（秒）
+    """
+    try:
+        data = scheduler_service.get_stats()
+        return Response.ok(data=data, msg="获取成功")
+    except Exception as e:
+        logger.error(f"获取调度统计失败: {str(e)}")
+        return Response.fail(msg=str(e))
+
+
+@router.post("/breakers", summary="获取熔断状态")
+async def get_breaker_stats():
+    """
+    获取 Key / 代理熔断器状态
+    
+    返回:
+    - window / min_requests / error_rate / cooldown: 熔断配置
+    - tracked_keys / tracked_proxies: 已统计的 Key / 代理数
+    - open_keys / open_proxies: 当前处于熔断（open 或 half_open）的 Key / 代理数
+    - keys / proxies: 熔断中或发生过熔断的目标（状态、窗口内请求数、错误率、熔断次数、剩余冷却时间）
+    """
+    try:
+        data = breaker_service.get_stats()
+        return Response.ok(data=data, msg="获取成功")
+    except Exception as e:
+        logger.error(f"获取熔断状态失败: {str(e)}")
+        return Response.fail(msg=str(e))
+
+
+@router.post("/breakers/reset", summary="重置熔断状态")
+async def reset_breakers():
+    """重置所有 Key / 代理熔断器（恢复为 closed）"""
+    try:
+        breaker_service.reset()
+        logger.info("已重置所有熔断器")
+        return Response.ok(msg="重置成功")
+    except Exception as e:
+        logger.error(f"重置熔断器失败: {str(e)}")
+        return Response.fail(msg=str(e))
+
+
+@router.post("/latency", summary="获取 Key / 代理延迟统计")
+async def get_latency_stats():
+    """
+    获取延迟感知选择策略使用的 EWMA 统计
+    
+    返回:
+    - keys / proxies: 各 Key / 代理的 EWMA 延迟（流式为首字节时间）、错误率、样本数、距最后一次样本的秒数（按延迟升序）
+    """
+    try:
+        data = latency_service.get_stats()
+        return Response.ok(data=data, msg="获取成功")
+    except Exception as e:
+        logger.error(f"获取延迟统计失败: {str(e)}")
+        return Response.fail(msg=str(e))
+
+
+@router.post("/usage", summary="获取 Key 滑动窗口用量")
+async def get_usage_stats():
+    """
+    获取最少使用策略使用的滑动窗口用量
+    
+    返回:
+    - window: 统计窗口（秒）
+    - keys: 各 Key 窗口内的请求数和花费（按请求数降序）
+    """
+    try:
+        data = key_usage_service.get_stats()
+        return Response.ok(data=data, msg="获取成功")
+    except Exception as e:
+        logger.error(f"获取 Key 用量统计失败: {str(e)}")
+        return Response.fail(msg=str(e))
+
+
+@router.post("/refiller", summary="获取 Key 池补充任务状态")
+async def get_refiller_stats():
+    """
+    获取后台 Key 池补充任务状态
+    
+    返回:
+    - cached: 当前缓存的 Key 数
+    - low_watermark / high_watermark: 低水位 / 高水位（key_pool_size）
+    - cursor: ID 游标（下次从该 ID 之后继续查询）
+    - triggers / refills / loaded: 触发次数、实际补充次数、累计补充的 Key 数
+    - event_adds: 由 Key 变更事件直接加入缓存的 Key 数
+    - last_refill_at / last_refill_ms: 最近一次补充的时间戳和耗时
+    """
+    try:
+        data = refill_task.get_refiller().get_stats()
+        return Response.ok(data=data, msg="获取成功")
+    except Exception as e:
+        logger.error(f"获取 Key 池补充任务状态失败: {str(e)}")
+        return Response.fail(msg=str(e))
+
+
+@router.post("/key-events", summary="获取 Key 变更事件统计")
+async def get_key_events():
+    """
+    获取 Key 变更事件总线统计
+    
+    返回:
+    - subscribers: 订阅者列表（缓存池、补充任务、上游客户端注册表）
+    - published: 按事件类型统计的发布次数
+    - errors: 订阅者处理出错次数
+    """
+    try:
+        data = key_event_service.get_stats()
+        return Response.ok(data=data, msg="获取成功")
+    except Exception as e:
+        logger.error(f"获取 Key 变更事件统计失败: {str(e)}")
+        return Response.fail(msg=str(e))
+
+
+@router.post("/workers", summary="获取多 worker 协调状态")
+async def get_workers():
+    """
+    获取当前 worker 的协调状态
+    
+    返回:
+    - worker_id / is_leader: 当前 worker 及是否为 leader（只有 leader 运行统计任务）
+    - workers: 心跳未过期的 worker 列表
+    - config_version: 已加载的系统配置版本号
+    - change_cursor / pending_changes: Key 变更记录游标、待写入的本进程变更数
+    - changes_published / changes_applied: 写入的本进程变更数、应用的其他 worker 变更数
+    - leader_changes / config_reloads / last_sync_ms: leader 切换次数、配置重新加载次数、最近一次同步耗时
+    """
+    try:
+        data = coordination_task.get_coordinator().get_stats()
+        return Response.ok(data=data, msg="获取成功")
+    except Exception as e:
+        logger.error(f"获取协调状态失败: {str(e)}")
+        return Response.fail(msg=str(e))
+
+
+@router.post("/shared-counters", summary="获取跨进程 Key 计数")
+async def get_shared_counters():
+    """
+    获取所有 worker 共享内存中的 Key 计数（不查询数据库）
+    
+    返回:
+    - enabled: 是否已启用
+    - partition / workers: 当前 worker 的分区、所有存活 worker 的分区（pid、心跳、已用槽位）
+    - keys: 按 Key 汇总的 inflight（进行中请求数）、requests / errors（累计请求数 / 错误数）、spend（累计花费）
+    """
+    try:
+        data = shared_counter_service.get_stats()
+        return Response.ok(data=data, msg="获取成功")
+    except Exception as e:
+        logger.error(f"获取跨进程 Key 计数失败: {str(e)}")
+        return Response.fail(msg=str(e))
+
+
+@router.post("/spend-ledger", summary="获取 Key 花费账本状态")
+async def get_spend_ledger():
+    """
+    获取当前 worker 的 Key 花费账本状态（不查询数据库）
+    
+    返回:
+    - flush_interval: 写入数据库的间隔（秒）
+    - pending_keys / pending_amount: 尚未写入的 Key 数和花费
+    - exhausted_keys: 已因余额耗尽移出缓存、尚未写入的 Key
+    - recorded / recorded_amount: 累计记录的请求数和花费
+    - evictions / flushes / flush_errors: 余额耗尽移出次数、写入次数、写入失败次数
+    """
+    try:
+        data = spend_ledger_task.get_ledger().get_stats()
+        return Response.ok(data=data, msg="获取成功")
+    except Exception as e:
+        logger.error(f"获取花费账本状态失败: {str(e)}")
+        return Response.fail(msg=str(e))
+
+
+@router.post("/reservations", summary="获取 Key 余额预留统计")
+async def get_reservations():
+    """
+    获取当前 worker 的 Key 余额预留统计（不查询数据库）
+    
+    返回:
+    - enabled / default_cost: 是否启用、模型没有样本时的预估花费
+    - total_reserved / keys: 进行中请求预留的花费总额、按 Key 的预留花费和请求数
+    - models: 按模型的平均花费、平均输出 token 数和样本数（预估花费的依据）
+    - short_selections: 选 Key 时有 Key 因可用余额不够而被跳过的次数
+    - fallbacks: 可用余额全部不够预估花费、退而选择余额未耗尽的 Key 的次数
+    """
+    try:
+        data = reservation_service.get_stats()
+        return Response.ok(data=data, msg="获取成功")
+    except Exception as e:
+        logger.error(f"获取余额预留统计失败: {str(e)}")
+        return Response.fail(msg=str(e))
+
+
+@router.post("/log-writer", summary="获取请求日志写入统计")
+async def get_log_writer_stats():
+    """
+    获取当前 worker 的请求日志批量写入统计
+    
+    返回:
+    - batch_size / max_latency_ms: 每批最多条数、凑批的最长等待时间
+    - queue_size / queued: 队列上限、队列中等待写入的日志数（队列深度）
+    - submitted / written / failed: 累计提交、写入（含导入）、写入失败（已丢弃）的日志数
+    - batches / avg_batch / max_batch / last_batch_ms: 批次数、平均和最大批量、最近一批的写入耗时
+    - db_available / db_errors: 数据库当前是否可写、不可用的次数
+    - overflowed / spilled / spill_dropped: 队列溢出次数、写入溢出文件的日志数、溢出文件达到上限后丢弃的日志数
+    - spill_files / spill_bytes: 溢出目录中待导入的文件数和字节数（所有 worker）
+    - replayed / replay_corrupt / last_replay_rows / last_replay_rate: 累计导入数、无法解析的记录数、最近一次导入的条数和速率（条/秒）
+    - replay_failed / failed_files: 导入时出现数据库不可用以外的错误、移到 failed-*.log 的次数，溢出目录中这类文件数（需要人工处理）
+    """
+    try:
+        data = log_writer_service.get_stats()
+        return Response.ok(data=data, msg="获取成功")
+    except Exception as e:
+        logger.error(f"获取请求日志写入统计失败: {str(e)}")
+        return Response.fail(msg=str(e))
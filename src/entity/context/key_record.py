@@ -0,0 +1,35 @@
+"""Key 池中的 Key 记录（与数据库会话无关的只读对象）"""
+
+from decimal import Decimal
+from typing import Optional
+
+
+class KeyRecord:
+    """
+    缓存池中的 Key 记录
+    
+    只包含选 Key 和发送请求需要的字段，由 mapper 直接从查询结果构建：
+    - 使用 __slots__，没有 __dict__，也没有 SQLAlchemy 的属性插桩，占用内存小、属性访问快
+    - 与 Session 无关，不存在 DetachedInstanceError
+    - 创建后不可修改（Key 变化时用新记录替换缓存中的旧记录）
+    """
+    
+    __slots__ = ('id', 'name', 'api_key', 'proxy', 'ua', 'balance')
+    
+    def __init__(self, id: int, name: str, api_key: str, proxy: Optional[str], ua: Optional[str], balance: Optional[Decimal]):
+        setattr_ = object.__setattr__
+        setattr_(self, 'id', id)
+        setattr_(self, 'name', name)
+        setattr_(self, 'api_key', api_key)
+        setattr_(self, 'proxy', (proxy.strip() or None) if proxy else None)  # 去掉首尾空白，未绑定代理时为 None
+        setattr_(self, 'ua', ua)
+        setattr_(self, 'balance', balance)
+    
+    def __setattr__(self, name, value):
+        raise AttributeError(f"KeyRecord is immutable: cannot set '{name}'")
+    
+    def __delattr__(self, name):
+        raise AttributeError(f"KeyRecord is immutable: cannot delete '{name}'")
+    
+    def __repr__(self):
+        return f"<KeyRecord(id={self.id}, name='{self.name}')>"
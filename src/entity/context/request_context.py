@@ -1,8 +1,9 @@
 """请求流程上下文对象"""
 
-from typing import Optional
+import uuid
+from typing import Optional, Set
 from entity.req import ChatCompletionRequest
-from entity.databases.api_key import APIKey
+from entity.context.key_record import KeyRecord
 from constants import get_provider_by_model
 
 
@@ -15,15 +16,37 @@ class RequestContext:
         self.provider: Optional[str] = None
         self.is_stream: bool = False
         self.api_key: Optional[str] = None  # API Key 字符串
-        self.api_key_entity: Optional[APIKey] = None  # APIKey 对象（用于日志记录）
+        self.api_key_entity: Optional[KeyRecord] = None  # 选中的 Key 记录（用于日志记录）
         self.api_key_from_pool: bool = False  # 标记：API Key 是否从池中选择（True=池中选择，False=参数指定）
         self.proxy: Optional[str] = None  # 代理地址
         self.url: Optional[str] = None
         self.headers: Optional[dict] = None
         self.body: Optional[dict] = None
         self.response = None
+        self.passthrough: bool = False  # 是否透传上游原始响应字节（此时 response 为 httpx.Response）
         self.error: Optional[str] = None
-        self.start_time: float = 0.0  # 请求开始时间
+        self.start_time: float = 0.0  # 本次尝试开始时间
+        self.stream_finished: bool = False  # 流式响应是否已结束（已记录日志并释放名额）
+        
+        # 故障转移
+        self.request_id: str = uuid.uuid4().hex  # 请求 ID（同一请求的多次尝试共用，写入日志）
+        self.attempt: int = 1  # 当前第几次尝试
+        self.forked_attempt: int = 0  # 并行尝试（对冲请求）用过的最大尝试序号，下一次尝试从它之后编号
+        self.excluded_key_ids: Set[int] = set()  # 本请求已失败过的 Key，重试时不再选择
+        self.upstream_status_code: Optional[int] = None  # 上游返回的 HTTP 状态码（失败时）
+        self.retryable: bool = False  # 本次失败是否可以换 Key 重试
+        self.cancelled: bool = False  # 是否为被取消的对冲尝试（落败方）
+        
+        # Key 并发控制
+        self.inflight_key_id: Optional[int] = None  # 当前占用并发名额的 Key ID（释放后置为 None）
+        self.admission_status: Optional[int] = None  # 未能获取 Key 时返回给客户端的状态码（429 / 503）
+        self.reserved_cost: float = 0.0  # 在当前 Key 上预留的花费（释放后置为 0）
+        self.breaker_proxy: Optional[str] = None  # 选中 Key 时计入代理熔断的代理（Key 绑定的代理；请求指定的代理不参与熔断）
+        
+        # 全局调度
+        self.scheduler_admitted: bool = False  # 是否占用调度名额（释放后置为 False）
+        self.scheduler_admit_time: float = 0.0  # 获得调度名额的时间（monotonic）
+        self.retry_after: Optional[int] = None  # 过载被拒绝时建议客户端重试的等待秒数
     
     def init(self):
         """初始化上下文基本信息（不包含参数校验）"""
@@ -56,6 +79,68 @@ class RequestContext:
         if self.request.proxy:
             self.proxy = self.request.proxy
 
+    def next_attempt(self):
+        """
+        准备下一次尝试：排除当前 Key，清空上一次的 Key / 响应 / 错误信息
+        
+        注意：需要在上一次尝试记录日志并释放 Key 并发名额之后调用
+        """
+        import time
+        
+        if self.api_key_entity and self.api_key_entity.id:
+            self.excluded_key_ids.add(self.api_key_entity.id)
+        
+        self.attempt = max(self.attempt, self.forked_attempt) + 1
+        self.start_time = time.time()
+        self.api_key = None
+        self.api_key_entity = None
+        self.breaker_proxy = None
+        self.proxy = self.request.proxy or None
+        self.response = None
+        self.error = None
+        self.upstream_status_code = None
+        self.retryable = False
+
+    def fork(self) -> "RequestContext":
+        """
+        复制一个并行尝试用的上下文（对冲请求）
+        
+        共享请求信息和 request_id，Key / 响应 / 错误独立，并排除当前 Key
+        """
+        import time
+        
+        other = RequestContext(self.request, self.db)
+        other.provider = self.provider
+        other.is_stream = self.is_stream
+        other.url = self.url
+        other.passthrough = self.passthrough
+        other.api_key_from_pool = self.api_key_from_pool
+        other.proxy = self.request.proxy or None
+        other.start_time = time.time()
+        other.request_id = self.request_id
+        other.attempt = self.attempt + 1
+        other.excluded_key_ids = set(self.excluded_key_ids)
+        if self.api_key_entity and self.api_key_entity.id:
+            other.excluded_key_ids.add(self.api_key_entity.id)
+        return other
+
+    def adopt(self, other: "RequestContext"):
+        """采用并行尝试的结果（对冲请求胜出时，后续响应处理和日志使用胜出方的 Key / 响应）"""
+        self.api_key = other.api_key
+        self.api_key_entity = other.api_key_entity
+        self.inflight_key_id = other.inflight_key_id
+        self.reserved_cost = other.reserved_cost
+        self.proxy = other.proxy
+        self.breaker_proxy = other.breaker_proxy
+        self.response = other.response
+        self.error = other.error
+        self.start_time = other.start_time
+        self.attempt = other.attempt
+        self.upstream_status_code = other.upstream_status_code
+        self.retryable = other.retryable
+        self.cancelled = other.cancelled
+        self.excluded_key_ids |= other.excluded_key_ids
+
     def __repr__(self):
         return f"<RequestContext(provider='{self.provider}', model='{self.request.model}')>"
 
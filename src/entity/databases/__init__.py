@@ -5,6 +5,8 @@ from entity.databases.api_key import APIKey
 from entity.databases.request_log import RequestLog
 from entity.databases.request_stats import RequestStats
 from entity.databases.config import Config
+from entity.databases.coordination import Coordination, KeyChange
+from entity.databases.job import AdminJob
 
 __all__ = [
     'Base',
@@ -15,4 +17,7 @@ __all__ = [
     'RequestLog',
     'RequestStats',
     'Config',
+    'Coordination',
+    'KeyChange',
+    'AdminJob',
 ]
@@ -18,6 +18,7 @@ class APIKey(Base, TimestampMixin):
     enabled = Column(Boolean, default=True, nullable=False, comment='是否启用')
     balance = Column(DECIMAL(10, 2), comment='当前余额')
     total_balance = Column(DECIMAL(10, 2), comment='总授权额度')
+    spent = Column(DECIMAL(12, 6), default=0, comment='累计花费（美元，由花费账本定期累加；为空表示尚未从请求日志初始化）')
     balance_last_update = Column(DateTime, comment='余额最后更新时间')
     error_code = Column(String(50), comment='错误代码（如：UNAUTHORIZED, RATE_LIMIT 等）')
     memo = Column(Text, comment='备注说明')
@@ -38,6 +39,7 @@ class APIKey(Base, TimestampMixin):
             'enabled': self.enabled,
             'balance': float(self.balance) if self.balance else None,
             'total_balance': float(self.total_balance) if self.total_balance else None,
+            'spent': float(self.spent) if self.spent is not None else None,
             'balance_last_update': self.balance_last_update.isoformat() if self.balance_last_update else None,
             'error_code': self.error_code,
             'memo': self.memo,
@@ -0,0 +1,49 @@
+"""多进程协调模型"""
+
+from sqlalchemy import Column, Integer, String, Float, Index
+from entity.databases.database import Base
+from entity.databases.base_model import TimestampMixin
+
+
+class Coordination(Base, TimestampMixin):
+    """
+    多进程协调表（多个 worker 进程共享同一个 SQLite 文件）
+    
+    - leader: 租约行，holder 为当前 leader 的 worker ID，lease_until 前有效
+    - config: version 为系统配置版本号，保存配置后加 1
+    - worker:<ID>: 各 worker 的心跳（lease_until 过期视为已退出）
+    """
+    
+    __tablename__ = 'coordination'
+    
+    # 业务字段
+    name = Column(String(100), nullable=False, unique=True, comment='协调项名称')
+    holder = Column(String(100), comment='持有者（worker ID）')
+    lease_until = Column(Float, default=0, comment='租约到期时间（Unix 时间戳）')
+    version = Column(Integer, default=0, nullable=False, comment='版本号')
+    
+    def __repr__(self):
+        return f"<Coordination(name='{self.name}', holder='{self.holder}', version={self.version})>"
+
+
+class KeyChange(Base, TimestampMixin):
+    """
+    Key 变更记录表（各 worker 按 ID 游标读取其他 worker 产生的 Key 变更，增量更新本进程的缓存池）
+    
+    注意：ID 必须单调递增（AUTOINCREMENT），否则表被清空后 SQLite 会从 1 重新分配 ID，各 worker 的游标会跳过新记录
+    """
+    
+    __tablename__ = 'key_change_log'
+    
+    # 业务字段
+    key_id = Column(Integer, nullable=False, comment='API Key ID')
+    event = Column(String(50), nullable=False, comment='事件类型（key_created / key_updated / key_disabled / key_deleted / key_balance_changed）')
+    worker = Column(String(100), nullable=False, comment='产生变更的 worker ID')
+    
+    __table_args__ = (
+        Index('idx_key_change_create_time', 'create_time'),
+        {'sqlite_autoincrement': True},
+    )
+    
+    def __repr__(self):
+        return f"<KeyChange(id={self.id}, key_id={self.key_id}, event='{self.event}')>"
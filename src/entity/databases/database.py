@@ -2,17 +2,20 @@
 
 from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker, DeclarativeBase
-from sqlalchemy.pool import StaticPool
+from sqlalchemy.pool import NullPool
 from configs.config import settings
 
 
 # 创建引擎
 # check_same_thread=False 是 SQLite 特有的配置，允许多线程访问
-# StaticPool 用于测试环境，生产环境可以使用默认的连接池
+# NullPool：每个会话独占一个 SQLite 连接（打开文件连接的开销很小）
+# - 请求在事件循环中并发处理、日志在后台线程写入，共享单个连接（StaticPool）会导致多线程同时操作同一个 sqlite3 连接
+# - 有上限的连接池在并发请求等待上游时会被耗尽，阻塞事件循环
+# timeout: 写锁被占用时的等待秒数
 engine = create_engine(
     settings.SQLALCHEMY_DATABASE_URL,
-    connect_args={"check_same_thread": False},
-    poolclass=StaticPool,
+    connect_args={"check_same_thread": False, "timeout": 30},
+    poolclass=NullPool,
     echo=settings.DB_ECHO,  # 从配置读取是否打印 SQL
 )
 
@@ -0,0 +1,59 @@
+"""后台任务模型"""
+
+import json
+
+from sqlalchemy import Column, Integer, String, Boolean, DateTime, Text, Index
+from entity.databases.database import Base
+from entity.databases.base_model import TimestampMixin
+
+
+class AdminJob(Base, TimestampMixin):
+    """
+    管理后台任务表（批量创建 / 测活 / 删除、余额更新等长时间操作）
+    
+    任务在提交它的 worker 进程中执行，状态写入数据库，任意 worker 都可以查询和取消
+    """
+    
+    __tablename__ = 'admin_job'
+    
+    # 业务字段
+    job_type = Column(String(50), nullable=False, comment='任务类型（batch_create / batch_check / batch_delete / update_balance）')
+    status = Column(String(20), nullable=False, default='pending', comment='状态：pending / running / succeeded / failed / cancelled')
+    total = Column(Integer, default=0, nullable=False, comment='需要处理的总数')
+    processed = Column(Integer, default=0, nullable=False, comment='已处理数量')
+    success_count = Column(Integer, default=0, nullable=False, comment='成功数量')
+    fail_count = Column(Integer, default=0, nullable=False, comment='失败数量')
+    cancel_requested = Column(Boolean, default=False, nullable=False, comment='是否已请求取消')
+    worker = Column(String(100), comment='执行任务的 worker ID')
+    result = Column(Text, comment='任务结果（JSON）')
+    error = Column(Text, comment='失败原因')
+    start_time = Column(DateTime, comment='开始执行时间')
+    finish_time = Column(DateTime, comment='结束时间')
+    
+    __table_args__ = (
+        Index('idx_admin_job_status', 'status'),
+    )
+    
+    def __repr__(self):
+        return f"<AdminJob(id={self.id}, job_type='{self.job_type}', status='{self.status}')>"
+    
+    def to_dict(self):
+        """转换为字典"""
+        return {
+            'id': self.id,
+            'create_time': self.create_time.isoformat() if self.create_time else None,
+            'update_time': self.update_time.isoformat() if self.update_time else None,
+            'job_type': self.job_type,
+            'status': self.status,
+            'total': self.total,
+            'processed': self.processed,
+            'success_count': self.success_count,
+            'fail_count': self.fail_count,
+            'progress': round(self.processed * 100 / self.total, 2) if self.total else 0,
+            'cancel_requested': self.cancel_requested,
+            'worker': self.worker,
+            'result': json.loads(self.result) if self.result else None,
+            'error': self.error,
+            'start_time': self.start_time.isoformat() if self.start_time else None,
+            'finish_time': self.finish_time.isoformat() if self.finish_time else None,
+        }
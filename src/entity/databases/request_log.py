@@ -1,6 +1,6 @@
 """请求日志模型"""
 
-from sqlalchemy import Column, Integer, String, DECIMAL, Text
+from sqlalchemy import Column, Integer, String, DECIMAL, Text, Index
 from entity.databases.database import Base
 from entity.databases.base_model import TimestampMixin
 
@@ -11,6 +11,8 @@ class RequestLog(Base, TimestampMixin):
     __tablename__ = 'api_request_log'
     
     # 业务字段
+    request_id = Column(String(32), index=True, comment='请求 ID（同一个客户端请求的多次尝试共用）')
+    attempt = Column(Integer, default=1, comment='第几次尝试（故障转移换 Key 重试时递增）')
     key_id = Column(Integer, default=0, comment='使用的API Key ID (从池中选择时)')
     api_key = Column(String(255), comment='实际使用的 API Key (参数指定时)')
     proxy = Column(String(255), comment='使用的代理地址')
@@ -45,6 +47,11 @@ class RequestLog(Base, TimestampMixin):
     request_body = Column(Text, comment='请求 body（JSON）')
     response_body = Column(Text, comment='响应 body（JSON）')
     
+    __table_args__ = (
+        # 按 Key 汇总成本（余额计算）的覆盖索引：只读索引，不回表
+        Index('idx_request_log_key_cost', 'key_id', 'status', 'cost'),
+    )
+    
     def __repr__(self):
         return f"<RequestLog(id={self.id}, key_id={self.key_id}, model='{self.model}', status='{self.status}')>"
     
@@ -54,6 +61,8 @@ class RequestLog(Base, TimestampMixin):
             'id': self.id,
             'create_time': self.create_time.isoformat() if self.create_time else None,
             'update_time': self.update_time.isoformat() if self.update_time else None,
+            'request_id': self.request_id,
+            'attempt': self.attempt,
             'key_id': self.key_id,
             'api_key': self.api_key,
             'proxy': self.proxy,
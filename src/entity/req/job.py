@@ -0,0 +1,28 @@
+"""后台任务请求模型"""
+
+from typing import Optional
+from pydantic import BaseModel, Field
+
+
+class JobSubmitRequest(BaseModel):
+    """提交后台任务请求"""
+    job_type: str = Field(..., description="任务类型：batch_create / batch_check / batch_delete / update_balance")
+    params: dict = Field(default_factory=dict, description="任务参数（与对应批量接口的请求体相同）")
+
+
+class JobGetRequest(BaseModel):
+    """获取后台任务请求"""
+    job_id: int = Field(..., description="任务ID")
+
+
+class JobCancelRequest(BaseModel):
+    """取消后台任务请求"""
+    job_id: int = Field(..., description="任务ID")
+
+
+class JobQueryRequest(BaseModel):
+    """查询后台任务列表请求"""
+    page: int = Field(1, ge=1, description="页码")
+    page_size: int = Field(10, ge=1, le=100, description="每页数量")
+    job_type: Optional[str] = Field(None, description="任务类型筛选")
+    status: Optional[str] = Field(None, description="状态筛选：pending / running / succeeded / failed / cancelled")
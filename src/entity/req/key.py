@@ -65,13 +65,23 @@ class APIKeyBatchCreateRequest(BaseModel):
     """批量创建 API Key 请求"""
     batch_name: str = Field(..., description="批次名称（作为密钥名称的前缀）")
     api_keys: List[str] = Field(..., description="API密钥列表（每行一个密钥）")
+    async_job: bool = Field(True, description="是否作为后台任务执行（默认是，立即返回任务，通过 /api/jobs/get 查询进度；false 时在请求内执行并返回结果）")
 
 
 class APIKeyBatchCheckRequest(BaseModel):
     """批量测活 API Key 请求"""
     key_ids: List[int] = Field(..., description="需要测活的密钥ID列表")
+    parallelism: Optional[int] = Field(None, ge=1, le=100, description="同时测活的密钥数（不传使用 KEY_CHECK_PARALLELISM）")
+    timeout: Optional[float] = Field(None, gt=0, le=300, description="单个密钥的测活超时（秒，不传使用 KEY_CHECK_TIMEOUT）")
+    async_job: bool = Field(True, description="是否作为后台任务执行（默认是，立即返回任务，通过 /api/jobs/get 查询进度；false 时在请求内执行并返回结果）")
 
 
 class APIKeyBatchDeleteRequest(BaseModel):
     """批量删除 API Key 请求"""
     key_ids: List[int] = Field(..., description="需要删除的密钥ID列表")
+    async_job: bool = Field(True, description="是否作为后台任务执行（默认是，立即返回任务，通过 /api/jobs/get 查询进度；false 时在请求内执行并返回结果）")
+
+
+class APIKeyBalanceUpdateRequest(BaseModel):
+    """更新所有 Key 余额请求"""
+    async_job: bool = Field(True, description="是否作为后台任务执行（默认是，立即返回任务，通过 /api/jobs/get 查询进度；false 时在请求内执行并返回结果）")
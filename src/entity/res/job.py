@@ -0,0 +1,24 @@
+"""后台任务响应模型"""
+
+from typing import Optional
+from pydantic import BaseModel
+
+
+class JobResponse(BaseModel):
+    """后台任务响应"""
+    id: int
+    create_time: Optional[str]
+    update_time: Optional[str]
+    job_type: str
+    status: str
+    total: int
+    processed: int
+    success_count: int
+    fail_count: int
+    progress: float
+    cancel_requested: bool
+    worker: Optional[str]
+    result: Optional[dict]
+    error: Optional[str]
+    start_time: Optional[str]
+    finish_time: Optional[str]
@@ -16,6 +16,7 @@ class APIKeyResponse(BaseModel):
     enabled: bool
     balance: Optional[float]
     total_balance: Optional[float]
+    spent: Optional[float] = None
     balance_last_update: Optional[str]
     error_code: Optional[str]
     memo: Optional[str]
@@ -9,6 +9,8 @@ class RequestLogResponse(BaseModel):
     id: int
     create_time: Optional[str]
     update_time: Optional[str]
+    request_id: Optional[str] = None
+    attempt: Optional[int] = None
     key_id: int
     api_key: Optional[str]
     proxy: Optional[str]
@@ -1,8 +1,8 @@
 """数据访问层（Mapper/DAO）"""
 
-from mapper.api_key_mapper import query_available_keys
+from mapper.api_key_mapper import query_available_keys_after
 
 __all__ = [
-    'query_available_keys',
+    'query_available_keys_after',
 ]
 
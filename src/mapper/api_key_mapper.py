@@ -2,37 +2,33 @@
 
 from typing import Optional
 from sqlalchemy.orm import Session
+from entity.context.key_record import KeyRecord
 from entity.databases.api_key import APIKey
 
 
-def query_available_keys(
-    db: Session, 
-    limit: int = None, 
-    exclude_ids: list[int] = None
-) -> list[APIKey]:
+def query_available_keys_after(
+    db: Session,
+    after_id: int,
+    limit: int
+) -> list[KeyRecord]:
     """
-    查询可用的 API Key 列表
+    按 ID 游标分页查询可用的 API Key（keyset 分页，走主键索引，不需要排除列表）
+    
+    只查询 Key 池需要的列，直接构建 KeyRecord（不创建 ORM 实例，结果与 Session 无关）
     
     Args:
         db: 数据库会话
-        limit: 限制返回数量（None 表示不限制）
-        exclude_ids: 需要排除的 Key ID 列表
+        after_id: 只返回 ID 大于该值的 Key
+        limit: 返回数量上限
         
     Returns:
-        APIKey 对象列表
+        KeyRecord 列表（按 ID 升序）
     """
-    query = db.query(APIKey).filter(
+    rows = db.query(
+        APIKey.id, APIKey.name, APIKey.api_key, APIKey.proxy, APIKey.ua, APIKey.balance
+    ).filter(
+        APIKey.id > after_id,
         APIKey.enabled == True,
         (APIKey.balance > 0) | (APIKey.balance == None)
-    )
-    
-    # 排除指定的 ID
-    if exclude_ids:
-        query = query.filter(~APIKey.id.in_(exclude_ids))
-    
-    # 限制数量
-    if limit is not None:
-        query = query.limit(limit)
-    
-    return query.all()
-
+    ).order_by(APIKey.id).limit(limit).all()
+    return [KeyRecord(*row) for row in rows]
@@ -1,5 +1,6 @@
 """RequestLog 数据访问层（Mapper）"""
 
+from sqlalchemy import insert
 from sqlalchemy.orm import Session
 from entity.databases.request_log import RequestLog
 
@@ -22,6 +23,24 @@ def insert_request_log(db: Session, log_data: dict) -> RequestLog:
     return log
 
 
+def insert_request_logs(db: Session, rows: list[dict]) -> int:
+    """
+    批量插入请求日志（一条批量 INSERT，一次提交，不回读）
+    
+    Args:
+        db: 数据库会话
+        rows: 日志数据字典列表（字段可以不完全相同）
+        
+    Returns:
+        插入的数量
+    """
+    if not rows:
+        return 0
+    db.execute(insert(RequestLog), rows)
+    db.commit()
+    return len(rows)
+
+
 def query_logs_by_key(db: Session, key_id: int, limit: int = 100) -> list[RequestLog]:
     """
     查询指定 Key 的日志
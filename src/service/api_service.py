@@ -1,29 +1,226 @@
-"""API 请求服务 - 使用 OpenAI 和 Anthropic SDK"""
+"""API 请求服务 - 使用 OpenAI 和 Anthropic 异步 SDK"""
 
-import httpx
-from openai import OpenAI, AuthenticationError as OpenAIAuthError
-from anthropic import Anthropic, AuthenticationError as AnthropicAuthError
+import time
+import asyncio
 
+import openai
+import anthropic
+
+from configs.config import settings
 from entity.context import RequestContext
 from constants import PROVIDER_OPENAI, PROVIDER_ANTHROPIC
 from utils.logger import logger
+from service import http_client_service, lb_service, log_service, hedge_service, scheduler_service, breaker_service, latency_service, shared_counter_service
+from utils.sse_utils import RawJSONResponse
 from service.databases import key_service
 
 
-def send_request(context: RequestContext) -> bool:
+# 可以换 Key 重试的上游状态码（另加所有 5xx）
+_RETRYABLE_STATUS_CODES = {401, 403, 408, 409, 429}
+
+
+async def send_with_failover(context: RequestContext) -> bool:
+    """
+    发送 API 请求，失败时换一个池中的 Key 重试（故障转移）
+    
+    规则：
+    - 只有从池中选择的 Key 才会重试，参数指定的 Key 只尝试一次
+    - 只在 401/403/408/409/429/5xx、连接失败、超时时重试，400 等请求本身的错误直接返回
+    - 尝试次数和截止时间由 UPSTREAM_MAX_ATTEMPTS / UPSTREAM_RETRY_DEADLINE 控制
+    - 重试只发生在向客户端写出第一个字节之前：流式请求在收到上游响应头时即返回，之后的中断不再重试
+    - 每次失败的尝试单独记录一条日志，通过 request_id 关联
     """
-    发送 API 请求（使用官方 SDK）
+    max_attempts = max(settings.UPSTREAM_MAX_ATTEMPTS, 1) if context.api_key_from_pool else 1
+    deadline = time.time() + settings.UPSTREAM_RETRY_DEADLINE
+    
+    try:
+        while True:
+            if await _send_attempt(context):
+                return True
+            
+            # 记录本次失败的尝试（日志数据在 log() 中同步构建，之后可以安全地重置 context）
+            try:
+                log_service.log(context)
+            except Exception as e:
+                logger.error(f"记录失败尝试日志失败: {str(e)}")
+            lb_service.release_key(context)
+            
+            attempts = max(context.attempt, context.forked_attempt)
+            if not context.retryable or attempts >= max_attempts or time.time() >= deadline:
+                return False
+            
+            last_error = context.error
+            failed_key_id = context.api_key_entity.id if context.api_key_entity else None
+            context.next_attempt()
+            
+            if not await lb_service.get_key(context):
+                logger.warning(f"故障转移失败，没有其他可用的 Key: request_id={context.request_id}")
+                context.error = last_error
+                return False
+            
+            logger.warning(
+                f"🔁 故障转移: request_id={context.request_id}, attempt={context.attempt}, "
+                f"failed_key={failed_key_id}, new_key={context.api_key_entity.id}"
+            )
+    except asyncio.CancelledError:
+        # 客户端断开（发送中或故障转移排队等待 Key 时）：释放 Key 并发名额和调度名额
+        release_request(context)
+        raise
+
+
+def release_request(context: RequestContext):
+    """
+    请求结束：释放 Key 并发名额和全局调度名额（幂等，可重复调用）
+    
+    在响应处理完成、记录日志的同时调用；提前返回错误的分支也需要调用
+    """
+    lb_service.release_key(context)
+    scheduler_service.release(context)
+
+
+async def _send_attempt(context: RequestContext) -> bool:
+    """发送一次尝试；启用对冲时，非流式的池中 Key 请求走对冲逻辑"""
+    if not hedge_service.is_enabled() or context.is_stream or not context.api_key_from_pool:
+        return await send_request(context)
+    
+    hedge_service.mark_eligible()
+    started = time.time()
+    
+    # 样本不足时不对冲
+    delay = hedge_service.get_hedge_delay(context.request.model)
+    if delay is None:
+        success = await send_request(context)
+    else:
+        success = await _send_hedged(context, delay)
+    
+    if success:
+        hedge_service.record_latency(context.request.model, time.time() - started)
+    return success
+
+
+async def _send_hedged(context: RequestContext, delay: float) -> bool:
+    """
+    对冲请求：主请求 delay 秒内未返回时，用另一个 Key 再发一次，先成功者胜出，另一方被取消
+    
+    - 胜出方的结果写回 context（对冲方胜出时通过 context.adopt）
+    - 落败方单独记录日志：被取消的记为 cancelled（已拿到响应的按实际用量记账），失败的记为 error
+    - 两方都失败时，主请求的失败由 send_with_failover 记录，这里只记录对冲方
+    """
+    primary = asyncio.ensure_future(send_request(context))
+    try:
+        done, _ = await asyncio.wait({primary}, timeout=delay)
+    except asyncio.CancelledError:
+        # asyncio.wait 不会取消等待的任务，需要手动取消
+        primary.cancel()
+        raise
+    if done or not hedge_service.try_acquire():
+        return await primary
+    
+    hedge = context.fork()
+    # 对冲请求不排队等待：没有空闲的 Key 时退回对冲名额，只等主请求
+    if not await lb_service.get_key(hedge, wait=False):
+        hedge_service.refund()
+        return await primary
+    
+    logger.info(
+        f"⏱️ 发起对冲请求: request_id={context.request_id}, delay={delay:.2f}s, "
+        f"primary_key={context.api_key_entity.id if context.api_key_entity else None}, hedge_key={hedge.api_key_entity.id}"
+    )
+    secondary = asyncio.ensure_future(send_request(hedge))
+    contexts = {primary: context, secondary: hedge}
+    pending = {primary, secondary}
+    winner = None
+    
+    try:
+        while pending and winner is None:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            # 同时完成时优先采用主请求
+            for task in sorted(done, key=lambda t: t is not primary):
+                if winner is None and task.result():
+                    winner = contexts[task]
+    except asyncio.CancelledError:
+        # 客户端断开：主请求的 Key 由 send_with_failover 释放，这里释放对冲请求的 Key
+        lb_service.release_key(hedge)
+        raise
+    finally:
+        # 取消仍在进行的一方（客户端断开导致本协程被取消时同样会取消两方）
+        for task in pending:
+            task.cancel()
+        if pending:
+            await asyncio.gather(*pending, return_exceptions=True)
+    
+    for task in pending:
+        contexts[task].cancelled = True
+    
+    if winner is not None:
+        hedge_service.record_result(hedge_won=winner is hedge, cancelled=bool(pending))
+    
+    # 记录落败方的日志
+    for ctx in (context, hedge):
+        if ctx is winner or (winner is None and ctx is context):
+            continue
+        # 同时完成的成功方：响应被丢弃，但上游已计费
+        if ctx.response is not None:
+            ctx.cancelled = True
+        try:
+            log_service.log(ctx)
+        except Exception as e:
+            logger.error(f"记录对冲尝试日志失败: {str(e)}")
+        lb_service.release_key(ctx)
+    
+    if winner is hedge:
+        context.adopt(hedge)
+    elif winner is None:
+        # 两方都失败：后续故障转移排除两个 Key，并延续尝试序号（主请求的失败日志仍使用主请求自己的序号）
+        context.forked_attempt = hedge.attempt
+        context.excluded_key_ids |= hedge.excluded_key_ids
+        if hedge.api_key_entity and hedge.api_key_entity.id:
+            context.excluded_key_ids.add(hedge.api_key_entity.id)
+    
+    return winner is not None
+
+
+def _classify_error(context: RequestContext, e: Exception):
+    """记录上游状态码，并判断本次失败是否可以换 Key 重试"""
+    status_code = getattr(e, 'status_code', None)
+    context.upstream_status_code = status_code
+    
+    if status_code is None:
+        # 连接失败 / 超时（APITimeoutError 是 APIConnectionError 的子类）
+        context.retryable = isinstance(e, (openai.APIConnectionError, anthropic.APIConnectionError))
+    else:
+        context.retryable = status_code in _RETRYABLE_STATUS_CODES or status_code >= 500
+
+
+async def send_request(context: RequestContext) -> bool:
+    """
+    发送 API 请求（使用官方异步 SDK）
     
     注意：
-    - 使用官方 SDK，自动处理流式和非流式响应
+    - 使用 AsyncOpenAI / AsyncAnthropic，上游请求期间不阻塞事件循环
     - 响应对象保存在 context.response 中
-    - 流式响应返回 Stream 对象，非流式返回对应的 Completion 对象
+    - 流式响应返回 AsyncStream 对象（需使用 async for 迭代），非流式返回对应的 Completion 对象
+    - 每次请求的结果计入 Key / 代理熔断统计和延迟统计
     """
+    started = time.monotonic()
+    try:
+        success = await _dispatch_request(context)
+    except asyncio.CancelledError:
+        breaker_service.record_cancelled(context)
+        raise
+    breaker_service.record_result(context, success)
+    latency_service.record_result(context, success, time.monotonic() - started)
+    shared_counter_service.record_result(context, success)
+    return success
+
+
+async def _dispatch_request(context: RequestContext) -> bool:
+    """按 provider 分发请求"""
     try:
         if context.provider == PROVIDER_OPENAI:
-            return _send_openai_request(context)
+            return await _send_openai_request(context)
         elif context.provider == PROVIDER_ANTHROPIC:
-            return _send_anthropic_request(context)
+            return await _send_anthropic_request(context)
         else:
             logger.error(f"不支持的 provider: {context.provider}")
             context.error = f"Unsupported provider: {context.provider}"
@@ -33,10 +230,11 @@ def send_request(context: RequestContext) -> bool:
         logger.error(f"请求失败: provider={context.provider}, error={str(e)}")
         context.error = str(e)
         context.response = None
+        context.retryable = False
         return False
 
 
-def _send_openai_request(context: RequestContext) -> bool:
+async def _send_openai_request(context: RequestContext) -> bool:
     """发送 OpenAI 请求"""
     try:
         logger.info(f"发送请求: provider={context.provider}, model={context.request.model}, stream={context.is_stream}")
@@ -45,29 +243,10 @@ def _send_openai_request(context: RequestContext) -> bool:
         base_url = context.url.replace('/chat/completions', '')
         logger.info(f"使用 base_url: {base_url}")
         
-        # 创建 HTTP 客户端（支持代理，包括 socks5）
-        http_client = None
+        # 从注册表获取 OpenAI 异步客户端（按代理复用长连接，支持 http/https/socks5 代理）
         if context.proxy:
             logger.info(f"使用代理: {context.proxy}")
-            # httpx 支持 http/https/socks5 代理
-            # 格式: http://..., https://..., socks5://...
-            http_client = httpx.Client(
-                proxy=context.proxy,
-                timeout=httpx.Timeout(60.0, connect=10.0),
-            )
-        
-        # 初始化 OpenAI 客户端
-        client = OpenAI(
-            api_key=context.api_key,
-            base_url=base_url,
-            http_client=http_client,
-            timeout=60.0,
-            default_headers={
-                'x-amp-feature': 'chat',
-                'accept-language': 'zh-CN,zh;q=0.9,en;q=0.8',
-                'user-agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36'
-            }
-        )
+        client = http_client_service.get_openai_client(context.api_key, base_url, context.proxy)
         
         # 构建请求参数
         request_params = {
@@ -96,8 +275,16 @@ def _send_openai_request(context: RequestContext) -> bool:
         if context.request.user is not None:
             request_params['user'] = context.request.user
         
-        # 发送请求
-        response = client.chat.completions.create(**request_params)
+        # 发送请求（await 上游响应，期间事件循环可处理其他请求）
+        if context.passthrough:
+            # 透传模式：跳过 SDK 解析，流式保留未读取的 httpx.Response，非流式保留原始 JSON 字节
+            raw = await client.chat.completions.with_raw_response.create(**request_params)
+            if context.is_stream:
+                response = raw.http_response
+            else:
+                response = RawJSONResponse(await raw.http_response.aread())
+        else:
+            response = await client.chat.completions.create(**request_params)
         
         # 保存响应到 context
         context.response = response
@@ -111,6 +298,7 @@ def _send_openai_request(context: RequestContext) -> bool:
         logger.error(f"OpenAI 请求失败: {error_msg}")
         context.error = error_msg
         context.response = None
+        _classify_error(context, e)
         
         # 检查是否是认证错误（通过错误消息判断）
         # 支持的错误消息模式：
@@ -144,7 +332,7 @@ def _send_openai_request(context: RequestContext) -> bool:
         return False
 
 
-def _send_anthropic_request(context: RequestContext) -> bool:
+async def _send_anthropic_request(context: RequestContext) -> bool:
     """发送 Anthropic 请求"""
     try:
         logger.info(f"发送请求: provider=anthropic, model={context.request.model}, stream={context.is_stream}")
@@ -153,34 +341,10 @@ def _send_anthropic_request(context: RequestContext) -> bool:
         base_url = context.url.replace('/v1/messages', '')
         logger.info(f"使用 base_url: {base_url}")
         
-        # 创建 HTTP 客户端（支持代理）
-        # Anthropic SDK 需要传递完整的 httpx.Client 实例
+        # 从注册表获取 Anthropic 异步客户端（按代理复用长连接）
         if context.proxy:
             logger.info(f"使用代理: {context.proxy}")
-            http_client = httpx.Client(
-                proxy=context.proxy,
-                timeout=httpx.Timeout(60.0, connect=10.0),
-            )
-        else:
-            http_client = httpx.Client(
-                timeout=httpx.Timeout(60.0, connect=10.0),
-            )
-        
-        # 初始化 Anthropic 客户端
-        from constants import ANTHROPIC_API_VERSION
-        
-        client = Anthropic(
-            api_key=context.api_key,
-            base_url=base_url,
-            http_client=http_client,
-            max_retries=0,  # 禁用重试
-            default_headers={
-                'x-amp-feature': 'chat',
-                'accept-language': 'zh-CN,zh;q=0.9,en;q=0.8',
-                'user-agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36',
-                'anthropic-version': ANTHROPIC_API_VERSION  # ✅ 添加 anthropic-version header
-            }
-        )
+        client = http_client_service.get_anthropic_client(context.api_key, base_url, context.proxy)
         
         # 构建请求参数
         # Anthropic 只支持 role 和 content 字段，需要过滤掉其他字段（如 name）
@@ -204,8 +368,13 @@ def _send_anthropic_request(context: RequestContext) -> bool:
         if context.request.stop is not None:
             request_params['stop_sequences'] = [context.request.stop] if isinstance(context.request.stop, str) else context.request.stop
         
-        # 发送请求
-        response = client.messages.create(**request_params)
+        # 发送请求（await 上游响应，期间事件循环可处理其他请求）
+        if context.passthrough:
+            # 透传模式：只拿原始 httpx.Response（响应体未读取），由 response_utils 直接转发字节
+            raw = await client.messages.with_raw_response.create(**request_params)
+            response = raw.http_response
+        else:
+            response = await client.messages.create(**request_params)
         
         # 保存响应到 context
         context.response = response
@@ -218,6 +387,7 @@ def _send_anthropic_request(context: RequestContext) -> bool:
         logger.error(f"Anthropic 请求失败: {error_msg}")
         context.error = error_msg
         context.response = None
+        _classify_error(context, e)
         
         # 检查是否是认证错误（通过错误消息判断）
         # 支持的错误消息模式：
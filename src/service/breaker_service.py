@@ -0,0 +1,301 @@
+"""熔断服务 - 按 Key 和代理统计滚动错误率，错误率过高时熔断，冷却后放行探测请求"""
+
+import time
+from collections import deque
+from typing import Dict, Iterable, Optional, Set
+
+from configs.config import settings
+from entity.context import RequestContext
+from utils.logger import logger
+
+
+# 熔断器状态
+STATE_CLOSED = "closed"  # 正常
+STATE_OPEN = "open"  # 熔断中，不参与选择
+STATE_HALF_OPEN = "half_open"  # 冷却结束，放行一个探测请求
+
+
+class CircuitBreaker:
+    """
+    单个目标（Key 或代理）的熔断器
+
+    - closed: 记录滑动窗口内的请求结果，请求数达到 min_requests 且错误率达到 error_rate 时熔断
+    - open: 冷却 cooldown 秒后进入 half_open
+    - half_open: 只放行一个探测请求，成功则恢复 closed，失败则重新 open
+    """
+
+    def __init__(self, name: str, window: float, min_requests: int, error_rate: float, cooldown: float):
+        self.name = name
+        self.window = window
+        self.min_requests = min_requests
+        self.error_rate = error_rate
+        self.cooldown = cooldown
+
+        self.state = STATE_CLOSED
+        self.opened_at = 0.0
+        self.probing = False
+        self.trips = 0
+        self._outcomes: deque = deque()  # (时间, 是否失败)
+        self._failures = 0
+
+    def allow(self, now: float) -> bool:
+        """是否可以选择该目标（冷却结束的熔断器进入 half_open，只允许一个探测请求）"""
+        if self.state == STATE_CLOSED:
+            return True
+        if self.state == STATE_OPEN:
+            if now - self.opened_at < self.cooldown:
+                return False
+            self.state = STATE_HALF_OPEN
+            logger.info(f"🔌 熔断冷却结束，进入探测: {self.name}")
+        return not self.probing
+
+    def on_selected(self):
+        """目标被选中：half_open 状态下占用探测名额"""
+        if self.state == STATE_HALF_OPEN:
+            self.probing = True
+
+    def record(self, failed: bool, now: float) -> bool:
+        """
+        记录一次请求结果
+
+        Returns:
+            是否因本次结果触发熔断
+        """
+        if self.state == STATE_HALF_OPEN:
+            self.probing = False
+            if failed:
+                self._open(now)
+                return True
+            self.state = STATE_CLOSED
+            self._outcomes.clear()
+            self._failures = 0
+            logger.info(f"✅ 探测成功，熔断恢复: {self.name}")
+            return False
+
+        if self.state == STATE_OPEN:
+            # 熔断前已发出的请求，结果不再统计
+            return False
+
+        self._outcomes.append((now, failed))
+        if failed:
+            self._failures += 1
+        self._trim(now)
+
+        total = len(self._outcomes)
+        if total >= self.min_requests and self._failures / total >= self.error_rate:
+            self._open(now)
+            return True
+        return False
+
+    def release_probe(self):
+        """探测请求被取消：释放探测名额"""
+        self.probing = False
+
+    def _open(self, now: float):
+        self.state = STATE_OPEN
+        self.opened_at = now
+        self.probing = False
+        self.trips += 1
+        self._outcomes.clear()
+        self._failures = 0
+
+    def _trim(self, now: float):
+        cutoff = now - self.window
+        while self._outcomes and self._outcomes[0][0] < cutoff:
+            _, failed = self._outcomes.popleft()
+            if failed:
+                self._failures -= 1
+
+    def get_stats(self, now: float) -> dict:
+        self._trim(now)
+        total = len(self._outcomes)
+        return {
+            'target': self.name,
+            'state': self.state,
+            'requests': total,
+            'error_rate': round(self._failures / total, 4) if total > 0 else 0.0,
+            'trips': self.trips,
+            'cooldown_left': round(max(self.cooldown - (now - self.opened_at), 0), 2) if self.state == STATE_OPEN else 0,
+            'probing': self.probing,
+        }
+
+
+class BreakerRegistry:
+    """
+    Key / 代理熔断器注册表
+
+    - Key 熔断：可重试的失败（429、5xx、401/403、连接失败、超时）计为失败
+    - 代理熔断：只有连接失败和超时（没有拿到上游状态码）计为失败；只统计 Key 绑定的代理（选 Key 时按它过滤）
+    - 不可重试的失败（如 400）说明链路正常，计为成功
+    - 只记录池中的 Key（参数指定的 Key 不参与选择）
+
+    注意：只在事件循环线程中使用，不需要加锁
+    """
+
+    def __init__(self, enabled: bool, window: float, min_requests: int, error_rate: float, cooldown: float):
+        self.enabled = enabled
+        self.window = window
+        self.min_requests = min_requests
+        self.error_rate = error_rate
+        self.cooldown = cooldown
+
+        self._keys: Dict[int, CircuitBreaker] = {}
+        self._proxies: Dict[str, CircuitBreaker] = {}
+
+        # 非 closed 状态的熔断器（没有时选 Key 直接走快速路径）
+        self._tripped_keys: Set[int] = set()
+        self._tripped_proxies: Set[str] = set()
+
+    # ==================== 选择 ====================
+
+    def blocked_key_ids(self, keys: Iterable) -> Set[int]:
+        """返回 Key 自身或其代理处于熔断中的 Key ID"""
+        if not self._tripped_keys and not self._tripped_proxies:
+            return set()
+
+        now = time.monotonic()
+        blocked = {key_id for key_id in self._tripped_keys if not self._keys[key_id].allow(now)}
+
+        if self._tripped_proxies:
+            blocked_proxies = {proxy for proxy in self._tripped_proxies if not self._proxies[proxy].allow(now)}
+            if blocked_proxies:
+                for key in keys:
+                    if key.proxy in blocked_proxies:
+                        blocked.add(key.id)
+        return blocked
+
+    def on_selected(self, key_id: int, proxy: Optional[str]):
+        """Key 被选中：half_open 的熔断器占用探测名额"""
+        if key_id in self._tripped_keys:
+            self._keys[key_id].on_selected()
+        if proxy and proxy in self._tripped_proxies:
+            self._proxies[proxy].on_selected()
+
+    # ==================== 结果记录 ====================
+
+    def record_result(self, context: RequestContext, success: bool):
+        """
+        记录一次尝试的结果
+
+        代理的结果只计入选中 Key 时的代理（context.breaker_proxy，即 Key 绑定的代理），
+        与 blocked_key_ids / on_selected 使用同一个来源；请求指定的代理不参与熔断
+        """
+        key_id = context.api_key_entity.id if context.api_key_from_pool and context.api_key_entity else None
+        if key_id is None:
+            return
+
+        now = time.monotonic()
+        key_failed = not success and context.retryable
+        proxy_failed = key_failed and context.upstream_status_code is None
+
+        breaker = self._get(self._keys, key_id, f"key:{key_id}")
+        if breaker.record(key_failed, now):
+            logger.warning(f"⚡ Key 熔断: id={key_id}, 冷却 {self.cooldown}s")
+        self._update_tripped(self._tripped_keys, key_id, breaker)
+
+        proxy = context.breaker_proxy
+        if proxy:
+            breaker = self._get(self._proxies, proxy, f"proxy:{proxy}")
+            if breaker.record(proxy_failed, now):
+                logger.warning(f"⚡ 代理熔断: {proxy}, 冷却 {self.cooldown}s")
+            self._update_tripped(self._tripped_proxies, proxy, breaker)
+
+    def record_cancelled(self, context: RequestContext):
+        """尝试被取消（客户端断开 / 对冲落败）：不计入结果，只释放探测名额"""
+        if context.api_key_entity and context.api_key_entity.id in self._tripped_keys:
+            self._keys[context.api_key_entity.id].release_probe()
+        if context.breaker_proxy and context.breaker_proxy in self._tripped_proxies:
+            self._proxies[context.breaker_proxy].release_probe()
+
+    def _get(self, breakers: dict, target, name: str) -> CircuitBreaker:
+        breaker = breakers.get(target)
+        if breaker is None:
+            breaker = CircuitBreaker(name, self.window, self.min_requests, self.error_rate, self.cooldown)
+            breakers[target] = breaker
+        return breaker
+
+    @staticmethod
+    def _update_tripped(tripped: set, target, breaker: CircuitBreaker):
+        if breaker.state == STATE_CLOSED:
+            tripped.discard(target)
+        else:
+            tripped.add(target)
+
+    # ==================== 统计 ====================
+
+    def reset(self):
+        """重置所有熔断器"""
+        self._keys.clear()
+        self._proxies.clear()
+        self._tripped_keys.clear()
+        self._tripped_proxies.clear()
+
+    def get_stats(self) -> dict:
+        """获取熔断统计信息（只列出非 closed 或发生过熔断的目标）"""
+        now = time.monotonic()
+
+        def collect(breakers: dict) -> list:
+            return [
+                breaker.get_stats(now)
+                for breaker in breakers.values()
+                if breaker.state != STATE_CLOSED or breaker.trips > 0
+            ]
+
+        return {
+            'enabled': self.enabled,
+            'window': self.window,
+            'min_requests': self.min_requests,
+            'error_rate': self.error_rate,
+            'cooldown': self.cooldown,
+            'tracked_keys': len(self._keys),
+            'tracked_proxies': len(self._proxies),
+            'open_keys': len(self._tripped_keys),
+            'open_proxies': len(self._tripped_proxies),
+            'keys': collect(self._keys),
+            'proxies': collect(self._proxies),
+        }
+
+
+# 全局熔断器注册表实例
+_registry = BreakerRegistry(
+    enabled=settings.BREAKER_ENABLED,
+    window=settings.BREAKER_WINDOW,
+    min_requests=settings.BREAKER_MIN_REQUESTS,
+    error_rate=settings.BREAKER_ERROR_RATE,
+    cooldown=settings.BREAKER_COOLDOWN,
+)
+
+
+def blocked_key_ids(keys: Iterable) -> Set[int]:
+    """返回 Key 自身或其代理处于熔断中的 Key ID"""
+    if not _registry.enabled:
+        return set()
+    return _registry.blocked_key_ids(keys)
+
+
+def on_selected(key_id: int, proxy: Optional[str]):
+    """Key 被选中（half_open 时占用探测名额）"""
+    if _registry.enabled:
+        _registry.on_selected(key_id, proxy)
+
+
+def record_result(context: RequestContext, success: bool):
+    """记录一次尝试的结果"""
+    if _registry.enabled:
+        _registry.record_result(context, success)
+
+
+def record_cancelled(context: RequestContext):
+    """尝试被取消，释放探测名额"""
+    if _registry.enabled:
+        _registry.record_cancelled(context)
+
+
+def reset():
+    """重置所有熔断器"""
+    _registry.reset()
+
+
+def get_stats() -> dict:
+    """获取熔断统计信息"""
+    return _registry.get_stats()
@@ -1,30 +1,81 @@
 """缓存服务"""
 
-from typing import List, Optional
-from entity.databases.api_key import APIKey
-from entity.context import KeyCache
+from typing import List, Optional, Collection, Tuple
+from entity.context import KeyCache, KeyRecord
+from service import key_event_service
 
 
 # 全局 Key 缓存实例
 _key_cache = KeyCache()
 
 
-def get_all_keys() -> List[APIKey]:
-    """获取所有缓存的 key"""
+def get_all_keys() -> Tuple[KeyRecord, ...]:
+    """获取所有缓存的 key（不可变快照）"""
     return _key_cache.get_all_keys()
 
 
-def add_key(key: APIKey):
+def get_funded_keys() -> Tuple[Tuple[float, int], ...]:
+    """有额度的 key，按 (余额, id) 升序（不可变快照）"""
+    return _key_cache.get_funded_keys()
+
+
+def add_key(key: KeyRecord):
     """向缓存添加 key"""
     _key_cache.add_key(key)
 
 
-def get_random_key() -> Optional[APIKey]:
-    """随机获取一个 key"""
-    return _key_cache.get_random_key()
+def add_keys(keys: Collection[KeyRecord]):
+    """向缓存批量添加 key（只发布一次快照）"""
+    _key_cache.add_keys(keys)
+
+
+def batch():
+    """批量写入缓存（with 块内的添加 / 移除在结束时只发布一次快照）"""
+    return _key_cache.batch()
+
+
+def get_random_key(exclude_ids: Collection[int] = None) -> Optional[KeyRecord]:
+    """随机获取一个 key（可排除指定的 key）"""
+    return _key_cache.get_random_key(exclude_ids)
+
+
+def get_next_key(exclude_ids: Collection[int] = None) -> Optional[KeyRecord]:
+    """按轮询顺序获取下一个 key（可排除指定的 key）"""
+    return _key_cache.get_next_key(exclude_ids)
+
+
+def sample_keys(count: int, exclude_ids: Collection[int] = None) -> List[KeyRecord]:
+    """随机抽取最多 count 个不同的 key（可排除指定的 key）"""
+    return _key_cache.sample_keys(count, exclude_ids)
+
+
+def get_key(key_id: int) -> Optional[KeyRecord]:
+    """按 ID 获取缓存中的 key"""
+    return _key_cache.get_key(key_id)
+
+
+def contains(key_id: int) -> bool:
+    """key 是否在缓存中"""
+    return _key_cache.contains(key_id)
+
+
+def size() -> int:
+    """缓存中的 key 数量"""
+    return _key_cache.size()
 
 
 def remove_key(key_id: int):
     """从缓存移除指定的 key"""
     _key_cache.remove_key(key_id)
 
+
+
+def _on_key_event(event: key_event_service.KeyEvent):
+    """Key 变更事件：缓存中的 Key 替换为新记录，不再可用的 Key 移出缓存（不在缓存中的 Key 由补充任务决定是否加入）"""
+    if event.record is None:
+        _key_cache.remove_key(event.key_id)
+    elif _key_cache.contains(event.key_id):
+        _key_cache.add_key(event.record)
+
+
+key_event_service.subscribe(_on_key_event)
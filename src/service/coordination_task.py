@@ -0,0 +1,319 @@
+"""多 worker 协调任务 - 多个 worker 进程通过 SQLite 协调表选主、同步配置版本和 Key 变更"""
+
+import asyncio
+import os
+import socket
+import time
+from collections import deque
+from datetime import datetime, timedelta
+from typing import List, Optional
+
+from sqlalchemy.orm import Session
+
+from configs.config import settings
+from entity.databases.database import SessionLocal
+from service import key_event_service, shared_counter_service
+from service.databases import coordination_service, job_service, key_service
+from utils.logger import logger
+
+
+# 每次读取的 Key 变更记录数
+_CHANGE_BATCH = 1000
+
+# leader 清理过期 Key 变更记录的间隔（秒）
+_PRUNE_INTERVAL = 60
+
+
+class WorkerCoordinator:
+    """
+    多 worker 协调任务类
+    
+    每个 worker 进程（uvicorn --workers N）各有一份 Key 缓存池、全局配置和统计任务，通过同一个 SQLite 文件协调：
+    - leader 选举：租约行的条件 UPDATE（自己持有或已过期才能写入），只有 leader 运行统计任务；
+      leader 退出时释放租约，异常退出时租约过期后由其他 worker 接管
+    - 配置版本：保存系统配置后版本号加 1，其他 worker 发现版本变化后重新加载全局配置
+    - Key 变更：本进程发布的 Key 变更事件批量写入变更记录表；其他 worker 按 ID 游标读取，
+      从数据库重新加载这些 Key 后作为 remote 事件发布给本进程的缓存池、补充任务和上游客户端
+    - 单 worker 部署时同样运行（自己就是 leader），开销为每个间隔几条 SQLite 查询
+    
+    注意：租约在事件循环中续约，事件循环被阻塞超过 LEADER_LEASE_TTL 时会失去 leader
+    """
+    
+    def __init__(self, interval_seconds: float, lease_ttl: float, change_retention: float):
+        """
+        初始化协调任务
+        
+        Args:
+            interval_seconds: 协调检查间隔（秒）
+            lease_ttl: leader 租约和 worker 心跳的有效期（秒）
+            change_retention: Key 变更记录保留时间（秒）
+        """
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}"
+        self.interval_seconds = interval_seconds
+        self.lease_ttl = lease_ttl
+        self.change_retention = change_retention
+        self._task: Optional[asyncio.Task] = None
+        self._running = False
+        
+        self._pending: deque = deque()  # 本进程待写入的 Key 变更 (key_id, 事件类型)
+        self._is_leader = False
+        self._config_version = 0
+        self._change_cursor = 0
+        self._last_prune = 0.0
+        self._workers: List[str] = []
+        
+        # 统计信息
+        self._leader_changes = 0
+        self._config_reloads = 0
+        self._changes_published = 0
+        self._changes_applied = 0
+        self._cursor_resets = 0
+        self._last_sync_ms = 0
+    
+    async def start(self):
+        """启动协调任务（先同步一次，单 worker 时立即成为 leader 并启动统计任务）"""
+        if self._running:
+            logger.warning("协调任务已经在运行中")
+            return
+        
+        self._running = True
+        key_event_service.subscribe(self._on_key_event)
+        await asyncio.to_thread(self._bootstrap)
+        await self._tick()
+        self._task = asyncio.create_task(self._run_loop())
+        logger.info(f"协调任务已启动，worker: {self.worker_id}，间隔: {self.interval_seconds}秒，leader: {self._is_leader}")
+    
+    async def stop(self):
+        """停止协调任务（停止统计任务并释放 leader 租约）"""
+        if not self._running:
+            return
+        
+        self._running = False
+        key_event_service.unsubscribe(self._on_key_event)
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        
+        if self._is_leader:
+            from service.stats_task import stop_stats_task
+            await stop_stats_task()
+            self._is_leader = False
+        
+        try:
+            await asyncio.to_thread(self._shutdown)
+        except Exception as e:
+            logger.warning(f"释放协调状态失败: {str(e)}")
+        
+        logger.info("协调任务已停止")
+    
+    def _on_key_event(self, event: key_event_service.KeyEvent):
+        """本进程的 Key 变更事件：记下来，下一次同步时写入变更记录表（可能在任意线程中调用）"""
+        if event.remote:
+            return
+        self._pending.append((event.key_id, event.type))
+    
+    def on_config_saved(self, version: int):
+        """本进程保存了系统配置（已重新加载），记录新版本号避免重复加载"""
+        self._config_version = max(self._config_version, version)
+    
+    async def _run_loop(self):
+        """任务循环"""
+        while self._running:
+            try:
+                await asyncio.sleep(self.interval_seconds)
+                await self._tick()
+            
+            except asyncio.CancelledError:
+                break
+            except Exception as e:
+                logger.error(f"协调任务执行失败: {str(e)}")
+                logger.exception(e)
+                # 出错后等待一段时间再重试
+                await asyncio.sleep(5)
+    
+    async def _tick(self):
+        """同步一次协调状态，并根据 leader 变化启停统计任务"""
+        started = time.monotonic()
+        shared_counter_service.heartbeat()
+        is_leader, config_changed = await asyncio.to_thread(self._sync)
+        self._last_sync_ms = int((time.monotonic() - started) * 1000)
+        
+        if config_changed:
+            # Key 池大小可能变化，通知后台任务补充
+            from service.refill_task import trigger_refill
+            trigger_refill()
+        
+        if is_leader == self._is_leader:
+            return
+        
+        from service.stats_task import start_stats_task, stop_stats_task
+        self._is_leader = is_leader
+        self._leader_changes += 1
+        if is_leader:
+            logger.info(f"👑 成为 leader，启动统计任务: {self.worker_id}")
+            await start_stats_task()
+        else:
+            logger.warning(f"失去 leader 租约，停止统计任务: {self.worker_id}")
+            await stop_stats_task()
+    
+    def _bootstrap(self):
+        """启动时记录当前配置版本和变更记录游标（全局配置和缓存池刚从数据库加载，不需要回放历史变更）"""
+        db = SessionLocal()
+        try:
+            self._config_version = coordination_service.get_config_version(db)
+            self._change_cursor = coordination_service.get_last_key_change_id(db)
+        finally:
+            db.close()
+    
+    def _sync(self):
+        """
+        同步一次（在线程中执行，使用独立的数据库 session）
+        
+        Returns:
+            (是否为 leader, 配置是否变化)
+        """
+        db = SessionLocal()
+        try:
+            now = time.time()
+            
+            # 1. 写入本进程的 Key 变更
+            self._flush_changes(db)
+            
+            # 2. 心跳并获取 / 续约 leader 租约
+            coordination_service.heartbeat(db, self.worker_id, self.lease_ttl, now)
+            is_leader = coordination_service.try_acquire_leader(db, self.worker_id, self.lease_ttl, now)
+            
+            # 3. 配置版本变化时重新加载全局配置
+            config_changed = False
+            version = coordination_service.get_config_version(db)
+            if version != self._config_version:
+                from configs.global_config import global_config
+                global_config.reload(db)
+                self._config_version = version
+                self._config_reloads += 1
+                config_changed = True
+                logger.info(f"全局配置版本变化，已重新加载: version={version}")
+            
+            # 4. 应用其他 worker 的 Key 变更
+            self._apply_remote_changes(db)
+            
+            self._workers = coordination_service.get_live_workers(db, now)
+            
+            # 5. leader 定期清理过期的变更记录，并将已退出 worker 未结束的后台任务标记为失败
+            if is_leader and now - self._last_prune >= _PRUNE_INTERVAL:
+                self._last_prune = now
+                coordination_service.prune_key_changes(db, datetime.now() - timedelta(seconds=self.change_retention))
+                orphans = job_service.fail_orphan_jobs(db, self._workers)
+                if orphans:
+                    logger.warning(f"已将 {orphans} 个后台任务标记为失败（执行任务的 worker 已退出）")
+            
+            return is_leader, config_changed
+        finally:
+            db.close()
+    
+    def _flush_changes(self, db: Session):
+        """批量写入本进程的 Key 变更（失败时放回队列，下一次重试）"""
+        changes = []
+        while self._pending:
+            changes.append(self._pending.popleft())
+        if not changes:
+            return
+        
+        try:
+            coordination_service.add_key_changes(db, self.worker_id, changes)
+        except Exception:
+            db.rollback()
+            self._pending.extendleft(reversed(changes))
+            raise
+        self._changes_published += len(changes)
+    
+    def _apply_remote_changes(self, db: Session):
+        """读取其他 worker 的 Key 变更（同一个 Key 只取最后一次），重新加载后在本进程发布"""
+        # 最新 ID 小于游标：变更记录表被清空后 ID 重新分配（旧版本的表没有 AUTOINCREMENT），从头读取
+        last_id = coordination_service.get_last_key_change_id(db)
+        if last_id < self._change_cursor:
+            logger.warning(f"Key 变更记录 ID 小于游标，重置游标: cursor={self._change_cursor}, last_id={last_id}")
+            self._change_cursor = 0
+            self._cursor_resets += 1
+        
+        while True:
+            rows = coordination_service.get_key_changes_after(db, self._change_cursor, _CHANGE_BATCH)
+            if not rows:
+                return
+            self._change_cursor = rows[-1][0]
+            
+            latest = {}
+            for _, key_id, event, worker in rows:
+                if worker != self.worker_id:
+                    latest[key_id] = event
+            if latest:
+                key_service.publish_remote_key_changes(db, latest)
+                self._changes_applied += len(latest)
+            
+            if len(rows) < _CHANGE_BATCH:
+                return
+    
+    def _shutdown(self):
+        """写入剩余的 Key 变更，释放 leader 租约并移除心跳"""
+        db = SessionLocal()
+        try:
+            self._flush_changes(db)
+            coordination_service.release_leader(db, self.worker_id)
+            coordination_service.remove_worker(db, self.worker_id)
+        finally:
+            db.close()
+    
+    def get_stats(self) -> dict:
+        """获取协调任务统计信息"""
+        return {
+            'running': self._running,
+            'worker_id': self.worker_id,
+            'is_leader': self._is_leader,
+            'workers': self._workers,
+            'interval_seconds': self.interval_seconds,
+            'lease_ttl': self.lease_ttl,
+            'config_version': self._config_version,
+            'change_cursor': self._change_cursor,
+            'cursor_resets': self._cursor_resets,
+            'pending_changes': len(self._pending),
+            'leader_changes': self._leader_changes,
+            'config_reloads': self._config_reloads,
+            'changes_published': self._changes_published,
+            'changes_applied': self._changes_applied,
+            'last_sync_ms': self._last_sync_ms,
+        }
+
+
+# 全局单例
+_coordinator: Optional[WorkerCoordinator] = None
+
+
+def get_coordinator() -> WorkerCoordinator:
+    """获取全局协调任务实例"""
+    global _coordinator
+    if _coordinator is None:
+        _coordinator = WorkerCoordinator(
+            interval_seconds=settings.COORDINATION_INTERVAL,
+            lease_ttl=settings.LEADER_LEASE_TTL,
+            change_retention=settings.KEY_CHANGE_RETENTION,
+        )
+    return _coordinator
+
+
+async def start_coordination_task():
+    """启动协调任务（在应用启动时调用，由它决定是否启动统计任务）"""
+    await get_coordinator().start()
+
+
+async def stop_coordination_task():
+    """停止协调任务（在应用关闭时调用）"""
+    await get_coordinator().stop()
+
+
+def notify_config_saved(db: Session):
+    """系统配置已保存：版本号加 1，其他 worker 下一次同步时重新加载"""
+    version = coordination_service.bump_config_version(db)
+    get_coordinator().on_config_saved(version)
@@ -0,0 +1,156 @@
+"""多进程协调业务服务 - leader 租约、worker 心跳、配置版本号、Key 变更记录"""
+
+from datetime import datetime
+from typing import List, Optional, Tuple
+from sqlalchemy import or_, func
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+from entity.databases.coordination import Coordination, KeyChange
+
+
+# 协调项名称
+LEADER = "leader"
+CONFIG = "config"
+WORKER_PREFIX = "worker:"
+
+
+def _ensure_row(db: Session, name: str):
+    """协调项不存在时创建（多个进程同时创建时忽略唯一约束冲突）"""
+    if db.query(Coordination.id).filter(Coordination.name == name).first():
+        return
+    try:
+        db.add(Coordination(name=name, lease_until=0, version=0))
+        db.commit()
+    except IntegrityError:
+        db.rollback()
+
+
+# ==================== leader 租约 ====================
+
+def try_acquire_leader(db: Session, worker_id: str, ttl: float, now: float) -> bool:
+    """
+    获取或续约 leader 租约（原子的条件 UPDATE：自己持有或租约已过期时才能写入）
+    
+    Returns:
+        当前 worker 是否为 leader
+    """
+    _ensure_row(db, LEADER)
+    updated = db.query(Coordination).filter(
+        Coordination.name == LEADER,
+        or_(Coordination.holder == worker_id, Coordination.holder == None, Coordination.lease_until < now)
+    ).update({
+        Coordination.holder: worker_id,
+        Coordination.lease_until: now + ttl,
+        Coordination.update_time: datetime.now(),
+    }, synchronize_session=False)
+    db.commit()
+    return updated == 1
+
+
+def release_leader(db: Session, worker_id: str):
+    """释放 leader 租约（其他 worker 下一次检查时即可接管）"""
+    db.query(Coordination).filter(
+        Coordination.name == LEADER,
+        Coordination.holder == worker_id
+    ).update({Coordination.holder: None, Coordination.lease_until: 0}, synchronize_session=False)
+    db.commit()
+
+
+def get_leader(db: Session, now: float) -> Optional[str]:
+    """当前有效的 leader（没有时返回 None）"""
+    row = db.query(Coordination).filter(Coordination.name == LEADER).first()
+    if not row or not row.holder or row.lease_until < now:
+        return None
+    return row.holder
+
+
+# ==================== worker 心跳 ====================
+
+def heartbeat(db: Session, worker_id: str, ttl: float, now: float):
+    """刷新 worker 心跳"""
+    name = f"{WORKER_PREFIX}{worker_id}"
+    _ensure_row(db, name)
+    db.query(Coordination).filter(Coordination.name == name).update({
+        Coordination.holder: worker_id,
+        Coordination.lease_until: now + ttl,
+        Coordination.update_time: datetime.now(),
+    }, synchronize_session=False)
+    db.commit()
+
+
+def remove_worker(db: Session, worker_id: str):
+    """移除 worker 心跳（正常退出时调用）"""
+    db.query(Coordination).filter(Coordination.name == f"{WORKER_PREFIX}{worker_id}").delete(synchronize_session=False)
+    db.commit()
+
+
+def get_live_workers(db: Session, now: float) -> List[str]:
+    """心跳未过期的 worker，同时清理已过期的心跳"""
+    db.query(Coordination).filter(
+        Coordination.name.like(f"{WORKER_PREFIX}%"),
+        Coordination.lease_until < now
+    ).delete(synchronize_session=False)
+    db.commit()
+    
+    rows = db.query(Coordination.holder).filter(Coordination.name.like(f"{WORKER_PREFIX}%")).all()
+    return sorted(row[0] for row in rows)
+
+
+# ==================== 配置版本号 ====================
+
+def get_config_version(db: Session) -> int:
+    """当前系统配置版本号"""
+    version = db.query(Coordination.version).filter(Coordination.name == CONFIG).scalar()
+    return version or 0
+
+
+def bump_config_version(db: Session) -> int:
+    """系统配置版本号加 1，返回新版本号"""
+    _ensure_row(db, CONFIG)
+    db.query(Coordination).filter(Coordination.name == CONFIG).update({
+        Coordination.version: Coordination.version + 1,
+        Coordination.update_time: datetime.now(),
+    }, synchronize_session=False)
+    db.commit()
+    return get_config_version(db)
+
+
+# ==================== Key 变更记录 ====================
+
+def add_key_changes(db: Session, worker_id: str, changes: List[Tuple[int, str]]):
+    """批量写入 Key 变更记录（key_id, 事件类型）"""
+    if not changes:
+        return
+    now = datetime.now()
+    db.bulk_insert_mappings(KeyChange, [
+        {'key_id': key_id, 'event': event, 'worker': worker_id, 'create_time': now, 'update_time': now}
+        for key_id, event in changes
+    ])
+    db.commit()
+
+
+def get_last_key_change_id(db: Session) -> int:
+    """最新的 Key 变更记录 ID"""
+    return db.query(func.max(KeyChange.id)).scalar() or 0
+
+
+def get_key_changes_after(db: Session, after_id: int, limit: int = 1000) -> List[Tuple[int, int, str, str]]:
+    """按 ID 游标读取 Key 变更记录，返回 (id, key_id, 事件类型, worker ID)"""
+    return db.query(KeyChange.id, KeyChange.key_id, KeyChange.event, KeyChange.worker).filter(
+        KeyChange.id > after_id
+    ).order_by(KeyChange.id).limit(limit).all()
+
+
+def prune_key_changes(db: Session, before: datetime) -> int:
+    """
+    删除指定时间之前的 Key 变更记录，返回删除数量
+    
+    始终保留 ID 最大的一条：旧版本创建的表没有 AUTOINCREMENT，表被清空后 SQLite 会从 1 重新分配 ID
+    """
+    last_id = get_last_key_change_id(db)
+    deleted = db.query(KeyChange).filter(
+        KeyChange.create_time < before,
+        KeyChange.id < last_id
+    ).delete(synchronize_session=False)
+    db.commit()
+    return deleted
@@ -0,0 +1,154 @@
+"""后台任务业务服务 - 任务状态的数据库操作"""
+
+import json
+from datetime import datetime
+from typing import List, Optional, Tuple
+
+from sqlalchemy.orm import Session
+
+from entity.databases.job import AdminJob
+
+
+# 任务状态
+PENDING = "pending"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+CANCELLED = "cancelled"
+
+# 未结束的任务状态
+ACTIVE_STATUSES = (PENDING, RUNNING)
+
+
+def create_job(db: Session, job_type: str, total: int, worker: str) -> AdminJob:
+    """创建任务（pending 状态）"""
+    job = AdminJob(job_type=job_type, status=PENDING, total=total, worker=worker)
+    db.add(job)
+    db.commit()
+    db.refresh(job)
+    return job
+
+
+def get_job_by_id(db: Session, job_id: int) -> Optional[AdminJob]:
+    """根据 ID 获取任务"""
+    return db.query(AdminJob).filter(AdminJob.id == job_id).first()
+
+
+def query_jobs(
+    db: Session,
+    page: int = 1,
+    page_size: int = 10,
+    job_type: Optional[str] = None,
+    status: Optional[str] = None
+) -> Tuple[List[AdminJob], int]:
+    """
+    查询任务列表（按创建时间倒序）
+    
+    Returns:
+        (任务列表, 总数量)
+    """
+    query = db.query(AdminJob)
+    
+    if job_type:
+        query = query.filter(AdminJob.job_type == job_type)
+    
+    if status:
+        query = query.filter(AdminJob.status == status)
+    
+    total = query.count()
+    items = query.order_by(AdminJob.id.desc()).offset((page - 1) * page_size).limit(page_size).all()
+    
+    return items, total
+
+
+def start_job(db: Session, job_id: int) -> bool:
+    """
+    任务开始执行（pending -> running）
+    
+    Returns:
+        是否开始执行（排队期间已被取消时返回 False）
+    """
+    updated = db.query(AdminJob).filter(
+        AdminJob.id == job_id,
+        AdminJob.status == PENDING,
+        AdminJob.cancel_requested == False
+    ).update({
+        AdminJob.status: RUNNING,
+        AdminJob.start_time: datetime.now(),
+        AdminJob.update_time: datetime.now(),
+    }, synchronize_session=False)
+    db.commit()
+    return updated == 1
+
+
+def update_job_progress(db: Session, job_id: int, total: int, processed: int, success_count: int, fail_count: int) -> bool:
+    """
+    更新任务进度（总数在执行前未知的任务，执行过程中更新总数）
+    
+    Returns:
+        是否已请求取消（其他 worker 也可能请求取消，通过这里读取）
+    """
+    db.query(AdminJob).filter(AdminJob.id == job_id).update({
+        AdminJob.total: total,
+        AdminJob.processed: processed,
+        AdminJob.success_count: success_count,
+        AdminJob.fail_count: fail_count,
+        AdminJob.update_time: datetime.now(),
+    }, synchronize_session=False)
+    db.commit()
+    
+    cancel_requested = db.query(AdminJob.cancel_requested).filter(AdminJob.id == job_id).scalar()
+    return bool(cancel_requested)
+
+
+def finish_job(db: Session, job_id: int, status: str, result: Optional[dict] = None, error: Optional[str] = None):
+    """任务结束（成功 / 失败 / 已取消），写入结果"""
+    db.query(AdminJob).filter(AdminJob.id == job_id).update({
+        AdminJob.status: status,
+        AdminJob.result: json.dumps(result, ensure_ascii=False) if result is not None else None,
+        AdminJob.error: error,
+        AdminJob.finish_time: datetime.now(),
+        AdminJob.update_time: datetime.now(),
+    }, synchronize_session=False)
+    db.commit()
+
+
+def request_cancel(db: Session, job_id: int) -> Optional[AdminJob]:
+    """
+    请求取消任务（只能取消未结束的任务；执行中的任务在处理完当前这一批后停止）
+    
+    Returns:
+        任务（不存在时返回 None）
+    """
+    db.query(AdminJob).filter(
+        AdminJob.id == job_id,
+        AdminJob.status.in_(ACTIVE_STATUSES)
+    ).update({
+        AdminJob.cancel_requested: True,
+        AdminJob.update_time: datetime.now(),
+    }, synchronize_session=False)
+    db.commit()
+    return get_job_by_id(db, job_id)
+
+
+def fail_orphan_jobs(db: Session, live_workers: List[str]) -> int:
+    """
+    执行任务的 worker 已退出（心跳过期）时，将其未结束的任务标记为失败
+    
+    Returns:
+        标记的任务数
+    """
+    if not live_workers:
+        return 0
+    
+    updated = db.query(AdminJob).filter(
+        AdminJob.status.in_(ACTIVE_STATUSES),
+        AdminJob.worker.notin_(live_workers)
+    ).update({
+        AdminJob.status: FAILED,
+        AdminJob.error: "执行任务的 worker 已退出",
+        AdminJob.finish_time: datetime.now(),
+        AdminJob.update_time: datetime.now(),
+    }, synchronize_session=False)
+    db.commit()
+    return updated
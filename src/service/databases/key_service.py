@@ -1,37 +1,108 @@
 """API Key 业务服务"""
 
-from typing import Optional, List, Tuple
+from typing import Optional, List, Tuple, Collection, Dict
 from sqlalchemy.orm import Session
-from sqlalchemy import func
+from sqlalchemy import func, bindparam
 from datetime import datetime
+from decimal import Decimal
+from entity.context import KeyRecord
 from entity.databases.api_key import APIKey
 from entity.databases.request_log import RequestLog
 from entity.req.key import APIKeyCreateRequest, APIKeyUpdateRequest, APIKeyBatchCreateRequest
 from mapper import api_key_mapper
-from service import cache_service
+from service import cache_service, key_event_service
 from utils.logger import logger
 
 
 # ==================== 缓存相关 ====================
 
-def get_available_keys(db: Session, limit: int, exclude_ids: list[int] = None) -> list[APIKey]:
-    """获取指定数量的可用 Key"""
-    return api_key_mapper.query_available_keys(db, limit=limit, exclude_ids=exclude_ids)
+def get_available_keys_after(db: Session, after_id: int, limit: int) -> list[KeyRecord]:
+    """按 ID 游标获取可用 Key（ID 大于 after_id，按 ID 升序）"""
+    return api_key_mapper.query_available_keys_after(db, after_id=after_id, limit=limit)
 
 
-def get_cached_keys() -> List[APIKey]:
-    """获取缓存中的所有 Key"""
+def is_key_cached(key_id: int) -> bool:
+    """Key 是否在缓存中"""
+    return cache_service.contains(key_id)
+
+
+def get_cached_key_count() -> int:
+    """缓存中的 Key 数量"""
+    return cache_service.size()
+
+
+def get_cached_keys() -> Tuple[KeyRecord, ...]:
+    """获取缓存中的所有 Key（不可变快照，不要修改）"""
     return cache_service.get_all_keys()
 
 
-def add_key_to_cache(key: APIKey):
+def add_key_to_cache(key: KeyRecord):
     """添加 Key 到缓存"""
     cache_service.add_key(key)
 
 
-def get_random_key_from_cache() -> Optional[APIKey]:
-    """从缓存随机获取一个 Key"""
-    return cache_service.get_random_key()
+def add_keys_to_cache(keys: List[KeyRecord]):
+    """批量添加 Key 到缓存（只发布一次缓存快照）"""
+    cache_service.add_keys(keys)
+
+
+def get_random_key_from_cache(exclude_ids: Collection[int] = None) -> Optional[KeyRecord]:
+    """从缓存随机获取一个 Key（可排除指定的 Key）"""
+    return cache_service.get_random_key(exclude_ids)
+
+
+def get_next_key_from_cache(exclude_ids: Collection[int] = None) -> Optional[KeyRecord]:
+    """从缓存按轮询顺序获取下一个 Key（可排除指定的 Key）"""
+    return cache_service.get_next_key(exclude_ids)
+
+
+def sample_keys_from_cache(count: int, exclude_ids: Collection[int] = None) -> List[KeyRecord]:
+    """从缓存随机抽取最多 count 个不同的 Key（可排除指定的 Key）"""
+    return cache_service.sample_keys(count, exclude_ids)
+
+
+# ==================== 变更事件 ====================
+
+def to_key_record(api_key: APIKey) -> KeyRecord:
+    """ORM 对象转换为缓存使用的 KeyRecord"""
+    return KeyRecord(api_key.id, api_key.name, api_key.api_key, api_key.proxy, api_key.ua, api_key.balance)
+
+
+def _available_record(api_key: APIKey) -> Optional[KeyRecord]:
+    """Key 可用（已启用且余额大于 0 或未设置，与可用 Key 查询条件一致）时返回 KeyRecord，否则返回 None"""
+    if not api_key.enabled:
+        return None
+    if api_key.balance is not None and api_key.balance <= 0:
+        return None
+    return to_key_record(api_key)
+
+
+def notify_key_changed(event_type: str, api_key: APIKey, previous: Optional[KeyRecord] = None):
+    """
+    发布 Key 变更事件（在数据库变更之后调用），缓存池、补充任务、上游客户端据此增量更新
+    
+    Args:
+        event_type: 事件类型（key_event_service.KEY_*）
+        api_key: 变更后的 Key
+        previous: 变更前的 Key（修改 / 删除时提供）
+    """
+    key_event_service.publish(event_type, api_key.id, _available_record(api_key), previous)
+
+
+def publish_remote_key_changes(db: Session, changes: Dict[int, str]):
+    """
+    发布其他 worker 进程产生的 Key 变更（从数据库重新加载这些 Key，变更前的记录取本进程缓存中的）
+    
+    Args:
+        db: 数据库会话
+        changes: key_id -> 事件类型
+    """
+    keys = {k.id: k for k in get_api_keys_by_ids(db, list(changes))}
+    with cache_service.batch():
+        for key_id, event_type in changes.items():
+            api_key = keys.get(key_id)
+            record = _available_record(api_key) if api_key else None
+            key_event_service.publish(event_type, key_id, record, cache_service.get_key(key_id), remote=True)
 
 
 # ==================== CRUD 操作 ====================
@@ -58,10 +129,12 @@ def create_api_key(db: Session, request: APIKeyCreateRequest) -> APIKey:
     db.commit()
     db.refresh(api_key)
     
+    notify_key_changed(key_event_service.KEY_CREATED, api_key)
+    
     return api_key
 
 
-def batch_create_api_keys(db: Session, request: APIKeyBatchCreateRequest, ua_list: List[str], proxy_list: List[str]) -> Tuple[List[APIKey], int, int]:
+def batch_create_api_keys(db: Session, request: APIKeyBatchCreateRequest, ua_list: List[str], proxy_list: List[str], start_index: int = 0) -> Tuple[List[APIKey], int, int]:
     """
     批量创建 API Keys（支持去重）
     
@@ -70,6 +143,7 @@ def batch_create_api_keys(db: Session, request: APIKeyBatchCreateRequest, ua_lis
         request: 批量创建请求（包含API密钥列表）
         ua_list: UA列表（从配置中获取）
         proxy_list: 代理列表（从配置中获取）
+        start_index: 名称序号的起始偏移（分批创建时传入之前已创建的数量，序号连续）
     
     返回: (成功创建的列表, 成功数量, 失败数量)
     """
@@ -106,7 +180,7 @@ def batch_create_api_keys(db: Session, request: APIKeyBatchCreateRequest, ua_lis
             proxy = random.choice(proxy_list) if proxy_list else ""
             
             api_key = APIKey(
-                name=f"{request.batch_name}-{idx+1}",  # 使用批次名称 + 序号
+                name=f"{request.batch_name}-{start_index+idx+1}",  # 使用批次名称 + 序号
                 api_key=api_key_str,
                 ua=ua,
                 proxy=proxy,
@@ -134,6 +208,7 @@ def batch_create_api_keys(db: Session, request: APIKeyBatchCreateRequest, ua_lis
         # 刷新所有成功创建的对象
         for key in success_keys:
             db.refresh(key)
+            notify_key_changed(key_event_service.KEY_CREATED, key)
     
     return success_keys, success_count, fail_count
 
@@ -143,6 +218,15 @@ def get_api_key_by_id(db: Session, key_id: int) -> Optional[APIKey]:
     return db.query(APIKey).filter(APIKey.id == key_id).first()
 
 
+def get_api_keys_by_ids(db: Session, key_ids: List[int]) -> List[APIKey]:
+    """根据 ID 列表批量获取 API Key（不存在的 ID 忽略，不保证顺序）"""
+    keys = []
+    # 分批查询，避免超过 SQLite 的参数个数上限
+    for i in range(0, len(key_ids), 500):
+        keys.extend(db.query(APIKey).filter(APIKey.id.in_(key_ids[i:i + 500])).all())
+    return keys
+
+
 def update_api_key(db: Session, key_id: int, request: APIKeyUpdateRequest) -> Optional[APIKey]:
     """更新 API Key"""
     api_key = get_api_key_by_id(db, key_id)
@@ -150,6 +234,8 @@ def update_api_key(db: Session, key_id: int, request: APIKeyUpdateRequest) -> Op
     if not api_key:
         return None
     
+    previous = to_key_record(api_key)
+    
     # 更新字段
     update_data = request.dict(exclude_unset=True)
     
@@ -165,6 +251,8 @@ def update_api_key(db: Session, key_id: int, request: APIKeyUpdateRequest) -> Op
     db.commit()
     db.refresh(api_key)
     
+    notify_key_changed(key_event_service.KEY_UPDATED, api_key, previous)
+    
     return api_key
 
 
@@ -175,12 +263,38 @@ def delete_api_key(db: Session, key_id: int) -> bool:
     if not api_key:
         return False
     
+    previous = to_key_record(api_key)
     db.delete(api_key)
     db.commit()
     
+    key_event_service.publish(key_event_service.KEY_DELETED, key_id, None, previous)
+    
     return True
 
 
+def batch_delete_api_keys(db: Session, key_ids: List[int]) -> int:
+    """
+    批量删除 API Keys（只提交一次事务，不存在的 ID 忽略）
+    
+    Returns:
+        删除的数量
+    """
+    api_keys = get_api_keys_by_ids(db, list(set(key_ids)))
+    if not api_keys:
+        return 0
+    
+    previous = [(api_key.id, to_key_record(api_key)) for api_key in api_keys]
+    deleted_ids = [key_id for key_id, _ in previous]
+    for i in range(0, len(deleted_ids), 500):
+        db.query(APIKey).filter(APIKey.id.in_(deleted_ids[i:i + 500])).delete(synchronize_session=False)
+    db.commit()
+    
+    for key_id, record in previous:
+        key_event_service.publish(key_event_service.KEY_DELETED, key_id, None, record)
+    
+    return len(previous)
+
+
 def disable_api_key(db: Session, key_id: int, reason: str = None, error_code: str = None, auto_commit: bool = True) -> bool:
     """
     禁用 API Key（用于自动禁用被封禁的 Key）
@@ -201,6 +315,8 @@ def disable_api_key(db: Session, key_id: int, reason: str = None, error_code: st
         logger.warning(f"尝试禁用不存在的 Key: id={key_id}")
         return False
     
+    previous = to_key_record(api_key)
+    
     # 更新 Key 状态为禁用
     api_key.enabled = False
     api_key.update_time = datetime.now()
@@ -224,9 +340,8 @@ def disable_api_key(db: Session, key_id: int, reason: str = None, error_code: st
     
     logger.warning(f"🚫 已自动禁用 Key: id={key_id}, name={api_key.name}, error_code={error_code}, reason={reason}")
     
-    # 从缓存中移除
-    cache_service.remove_key(key_id)
-    logger.info(f"✅ 已从缓存移除 Key: id={key_id}")
+    # 通知缓存移除该 Key，并由后台任务补充（批量操作未提交时也立即移除，避免继续被选中）
+    notify_key_changed(key_event_service.KEY_DISABLED, api_key, previous)
     
     return True
 
@@ -292,15 +407,24 @@ def query_api_keys(
 
 # ==================== 余额更新 ====================
 
+# 计费的请求状态（成功的请求和被取消但已计费的对冲请求）
+BILLED_STATUSES = ('success', 'cancelled')
+
+
 def update_all_keys_balance(db: Session) -> dict:
     """
-    更新所有可用 Key 的余额
+    从请求日志重新计算所有可用 Key 的花费和余额（全量对账）
+    
+    平时余额由花费账本（spend_ledger_task）增量扣减，这里用于初始化 spent 字段和手动对账；
+    通过 spend_ledger_task.reconcile_balances() 调用：本进程之前提交的日志全部入库后、在日志写入线程中执行，
+    并丢弃账本中已计入这些日志的待写入花费（直接调用时，账本中尚未写入的花费会再扣一次）
     
     逻辑：
-    1. 获取所有可用的 Key（enabled=True）
-    2. 对每个 Key，统计所有请求日志的成本总和
-    3. 计算余额：balance = total_balance - sum(cost)
-    4. 更新 balance 和 balance_last_update
+    1. 一条分组聚合查询：按 key_id 统计请求日志的成本总和（走 key_id + status + cost 覆盖索引），
+       与可用的 Key（enabled=True）左连接
+    2. 计算余额：spent = sum(cost)，balance = total_balance - spent
+    3. 一条批量 UPDATE（executemany）写入 spent、balance 和 balance_last_update，只提交一次
+    4. 余额变化的 Key 发布变更事件（余额耗尽的 Key 移出缓存）
     
     返回:
         dict: 更新统计信息
@@ -320,60 +444,78 @@ def update_all_keys_balance(db: Session) -> dict:
     }
     
     try:
-        # 获取所有可用的 Key
-        enabled_keys = db.query(APIKey).filter(APIKey.enabled == True).all()
-        stats['total_keys'] = len(enabled_keys)
+        # 按 Key 汇总成本（统计成功的请求和被取消但已计费的对冲请求）
+        spent = db.query(
+            RequestLog.key_id.label('key_id'),
+            func.sum(RequestLog.cost).label('total_cost')
+        ).filter(
+            RequestLog.status.in_(BILLED_STATUSES)
+        ).group_by(RequestLog.key_id).subquery()
+        
+        rows = db.query(
+            APIKey.id, APIKey.name, APIKey.api_key, APIKey.proxy, APIKey.ua,
+            APIKey.balance, APIKey.total_balance, spent.c.total_cost
+        ).outerjoin(spent, spent.c.key_id == APIKey.id).filter(APIKey.enabled == True).all()
+        stats['total_keys'] = len(rows)
         
         logger.info(f"找到 {stats['total_keys']} 个可用的 Key")
         
-        for key in enabled_keys:
-            try:
-                # 查询该 Key 的所有请求成本总和
-                total_cost = db.query(func.sum(RequestLog.cost)).filter(
-                    RequestLog.key_id == key.id,
-                    RequestLog.status == 'success'  # 只统计成功的请求
-                ).scalar()
-                
-                # 如果没有请求记录，total_cost 为 None
-                total_cost = float(total_cost) if total_cost else 0.0
-                
-                # 计算新余额
-                if key.total_balance is not None:
-                    # 如果有总授权额度，从总额度扣减
-                    new_balance = float(key.total_balance) - total_cost
-                else:
-                    # 如果没有总授权额度，无法计算余额
-                    logger.warning(f"Key {key.name} (ID: {key.id}) 没有设置总授权额度，跳过余额更新")
-                    continue
-                
-                # 更新余额
-                old_balance = float(key.balance) if key.balance else 0.0
-                key.balance = new_balance
-                key.balance_last_update = datetime.now()
-                key.update_time = datetime.now()
-                
+        now = datetime.now()
+        updates = []
+        spent_only = []  # 没有总授权额度的 Key 只更新累计花费
+        changed_records = []  # (key_id, 可用时的 KeyRecord)
+        for key_id, name, api_key, proxy, ua, balance, total_balance, total_cost in rows:
+            # 如果没有请求记录，total_cost 为 None
+            total_cost = float(total_cost) if total_cost else 0.0
+            
+            if total_balance is None:
+                # 如果没有总授权额度，无法计算余额
+                spent_only.append({'key_id': key_id, 'spent': total_cost})
+                continue
+            
+            new_balance = round(float(total_balance) - total_cost, 2)
+            updates.append({'key_id': key_id, 'spent': total_cost, 'balance': new_balance, 'balance_last_update': now, 'update_time': now})
+            
+            if balance is None or float(balance) != new_balance:
+                record = KeyRecord(key_id, name, api_key, proxy, ua, Decimal(str(new_balance))) if new_balance > 0 else None
+                changed_records.append((key_id, record))
                 logger.info(
-                    f"更新 Key: {key.name} (ID: {key.id}), "
-                    f"总授权: ${float(key.total_balance):.2f}, "
+                    f"更新 Key: {name} (ID: {key_id}), "
+                    f"总授权: ${float(total_balance):.2f}, "
                     f"已消耗: ${total_cost:.4f}, "
-                    f"旧余额: ${old_balance:.2f}, "
+                    f"旧余额: ${float(balance) if balance else 0.0:.2f}, "
                     f"新余额: ${new_balance:.2f}"
                 )
-                
-                stats['updated_keys'] += 1
-                
-            except Exception as e:
-                error_msg = f"更新 Key {key.name} (ID: {key.id}) 失败: {str(e)}"
-                logger.error(error_msg)
-                stats['failed_keys'] += 1
-                stats['errors'].append(error_msg)
         
-        # 提交所有更改
+        if spent_only:
+            logger.warning(f"{len(spent_only)} 个 Key 没有设置总授权额度，跳过余额更新")
+        
+        # 批量更新并提交（Core UPDATE 按 ID 匹配，期间被删除的 Key 直接忽略）
+        table = APIKey.__table__
+        if updates:
+            db.execute(
+                table.update().where(table.c.id == bindparam('key_id')).values(
+                    spent=bindparam('spent'),
+                    balance=bindparam('balance'),
+                    balance_last_update=bindparam('balance_last_update'),
+                    update_time=bindparam('update_time'),
+                ),
+                updates
+            )
+        if spent_only:
+            db.execute(table.update().where(table.c.id == bindparam('key_id')).values(spent=bindparam('spent')), spent_only)
         db.commit()
+        stats['updated_keys'] = len(updates)
+        
+        # 余额变化的 Key 通知缓存（余额耗尽的 Key 移出缓存；批量写入缓存，只发布一次快照）
+        with cache_service.batch():
+            for key_id, record in changed_records:
+                key_event_service.publish(key_event_service.KEY_BALANCE_CHANGED, key_id, record)
         
         logger.info(
             f"余额更新完成: 总计 {stats['total_keys']} 个, "
             f"成功 {stats['updated_keys']} 个, "
+            f"余额变化 {len(changed_records)} 个, "
             f"失败 {stats['failed_keys']} 个"
         )
         
@@ -381,6 +523,112 @@ def update_all_keys_balance(db: Session) -> dict:
         db.rollback()
         error_msg = f"更新余额失败: {str(e)}"
         logger.error(error_msg)
+        stats['updated_keys'] = 0
+        stats['failed_keys'] = stats['total_keys']
+        stats['errors'].append(error_msg)
+    
+    return stats
+
+
+def apply_key_spend(db: Session, amounts: Dict[int, float]) -> List[Tuple[int, Optional[KeyRecord]]]:
+    """
+    累加花费并扣减余额（花费账本定期写入，一条批量 UPDATE，只提交一次）
+    
+    spent / balance 为空的 Key 保持为空（未初始化 / 不限额度）
+    
+    Args:
+        db: 数据库会话
+        amounts: key_id -> 本次写入的花费
+    
+    Returns:
+        [(key_id, 可用时的 KeyRecord，否则为 None)]（期间被删除的 Key 不返回）
+    """
+    if not amounts:
+        return []
+    
+    now = datetime.now()
+    table = APIKey.__table__
+    db.execute(
+        table.update().where(table.c.id == bindparam('key_id')).values(
+            spent=table.c.spent + bindparam('amount'),
+            balance=table.c.balance - bindparam('amount'),
+            balance_last_update=now,
+        ),
+        [{'key_id': key_id, 'amount': amount} for key_id, amount in amounts.items()]
+    )
+    db.commit()
+    
+    return [(api_key.id, _available_record(api_key)) for api_key in get_api_keys_by_ids(db, list(amounts))]
+
+
+def count_uninitialized_spent(db: Session) -> int:
+    """累计花费（spent）尚未初始化的可用 Key 数（新增字段后的旧数据，需要从请求日志全量对账一次）"""
+    return db.query(func.count(APIKey.id)).filter(
+        APIKey.enabled == True,
+        APIKey.spent == None
+    ).scalar()
+
+
+def refresh_keys_balance(db: Session) -> dict:
+    """
+    根据累计花费刷新可用 Key 的余额（统计任务定期调用，不扫描请求日志）
+    
+    balance = total_balance - spent，只更新不一致的 Key（如修改了总授权额度）；
+    spent 为空的 Key 跳过（由统计任务先全量对账，见 count_uninitialized_spent）
+    
+    返回:
+        dict: 同 update_all_keys_balance
+    """
+    stats = {
+        'total_keys': 0,
+        'updated_keys': 0,
+        'failed_keys': 0,
+        'errors': []
+    }
+    
+    try:
+        rows = db.query(
+            APIKey.id, APIKey.name, APIKey.api_key, APIKey.proxy, APIKey.ua, APIKey.balance, APIKey.total_balance, APIKey.spent
+        ).filter(
+            APIKey.enabled == True,
+            APIKey.total_balance != None,
+            APIKey.spent != None
+        ).all()
+        stats['total_keys'] = len(rows)
+        
+        now = datetime.now()
+        updates = []
+        changed_records = []
+        for key_id, name, api_key, proxy, ua, balance, total_balance, spent in rows:
+            new_balance = round(float(total_balance) - float(spent), 2)
+            if balance is not None and abs(float(balance) - new_balance) < 0.005:
+                continue
+            updates.append({'key_id': key_id, 'balance': new_balance, 'balance_last_update': now, 'update_time': now})
+            record = KeyRecord(key_id, name, api_key, proxy, ua, Decimal(str(new_balance))) if new_balance > 0 else None
+            changed_records.append((key_id, record))
+            logger.info(f"刷新 Key 余额: {name} (ID: {key_id}), 总授权: ${float(total_balance):.2f}, 已消耗: ${float(spent):.4f}, 新余额: ${new_balance:.2f}")
+        
+        if updates:
+            table = APIKey.__table__
+            db.execute(
+                table.update().where(table.c.id == bindparam('key_id')).values(
+                    balance=bindparam('balance'),
+                    balance_last_update=bindparam('balance_last_update'),
+                    update_time=bindparam('update_time'),
+                ),
+                updates
+            )
+            db.commit()
+        stats['updated_keys'] = len(updates)
+        
+        with cache_service.batch():
+            for key_id, record in changed_records:
+                key_event_service.publish(key_event_service.KEY_BALANCE_CHANGED, key_id, record)
+        
+    except Exception as e:
+        db.rollback()
+        error_msg = f"刷新余额失败: {str(e)}"
+        logger.error(error_msg)
         stats['errors'].append(error_msg)
     
     return stats
@@ -29,6 +29,8 @@ def build_log_data_from_context(context: RequestContext) -> Dict[str, Any]:
         
         # 构建日志数据
         log_data = {
+            'request_id': context.request_id,
+            'attempt': context.attempt,
             'model': context.request.model if hasattr(context.request, 'model') else 'unknown',
             'res_model': None,  # 稍后从响应中提取
             'provider': context.provider if hasattr(context, 'provider') else 'unknown',
@@ -97,11 +99,18 @@ def build_log_data_from_context(context: RequestContext) -> Dict[str, Any]:
         }
     
     # 判断请求状态
-    if context.error:
+    if context.cancelled:
+        # 对冲落败被取消的尝试：已拿到响应的按实际用量记账，否则成本为 0
+        log_data['status'] = 'cancelled'
+        log_data['http_status_code'] = 200 if context.response else 0
+        log_data['error_message'] = 'Cancelled: hedged request lost the race'
+        if context.response:
+            _apply_usage(log_data, context)
+    elif context.error:
         # 失败
         log_data['status'] = 'error'
         log_data['error_message'] = context.error
-        log_data['http_status_code'] = 0
+        log_data['http_status_code'] = context.upstream_status_code or 0
         
         # 从错误消息中提取错误类型（使用工具函数）
         from utils.context_utils import extract_error_type
@@ -144,33 +153,8 @@ def build_log_data_from_context(context: RequestContext) -> Dict[str, Any]:
                 except Exception as e:
                     logger.warning(f"序列化流式响应 body 失败: {str(e)}")
         
-        # 解析 token 使用量（使用工具函数简化）
-        try:
-            from utils.context_utils import get_usage_from_context, extract_tokens, extract_credits
-            
-            # 获取 usage 对象
-            usage = get_usage_from_context(context, context.is_stream)
-            
-            if usage:
-                # 提取 token 信息
-                tokens = extract_tokens(usage, context.provider)
-                log_data.update(tokens)
-                
-                # 如果没有 total_tokens，计算总和
-                if log_data['total_tokens'] == 0:
-                    log_data['total_tokens'] = (
-                        (log_data['prompt_tokens'] or 0) + 
-                        (log_data['completion_tokens'] or 0) +
-                        (log_data['input_tokens'] or 0) + 
-                        (log_data['output_tokens'] or 0)
-                    )
-                
-                # 提取 credits 作为 cost
-                log_data['cost'] = extract_credits(usage)
-                logger.debug(f"✅ 成功提取 usage: cost={log_data['cost']}, tokens={log_data['total_tokens']}")
-                
-        except Exception as e:
-            logger.error(f"❌ 解析响应 token 使用量失败: {str(e)}")
+        # 解析 token 使用量
+        _apply_usage(log_data, context)
     else:
         # 未知状态
         log_data['status'] = 'unknown'
@@ -178,6 +162,36 @@ def build_log_data_from_context(context: RequestContext) -> Dict[str, Any]:
     return log_data
 
 
+def _apply_usage(log_data: Dict[str, Any], context: RequestContext):
+    """从响应中解析 token 使用量和成本，写入日志数据"""
+    try:
+        from utils.context_utils import get_usage_from_context, extract_tokens, extract_credits
+        
+        # 获取 usage 对象
+        usage = get_usage_from_context(context, context.is_stream)
+        
+        if usage:
+            # 提取 token 信息
+            tokens = extract_tokens(usage, context.provider)
+            log_data.update(tokens)
+            
+            # 如果没有 total_tokens，计算总和
+            if log_data['total_tokens'] == 0:
+                log_data['total_tokens'] = (
+                    (log_data['prompt_tokens'] or 0) + 
+                    (log_data['completion_tokens'] or 0) +
+                    (log_data['input_tokens'] or 0) + 
+                    (log_data['output_tokens'] or 0)
+                )
+            
+            # 提取 credits 作为 cost
+            log_data['cost'] = extract_credits(usage)
+            logger.debug(f"✅ 成功提取 usage: cost={log_data['cost']}, tokens={log_data['total_tokens']}")
+    
+    except Exception as e:
+        logger.error(f"❌ 解析响应 token 使用量失败: {str(e)}")
+
+
 def create_log_from_data(db: Session, log_data: Dict[str, Any]) -> RequestLog:
     """
     从日志数据创建日志记录
@@ -199,6 +213,22 @@ def create_log_from_data(db: Session, log_data: Dict[str, Any]) -> RequestLog:
         raise
 
 
+def create_logs_from_data(db: Session, rows: list[Dict[str, Any]]) -> int:
+    """
+    批量创建日志记录（一个事务）
+    
+    Args:
+        db: 数据库会话
+        rows: 日志数据字典列表
+        
+    Returns:
+        插入的数量
+    """
+    count = request_log_mapper.insert_request_logs(db, rows)
+    logger.debug(f"批量日志记录成功: {count} 条")
+    return count
+
+
 def get_logs_by_key(db: Session, key_id: int, limit: int = 100) -> list[RequestLog]:
     """获取指定 Key 的日志"""
     return request_log_mapper.query_logs_by_key(db, key_id, limit)
@@ -0,0 +1,197 @@
+"""对冲请求服务 - 非流式请求慢于近期延迟分位数时，用另一个 Key 再发一次，先返回者胜出"""
+
+import time
+from collections import deque
+from typing import Dict, Optional
+
+from configs.config import settings
+from utils.logger import logger
+
+
+# 每个模型保留的最近延迟样本数
+_SAMPLE_SIZE = 200
+
+# 样本不足时不对冲（分位数不可靠）
+_MIN_SAMPLES = 20
+
+# 对冲比例统计窗口（秒）
+_WINDOW_SECONDS = 60
+
+
+class HedgeController:
+    """
+    对冲控制器
+
+    - 按模型记录最近的成功延迟，计算对冲触发延迟（分位数，不低于 min_delay）
+    - 按窗口统计可对冲请求数和已对冲次数，对冲次数不超过 max_ratio
+    - 统计胜出方和被取消的请求数
+
+    注意：只在事件循环线程中使用，不需要加锁
+    """
+
+    def __init__(self, enabled: bool, percentile: float, max_ratio: float, min_delay: float):
+        self.enabled = enabled
+        self.percentile = percentile
+        self.max_ratio = max_ratio
+        self.min_delay = min_delay
+
+        self._latencies: Dict[str, deque] = {}
+
+        # 对冲比例窗口（当前窗口 + 上一个窗口的请求数，避免窗口刚开始时无法对冲）
+        self._window_start = time.monotonic()
+        self._window_eligible = 0
+        self._window_hedged = 0
+        self._prev_window_eligible = 0
+
+        # 统计信息
+        self._eligible = 0
+        self._hedged = 0
+        self._hedge_wins = 0
+        self._primary_wins = 0
+        self._cancelled = 0
+        self._rejected_by_cap = 0
+        self._no_key = 0
+
+    # ==================== 延迟样本 ====================
+
+    def record_latency(self, model: str, seconds: float):
+        """记录一次成功的非流式请求延迟"""
+        samples = self._latencies.get(model)
+        if samples is None:
+            samples = deque(maxlen=_SAMPLE_SIZE)
+            self._latencies[model] = samples
+        samples.append(seconds)
+
+    def get_hedge_delay(self, model: str) -> Optional[float]:
+        """获取对冲触发延迟（秒），样本不足时返回 None（不对冲）"""
+        samples = self._latencies.get(model)
+        if not samples or len(samples) < _MIN_SAMPLES:
+            return None
+        ordered = sorted(samples)
+        index = min(int(len(ordered) * self.percentile / 100), len(ordered) - 1)
+        return max(ordered[index], self.min_delay)
+
+    # ==================== 对冲比例 ====================
+
+    def mark_eligible(self):
+        """记录一个可对冲的请求"""
+        self._roll_window()
+        self._eligible += 1
+        self._window_eligible += 1
+
+    def try_acquire(self) -> bool:
+        """申请一次对冲名额（超过比例上限时返回 False）"""
+        self._roll_window()
+        base = max(self._window_eligible, self._prev_window_eligible)
+        if self._window_hedged + 1 > base * self.max_ratio:
+            self._rejected_by_cap += 1
+            return False
+        self._window_hedged += 1
+        self._hedged += 1
+        return True
+
+    def refund(self):
+        """退回一次对冲名额（申请到名额后没有空闲的 Key，对冲请求没有发出）"""
+        self._window_hedged = max(self._window_hedged - 1, 0)
+        self._hedged = max(self._hedged - 1, 0)
+        self._no_key += 1
+
+    def _roll_window(self):
+        now = time.monotonic()
+        if now - self._window_start < _WINDOW_SECONDS:
+            return
+        self._prev_window_eligible = self._window_eligible
+        self._window_start = now
+        self._window_eligible = 0
+        self._window_hedged = 0
+
+    # ==================== 结果统计 ====================
+
+    def record_result(self, hedge_won: bool, cancelled: bool):
+        """记录对冲结果"""
+        if hedge_won:
+            self._hedge_wins += 1
+        else:
+            self._primary_wins += 1
+        if cancelled:
+            self._cancelled += 1
+
+    def get_stats(self) -> dict:
+        """获取对冲统计信息"""
+        delays = {}
+        for model in self._latencies:
+            delay = self.get_hedge_delay(model)
+            delays[model] = {
+                'samples': len(self._latencies[model]),
+                'hedge_delay_ms': int(delay * 1000) if delay is not None else None,
+            }
+
+        return {
+            'enabled': self.enabled,
+            'percentile': self.percentile,
+            'max_ratio': self.max_ratio,
+            'eligible': self._eligible,
+            'hedged': self._hedged,
+            'hedge_rate': round(self._hedged / self._eligible * 100, 2) if self._eligible > 0 else 0.0,
+            'hedge_wins': self._hedge_wins,
+            'primary_wins': self._primary_wins,
+            'cancelled': self._cancelled,
+            'rejected_by_cap': self._rejected_by_cap,
+            'no_key': self._no_key,
+            'models': delays,
+        }
+
+
+# 全局对冲控制器实例
+_controller = HedgeController(
+    enabled=settings.UPSTREAM_HEDGE_ENABLED,
+    percentile=settings.UPSTREAM_HEDGE_PERCENTILE,
+    max_ratio=settings.UPSTREAM_HEDGE_MAX_RATIO,
+    min_delay=settings.UPSTREAM_HEDGE_MIN_DELAY,
+)
+
+if _controller.enabled:
+    logger.info(
+        f"对冲请求已启用: percentile=p{settings.UPSTREAM_HEDGE_PERCENTILE}, "
+        f"max_ratio={settings.UPSTREAM_HEDGE_MAX_RATIO}, min_delay={settings.UPSTREAM_HEDGE_MIN_DELAY}s"
+    )
+
+
+def is_enabled() -> bool:
+    """是否启用对冲"""
+    return _controller.enabled
+
+
+def record_latency(model: str, seconds: float):
+    """记录一次成功的非流式请求延迟"""
+    _controller.record_latency(model, seconds)
+
+
+def get_hedge_delay(model: str) -> Optional[float]:
+    """获取对冲触发延迟（秒）"""
+    return _controller.get_hedge_delay(model)
+
+
+def mark_eligible():
+    """记录一个可对冲的请求"""
+    _controller.mark_eligible()
+
+
+def try_acquire() -> bool:
+    """申请一次对冲名额"""
+    return _controller.try_acquire()
+
+
+def refund():
+    """退回一次对冲名额（没有空闲的 Key，对冲请求没有发出）"""
+    _controller.refund()
+
+
+def record_result(hedge_won: bool, cancelled: bool):
+    """记录对冲结果"""
+    _controller.record_result(hedge_won, cancelled)
+
+
+def get_stats() -> dict:
+    """获取对冲统计信息"""
+    return _controller.get_stats()
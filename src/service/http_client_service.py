@@ -0,0 +1,319 @@
+"""上游 HTTP 客户端注册表 - 复用长连接，避免每个请求重新建立 TCP/TLS/SOCKS 连接"""
+
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+import httpx
+from openai import AsyncOpenAI
+from anthropic import AsyncAnthropic
+
+from configs.config import settings
+from constants import (
+    PROVIDER_OPENAI,
+    PROVIDER_ANTHROPIC,
+    ANTHROPIC_API_VERSION,
+    DEFAULT_USER_AGENT,
+    DEFAULT_ACCEPT_LANGUAGE,
+)
+from service import key_event_service
+from utils.logger import logger
+
+
+# 直连（不走代理）时使用的注册表键
+_DIRECT = ""
+
+# 空闲清理的最小间隔（秒）
+_SWEEP_INTERVAL = 60
+
+
+def _http2_available() -> bool:
+    """HTTP/2 依赖 h2 包（httpx[http2]），未安装时降级为 HTTP/1.1"""
+    try:
+        import h2  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+
+class _HttpClientEntry:
+    """按代理划分的 httpx.AsyncClient（连接池），同一代理下的所有 Key 共享"""
+
+    def __init__(self, client: httpx.AsyncClient):
+        self.client = client
+        self.last_used = time.monotonic()
+
+
+class UpstreamClientRegistry:
+    """
+    上游客户端注册表
+
+    - 第一层：按代理缓存 httpx.AsyncClient，复用 keep-alive 连接（可选 HTTP/2 多路复用）
+    - 第二层：按 (provider, base_url, api_key, proxy) 缓存 SDK 客户端，LRU 淘汰
+    - 代理连接池空闲超过 idle_timeout 且没有活跃连接时关闭
+    - Key 被删除、禁用或修改了密钥 / 代理时，按旧的 (api_key, proxy) 移除 SDK 客户端
+
+    注意：只在事件循环线程中使用，不需要加锁（Key 变更事件可能来自其他线程，转交给事件循环处理）
+    """
+
+    def __init__(self, max_clients: int, idle_timeout: float, http2: bool):
+        self.max_clients = max_clients
+        self.idle_timeout = idle_timeout
+        self.http2 = http2 and _http2_available()
+        if http2 and not self.http2:
+            logger.warning("未安装 h2，上游 HTTP/2 已禁用（pip install httpx[http2]）")
+
+        self._http_clients: Dict[str, _HttpClientEntry] = {}
+        self._sdk_clients: "OrderedDict[Tuple[str, str, str, str], object]" = OrderedDict()
+        self._last_sweep = time.monotonic()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+        # 统计信息
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+        self._key_evictions = 0
+        self._closed_http_clients = 0
+
+    # ==================== 获取客户端 ====================
+
+    def get_http_client(self, proxy: Optional[str]) -> httpx.AsyncClient:
+        """获取指定代理的共享 httpx.AsyncClient（不存在则创建）"""
+        proxy_key = proxy or _DIRECT
+        entry = self._http_clients.get(proxy_key)
+
+        if entry is None or entry.client.is_closed:
+            client = httpx.AsyncClient(
+                proxy=proxy or None,
+                http2=self.http2,
+                timeout=httpx.Timeout(60.0, connect=10.0),
+                limits=httpx.Limits(
+                    max_connections=settings.UPSTREAM_MAX_CONNECTIONS,
+                    max_keepalive_connections=settings.UPSTREAM_MAX_KEEPALIVE_CONNECTIONS,
+                    keepalive_expiry=settings.UPSTREAM_KEEPALIVE_EXPIRY,
+                ),
+            )
+            entry = _HttpClientEntry(client)
+            self._http_clients[proxy_key] = entry
+            self._loop = asyncio.get_running_loop()
+            logger.info(f"创建上游连接池: proxy={proxy or '直连'}, http2={self.http2}")
+
+        entry.last_used = time.monotonic()
+        return entry.client
+
+    def get_openai_client(self, api_key: str, base_url: str, proxy: Optional[str]) -> AsyncOpenAI:
+        """获取 OpenAI 异步客户端"""
+        return self._get_sdk_client(PROVIDER_OPENAI, api_key, base_url, proxy)
+
+    def get_anthropic_client(self, api_key: str, base_url: str, proxy: Optional[str]) -> AsyncAnthropic:
+        """获取 Anthropic 异步客户端"""
+        return self._get_sdk_client(PROVIDER_ANTHROPIC, api_key, base_url, proxy)
+
+    def _get_sdk_client(self, provider: str, api_key: str, base_url: str, proxy: Optional[str]):
+        """按 (provider, base_url, api_key, proxy) 获取 SDK 客户端（LRU）"""
+        self._maybe_sweep()
+
+        cache_key = (provider, base_url, api_key, proxy or _DIRECT)
+        http_client = self.get_http_client(proxy)
+
+        client = self._sdk_clients.get(cache_key)
+        # 底层连接池被清理后，SDK 客户端需要重建
+        if client is not None and client._client is http_client:
+            self._sdk_clients.move_to_end(cache_key)
+            self._hits += 1
+            return client
+
+        self._misses += 1
+        client = self._build_sdk_client(provider, api_key, base_url, http_client)
+        self._sdk_clients[cache_key] = client
+
+        # LRU 淘汰（SDK 客户端不持有连接，连接由共享的 httpx 客户端管理）
+        while len(self._sdk_clients) > self.max_clients:
+            self._sdk_clients.popitem(last=False)
+            self._evictions += 1
+
+        return client
+
+    @staticmethod
+    def _build_sdk_client(provider: str, api_key: str, base_url: str, http_client: httpx.AsyncClient):
+        """创建 SDK 客户端（复用共享的 httpx 客户端）"""
+        if provider == PROVIDER_ANTHROPIC:
+            return AsyncAnthropic(
+                api_key=api_key,
+                base_url=base_url,
+                http_client=http_client,
+                max_retries=0,  # 禁用重试
+                default_headers={
+                    'x-amp-feature': 'chat',
+                    'accept-language': DEFAULT_ACCEPT_LANGUAGE,
+                    'user-agent': DEFAULT_USER_AGENT,
+                    'anthropic-version': ANTHROPIC_API_VERSION,
+                }
+            )
+
+        return AsyncOpenAI(
+            api_key=api_key,
+            base_url=base_url,
+            http_client=http_client,
+            timeout=60.0,
+            max_retries=0,  # 禁用 SDK 内部重试（由 api_service 换 Key 故障转移）
+            default_headers={
+                'x-amp-feature': 'chat',
+                'accept-language': DEFAULT_ACCEPT_LANGUAGE,
+                'user-agent': DEFAULT_USER_AGENT,
+            }
+        )
+
+    # ==================== Key 变更 ====================
+
+    def on_key_event(self, event: key_event_service.KeyEvent):
+        """Key 变更事件：旧的密钥或代理不再使用时，在事件循环中移除对应的 SDK 客户端（线程安全）"""
+        old, new = event.previous, event.record
+        if old is None or self._loop is None:
+            return
+        if new is not None and new.api_key == old.api_key and new.proxy == old.proxy:
+            return
+        try:
+            self._loop.call_soon_threadsafe(self.evict_key, old.api_key, old.proxy)
+        except RuntimeError:
+            # 事件循环已关闭
+            pass
+
+    def evict_key(self, api_key: str, proxy: Optional[str]):
+        """移除指定 (api_key, proxy) 的 SDK 客户端（代理连接池由其他 Key 共享，不关闭）"""
+        proxy_key = proxy or _DIRECT
+        for cache_key in [k for k in self._sdk_clients if k[2] == api_key and k[3] == proxy_key]:
+            del self._sdk_clients[cache_key]
+            self._key_evictions += 1
+
+    # ==================== 清理与关闭 ====================
+
+    def _maybe_sweep(self):
+        """定期清理空闲的代理连接池（惰性触发，不需要后台任务）"""
+        now = time.monotonic()
+        if now - self._last_sweep < _SWEEP_INTERVAL:
+            return
+        self._last_sweep = now
+
+        for proxy_key, entry in list(self._http_clients.items()):
+            if now - entry.last_used < self.idle_timeout:
+                continue
+            # 仍有活跃连接（如长时间的流式响应）时不关闭
+            if _active_connection_count(entry.client) > 0:
+                continue
+            self._drop_http_client(proxy_key)
+
+    def _drop_http_client(self, proxy_key: str):
+        """移除代理连接池及其关联的 SDK 客户端，并异步关闭连接"""
+        entry = self._http_clients.pop(proxy_key, None)
+        if entry is None:
+            return
+
+        for cache_key in [k for k in self._sdk_clients if k[3] == proxy_key]:
+            del self._sdk_clients[cache_key]
+
+        self._closed_http_clients += 1
+        logger.info(f"关闭空闲上游连接池: proxy={proxy_key or '直连'}")
+        asyncio.get_running_loop().create_task(entry.client.aclose())
+
+    async def close_all(self):
+        """关闭所有连接池（应用退出时调用）"""
+        entries = list(self._http_clients.values())
+        self._http_clients.clear()
+        self._sdk_clients.clear()
+
+        for entry in entries:
+            try:
+                await entry.client.aclose()
+            except Exception as e:
+                logger.warning(f"关闭上游连接池失败: {str(e)}")
+
+        logger.info(f"已关闭 {len(entries)} 个上游连接池")
+
+    # ==================== 统计 ====================
+
+    def get_stats(self) -> dict:
+        """获取注册表统计信息"""
+        total = self._hits + self._misses
+        proxies = []
+        for proxy_key, entry in self._http_clients.items():
+            proxies.append({
+                'proxy': proxy_key or None,
+                'open_connections': _open_connection_count(entry.client),
+                'active_connections': _active_connection_count(entry.client),
+                'idle_seconds': int(time.monotonic() - entry.last_used),
+            })
+
+        return {
+            'hits': self._hits,
+            'misses': self._misses,
+            'hit_rate': round(self._hits / total * 100, 2) if total > 0 else 0.0,
+            'evictions': self._evictions,
+            'key_evictions': self._key_evictions,
+            'closed_pools': self._closed_http_clients,
+            'sdk_clients': len(self._sdk_clients),
+            'http_pools': len(self._http_clients),
+            'open_connections': sum(p['open_connections'] for p in proxies),
+            'http2': self.http2,
+            'pools': proxies,
+        }
+
+
+def _pool_connections(client: httpx.AsyncClient) -> list:
+    """读取 httpcore 连接池中的连接列表（内部属性，读取失败时返回空列表）"""
+    try:
+        return list(client._transport._pool.connections)
+    except Exception:
+        return []
+
+
+def _open_connection_count(client: httpx.AsyncClient) -> int:
+    """已建立的连接数"""
+    return len(_pool_connections(client))
+
+
+def _active_connection_count(client: httpx.AsyncClient) -> int:
+    """正在处理请求的连接数"""
+    count = 0
+    for conn in _pool_connections(client):
+        try:
+            if not conn.is_idle():
+                count += 1
+        except Exception:
+            continue
+    return count
+
+
+# 全局注册表实例
+_registry = UpstreamClientRegistry(
+    max_clients=settings.UPSTREAM_MAX_CLIENTS,
+    idle_timeout=settings.UPSTREAM_CLIENT_IDLE_TIMEOUT,
+    http2=settings.UPSTREAM_HTTP2,
+)
+key_event_service.subscribe(_registry.on_key_event)
+
+
+def get_openai_client(api_key: str, base_url: str, proxy: Optional[str]) -> AsyncOpenAI:
+    """获取 OpenAI 异步客户端"""
+    return _registry.get_openai_client(api_key, base_url, proxy)
+
+
+def get_anthropic_client(api_key: str, base_url: str, proxy: Optional[str]) -> AsyncAnthropic:
+    """获取 Anthropic 异步客户端"""
+    return _registry.get_anthropic_client(api_key, base_url, proxy)
+
+
+def get_http_client(proxy: Optional[str]) -> httpx.AsyncClient:
+    """获取指定代理的共享 httpx.AsyncClient"""
+    return _registry.get_http_client(proxy)
+
+
+def get_stats() -> dict:
+    """获取注册表统计信息"""
+    return _registry.get_stats()
+
+
+async def close_all():
+    """关闭所有上游连接（应用退出时调用）"""
+    await _registry.close_all()
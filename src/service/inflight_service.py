@@ -0,0 +1,180 @@
+"""Key 并发控制服务 - 限制每个 Key 同时进行的请求数，所有 Key 饱和时排队等待"""
+
+import asyncio
+from collections import deque
+from typing import Dict, Optional, Set
+
+from configs.config import settings
+from utils.logger import logger
+
+
+class KeyInflightLimiter:
+    """
+    Key 并发限制器（相当于每个 Key 一个非阻塞的信号量 + 一个所有 Key 共享的等待队列）
+
+    - acquire / release: 增减 Key 的进行中请求数，达到上限的 Key 进入饱和集合，选 Key 时跳过
+    - wait_for_release: 所有 Key 都饱和时排队等待，任意 Key 释放时按先后顺序唤醒一个等待者
+    - 等待队列有长度上限，超过上限时直接拒绝
+
+    注意：只在事件循环线程中使用，不需要加锁
+    """
+
+    def __init__(self, max_inflight: int, queue_size: int):
+        self.max_inflight = max_inflight  # 0 表示不限制
+        self.queue_size = queue_size
+
+        self._inflight: Dict[int, int] = {}
+        self._saturated: Set[int] = set()
+        self._waiters: deque = deque()
+
+        # 统计信息
+        self._waited = 0
+        self._rejected = 0
+        self._timeouts = 0
+
+    # ==================== 占用与释放 ====================
+
+    def acquire(self, key_id: int):
+        """占用 Key 的一个并发名额"""
+        count = self._inflight.get(key_id, 0) + 1
+        self._inflight[key_id] = count
+        if self.max_inflight > 0 and count >= self.max_inflight:
+            self._saturated.add(key_id)
+
+    def release(self, key_id: int):
+        """释放 Key 的一个并发名额，并唤醒一个等待者"""
+        count = self._inflight.get(key_id, 0) - 1
+        if count > 0:
+            self._inflight[key_id] = count
+        else:
+            self._inflight.pop(key_id, None)
+
+        if key_id in self._saturated and (self.max_inflight <= 0 or count < self.max_inflight):
+            self._saturated.discard(key_id)
+        self.notify(key_id)
+
+    def get_inflight(self, key_id: int) -> int:
+        """Key 当前进行中的请求数"""
+        return self._inflight.get(key_id, 0)
+
+    def saturated_key_ids(self) -> Set[int]:
+        """已达到并发上限的 Key ID"""
+        return self._saturated
+
+    def is_saturated(self, key_id: int) -> bool:
+        return key_id in self._saturated
+
+    # ==================== 等待队列 ====================
+
+    def is_queue_full(self) -> bool:
+        return len(self._waiters) >= self.queue_size
+
+    async def wait_for_release(self, timeout: float) -> Optional[int]:
+        """
+        等待任意 Key 释放名额
+
+        Returns:
+            被释放的 Key ID；超时返回 None
+        """
+        future = asyncio.get_running_loop().create_future()
+        self._waiters.append(future)
+        self._waited += 1
+        try:
+            return await asyncio.wait_for(future, timeout=max(timeout, 0))
+        except asyncio.TimeoutError:
+            self._timeouts += 1
+            return None
+        finally:
+            try:
+                self._waiters.remove(future)
+            except ValueError:
+                pass
+
+    def notify(self, key_id: int):
+        """唤醒最早的一个等待者（唤醒后由等待者重新选 Key）"""
+        while self._waiters:
+            future = self._waiters.popleft()
+            if not future.done():
+                future.set_result(key_id)
+                return
+
+    def record_rejected(self):
+        self._rejected += 1
+
+    # ==================== 统计 ====================
+
+    def get_stats(self) -> dict:
+        """获取并发统计信息"""
+        keys = [
+            {'key_id': key_id, 'inflight': count, 'saturated': key_id in self._saturated}
+            for key_id, count in sorted(self._inflight.items(), key=lambda item: -item[1])
+        ]
+        return {
+            'max_inflight': self.max_inflight,
+            'queue_size': self.queue_size,
+            'total_inflight': sum(self._inflight.values()),
+            'saturated_keys': len(self._saturated),
+            'waiting': len(self._waiters),
+            'waited': self._waited,
+            'wait_timeouts': self._timeouts,
+            'rejected_queue_full': self._rejected,
+            'keys': keys,
+        }
+
+
+# 全局并发限制器实例
+_limiter = KeyInflightLimiter(
+    max_inflight=settings.KEY_MAX_INFLIGHT,
+    queue_size=settings.KEY_WAIT_QUEUE_SIZE,
+)
+logger.info(f"Key 并发限制: max_inflight={settings.KEY_MAX_INFLIGHT or '不限制'}, queue_size={settings.KEY_WAIT_QUEUE_SIZE}")
+
+
+def acquire(key_id: int):
+    """占用 Key 的一个并发名额"""
+    _limiter.acquire(key_id)
+
+
+def release(key_id: int):
+    """释放 Key 的一个并发名额"""
+    _limiter.release(key_id)
+
+
+def get_inflight(key_id: int) -> int:
+    """Key 当前进行中的请求数"""
+    return _limiter.get_inflight(key_id)
+
+
+def saturated_key_ids() -> Set[int]:
+    """已达到并发上限的 Key ID"""
+    return _limiter.saturated_key_ids()
+
+
+def is_saturated(key_id: int) -> bool:
+    """Key 是否已达到并发上限"""
+    return _limiter.is_saturated(key_id)
+
+
+def is_queue_full() -> bool:
+    """等待队列是否已满"""
+    return _limiter.is_queue_full()
+
+
+async def wait_for_release(timeout: float) -> Optional[int]:
+    """等待任意 Key 释放名额"""
+    return await _limiter.wait_for_release(timeout)
+
+
+def notify(key_id: int):
+    """把唤醒机会传给下一个等待者"""
+    _limiter.notify(key_id)
+
+
+def record_rejected():
+    """记录一次因队列已满被拒绝的请求"""
+    _limiter.record_rejected()
+
+
+def get_stats() -> dict:
+    """获取并发统计信息"""
+    return _limiter.get_stats()
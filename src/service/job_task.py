@@ -0,0 +1,270 @@
+"""后台任务执行 - 批量操作在后台分批执行，进度写入数据库，可以查询和取消"""
+
+import asyncio
+import time
+from typing import Any, Awaitable, Callable, Dict, Iterator, List, Optional, Tuple, Type
+
+from pydantic import BaseModel
+
+from configs.config import settings
+from entity.databases.database import SessionLocal
+from service.databases import job_service
+from utils.logger import logger
+
+
+# 任务类型
+JOB_BATCH_CREATE = "batch_create"  # 批量创建 Key
+JOB_BATCH_CHECK = "batch_check"  # 批量测活 Key
+JOB_BATCH_DELETE = "batch_delete"  # 批量删除 Key
+JOB_UPDATE_BALANCE = "update_balance"  # 更新所有 Key 余额
+
+# 任务结果中最多保留的明细条数（如测活失败的 Key），避免几十万条明细写进一行
+_MAX_RESULT_ITEMS = 1000
+
+
+class JobCancelled(Exception):
+    """任务已被取消（由 JobContext.report 抛出，处理函数不需要捕获）"""
+    pass
+
+
+async def run_db(fn: Callable[..., Any], *args, **kwargs) -> Any:
+    """在线程中使用独立的数据库 session 执行 fn(db, *args, **kwargs)，不阻塞事件循环"""
+    def call():
+        db = SessionLocal()
+        try:
+            return fn(db, *args, **kwargs)
+        finally:
+            db.close()
+    
+    return await asyncio.to_thread(call)
+
+
+class JobContext:
+    """
+    任务执行上下文（传给任务处理函数）
+    
+    处理函数按 chunks() 分批处理，每批处理完调用 report() 累加进度：
+    进度写入数据库，同时读取取消标记，已请求取消时抛出 JobCancelled，在两批之间停止；
+    提交时不知道总数的任务，执行过程中直接修改 total，下一次 report() 时写入
+    """
+    
+    def __init__(self, job_id: int, job_type: str, total: int, chunk_size: int):
+        self.job_id = job_id
+        self.job_type = job_type
+        self.total = total
+        self.chunk_size = chunk_size
+        self.processed = 0
+        self.success_count = 0
+        self.fail_count = 0
+        self.items: List[dict] = []
+        self.cancel_requested = False
+        self.task: Optional[asyncio.Task] = None
+    
+    def chunks(self, items: List[Any]) -> Iterator[List[Any]]:
+        """按 chunk_size 分批"""
+        for i in range(0, len(items), self.chunk_size):
+            yield items[i:i + self.chunk_size]
+    
+    def add_item(self, item: dict):
+        """记录一条明细（如失败原因），超过上限后丢弃"""
+        if len(self.items) < _MAX_RESULT_ITEMS:
+            self.items.append(item)
+    
+    async def report(self, processed: int, success_count: int = 0, fail_count: int = 0):
+        """累加进度并写入数据库；已请求取消时抛出 JobCancelled"""
+        self.processed += processed
+        self.success_count += success_count
+        self.fail_count += fail_count
+        
+        cancel_requested = await run_db(
+            job_service.update_job_progress, self.job_id, self.total, self.processed, self.success_count, self.fail_count
+        )
+        if cancel_requested or self.cancel_requested:
+            raise JobCancelled()
+    
+    def summary(self) -> dict:
+        """任务结果（计数和明细）"""
+        return {
+            'total': self.total,
+            'processed': self.processed,
+            'success_count': self.success_count,
+            'fail_count': self.fail_count,
+            'items': self.items,
+        }
+
+
+JobHandler = Callable[[JobContext, BaseModel], Awaitable[Optional[dict]]]
+
+
+class JobRunner:
+    """
+    后台任务执行器
+    
+    - 任务在提交它的 worker 进程中以 asyncio 任务执行，每个 worker 最多同时执行 max_concurrency 个，其余排队
+    - 状态和进度写入 admin_job 表，任意 worker 都可以查询；取消标记也写入数据库，执行中的任务在两批之间读取
+    - 各类批量操作通过 register() 注册：请求模型、总数计算和处理函数
+    - 服务关闭时取消执行中的任务并标记为已取消；worker 异常退出时由 leader 将它的任务标记为失败
+    """
+    
+    def __init__(self, max_concurrency: int, chunk_size: int):
+        """
+        初始化任务执行器
+        
+        Args:
+            max_concurrency: 每个 worker 同时执行的任务数
+            chunk_size: 每批处理的数量
+        """
+        self.max_concurrency = max(max_concurrency, 1)
+        self.chunk_size = max(chunk_size, 1)
+        self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        self._handlers: Dict[str, Tuple[Type[BaseModel], Callable[[BaseModel], int], JobHandler]] = {}
+        self._jobs: Dict[int, JobContext] = {}
+        self._running_count = 0
+        
+        # 统计信息
+        self._submitted = 0
+        self._finished: Dict[str, int] = {}
+    
+    def register(self, job_type: str, request_model: Type[BaseModel], total: Callable[[BaseModel], int], handler: JobHandler):
+        """
+        注册任务类型
+        
+        Args:
+            job_type: 任务类型
+            request_model: 任务参数的请求模型
+            total: 根据请求计算需要处理的总数
+            handler: 处理函数 handler(job, request)，返回附加到结果中的字典（可选）
+        """
+        self._handlers[job_type] = (request_model, total, handler)
+    
+    def get_request_model(self, job_type: str) -> Type[BaseModel]:
+        """任务类型对应的请求模型（未注册时抛出 ValueError）"""
+        if job_type not in self._handlers:
+            raise ValueError(f"不支持的任务类型: {job_type}")
+        return self._handlers[job_type][0]
+    
+    async def submit(self, job_type: str, request: BaseModel):
+        """
+        提交任务（写入数据库后立即返回，任务在后台执行）
+        
+        Returns:
+            创建的任务（AdminJob）
+        """
+        from service.coordination_task import get_coordinator
+        
+        _, total, handler = self._handlers[job_type]
+        job = await run_db(job_service.create_job, job_type, total(request), get_coordinator().worker_id)
+        
+        context = JobContext(job.id, job_type, job.total, self.chunk_size)
+        self._jobs[job.id] = context
+        self._submitted += 1
+        context.task = asyncio.create_task(self._run(context, handler, request))
+        logger.info(f"已提交后台任务: id={job.id}, type={job_type}, total={job.total}")
+        return job
+    
+    async def cancel(self, job_id: int):
+        """
+        请求取消任务（执行中的任务在处理完当前这一批后停止，排队中的任务不再执行）
+        
+        Returns:
+            任务（不存在时返回 None）
+        """
+        job = await run_db(job_service.request_cancel, job_id)
+        context = self._jobs.get(job_id)
+        if context:
+            context.cancel_requested = True
+        return job
+    
+    async def _run(self, context: JobContext, handler: JobHandler, request: BaseModel):
+        """执行任务（等待并发名额 -> 执行处理函数 -> 写入结果）"""
+        status, result, error = job_service.FAILED, None, None
+        started = time.monotonic()
+        try:
+            async with self._semaphore:
+                if not await run_db(job_service.start_job, context.job_id):
+                    status, result = job_service.CANCELLED, context.summary()
+                    return
+                
+                self._running_count += 1
+                try:
+                    extra = await handler(context, request)
+                finally:
+                    self._running_count -= 1
+                status, result = job_service.SUCCEEDED, {**context.summary(), **(extra or {})}
+        
+        except JobCancelled:
+            status, result = job_service.CANCELLED, context.summary()
+        except asyncio.CancelledError:
+            status, result, error = job_service.CANCELLED, context.summary(), "服务关闭，任务已中止"
+        except Exception as e:
+            status, result, error = job_service.FAILED, context.summary(), str(e)
+            logger.error(f"后台任务执行失败: id={context.job_id}, type={context.job_type}, 错误: {str(e)}")
+            logger.exception(e)
+        finally:
+            self._jobs.pop(context.job_id, None)
+            self._finished[status] = self._finished.get(status, 0) + 1
+            try:
+                await run_db(job_service.finish_job, context.job_id, status, result, error)
+            except Exception as e:
+                logger.error(f"写入后台任务结果失败: id={context.job_id}, 错误: {str(e)}")
+            logger.info(
+                f"后台任务结束: id={context.job_id}, type={context.job_type}, status={status}, "
+                f"进度 {context.processed}/{context.total}, 耗时 {time.monotonic() - started:.1f}秒"
+            )
+    
+    async def stop(self):
+        """取消所有未结束的任务（在应用关闭时调用）"""
+        tasks = [context.task for context in self._jobs.values() if context.task]
+        for task in tasks:
+            task.cancel()
+        if tasks:
+            await asyncio.gather(*tasks, return_exceptions=True)
+            logger.info(f"已中止 {len(tasks)} 个后台任务")
+    
+    def get_stats(self) -> dict:
+        """获取任务执行器统计信息"""
+        return {
+            'max_concurrency': self.max_concurrency,
+            'chunk_size': self.chunk_size,
+            'job_types': sorted(self._handlers),
+            'running': self._running_count,
+            'queued': len(self._jobs) - self._running_count,
+            'jobs': sorted(self._jobs),
+            'submitted': self._submitted,
+            'finished': dict(self._finished),
+        }
+
+
+# 全局单例
+_runner: Optional[JobRunner] = None
+
+
+def get_job_runner() -> JobRunner:
+    """获取全局任务执行器实例"""
+    global _runner
+    if _runner is None:
+        _runner = JobRunner(
+            max_concurrency=settings.JOB_MAX_CONCURRENCY,
+            chunk_size=settings.JOB_CHUNK_SIZE,
+        )
+    return _runner
+
+
+def register_job_type(job_type: str, request_model: Type[BaseModel], total: Callable[[BaseModel], int], handler: JobHandler):
+    """注册任务类型（各控制器导入时调用）"""
+    get_job_runner().register(job_type, request_model, total, handler)
+
+
+async def submit_job(job_type: str, request: BaseModel):
+    """提交后台任务"""
+    return await get_job_runner().submit(job_type, request)
+
+
+async def cancel_job(job_id: int):
+    """请求取消后台任务"""
+    return await get_job_runner().cancel(job_id)
+
+
+async def stop_job_runner():
+    """中止所有未结束的后台任务（在应用关闭时调用）"""
+    await get_job_runner().stop()
@@ -0,0 +1,120 @@
+"""Key 变更事件服务 - 进程内的发布 / 订阅总线，Key 在数据库中变更后增量通知缓存池、补充任务和上游客户端"""
+
+import threading
+from typing import Callable, Dict, List, Optional
+
+from entity.context import KeyRecord
+from utils.logger import logger
+
+
+# 事件类型
+KEY_CREATED = "key_created"  # 新建 Key
+KEY_UPDATED = "key_updated"  # 修改 Key（名称、密钥、代理、UA、启用状态、余额等）
+KEY_DISABLED = "key_disabled"  # 禁用 Key（自动禁用 / 测活失败）
+KEY_DELETED = "key_deleted"  # 删除 Key
+KEY_BALANCE_CHANGED = "key_balance_changed"  # 余额重新计算
+
+
+class KeyEvent:
+    """
+    Key 变更事件
+
+    - record: 变更后的 Key；Key 不再可用（已禁用、已删除、余额不足）时为 None
+    - previous: 变更前的 Key（删除 / 修改时提供，用于清理按旧密钥、旧代理缓存的资源）
+    - remote: 是否为其他 worker 进程产生的变更（由协调任务读取变更记录后重新发布）
+    """
+
+    __slots__ = ('type', 'key_id', 'record', 'previous', 'remote')
+
+    def __init__(self, type: str, key_id: int, record: Optional[KeyRecord] = None, previous: Optional[KeyRecord] = None, remote: bool = False):
+        self.type = type
+        self.key_id = key_id
+        self.record = record
+        self.previous = previous
+        self.remote = remote
+
+    def __repr__(self):
+        return f"<KeyEvent(type={self.type}, key_id={self.key_id}, available={self.record is not None})>"
+
+
+KeyEventHandler = Callable[[KeyEvent], None]
+
+
+def _handler_name(handler: KeyEventHandler) -> str:
+    return f"{getattr(handler, '__module__', '')}.{getattr(handler, '__qualname__', repr(handler))}"
+
+
+class KeyEventBus:
+    """
+    Key 变更事件总线
+
+    - 同步分发：在发布者的线程中（请求处理、日志线程池、后台任务）依次调用订阅者
+    - 订阅者必须是线程安全且快速返回的；只能在事件循环中操作的状态，订阅者自己转交给事件循环
+    - 单个订阅者出错只记录日志，不影响其他订阅者和发布者
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._handlers: List[KeyEventHandler] = []
+
+        # 统计信息
+        self._published: Dict[str, int] = {}
+        self._errors = 0
+
+    def subscribe(self, handler: KeyEventHandler):
+        """订阅事件（重复订阅同一个处理函数会被忽略）"""
+        with self._lock:
+            if handler not in self._handlers:
+                self._handlers = self._handlers + [handler]
+
+    def unsubscribe(self, handler: KeyEventHandler):
+        """取消订阅"""
+        with self._lock:
+            self._handlers = [h for h in self._handlers if h != handler]
+
+    def publish(self, event: KeyEvent):
+        """发布事件"""
+        with self._lock:
+            handlers = self._handlers
+            self._published[event.type] = self._published.get(event.type, 0) + 1
+
+        for handler in handlers:
+            try:
+                handler(event)
+            except Exception as e:
+                with self._lock:
+                    self._errors += 1
+                logger.error(f"处理 Key 变更事件失败: {event}, handler={_handler_name(handler)}, 错误: {str(e)}")
+
+    def get_stats(self) -> dict:
+        """获取事件统计信息"""
+        with self._lock:
+            return {
+                'subscribers': [_handler_name(h) for h in self._handlers],
+                'published': dict(self._published),
+                'errors': self._errors,
+            }
+
+
+# 全局事件总线实例
+_bus = KeyEventBus()
+
+
+def subscribe(handler: KeyEventHandler):
+    """订阅 Key 变更事件"""
+    _bus.subscribe(handler)
+
+
+def unsubscribe(handler: KeyEventHandler):
+    """取消订阅 Key 变更事件"""
+    _bus.unsubscribe(handler)
+
+
+def publish(type: str, key_id: int, record: Optional[KeyRecord] = None, previous: Optional[KeyRecord] = None, remote: bool = False):
+    """发布 Key 变更事件"""
+    _bus.publish(KeyEvent(type, key_id, record, previous, remote))
+
+
+def get_stats() -> dict:
+    """获取事件统计信息"""
+    return _bus.get_stats()
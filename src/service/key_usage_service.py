@@ -0,0 +1,112 @@
+"""Key 用量统计服务 - 内存中按滑动窗口统计每个 Key 的请求数和花费，供最少使用策略选择"""
+
+import random
+import time
+from collections import deque
+from typing import Dict, List, Optional, Tuple
+
+from configs.config import settings
+from entity.context import KeyRecord
+
+
+# 滑动窗口的分桶粒度（秒）
+_BUCKET_SECONDS = 5
+
+
+class SlidingWindowUsage:
+    """
+    滑动窗口用量计数器
+
+    - 窗口按 _BUCKET_SECONDS 分桶，每个 Key 只保留窗口内的桶（[桶编号, 请求数, 花费]）
+    - 请求数在选中 Key 时累加，花费在记录日志时累加
+
+    注意：只在事件循环线程中使用，不需要加锁
+    """
+
+    def __init__(self, window: float):
+        self.window = window
+        self._buckets_in_window = max(int(window // _BUCKET_SECONDS), 1)
+        self._usage: Dict[int, deque] = {}
+
+    def _bucket(self, key_id: int) -> list:
+        """获取 Key 当前时间所在的桶（同时清理过期的桶）"""
+        index = int(time.monotonic() // _BUCKET_SECONDS)
+        buckets = self._usage.get(key_id)
+        if buckets is None:
+            buckets = deque()
+            self._usage[key_id] = buckets
+        self._trim(buckets, index)
+        if not buckets or buckets[-1][0] != index:
+            buckets.append([index, 0, 0.0])
+        return buckets[-1]
+
+    def _trim(self, buckets: deque, index: int):
+        while buckets and buckets[0][0] <= index - self._buckets_in_window:
+            buckets.popleft()
+
+    def record_request(self, key_id: int):
+        """记录一次选中"""
+        self._bucket(key_id)[1] += 1
+
+    def record_spend(self, key_id: int, amount: float):
+        """记录一次花费"""
+        self._bucket(key_id)[2] += amount
+
+    def get_usage(self, key_id: int) -> Tuple[int, float]:
+        """窗口内的 (请求数, 花费)"""
+        buckets = self._usage.get(key_id)
+        if not buckets:
+            return 0, 0.0
+        self._trim(buckets, int(time.monotonic() // _BUCKET_SECONDS))
+        return sum(b[1] for b in buckets), sum(b[2] for b in buckets)
+
+    def least_used(self, keys: List):
+        """从候选中选择窗口内请求数最少的 Key（相同时比较花费，再相同时随机）"""
+        best = None
+        best_usage = None
+        for key in keys:
+            usage = (*self.get_usage(key.id), random.random())
+            if best_usage is None or usage < best_usage:
+                best, best_usage = key, usage
+        return best
+
+    def get_stats(self) -> dict:
+        """获取用量统计信息"""
+        keys = []
+        for key_id in list(self._usage):
+            requests, spend = self.get_usage(key_id)
+            if requests == 0 and spend == 0:
+                self._usage.pop(key_id, None)
+                continue
+            keys.append({'key_id': key_id, 'requests': requests, 'spend': round(spend, 6)})
+
+        return {
+            'window': self.window,
+            'keys': sorted(keys, key=lambda x: -x['requests']),
+        }
+
+
+# 全局用量计数器实例
+_usage = SlidingWindowUsage(window=settings.KEY_USAGE_WINDOW)
+
+
+def record_request(key_id: int):
+    """记录 Key 被选中一次"""
+    _usage.record_request(key_id)
+
+
+def record_spend(key_id: int, amount):
+    """记录 Key 的一次花费"""
+    if not key_id or not amount:
+        return
+    _usage.record_spend(key_id, float(amount))
+
+
+def least_used(keys: List[KeyRecord]) -> Optional[KeyRecord]:
+    """从候选中选择窗口内用量最少的 Key"""
+    return _usage.least_used(keys)
+
+
+def get_stats() -> dict:
+    """获取用量统计信息"""
+    return _usage.get_stats()
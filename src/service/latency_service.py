@@ -0,0 +1,161 @@
+"""延迟统计服务 - 按 Key 和代理维护延迟 / 错误率的 EWMA，用于延迟感知的 Key 选择（二选一）"""
+
+import math
+import random
+import time
+from typing import Dict, List, Optional
+
+from entity.context import RequestContext
+from service import inflight_service, shared_counter_service
+
+
+# EWMA 时间常数（秒）：样本权重按距上一次样本的时间指数衰减，请求越密集，单个样本影响越小
+_EWMA_TAU = 10.0
+
+# 长时间没有新样本时，延迟估计按该时间常数（秒）衰减，让变慢过的 Key 有机会被重新探测
+_STALE_TAU = 60.0
+
+# 错误率惩罚系数：得分 = 延迟 × (进行中请求数 + 1) × (1 + 惩罚系数 × 错误率)
+_ERROR_PENALTY = 4.0
+
+
+class PathStats:
+    """单个 Key 或代理的延迟 / 错误率 EWMA"""
+
+    __slots__ = ('latency', 'error_rate', 'samples', 'updated_at')
+
+    def __init__(self):
+        self.latency = 0.0
+        self.error_rate = 0.0
+        self.samples = 0
+        self.updated_at = 0.0
+
+    def record(self, now: float, latency: Optional[float], failed: bool):
+        """记录一次结果（失败时没有延迟样本，只更新错误率）"""
+        if self.samples == 0:
+            weight = 0.0
+        else:
+            weight = math.exp(-(now - self.updated_at) / _EWMA_TAU)
+
+        if latency is not None:
+            self.latency = latency if self.latency == 0 else weight * self.latency + (1 - weight) * latency
+        self.error_rate = weight * self.error_rate + (1 - weight) * (1.0 if failed else 0.0)
+        self.samples += 1
+        self.updated_at = now
+
+    def decayed(self, now: float):
+        """返回按样本陈旧程度衰减后的 (延迟, 错误率)"""
+        if self.samples == 0:
+            return 0.0, 0.0
+        factor = math.exp(-(now - self.updated_at) / _STALE_TAU)
+        return self.latency * factor, self.error_rate * factor
+
+
+class LatencyTracker:
+    """
+    Key / 代理延迟跟踪器
+
+    - 成功的尝试记录延迟（流式为收到响应头的时间）和一次成功
+    - 可重试的失败（429、5xx、连接失败、超时等）只记录一次错误
+    - 选择时从候选中取两个，得分低者胜出；Key 没有样本时用其代理的统计，都没有时得分为 0（优先探测）
+
+    注意：只在事件循环线程中使用，不需要加锁
+    """
+
+    def __init__(self):
+        self._keys: Dict[int, PathStats] = {}
+        self._proxies: Dict[str, PathStats] = {}
+
+    def record_result(self, context: RequestContext, success: bool, latency: float):
+        """记录一次尝试的结果"""
+        key_id = context.api_key_entity.id if context.api_key_from_pool and context.api_key_entity else None
+        if key_id is None:
+            return
+        if not success and not context.retryable:
+            # 请求本身的错误（如 400）与 Key / 代理无关
+            return
+
+        now = time.monotonic()
+        sample = latency if success else None
+        self._get(self._keys, key_id).record(now, sample, not success)
+        if context.proxy:
+            self._get(self._proxies, context.proxy).record(now, sample, not success)
+
+    def score(self, key, now: float) -> float:
+        """Key 的得分（越低越好）"""
+        stats = self._keys.get(key.id)
+        proxy_stats = self._proxies.get(key.proxy) if key.proxy else None
+
+        latency, error_rate = stats.decayed(now) if stats else (0.0, 0.0)
+        if proxy_stats is not None:
+            proxy_latency, proxy_error_rate = proxy_stats.decayed(now)
+            if not stats:
+                latency = proxy_latency
+            error_rate = max(error_rate, proxy_error_rate)
+
+        # 多 worker 时使用所有 worker 的进行中请求数
+        inflight = max(inflight_service.get_inflight(key.id), shared_counter_service.get_inflight(key.id))
+        return latency * (inflight + 1) * (1 + _ERROR_PENALTY * error_rate)
+
+    def choose(self, candidates: List):
+        """二选一：得分低者胜出，得分相同时随机"""
+        if not candidates:
+            return None
+        if len(candidates) == 1:
+            return candidates[0]
+
+        now = time.monotonic()
+        first, second = candidates[0], candidates[1]
+        first_score, second_score = self.score(first, now), self.score(second, now)
+        if first_score == second_score:
+            return random.choice((first, second))
+        return first if first_score < second_score else second
+
+    @staticmethod
+    def _get(stats: dict, target) -> PathStats:
+        item = stats.get(target)
+        if item is None:
+            item = PathStats()
+            stats[target] = item
+        return item
+
+    def get_stats(self) -> dict:
+        """获取延迟统计信息"""
+        now = time.monotonic()
+
+        def collect(stats: dict) -> list:
+            items = []
+            for target, item in stats.items():
+                latency, error_rate = item.decayed(now)
+                items.append({
+                    'target': target,
+                    'latency_ms': int(latency * 1000),
+                    'error_rate': round(error_rate, 4),
+                    'samples': item.samples,
+                    'idle_seconds': int(now - item.updated_at),
+                })
+            return sorted(items, key=lambda x: x['latency_ms'])
+
+        return {
+            'keys': collect(self._keys),
+            'proxies': collect(self._proxies),
+        }
+
+
+# 全局延迟跟踪器实例
+_tracker = LatencyTracker()
+
+
+def record_result(context: RequestContext, success: bool, latency: float):
+    """记录一次尝试的结果"""
+    _tracker.record_result(context, success, latency)
+
+
+def choose(candidates: List):
+    """从候选 Key 中二选一（得分低者胜出）"""
+    return _tracker.choose(candidates)
+
+
+def get_stats() -> dict:
+    """获取延迟统计信息"""
+    return _tracker.get_stats()
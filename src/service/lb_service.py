@@ -3,17 +3,32 @@
 
 """负载均衡服务"""
 
-from typing import Optional
+import time
+from typing import Callable, Collection, Dict, Optional, Set
 
-from entity.context import RequestContext
+from configs.config import settings
+from constants import STRATEGY_RANDOM, STRATEGY_ROUND_ROBIN, STRATEGY_LEAST_USED, STRATEGY_LATENCY_P2C
+from entity.context import RequestContext, KeyRecord
+from service import inflight_service, shared_counter_service, breaker_service, latency_service, key_usage_service, refill_task, reservation_service
 from service.databases import key_service
 from utils.logger import logger
 from configs.global_config import global_config
 
 
-def get_key(context: RequestContext) -> Optional[str]:
+async def get_key(context: RequestContext, wait: bool = True) -> Optional[str]:
     """
-    获取一个可用的 API Key 字符串
+    获取一个可用的 API Key 字符串，并占用该 Key 的一个并发名额
+    
+    - 跳过已达到并发上限（KEY_MAX_INFLIGHT）的 Key，以及 Key 或代理处于熔断中的 Key
+    - 跳过可用余额（扣除尚未写入的花费和进行中请求的预留）不够本请求预估花费的 Key，
+      选中后在该 Key 上预留预估花费，请求结束时释放
+    - 所有 Key 都饱和时在等待队列中等待（最长 KEY_WAIT_TIMEOUT 秒），
+      队列已满或等待超时时返回 None，并在 context.admission_status 中设置 429 / 503
+    - 占用的名额和预留需要在请求结束时通过 release_key 释放
+    
+    Args:
+        context: 请求上下文
+        wait: 所有 Key 都饱和时是否排队等待（对冲请求不等待）
     
     Returns:
         API Key 字符串，如果没有可用的则返回 None
@@ -24,48 +39,187 @@ def get_key(context: RequestContext) -> Optional[str]:
         logger.info(f"使用请求中指定的 API Key")
         return context.api_key
     
-    # 否则通过负载均衡选择
-    # 获取缓存中的 key
-    cached_keys = key_service.get_cached_keys()
-    logger.debug(f"当前缓存 Key 数量: {len(cached_keys)}")
-
-    # 如果缓存不足，从数据库补充
-    current_cache_size = len(cached_keys)
-    pool_size = global_config.key_pool_size  # 使用全局配置
-    if current_cache_size < pool_size:
-        needed_count = pool_size - current_cache_size
-        logger.info(f"缓存不足，需要补充 {needed_count} 个 Key")
-        
-        cached_key_ids = [key.id for key in cached_keys]
-        new_keys = key_service.get_available_keys(context.db, limit=needed_count, exclude_ids=cached_key_ids)
+    # 否则通过负载均衡从缓存中选择（缓存由后台任务 refill_task 补充，这里不查询数据库）
+    selected_key = _select_key(context)
+    
+    if selected_key is None:
+        # 排除本请求已失败的 key 后缓存为空：没有可用的 key
+        if key_service.get_random_key_from_cache(context.excluded_key_ids) is None:
+            logger.warning("没有可用的 API Key")
+            refill_task.trigger_refill()
+            return None
         
-        logger.info(f"从数据库获取到 {len(new_keys)} 个可用 Key")
-        for key in new_keys:
-            key_service.add_key_to_cache(key)
+        # 所有 key 都已饱和
+        if not wait:
+            return None
+        selected_key = await _wait_for_key(context)
+        if selected_key is None:
+            return None
     
-    # 根据策略选择 key（目前只支持随机）
-    selected_key = key_service.get_random_key_from_cache()
+    # 占用并发名额（熔断探测中的 key 同时占用探测名额）
+    inflight_service.acquire(selected_key.id)
+    shared_counter_service.on_acquire(selected_key.id)
+    context.inflight_key_id = selected_key.id
+    context.reserved_cost = reservation_service.reserve(selected_key, _estimate_cost(context))
+    key_usage_service.record_request(selected_key.id)
+    breaker_service.on_selected(selected_key.id, selected_key.proxy)
+    context.breaker_proxy = selected_key.proxy
     
-    if selected_key:
-        logger.info(f"选中 Key: id={selected_key.id}, name={selected_key.name}")
-        context.api_key_entity = selected_key  # 保存 APIKey 对象（用于日志记录）
-        context.api_key = selected_key.api_key  # 保存 API Key 字符串
-        
-        # 设置代理（优先使用 Key 自带的代理，如果没有则使用请求中指定的代理）
-        if selected_key.proxy and selected_key.proxy.strip():
-            context.proxy = selected_key.proxy.strip()
-            logger.info(f"✅ 使用 Key 绑定的代理: {context.proxy}")
-        elif context.proxy:
-            logger.info(f"✅ 使用请求指定的代理: {context.proxy}")
-        else:
-            logger.info(f"⚠️ 未配置代理，直连")
+    logger.info(f"选中 Key: id={selected_key.id}, name={selected_key.name}")
+    context.api_key_entity = selected_key  # 保存 Key 记录（用于日志记录）
+    context.api_key = selected_key.api_key  # 保存 API Key 字符串
+    
+    # 设置代理（优先使用 Key 自带的代理，如果没有则使用请求中指定的代理）
+    if selected_key.proxy:
+        context.proxy = selected_key.proxy
+        logger.info(f"✅ 使用 Key 绑定的代理: {context.proxy}")
+    elif context.proxy:
+        logger.info(f"✅ 使用请求指定的代理: {context.proxy}")
+    else:
+        logger.info(f"⚠️ 未配置代理，直连")
+    
+    # 打印 API Key 前缀（用于调试）
+    api_key_prefix = selected_key.api_key[:20] + "..." if len(selected_key.api_key) > 20 else selected_key.api_key
+    logger.info(f"🔑 API Key: {api_key_prefix}")
+    
+    # 注意：api_key_from_pool 已在 context.init() 时设置为 True
+    return selected_key.api_key
+
+
+def release_key(context: RequestContext):
+    """
+    释放请求占用的 Key 并发名额和预留的花费（幂等，可重复调用）
+    
+    在请求（或某次尝试）结束、记录日志之后调用（实际花费先计入花费账本，再释放预留）
+    """
+    key_id = context.inflight_key_id
+    if key_id is None:
+        return
+    context.inflight_key_id = None
+    inflight_service.release(key_id)
+    reservation_service.release(key_id, context.reserved_cost)
+    context.reserved_cost = 0.0
+    shared_counter_service.on_release(key_id)
+
+
+def _select_key(context: RequestContext) -> Optional[KeyRecord]:
+    """
+    根据策略选择 key，排除本请求已失败的 key、已饱和的 key、熔断中的 key 和可用余额不足的 key
+    
+    可选的 key 全部熔断时忽略熔断（避免整个池不可用）
+    """
+    saturated = inflight_service.saturated_key_ids()
+    exclude_ids = context.excluded_key_ids | saturated if saturated else context.excluded_key_ids
+    
+    short, exhausted = reservation_service.short_key_ids(_estimate_cost(context))
+    
+    blocked = breaker_service.blocked_key_ids(key_service.get_cached_keys())
+    if blocked:
+        selected_key = _pick_funded_key(exclude_ids | blocked, short, exhausted)
+        if selected_key is not None:
+            return selected_key
+        logger.warning(f"可选的 Key 全部处于熔断中，忽略熔断: request_id={context.request_id}")
+    
+    return _pick_funded_key(exclude_ids, short, exhausted)
+
+
+def _pick_funded_key(exclude_ids: Collection[int], short: Set[int], exhausted: Set[int]) -> Optional[KeyRecord]:
+    """
+    优先选择可用余额够预估花费的 key；全部不够时退而选择可用余额未耗尽的 key（预估花费只是估计）
+    
+    Args:
+        exclude_ids: 需要排除的 key ID
+        short: 可用余额不够预估花费的 key ID
+        exhausted: 其中可用余额已耗尽的 key ID
+    """
+    if not short:
+        return _pick_key(exclude_ids)
+    
+    selected_key = _pick_key(exclude_ids | short)
+    if selected_key is None and len(exhausted) < len(short):
+        selected_key = _pick_key(exclude_ids | exhausted)
+        if selected_key is not None:
+            reservation_service.record_fallback()
+    return selected_key
+
+
+def _estimate_cost(context: RequestContext) -> float:
+    """预估本请求的花费（按模型近期平均花费，max_tokens 较小时按比例缩小）"""
+    return reservation_service.estimate(context.request.model, context.request.max_tokens)
+
+
+def _pick_key(exclude_ids: Collection[int]) -> Optional[KeyRecord]:
+    """按全局配置的策略（key_selection_strategy）从缓存中选择一个 key，每次选择时读取配置，修改后立即生效"""
+    picker = _strategies.get(global_config.key_selection_strategy)
+    if picker is None:
+        picker = _strategies[str(STRATEGY_RANDOM)]
+    return picker(exclude_ids)
+
+
+# ==================== 选择策略 ====================
+
+# 策略编号 -> 选择函数（参数为需要排除的 key ID，返回选中的 key，没有可选的返回 None）
+KeyPicker = Callable[[Collection[int]], Optional[KeyRecord]]
+
+_strategies: Dict[str, KeyPicker] = {}
+
+
+def register_strategy(strategy: int, picker: KeyPicker):
+    """注册 Key 选择策略（未注册的策略编号按随机处理）"""
+    _strategies[str(strategy)] = picker
+
+
+def _pick_random(exclude_ids: Collection[int]) -> Optional[KeyRecord]:
+    """随机"""
+    return key_service.get_random_key_from_cache(exclude_ids)
+
+
+def _pick_round_robin(exclude_ids: Collection[int]) -> Optional[KeyRecord]:
+    """轮询：全局游标依次选择缓存中的 key"""
+    return key_service.get_next_key_from_cache(exclude_ids)
+
+
+def _pick_least_used(exclude_ids: Collection[int]) -> Optional[KeyRecord]:
+    """最少使用：选择滑动窗口（KEY_USAGE_WINDOW）内请求数最少的 key，相同时比较花费"""
+    candidates = [key for key in key_service.get_cached_keys() if key.id not in exclude_ids]
+    return key_usage_service.least_used(candidates)
+
+
+def _pick_latency_p2c(exclude_ids: Collection[int]) -> Optional[KeyRecord]:
+    """延迟感知：随机抽两个候选，选 EWMA 延迟 / 错误率 / 进行中请求数综合得分更低的"""
+    return latency_service.choose(key_service.sample_keys_from_cache(2, exclude_ids))
+
+
+register_strategy(STRATEGY_RANDOM, _pick_random)
+register_strategy(STRATEGY_ROUND_ROBIN, _pick_round_robin)
+register_strategy(STRATEGY_LEAST_USED, _pick_least_used)
+register_strategy(STRATEGY_LATENCY_P2C, _pick_latency_p2c)
+
+
+async def _wait_for_key(context: RequestContext) -> Optional[KeyRecord]:
+    """所有 key 都已饱和时排队等待，直到有 key 释放名额、队列已满或超时"""
+    if inflight_service.is_queue_full():
+        inflight_service.record_rejected()
+        logger.warning(f"所有 Key 并发已满且等待队列已满，拒绝请求: request_id={context.request_id}")
+        context.admission_status = 429
+        context.error = "All API keys are busy and the wait queue is full"
+        return None
+    
+    logger.info(f"所有 Key 并发已满，进入等待队列: request_id={context.request_id}")
+    deadline = time.monotonic() + settings.KEY_WAIT_TIMEOUT
+    
+    while True:
+        released_key_id = await inflight_service.wait_for_release(deadline - time.monotonic())
+        if released_key_id is None:
+            logger.warning(f"等待可用 Key 超时: request_id={context.request_id}")
+            context.admission_status = 503
+            context.error = f"Timed out after {settings.KEY_WAIT_TIMEOUT}s waiting for an available API key"
+            return None
         
-        # 打印 API Key 前缀（用于调试）
-        api_key_prefix = selected_key.api_key[:20] + "..." if len(selected_key.api_key) > 20 else selected_key.api_key
-        logger.info(f"🔑 API Key: {api_key_prefix}")
+        selected_key = _select_key(context)
+        if selected_key is not None:
+            return selected_key
         
-        # 注意：api_key_from_pool 已在 context.init() 时设置为 True
-        return selected_key.api_key
-    else:
-        logger.warning("没有可用的 API Key")
-        return None
\ No newline at end of file
+        # 释放的 key 本请求不能用（已失败过）：把唤醒机会传给下一个等待者
+        if not inflight_service.is_saturated(released_key_id):
+            inflight_service.notify(released_key_id)
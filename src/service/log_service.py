@@ -1,39 +1,11 @@
 """日志记录服务 - 异步记录请求日志"""
 
-import time
-from concurrent.futures import ThreadPoolExecutor
 from entity.context import RequestContext
-from entity.databases.database import SessionLocal
-from service.databases import request_log_service
+from service import key_usage_service, shared_counter_service, spend_ledger_task, reservation_service, log_writer_service
+from service.databases import key_service, request_log_service
 from utils.logger import logger
 
 
-# 全局线程池（用于异步任务）
-_thread_pool = ThreadPoolExecutor(max_workers=5, thread_name_prefix="log-worker")
-
-
-def _async_save_log(log_data: dict):
-    """
-    异步保存日志到数据库（在独立线程中执行）
-    
-    Args:
-        log_data: 日志数据字典
-    """
-    # 在独立线程中创建新的数据库 session
-    db = SessionLocal()
-    try:
-        request_log_service.create_log_from_data(db, log_data)
-        # 注意：mapper 层的 insert_request_log 已经调用了 db.commit()，这里不需要再次提交
-        logger.debug("异步日志保存完成")
-        
-    except Exception as e:
-        db.rollback()
-        logger.error(f"异步保存日志失败: {str(e)}")
-        logger.exception(e)
-    finally:
-        db.close()
-
-
 def log(context: RequestContext):
     """
     记录请求日志（异步执行）
@@ -42,7 +14,7 @@ def log(context: RequestContext):
         context: 请求上下文
     
     注意：
-    - 日志会在后台线程中异步保存到数据库
+    - 日志会由专用的写入线程按批保存到数据库（log_writer_service）
     - 不会阻塞主请求的响应
     - 如果日志保存失败，不会影响请求响应
     """
@@ -50,9 +22,21 @@ def log(context: RequestContext):
         # 从 context 构建日志数据（在主线程中完成）
         log_data = request_log_service.build_log_data_from_context(context)
         
-        # 提交到线程池异步执行
-        _thread_pool.submit(_async_save_log, log_data)
-        logger.debug("日志任务已提交到异步队列")
+        # 累计 Key 花费（最少使用策略）
+        key_usage_service.record_spend(log_data.get('key_id'), log_data.get('cost'))
+        shared_counter_service.record_spend(log_data.get('key_id'), log_data.get('cost'))
+        
+        # 计费请求的花费记入花费账本（定期写入余额，余额耗尽时立即移出缓存）
+        if log_data.get('status') in key_service.BILLED_STATUSES:
+            spend_ledger_task.record_spend(log_data.get('key_id'), log_data.get('cost'))
+        
+        # 成功请求的实际花费用于预估同一模型后续请求的花费（余额预留）
+        if log_data.get('status') == 'success':
+            reservation_service.record_cost(log_data.get('model'), log_data.get('cost'), log_data.get('output_tokens'))
+        
+        # 提交到写入队列，由写入线程按批保存
+        log_writer_service.submit(log_data)
+        logger.debug("日志已提交到写入队列")
         
     except Exception as e:
         logger.error(f"提交日志任务失败: {str(e)}")
@@ -60,9 +44,8 @@ def log(context: RequestContext):
 
 def shutdown():
     """
-    关闭线程池（应用退出时调用）
+    写完队列中剩余的日志后停止写入线程（应用退出时调用）
     """
-    logger.info("正在关闭日志线程池...")
-    _thread_pool.shutdown(wait=True)
-    logger.info("日志线程池已关闭")
+    logger.info("正在写入剩余的请求日志...")
+    log_writer_service.stop()
 
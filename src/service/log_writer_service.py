@@ -0,0 +1,686 @@
+"""请求日志写入服务 - 专用线程从有界队列中取出日志，按批插入；队列溢出或数据库不可用时写入本地溢出文件，恢复后批量导入"""
+
+import glob
+import json
+import os
+import queue
+import struct
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from datetime import datetime
+from decimal import Decimal
+from typing import Any, Callable, Iterator, List, Optional, Tuple
+
+from sqlalchemy.exc import OperationalError
+
+from configs.config import settings
+from entity.databases.database import SessionLocal
+from service.databases import request_log_service
+from utils.logger import logger
+
+
+# 停止信号（放入队列，写入线程处理完之前的日志后退出）
+_STOP = object()
+
+
+class _Barrier:
+    """独占执行请求（放入队列，写入线程写完之前提交的日志后执行 fn，结果写入 future）"""
+
+    def __init__(self, fn: Callable[[Any], Any]):
+        self.fn = fn
+        self.future: Future = Future()
+
+# 溢出文件记录格式：4 字节大端长度 + UTF-8 JSON
+_LENGTH = struct.Struct('>I')
+
+# 溢出文件中需要还原类型的字段
+_DECIMAL_FIELDS = ('cost',)
+_DATETIME_FIELDS = ('create_time', 'update_time')
+
+# 数据库写入失败后，这段时间（秒）内的批次直接写入溢出文件，之后再尝试写库 / 导入
+_RETRY_INTERVAL = 5.0
+
+# 存在溢出文件时，写入线程空闲多久（秒）检查一次是否可以导入
+_REPLAY_CHECK_INTERVAL = 1.0
+
+
+class RequestLogWriter:
+    """
+    请求日志批量写入器（group commit）
+
+    - submit() 只把日志数据放入有界队列，不阻塞调用方（事件循环）；队列已满时放入溢出缓冲区（同样有界），
+      由溢出线程追加到溢出文件（写库阻塞时也能及时写出），事件循环不做磁盘 I/O、不争抢溢出文件的锁；
+      提交时写入 create_time，稍后导入的日志保留原来的时间
+    - 写入线程取到第一条日志后，继续收集，直到凑满 batch_size 条或等待超过 max_latency_ms，
+      然后一条批量 INSERT、一次提交（不 refresh），每批只有一次 fsync
+    - 数据库不可用（OperationalError，如锁等待超时、磁盘错误）时整批写入溢出文件，
+      之后 _RETRY_INTERVAL 秒内的批次不再尝试写库，直接写入溢出文件；其他错误逐条重试，只丢弃写不进去的那几条
+    - 溢出文件只追加，每条记录为 长度前缀 + JSON；写入线程在启动时、队列追上且数据库可用时，
+      按批导入溢出文件（每批一个事务），每批提交后把导入进度（文件偏移）记入文件名，导入完成后删除；
+      导入中断后从记录的进度继续，已提交的日志不会重复导入
+    - 导入时出现数据库不可用以外的错误（如读写溢出文件失败）时，文件移到 failed-*.log（文件名保留导入进度），
+      不再自动导入，需要人工处理
+    - 每个 worker 进程写自己的溢出文件（spill-<pid>.log）；导入前先重命名认领，
+      进程已退出的溢出文件由其他 worker 或重启后的进程导入，不会被重复导入
+    - stop() 写完队列中剩余的日志再退出（写库失败时写入溢出文件，下次启动时导入）
+    - run_exclusive(fn) 在写入线程中执行 fn(db)：之前提交的日志（队列、溢出缓冲区、本进程的溢出文件）全部入库后执行，
+      执行期间本进程不写入新的日志（用于需要和日志入库对齐的全量对账）
+
+    注意：只有写入线程访问数据库，不会和其他日志写入争抢 SQLite 写锁；溢出文件只由写入线程和溢出线程写入（用锁保护）
+    """
+
+    def __init__(self, batch_size: int, max_latency_ms: float, queue_size: int, spill_dir: str, spill_max_bytes: int):
+        self.batch_size = max(batch_size, 1)
+        self.max_latency = max(max_latency_ms, 0) / 1000
+        self.queue_size = max(queue_size, 1)
+        self.spill_dir = spill_dir
+        self.spill_max_bytes = spill_max_bytes  # 0 表示不限制
+        self._queue: queue.Queue = queue.Queue(maxsize=self.queue_size)
+        self._overflow: deque = deque()  # 队列已满时的溢出缓冲区（最多 queue_size 条，溢出线程写入溢出文件）
+        self._overflow_event = threading.Event()
+        self._drain_lock = threading.Lock()  # 溢出缓冲区取出到写入溢出文件之间持有（独占执行前等待写完）
+        self._spill_thread: Optional[threading.Thread] = None
+        self._stopping = False
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+        self._pid = 0
+        self._spill_path = ''
+        self._spill_lock = threading.Lock()
+        self._spill_file = None
+        self._spill_bytes = 0  # 本进程溢出文件的当前大小
+        self._db_down_until = 0.0
+        self._replay_seq = 0
+        self._replay_pending = False  # 有已认领、尚未导入完的溢出文件
+        self._replay_skipped = set()  # 导入失败且无法移走的文件，不再认领
+
+        # 统计信息
+        self._submitted = 0
+        self._written = 0
+        self._failed = 0
+        self._batches = 0
+        self._max_batch = 0
+        self._last_batch_ms = 0.0
+        self._overflowed = 0
+        self._spilled = 0
+        self._spill_dropped = 0
+        self._db_errors = 0
+        self._replayed = 0
+        self._replay_corrupt = 0
+        self._replay_failed = 0
+        self._last_replay_rows = 0
+        self._last_replay_rate = 0.0
+        self._last_replay_at = 0.0
+
+    # ==================== 启动与停止 ====================
+
+    def start(self):
+        """启动写入线程（已启动时忽略）；写入线程启动后先导入遗留的溢出文件"""
+        with self._lock:
+            if self._thread is not None:
+                return
+            os.makedirs(self.spill_dir, exist_ok=True)
+            # 在启动时取进程 ID（模块可能在 fork 出 worker 之前导入）
+            self._pid = os.getpid()
+            self._spill_path = os.path.join(self.spill_dir, f"spill-{self._pid}.log")
+            self._stopping = False
+            self._thread = threading.Thread(target=self._run, name="log-writer", daemon=True)
+            self._thread.start()
+            self._spill_thread = threading.Thread(target=self._run_spill, name="log-spill", daemon=True)
+            self._spill_thread.start()
+        logger.info(
+            f"请求日志写入线程已启动: batch_size={self.batch_size}, max_latency={self.max_latency * 1000:.0f}ms, "
+            f"queue_size={self.queue_size}, spill_dir={self.spill_dir}"
+        )
+
+    def stop(self, timeout: Optional[float] = None):
+        """写完队列中剩余的日志后停止写入线程"""
+        with self._lock:
+            thread = self._thread
+            if thread is None:
+                return
+        # 队列已满时等待写入线程腾出位置（停止信号不能丢）
+        self._queue.put(_STOP)
+        thread.join(timeout)
+        # 溢出线程写完溢出缓冲区后退出
+        self._stopping = True
+        self._overflow_event.set()
+        if self._spill_thread is not None:
+            self._spill_thread.join(timeout)
+        with self._lock:
+            self._thread = None
+            self._spill_thread = None
+        self._close_spill()
+        logger.info(f"请求日志写入线程已停止，累计写入 {self._written} 条，写入溢出文件 {self._spilled} 条")
+
+    # ==================== 提交与写入 ====================
+
+    def submit(self, log_data: dict):
+        """提交一条日志（立即返回；队列已满时写入溢出文件；写入线程未启动时先启动）"""
+        if self._thread is None:
+            self.start()
+        self._submitted += 1
+        log_data['create_time'] = log_data['update_time'] = datetime.now()
+        try:
+            self._queue.put_nowait(log_data)
+        except queue.Full:
+            self._overflowed += 1
+            if len(self._overflow) >= self.queue_size:
+                self._spill_dropped += 1
+                return
+            self._overflow.append(log_data)
+            if not self._overflow_event.is_set():
+                self._overflow_event.set()
+
+    def _run(self):
+        """写入线程：导入遗留的溢出文件 -> 凑批 -> 写入，收到停止信号时写完当前批次后退出"""
+        self._replay()
+
+        stopping = False
+        while not stopping:
+            try:
+                # 有待导入的溢出文件时定期醒来，没有新日志也能在数据库恢复后导入
+                item = self._queue.get(timeout=_REPLAY_CHECK_INTERVAL if self._has_spill() else None)
+            except queue.Empty:
+                self._maybe_replay()
+                continue
+            if item is _STOP:
+                break
+            if isinstance(item, _Barrier):
+                self._run_barrier(item)
+                continue
+
+            batch = [item]
+            barrier = None
+            deadline = time.monotonic() + self.max_latency
+            while len(batch) < self.batch_size:
+                try:
+                    # 队列中已有的日志直接取出，队列为空时最多等到 deadline
+                    item = self._queue.get(timeout=max(deadline - time.monotonic(), 0))
+                except queue.Empty:
+                    break
+                if item is _STOP:
+                    stopping = True
+                    break
+                if isinstance(item, _Barrier):
+                    barrier = item
+                    break
+                batch.append(item)
+
+            try:
+                self._write(batch)
+                if not stopping and barrier is None:
+                    self._maybe_replay()
+            except Exception as e:
+                logger.error(f"请求日志写入线程出错: {str(e)}")
+                logger.exception(e)
+            if barrier is not None:
+                self._run_barrier(barrier)
+
+        # 停止后才放入队列的独占执行请求不再执行
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if isinstance(item, _Barrier):
+                item.future.set_exception(RuntimeError("请求日志写入线程已停止"))
+
+    def run_exclusive(self, fn: Callable[[Any], Any]) -> Any:
+        """
+        在写入线程中执行 fn(db)，阻塞等待结果（不要在事件循环中调用）
+
+        调用之前提交的日志全部入库后才执行，执行期间本进程不写入新的日志；
+        数据库不可用、溢出文件没有导入完时抛出 RuntimeError，不执行 fn。写入线程未启动时直接执行
+        """
+        if self._thread is None:
+            db = SessionLocal()
+            try:
+                return fn(db)
+            finally:
+                db.close()
+        barrier = _Barrier(fn)
+        self._queue.put(barrier)
+        return barrier.future.result()
+
+    def _run_barrier(self, barrier: _Barrier):
+        """写完溢出缓冲区、导入溢出文件后执行独占执行请求"""
+        try:
+            self._drain_overflow()
+            if time.monotonic() >= self._db_down_until:
+                self._replay()
+            if time.monotonic() < self._db_down_until or self._replay_pending:
+                raise RuntimeError("数据库不可用，请求日志尚未全部入库")
+            db = SessionLocal()
+            try:
+                result = barrier.fn(db)
+            finally:
+                db.close()
+            barrier.future.set_result(result)
+        except Exception as e:
+            barrier.future.set_exception(e)
+
+    def _write(self, batch: List[dict]):
+        """写入一批日志（一个事务）；数据库不可用时写入溢出文件"""
+        if time.monotonic() < self._db_down_until:
+            self._spill(batch)
+            return
+
+        started = time.monotonic()
+        db = SessionLocal()
+        try:
+            consumed, error = self._insert(db, batch)
+        finally:
+            db.close()
+        if error is not None:
+            self._on_db_error(error, batch[consumed:])
+
+        self._batches += 1
+        self._max_batch = max(self._max_batch, len(batch))
+        self._last_batch_ms = (time.monotonic() - started) * 1000
+
+    def _insert(self, db, rows: List[dict]) -> Tuple[int, Optional[OperationalError]]:
+        """
+        插入一批日志（一个事务）；数据库不可用以外的错误逐条重试，只丢弃写不进去的那几条
+
+        Returns:
+            (已处理的条数（写入或丢弃），数据库不可用时的错误)
+        """
+        try:
+            request_log_service.create_logs_from_data(db, rows)
+            self._written += len(rows)
+            return len(rows), None
+        except OperationalError as e:
+            db.rollback()
+            return 0, e
+        except Exception as e:
+            db.rollback()
+            logger.error(f"批量写入请求日志失败（{len(rows)} 条），逐条重试: {_error_message(e)}")
+
+        for i, log_data in enumerate(rows):
+            try:
+                request_log_service.create_logs_from_data(db, [log_data])
+                self._written += 1
+            except OperationalError as e:
+                db.rollback()
+                return i, e
+            except Exception as e:
+                db.rollback()
+                self._failed += 1
+                logger.error(f"写入请求日志失败，丢弃: request_id={log_data.get('request_id')}, 错误: {_error_message(e)}")
+        return len(rows), None
+
+    def _on_db_error(self, e: Exception, rows: List[dict]):
+        """数据库不可用：日志写入溢出文件，_RETRY_INTERVAL 秒内不再尝试写库"""
+        self._db_errors += 1
+        self._db_down_until = time.monotonic() + _RETRY_INTERVAL
+        logger.error(f"数据库不可用，{len(rows)} 条请求日志写入溢出文件，{_RETRY_INTERVAL:.0f}秒后重试: {_error_message(e)}")
+        self._spill(rows)
+
+    # ==================== 溢出文件 ====================
+
+    def _run_spill(self):
+        """溢出线程：把溢出缓冲区中的日志追加到溢出文件，停止时写完剩余的再退出"""
+        while True:
+            self._overflow_event.wait()
+            self._overflow_event.clear()
+            try:
+                self._drain_overflow()
+            except Exception as e:
+                logger.error(f"请求日志溢出线程出错: {str(e)}")
+                logger.exception(e)
+            if self._stopping:
+                self._drain_overflow()
+                return
+
+    def _drain_overflow(self):
+        """把溢出缓冲区中的日志追加到溢出文件"""
+        with self._drain_lock:
+            rows = []
+            while True:
+                try:
+                    rows.append(self._overflow.popleft())
+                except IndexError:
+                    break
+            if rows:
+                self._spill(rows)
+
+    def _spill(self, rows: List[dict]):
+        """追加到本进程的溢出文件（超过 spill_max_bytes 时丢弃）"""
+        data = b''.join(_encode(log_data) for log_data in rows)
+        with self._spill_lock:
+            if self.spill_max_bytes and self._spill_bytes + len(data) > self.spill_max_bytes:
+                self._spill_dropped += len(rows)
+                logger.error(f"请求日志溢出文件已达上限（{self.spill_max_bytes} 字节），丢弃 {len(rows)} 条日志")
+                return
+            try:
+                if self._spill_file is None:
+                    self._spill_file = open(self._spill_path, 'ab')
+                    self._spill_bytes = self._spill_file.tell()
+                self._spill_file.write(data)
+                self._spill_file.flush()
+                self._spill_bytes += len(data)
+                self._spilled += len(rows)
+            except OSError as e:
+                self._spill_dropped += len(rows)
+                logger.error(f"写入请求日志溢出文件失败，丢弃 {len(rows)} 条日志: {str(e)}")
+
+    def _close_spill(self):
+        """关闭本进程的溢出文件（下一次溢出时重新创建）"""
+        with self._spill_lock:
+            if self._spill_file is not None:
+                self._spill_file.close()
+                self._spill_file = None
+            self._spill_bytes = 0
+
+    def _has_spill(self) -> bool:
+        return self._spill_bytes > 0 or self._replay_pending
+
+    def _maybe_replay(self):
+        """队列已经追上、数据库可用且有溢出文件时导入"""
+        if self._has_spill() and self._queue.qsize() < self.batch_size and time.monotonic() >= self._db_down_until:
+            self._replay()
+
+    def _claim_spill_files(self) -> List[str]:
+        """
+        认领需要导入的溢出文件（重命名为 replay-<本进程 pid>-<时间>-<序号>[-<导入进度>].log，重命名成功才算认领到）
+
+        - 本进程的溢出文件：先关闭，之后的溢出写入新文件
+        - 其他进程的溢出文件和导入中断的文件：只认领进程已退出的
+        """
+        claimed = []
+        for path in sorted(glob.glob(os.path.join(self.spill_dir, 'replay-*.log'))):
+            if path in self._replay_skipped:
+                continue
+            if _owner_pid(path) == self._pid:
+                claimed.append(path)
+            elif not _pid_alive(_owner_pid(path)):
+                claimed.extend(self._rename_claim(path))
+
+        for path in sorted(glob.glob(os.path.join(self.spill_dir, 'spill-*.log'))):
+            pid = _owner_pid(path)
+            if pid == self._pid:
+                with self._spill_lock:
+                    if self._spill_file is not None:
+                        self._spill_file.close()
+                        self._spill_file = None
+                    self._spill_bytes = 0
+                    claimed.extend(self._rename_claim(path))
+            elif not _pid_alive(pid):
+                claimed.extend(self._rename_claim(path))
+        return claimed
+
+    def _rename_claim(self, path: str) -> List[str]:
+        """重命名认领一个溢出文件（保留文件名中的导入进度）"""
+        self._replay_seq += 1
+        target = _replay_path(self.spill_dir, 'replay', f"{self._pid}-{int(time.time())}-{self._replay_seq}", _replay_offset(path))
+        try:
+            os.rename(path, target)
+            return [target]
+        except OSError:
+            # 已被其他进程认领
+            return []
+
+    def _replay(self):
+        """导入认领到的溢出文件；数据库不可用时保留剩余部分，稍后重试"""
+        try:
+            paths = self._claim_spill_files()
+        except OSError as e:
+            logger.error(f"读取请求日志溢出目录失败: {str(e)}")
+            return
+        if not paths:
+            return
+
+        started = time.monotonic()
+        imported = 0
+        self._replay_pending = True
+        db = SessionLocal()
+        try:
+            for path in paths:
+                count, db_down = self._replay_file(db, path)
+                imported += count
+                if db_down:
+                    return
+            self._replay_pending = False
+        finally:
+            db.close()
+            self._replayed += imported
+            if imported:
+                elapsed = time.monotonic() - started
+                self._last_replay_rows = imported
+                self._last_replay_rate = imported / elapsed if elapsed > 0 else 0.0
+                self._last_replay_at = time.time()
+                logger.info(f"已导入请求日志溢出文件: {imported} 条，耗时 {elapsed:.2f}秒")
+
+    def _replay_file(self, db, path: str) -> Tuple[int, bool]:
+        """
+        按批导入一个溢出文件（每批一个事务），从文件名中记录的导入进度开始；
+        每批提交后把新的进度记入文件名（重命名），导入完成后删除
+
+        Returns:
+            (导入的条数, 数据库是否不可用)
+        """
+        imported = 0
+        offset = _replay_offset(path)
+        try:
+            batches = self._read_batches(path, offset)
+            for batch, start, ends, end in batches:
+                consumed, error = self._insert(db, batch)
+                imported += consumed
+                self._batches += 1
+                self._max_batch = max(self._max_batch, len(batch))
+                if error is None:
+                    offset = end
+                else:
+                    offset = ends[consumed - 1] if consumed else start
+                path = self._checkpoint(path, offset)
+                if error is not None:
+                    # 数据库不可用：保留文件，稍后从记录的进度继续
+                    batches.close()
+                    self._db_errors += 1
+                    self._db_down_until = time.monotonic() + _RETRY_INTERVAL
+                    logger.error(f"导入请求日志溢出文件失败（数据库不可用），{_RETRY_INTERVAL:.0f}秒后重试: {_error_message(error)}")
+                    return imported, True
+            os.remove(path)
+        except Exception as e:
+            # 不是数据库不可用（如读写溢出文件失败）：重试多半还会失败，而且可能重复导入已提交的日志，移走等待人工处理
+            logger.error(f"导入请求日志溢出文件失败: {path}, 错误: {str(e)}")
+            logger.exception(e)
+            self._set_aside(path, offset)
+        return imported, False
+
+    def _checkpoint(self, path: str, offset: int) -> str:
+        """把导入进度记入文件名，返回新的文件名"""
+        target = _replay_path(self.spill_dir, 'replay', _replay_id(path), offset)
+        if target != path:
+            os.rename(path, target)
+        return target
+
+    def _set_aside(self, path: str, offset: int):
+        """导入失败的文件移到 failed-*.log（保留导入进度），不再自动导入；移不走时本进程不再认领"""
+        self._replay_failed += 1
+        target = _replay_path(self.spill_dir, 'failed', _replay_id(path), offset)
+        try:
+            os.rename(path, target)
+            logger.error(f"请求日志溢出文件已移到 {target}，从偏移 {offset} 起的日志尚未导入，需要人工处理")
+        except OSError as e:
+            self._replay_skipped.add(path)
+            logger.error(f"移动导入失败的请求日志溢出文件失败，不再导入: {path}（已导入到偏移 {offset}）, 错误: {str(e)}")
+
+    def _read_batches(self, path: str, offset: int = 0) -> Iterator[Tuple[List[dict], int, List[int], int]]:
+        """
+        从 offset 开始按 batch_size 读取溢出文件
+
+        Returns:
+            (日志列表, 这一批在文件中的起始偏移, 每条日志结束的文件偏移, 这一批结束的文件偏移)；
+            无法解析的记录跳过，末尾不完整的记录（写入中途崩溃）丢弃
+        """
+        batch, ends = [], []
+        start = offset
+        with open(path, 'rb') as f:
+            f.seek(offset)
+            while True:
+                header = f.read(_LENGTH.size)
+                if len(header) < _LENGTH.size:
+                    if header:
+                        self._replay_corrupt += 1
+                    break
+                length = _LENGTH.unpack(header)[0]
+                payload = f.read(length)
+                if len(payload) < length:
+                    self._replay_corrupt += 1
+                    break
+                try:
+                    batch.append(_decode(payload))
+                    ends.append(f.tell())
+                except (ValueError, ArithmeticError):
+                    self._replay_corrupt += 1
+                if len(batch) >= self.batch_size:
+                    yield batch, start, ends, f.tell()
+                    start = f.tell()
+                    batch, ends = [], []
+            if batch:
+                yield batch, start, ends, f.tell()
+
+    # ==================== 统计 ====================
+
+    def get_stats(self) -> dict:
+        """获取写入统计信息"""
+        try:
+            spill_files = glob.glob(os.path.join(self.spill_dir, 'spill-*.log')) + glob.glob(os.path.join(self.spill_dir, 'replay-*.log'))
+            spill_bytes = sum(os.path.getsize(path) for path in spill_files)
+            failed_files = glob.glob(os.path.join(self.spill_dir, 'failed-*.log'))
+        except OSError:
+            spill_files, spill_bytes, failed_files = [], 0, []
+
+        return {
+            'running': self._thread is not None,
+            'batch_size': self.batch_size,
+            'max_latency_ms': self.max_latency * 1000,
+            'queue_size': self.queue_size,
+            'queued': self._queue.qsize(),
+            'submitted': self._submitted,
+            'written': self._written,
+            'failed': self._failed,
+            'batches': self._batches,
+            'avg_batch': round(self._written / self._batches, 1) if self._batches else 0,
+            'max_batch': self._max_batch,
+            'last_batch_ms': round(self._last_batch_ms, 2),
+            'db_available': time.monotonic() >= self._db_down_until,
+            'db_errors': self._db_errors,
+            'overflowed': self._overflowed,
+            'overflow_buffered': len(self._overflow),
+            'spilled': self._spilled,
+            'spill_dropped': self._spill_dropped,
+            'spill_files': len(spill_files),
+            'spill_bytes': spill_bytes,
+            'replayed': self._replayed,
+            'replay_corrupt': self._replay_corrupt,
+            'replay_failed': self._replay_failed,
+            'failed_files': len(failed_files),
+            'last_replay_rows': self._last_replay_rows,
+            'last_replay_rate': round(self._last_replay_rate, 1),
+            'last_replay_at': self._last_replay_at or None,
+        }
+
+
+def _encode(log_data: dict) -> bytes:
+    """编码一条溢出文件记录（长度前缀 + JSON）"""
+    payload = json.dumps(log_data, ensure_ascii=False, default=str).encode('utf-8')
+    return _LENGTH.pack(len(payload)) + payload
+
+
+def _decode(payload: bytes) -> dict:
+    """解析溢出文件中的一条记录（JSON 无法表示的 Decimal / datetime 字段按字符串写入，这里还原）"""
+    log_data = json.loads(payload.decode('utf-8'))
+    if not isinstance(log_data, dict):
+        raise ValueError("溢出文件记录不是 JSON 对象")
+    for field in _DECIMAL_FIELDS:
+        if isinstance(log_data.get(field), str):
+            log_data[field] = Decimal(log_data[field])
+    for field in _DATETIME_FIELDS:
+        if isinstance(log_data.get(field), str):
+            log_data[field] = datetime.fromisoformat(log_data[field])
+    return log_data
+
+
+def _error_message(e: Exception) -> str:
+    """数据库错误只取驱动的错误信息（SQLAlchemy 的错误信息包含整批参数）"""
+    return str(getattr(e, 'orig', None) or e)
+
+
+def _replay_id(path: str) -> str:
+    """导入中的溢出文件名中的 <pid>-<时间>-<序号>"""
+    return '-'.join(os.path.basename(path)[:-len('.log')].split('-')[1:4])
+
+
+def _replay_offset(path: str) -> int:
+    """导入中的溢出文件名中记录的导入进度（文件偏移），没有记录时为 0"""
+    parts = os.path.basename(path)[:-len('.log')].split('-')
+    try:
+        return int(parts[4]) if parts[0] == 'replay' and len(parts) > 4 else 0
+    except ValueError:
+        return 0
+
+
+def _replay_path(spill_dir: str, prefix: str, replay_id: str, offset: int) -> str:
+    """<prefix>-<pid>-<时间>-<序号>[-<导入进度>].log"""
+    name = f"{prefix}-{replay_id}-{offset}.log" if offset else f"{prefix}-{replay_id}.log"
+    return os.path.join(spill_dir, name)
+
+
+def _owner_pid(path: str) -> int:
+    """溢出文件名中的进程 ID（spill-<pid>.log / replay-<pid>-...log / failed-<pid>-...log）"""
+    try:
+        return int(os.path.basename(path).split('-')[1].split('.')[0])
+    except (IndexError, ValueError):
+        return 0
+
+
+def _pid_alive(pid: int) -> bool:
+    if pid <= 0:
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except (PermissionError, OSError):
+        return True
+    return True
+
+
+# 全局日志写入器实例
+_writer = RequestLogWriter(
+    batch_size=settings.LOG_BATCH_SIZE,
+    max_latency_ms=settings.LOG_BATCH_LATENCY_MS,
+    queue_size=settings.LOG_QUEUE_SIZE,
+    spill_dir=os.path.join(settings.DATABASE_DIR, "log_spill"),
+    spill_max_bytes=int(settings.LOG_SPILL_MAX_MB * 1024 * 1024),
+)
+
+
+def start():
+    """启动写入线程（在应用启动时调用）"""
+    _writer.start()
+
+
+def stop():
+    """写完剩余日志后停止写入线程（在应用关闭时调用）"""
+    _writer.stop()
+
+
+def submit(log_data: dict):
+    """提交一条请求日志（不阻塞）"""
+    _writer.submit(log_data)
+
+
+def run_exclusive(fn: Callable[[Any], Any]) -> Any:
+    """之前提交的日志全部入库后，在写入线程中执行 fn(db)（阻塞，在线程中调用）"""
+    return _writer.run_exclusive(fn)
+
+
+def get_stats() -> dict:
+    """获取写入统计信息"""
+    return _writer.get_stats()
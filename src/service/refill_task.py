@@ -0,0 +1,236 @@
+"""Key 池补充任务 - 后台异步把缓存补充到目标数量，请求路径不再查询数据库"""
+
+import asyncio
+import math
+import time
+from typing import Optional
+
+from configs.config import settings
+from entity.databases.database import SessionLocal
+from service import key_event_service
+from service.databases import key_service
+from utils.logger import logger
+
+
+class KeyPoolRefiller:
+    """
+    Key 池补充任务类
+    
+    - 高水位：全局配置的 key_pool_size（补充的目标数量）
+    - 低水位：高水位 × KEY_POOL_LOW_WATERMARK（向上取整，至少为 1）
+    - Key 被移出缓存（如自动禁用）时触发：低于低水位才补充，避免每移除一个 Key 都查一次库
+    - 定时触发（KEY_REFILL_INTERVAL）：低于高水位就补充
+    - 订阅 Key 变更事件：Key 不再可用时触发检查；新建 / 重新启用的 Key 在缓存未满时直接加入，不查库
+    - 查询使用 ID 游标分页（id > cursor），从上次停下的位置继续，扫到末尾后回到开头
+    """
+    
+    def __init__(self, interval_seconds: float, low_watermark: float, batch_size: int = 200):
+        """
+        初始化补充任务
+        
+        Args:
+            interval_seconds: 定时检查间隔（秒）
+            low_watermark: 低水位比例（相对 key_pool_size）
+            batch_size: 每次查询的最大行数
+        """
+        self.interval_seconds = interval_seconds
+        self.low_watermark = low_watermark
+        self.batch_size = batch_size
+        self._task: Optional[asyncio.Task] = None
+        self._running = False
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._event: Optional[asyncio.Event] = None
+        self._cursor = 0
+        
+        # 统计信息
+        self._triggers = 0
+        self._event_adds = 0
+        self._refills = 0
+        self._loaded = 0
+        self._last_refill_at: Optional[float] = None
+        self._last_refill_ms = 0
+    
+    async def start(self):
+        """启动补充任务（先同步补充一次，保证第一个请求就有可用的 Key）"""
+        if self._running:
+            logger.warning("Key 池补充任务已经在运行中")
+            return
+        
+        self._loop = asyncio.get_running_loop()
+        self._event = asyncio.Event()
+        self._running = True
+        key_event_service.subscribe(self._on_key_event)
+        await self.refill(top_up=True)
+        self._task = asyncio.create_task(self._run_loop())
+        logger.info(f"Key 池补充任务已启动，定时间隔: {self.interval_seconds}秒，低水位: {self.low_watermark}")
+    
+    async def stop(self):
+        """停止补充任务"""
+        if not self._running:
+            return
+        
+        self._running = False
+        key_event_service.unsubscribe(self._on_key_event)
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        
+        logger.info("Key 池补充任务已停止")
+    
+    def trigger(self):
+        """触发一次检查（线程安全，可以在日志线程等非事件循环线程中调用）"""
+        if not self._running or self._loop is None:
+            return
+        self._triggers += 1
+        try:
+            self._loop.call_soon_threadsafe(self._event.set)
+        except RuntimeError:
+            # 事件循环已关闭
+            pass
+    
+    def _on_key_event(self, event: key_event_service.KeyEvent):
+        """Key 变更事件（可能在任意线程中调用）"""
+        if event.record is None:
+            self.trigger()
+            return
+        if key_service.is_key_cached(event.key_id):
+            return
+        _, high = self._watermarks()
+        if key_service.get_cached_key_count() < high:
+            key_service.add_key_to_cache(event.record)
+            self._event_adds += 1
+    
+    async def _run_loop(self):
+        """任务循环：等待触发或定时唤醒"""
+        while self._running:
+            try:
+                try:
+                    await asyncio.wait_for(self._event.wait(), timeout=self.interval_seconds)
+                    triggered = True
+                except asyncio.TimeoutError:
+                    triggered = False
+                self._event.clear()
+                
+                await self.refill(top_up=not triggered)
+            
+            except asyncio.CancelledError:
+                break
+            except Exception as e:
+                logger.error(f"Key 池补充失败: {str(e)}")
+                logger.exception(e)
+                # 出错后等待一段时间再重试
+                await asyncio.sleep(5)
+    
+    def _watermarks(self):
+        from configs.global_config import global_config
+        
+        high = global_config.key_pool_size
+        low = max(math.ceil(high * self.low_watermark), 1)
+        return low, high
+    
+    async def refill(self, top_up: bool = True) -> int:
+        """
+        检查并补充缓存
+        
+        Args:
+            top_up: True 时低于高水位就补充；False 时只在低于低水位时补充
+        
+        Returns:
+            新加入缓存的 Key 数量
+        """
+        low, high = self._watermarks()
+        size = key_service.get_cached_key_count()
+        if size >= high or (not top_up and size >= low):
+            return 0
+        
+        needed = high - size
+        started = time.monotonic()
+        added = await asyncio.to_thread(self._load, needed)
+        
+        self._refills += 1
+        self._loaded += added
+        self._last_refill_at = time.time()
+        self._last_refill_ms = int((time.monotonic() - started) * 1000)
+        logger.info(f"Key 池补充完成: 需要 {needed} 个，补充 {added} 个，当前 {key_service.get_cached_key_count()} 个")
+        return added
+    
+    def _load(self, needed: int) -> int:
+        """从数据库加载可用 Key 加入缓存（在线程中执行，使用独立的数据库 session）"""
+        db = SessionLocal()
+        try:
+            added = 0
+            wrapped = self._cursor == 0
+            while added < needed:
+                keys = key_service.get_available_keys_after(db, self._cursor, self.batch_size)
+                new_keys = []
+                for key in keys:
+                    self._cursor = key.id
+                    if key_service.is_key_cached(key.id):
+                        continue
+                    new_keys.append(key)
+                    if added + len(new_keys) >= needed:
+                        break
+                # 每批只发布一次缓存快照
+                key_service.add_keys_to_cache(new_keys)
+                added += len(new_keys)
+                
+                if len(keys) < self.batch_size and added < needed:
+                    # 扫到末尾：从头再扫一遍（已经从头扫过则说明没有更多可用 Key）
+                    self._cursor = 0
+                    if wrapped:
+                        break
+                    wrapped = True
+            return added
+        finally:
+            db.close()
+    
+    def get_stats(self) -> dict:
+        """获取补充任务统计信息"""
+        low, high = self._watermarks()
+        return {
+            'running': self._running,
+            'cached': key_service.get_cached_key_count(),
+            'low_watermark': low,
+            'high_watermark': high,
+            'interval_seconds': self.interval_seconds,
+            'cursor': self._cursor,
+            'triggers': self._triggers,
+            'event_adds': self._event_adds,
+            'refills': self._refills,
+            'loaded': self._loaded,
+            'last_refill_at': self._last_refill_at,
+            'last_refill_ms': self._last_refill_ms,
+        }
+
+
+# 全局单例
+_refiller: Optional[KeyPoolRefiller] = None
+
+
+def get_refiller() -> KeyPoolRefiller:
+    """获取全局 Key 池补充任务实例"""
+    global _refiller
+    if _refiller is None:
+        _refiller = KeyPoolRefiller(
+            interval_seconds=settings.KEY_REFILL_INTERVAL,
+            low_watermark=settings.KEY_POOL_LOW_WATERMARK,
+        )
+    return _refiller
+
+
+async def start_refill_task():
+    """启动 Key 池补充任务（在应用启动时调用）"""
+    await get_refiller().start()
+
+
+async def stop_refill_task():
+    """停止 Key 池补充任务（在应用关闭时调用）"""
+    await get_refiller().stop()
+
+
+def trigger_refill():
+    """触发一次 Key 池检查（线程安全）"""
+    get_refiller().trigger()
@@ -0,0 +1,197 @@
+"""Key 余额预留服务 - 选中 Key 时按预估花费预留余额，请求结束时释放；可用余额不够预估花费的 Key 选 Key 时跳过"""
+
+import bisect
+from typing import Dict, Optional, Set, Tuple
+
+from configs.config import settings
+from entity.context import KeyRecord
+from service import cache_service, spend_ledger_task
+
+
+# 每个模型平均花费 / 平均输出 token 数的 EWMA 系数（新样本的权重）
+_EWMA_ALPHA = 0.2
+
+
+class BalanceReservations:
+    """
+    Key 余额预留账本
+
+    - 预估花费：按模型统计最近计费成功请求的平均花费和平均输出 token 数（EWMA）；
+      请求的 max_tokens 小于平均输出 token 数时按比例缩小；模型还没有样本时使用 default_cost
+    - reserve: 选中 Key 时预留预估花费；release: 请求（或某次尝试）结束时释放
+    - 可用余额 = 缓存中的余额 - 花费账本中尚未写入的花费 - 已预留的花费；
+      请求结束时先记录日志（实际花费 usage.credits 计入花费账本）再释放预留，实际花费始终计入可用余额
+    - 选 Key 时跳过可用余额不够本请求预估花费的 Key，全部不够时只跳过可用余额已耗尽的 Key；
+      在缓存的余额索引（写入缓存时增量维护，按余额升序）中二分查找，
+      只检查余额低于 预估花费 + 最大待写入花费 + 最大预留 的 Key，不需要每次遍历或排序整个 Key 池
+    - 不限额度（余额为空）的 Key 不预留
+
+    注意：只在事件循环线程中使用，不需要加锁；预留只在本进程内生效，每个 worker 各自预留
+    """
+
+    def __init__(self, enabled: bool, default_cost: float):
+        self.enabled = enabled
+        self.default_cost = default_cost
+
+        self._reserved: Dict[int, float] = {}  # key_id -> 已预留的花费
+        self._counts: Dict[int, int] = {}  # key_id -> 预留中的请求数（归零时删除，避免浮点残差）
+        self._models: Dict[str, list] = {}  # model -> [平均花费, 平均输出 token 数, 样本数]
+
+        # 统计信息
+        self._reservations = 0
+        self._short_selections = 0
+        self._fallbacks = 0
+
+    # ==================== 预估花费 ====================
+
+    def estimate(self, model: str, max_tokens: Optional[int]) -> float:
+        """预估一次请求的花费"""
+        if not self.enabled:
+            return 0.0
+        stats = self._models.get(model)
+        if stats is None:
+            return self.default_cost
+        avg_cost, avg_output, _ = stats
+        if max_tokens and avg_output > max_tokens:
+            return avg_cost * max_tokens / avg_output
+        return avg_cost
+
+    def record_cost(self, model: str, cost: float, output_tokens: int):
+        """记录一次计费成功请求的实际花费"""
+        stats = self._models.get(model)
+        if stats is None:
+            self._models[model] = [cost, float(output_tokens), 1]
+            return
+        stats[0] += _EWMA_ALPHA * (cost - stats[0])
+        stats[1] += _EWMA_ALPHA * (output_tokens - stats[1])
+        stats[2] += 1
+
+    # ==================== 预留与释放 ====================
+
+    def short_key_ids(self, cost: float) -> Tuple[Set[int], Set[int]]:
+        """
+        可用余额不足的 Key
+
+        Args:
+            cost: 本请求的预估花费
+
+        Returns:
+            (可用余额不够 cost 的 Key ID, 其中可用余额已耗尽的 Key ID)
+        """
+        short: Set[int] = set()
+        exhausted: Set[int] = set()
+        if not self.enabled:
+            return short, exhausted
+
+        # 余额不低于上界的 Key，扣除待写入花费和预留后仍然够 cost，不需要检查
+        funded = cache_service.get_funded_keys()
+        ledger = spend_ledger_task.get_ledger()
+        bound = cost + ledger.max_unflushed() + max(self._reserved.values(), default=0.0)
+        for i in range(bisect.bisect_left(funded, (bound,))):
+            balance, key_id = funded[i]
+            available = balance - ledger.unflushed(key_id) - self._reserved.get(key_id, 0.0)
+            if available >= cost:
+                continue
+            short.add(key_id)
+            if available <= 0:
+                exhausted.add(key_id)
+
+        if short:
+            self._short_selections += 1
+        return short, exhausted
+
+    def reserve(self, key: KeyRecord, cost: float) -> float:
+        """
+        为选中的 Key 预留花费
+
+        Returns:
+            实际预留的花费（不限额度的 Key 不预留，返回 0）
+        """
+        if not self.enabled or key.balance is None or cost <= 0:
+            return 0.0
+        self._reserved[key.id] = self._reserved.get(key.id, 0.0) + cost
+        self._counts[key.id] = self._counts.get(key.id, 0) + 1
+        self._reservations += 1
+        return cost
+
+    def release(self, key_id: int, cost: float):
+        """释放预留的花费"""
+        if cost <= 0 or key_id not in self._counts:
+            return
+        count = self._counts[key_id] - 1
+        if count > 0:
+            self._counts[key_id] = count
+            self._reserved[key_id] -= cost
+        else:
+            self._counts.pop(key_id, None)
+            self._reserved.pop(key_id, None)
+
+    def record_fallback(self):
+        self._fallbacks += 1
+
+    # ==================== 统计 ====================
+
+    def get_stats(self) -> dict:
+        """获取预留统计信息"""
+        keys = [
+            {'key_id': key_id, 'reserved': round(amount, 6), 'requests': self._counts.get(key_id, 0)}
+            for key_id, amount in sorted(self._reserved.items(), key=lambda item: -item[1])
+        ]
+        models = [
+            {'model': model, 'avg_cost': round(stats[0], 6), 'avg_output_tokens': round(stats[1], 1), 'samples': stats[2]}
+            for model, stats in sorted(self._models.items())
+        ]
+        return {
+            'enabled': self.enabled,
+            'default_cost': self.default_cost,
+            'total_reserved': round(sum(self._reserved.values()), 6),
+            'reservations': self._reservations,
+            'short_selections': self._short_selections,
+            'fallbacks': self._fallbacks,
+            'keys': keys,
+            'models': models,
+        }
+
+
+# 全局预留账本实例
+_reservations = BalanceReservations(
+    enabled=settings.KEY_RESERVATION_ENABLED,
+    default_cost=settings.KEY_RESERVE_DEFAULT_COST,
+)
+
+
+def estimate(model: str, max_tokens: Optional[int]) -> float:
+    """预估一次请求的花费"""
+    return _reservations.estimate(model, max_tokens)
+
+
+def record_cost(model: str, cost, output_tokens):
+    """记录一次计费成功请求的实际花费（用于预估同一模型后续请求的花费）"""
+    if not model or not cost:
+        return
+    _reservations.record_cost(model, float(cost), int(output_tokens or 0))
+
+
+def short_key_ids(cost: float) -> Tuple[Set[int], Set[int]]:
+    """缓存中可用余额不够 cost 的 Key ID，以及其中可用余额已耗尽的 Key ID"""
+    return _reservations.short_key_ids(cost)
+
+
+def reserve(key: KeyRecord, cost: float) -> float:
+    """为选中的 Key 预留花费，返回实际预留的花费"""
+    return _reservations.reserve(key, cost)
+
+
+def release(key_id: int, cost: float):
+    """释放预留的花费"""
+    _reservations.release(key_id, cost)
+
+
+def record_fallback():
+    """记录一次可用余额全部不够预估花费、退而选择余额未耗尽的 Key"""
+    _reservations.record_fallback()
+
+
+def get_stats() -> dict:
+    """获取预留统计信息"""
+    return _reservations.get_stats()
@@ -0,0 +1,184 @@
+"""请求调度服务 - 全局并发上限 + 有界等待队列 + 过载时快速拒绝（429 + Retry-After）"""
+
+import asyncio
+import math
+import time
+from collections import deque
+
+from configs.config import settings
+from entity.context import RequestContext
+from utils.logger import logger
+
+
+# 保留的最近排队耗时样本数（用于计算分位数）
+_WAIT_SAMPLE_SIZE = 1000
+
+# 请求占用时长 EWMA 的平滑系数
+_HOLD_EWMA_ALPHA = 0.1
+
+
+class RequestScheduler:
+    """
+    全局请求调度器
+
+    - 进行中的请求数不超过 max_concurrency（0 表示不限制）
+    - 超出时按先后顺序排队，队列长度不超过 queue_size，每个请求最多排队 queue_timeout 秒
+    - 队列已满或排队超时时直接拒绝，并根据平均请求耗时估算 Retry-After
+    - 请求结束时名额直接转交给队首的等待者，避免被新请求插队
+
+    注意：只在事件循环线程中使用，不需要加锁
+    """
+
+    def __init__(self, max_concurrency: int, queue_size: int, queue_timeout: float):
+        self.max_concurrency = max_concurrency
+        self.queue_size = queue_size
+        self.queue_timeout = queue_timeout
+
+        self._active = 0
+        self._waiters: deque = deque()
+        self._wait_times: deque = deque(maxlen=_WAIT_SAMPLE_SIZE)
+        self._avg_hold = 0.0
+
+        # 统计信息
+        self._admitted = 0
+        self._queued = 0
+        self._shed_queue_full = 0
+        self._shed_timeout = 0
+
+    # ==================== 准入与释放 ====================
+
+    async def admit(self, context: RequestContext) -> bool:
+        """
+        申请执行名额
+
+        Returns:
+            是否准入；拒绝时在 context.error / context.retry_after 中设置原因和建议重试时间
+        """
+        start = time.monotonic()
+
+        if self.max_concurrency <= 0 or (self._active < self.max_concurrency and not self._waiters):
+            self._active += 1
+            self._grant(context, start)
+            return True
+
+        if len(self._waiters) >= self.queue_size:
+            self._shed_queue_full += 1
+            self._shed(context, "Server is overloaded, request queue is full")
+            return False
+
+        future = asyncio.get_running_loop().create_future()
+        self._waiters.append(future)
+        self._queued += 1
+        try:
+            # 名额由 _release_slot 直接转交（active 不变）
+            await asyncio.wait_for(future, timeout=self.queue_timeout)
+        except asyncio.TimeoutError:
+            self._shed_timeout += 1
+            self._shed(context, f"Server is overloaded, request waited more than {self.queue_timeout}s in queue")
+            return False
+        except asyncio.CancelledError:
+            # 客户端断开：名额已经转交给本请求时，继续转交给下一个
+            if future.done() and not future.cancelled():
+                self._release_slot()
+            raise
+        finally:
+            try:
+                self._waiters.remove(future)
+            except ValueError:
+                pass
+
+        self._grant(context, start)
+        return True
+
+    def release(self, context: RequestContext):
+        """释放执行名额（幂等，未准入或已释放时不做任何事）"""
+        if not context.scheduler_admitted:
+            return
+        context.scheduler_admitted = False
+
+        hold = time.monotonic() - context.scheduler_admit_time
+        self._avg_hold = hold if self._avg_hold == 0 else (
+            _HOLD_EWMA_ALPHA * hold + (1 - _HOLD_EWMA_ALPHA) * self._avg_hold
+        )
+        self._release_slot()
+
+    def _grant(self, context: RequestContext, start: float):
+        now = time.monotonic()
+        context.scheduler_admitted = True
+        context.scheduler_admit_time = now
+        self._admitted += 1
+        self._wait_times.append(now - start)
+
+    def _release_slot(self):
+        """名额转交给队首的等待者，没有等待者时归还"""
+        while self._waiters:
+            future = self._waiters.popleft()
+            if not future.done():
+                future.set_result(True)
+                return
+        self._active = max(self._active - 1, 0)
+
+    def _shed(self, context: RequestContext, message: str):
+        """拒绝请求，估算 Retry-After（当前队列按平均请求耗时排空所需的时间）"""
+        context.error = message
+        context.retry_after = self._estimate_retry_after()
+        logger.warning(f"请求被拒绝（过载）: request_id={context.request_id}, retry_after={context.retry_after}s, {message}")
+
+    def _estimate_retry_after(self) -> int:
+        if self.max_concurrency <= 0 or self._avg_hold <= 0:
+            return 1
+        seconds = self._avg_hold * (len(self._waiters) + 1) / self.max_concurrency
+        return min(max(math.ceil(seconds), 1), 60)
+
+    # ==================== 统计 ====================
+
+    def get_stats(self) -> dict:
+        """获取调度统计信息"""
+        waits = sorted(self._wait_times)
+
+        def percentile(p: float) -> int:
+            if not waits:
+                return 0
+            return int(waits[min(int(len(waits) * p / 100), len(waits) - 1)] * 1000)
+
+        return {
+            'max_concurrency': self.max_concurrency,
+            'active': self._active,
+            'queue_depth': len(self._waiters),
+            'queue_size': self.queue_size,
+            'queue_timeout': self.queue_timeout,
+            'admitted': self._admitted,
+            'queued': self._queued,
+            'shed_queue_full': self._shed_queue_full,
+            'shed_timeout': self._shed_timeout,
+            'wait_ms_avg': int(sum(waits) / len(waits) * 1000) if waits else 0,
+            'wait_ms_p50': percentile(50),
+            'wait_ms_p95': percentile(95),
+            'wait_ms_p99': percentile(99),
+            'wait_ms_max': int(waits[-1] * 1000) if waits else 0,
+            'avg_hold_ms': int(self._avg_hold * 1000),
+            'retry_after': self._estimate_retry_after(),
+        }
+
+
+# 全局调度器实例
+_scheduler = RequestScheduler(
+    max_concurrency=settings.SCHEDULER_MAX_CONCURRENCY,
+    queue_size=settings.SCHEDULER_QUEUE_SIZE,
+    queue_timeout=settings.SCHEDULER_QUEUE_TIMEOUT,
+)
+
+
+async def admit(context: RequestContext) -> bool:
+    """申请执行名额（可能排队等待）"""
+    return await _scheduler.admit(context)
+
+
+def release(context: RequestContext):
+    """释放执行名额（幂等）"""
+    _scheduler.release(context)
+
+
+def get_stats() -> dict:
+    """获取调度统计信息"""
+    return _scheduler.get_stats()
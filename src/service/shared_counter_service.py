@@ -0,0 +1,476 @@
+"""跨进程 Key 计数服务 - 多个 worker 进程通过共享内存读写每个 Key 的进行中请求数、请求数、错误数和花费"""
+
+import hashlib
+import os
+import struct
+import threading
+import time
+from typing import Dict, List, Optional
+
+from configs.config import settings
+from entity.context import RequestContext
+from utils.logger import logger
+
+try:
+    import fcntl
+except ImportError:  # Windows：没有文件锁，认领 worker 分区时退化为写后校验
+    fcntl = None
+
+
+# 共享内存布局版本（布局变化时修改，不兼容的旧内存段不会被复用）
+_MAGIC = 0x5347504F4F4C0002
+
+# 头部：magic、worker 分区数、每个分区的槽位数
+_HEADER = struct.Struct('<qqq')
+
+# worker 表：每个分区一项 (pid, 心跳毫秒时间戳)
+_WORKER = struct.Struct('<qq')
+
+# 槽位：key_id、进行中请求数、累计请求数、累计错误数、累计花费（百万分之一美元）、最后更新毫秒时间戳
+_SLOT = struct.Struct('<qqqqqq')
+_FIELD_INFLIGHT = 8
+_FIELD_REQUESTS = 16
+_FIELD_ERRORS = 24
+_FIELD_SPEND = 32
+_FIELD_UPDATED = 40
+
+_INT64 = struct.Struct('<q')
+
+# 槽位 key_id 的特殊值：0 为从未使用（查找到此结束），-1 为已回收（查找继续，插入时可复用）
+_EMPTY = 0
+_TOMBSTONE = -1
+
+# 最长探测长度：查找 / 插入最多检查这么多个槽位（分区接近写满时不会扫描整个分区）
+_MAX_PROBE = 64
+
+# 槽位空闲多久（没有进行中请求且没有更新）后可以回收（毫秒），以及回收扫描的间隔
+_SLOT_IDLE_MS = 600_000
+_RECLAIM_INTERVAL_MS = 60_000
+
+# worker 心跳超时（毫秒），超时且进程不存在的分区可以被新 worker 认领
+_WORKER_STALE_MS = 30_000
+
+# 存活分区列表的缓存时间（毫秒）
+_LIVE_CACHE_MS = 1000
+
+
+class SharedKeyCounters:
+    """
+    共享内存 Key 计数表
+
+    布局：头部 + worker 表 + max_workers 个分区，每个分区 capacity 个固定大小的槽位
+    - 每个 worker 进程认领一个分区，只写自己的分区（单写者，不需要跨进程锁）；读取时汇总所有存活 worker 的分区
+    - 分区内按 key_id 哈希开放寻址（线性探测，最多探测 _MAX_PROBE 个槽位），所有分区使用同一个探测序列，读者不需要索引即可查找
+    - 每个字段是 8 字节对齐的 int64，单次 pack_into 写入，读者不会读到半个值
+    - 进程内的写入用线程锁保护（日志线程和事件循环可能同时写同一个槽位）
+    - 槽位回收：没有进行中请求且 _SLOT_IDLE_MS 内没有更新的槽位（已耗尽、已删除的 Key）定期标记为已回收（墓碑），
+      插入新 Key 时复用；探测范围内没有空槽位时直接复用其中空闲的槽位，仍然没有时该 Key 不计数
+
+    计数是累计值（进行中请求数除外），需要速率时由读者按时间差计算
+    """
+
+    def __init__(self, name: str, max_workers: int, capacity: int):
+        self.name = name
+        self.max_workers = max_workers
+        self.capacity = capacity
+        self._workers_offset = _HEADER.size
+        self._slots_offset = self._workers_offset + _WORKER.size * max_workers
+        self._partition_size = _SLOT.size * capacity
+        self.size = self._slots_offset + self._partition_size * max_workers
+
+        self._shm = None
+        self._buf: Optional[memoryview] = None
+        self._partition = -1
+        self._base = 0
+        self._index: Dict[int, int] = {}  # 本分区 key_id -> 槽位偏移
+        self._lock = threading.Lock()
+        self._full_warned = False
+        self._next_reclaim = 0
+        self._reclaimed = 0
+        self._live: List[int] = []
+        self._live_expires = 0
+
+    # ==================== 打开与认领 ====================
+
+    def open(self) -> bool:
+        """创建或连接共享内存，并认领一个 worker 分区"""
+        from multiprocessing import shared_memory
+
+        created = False
+        try:
+            shm = shared_memory.SharedMemory(name=self.name, create=True, size=self.size)
+            created = True
+        except FileExistsError:
+            shm = shared_memory.SharedMemory(name=self.name)
+        _untrack(shm)
+
+        if shm.size < self.size:
+            logger.warning(f"共享计数内存段大小不匹配（{shm.size} < {self.size}），跨进程计数已禁用，请重启所有 worker")
+            shm.close()
+            return False
+
+        buf = shm.buf
+        if created:
+            _HEADER.pack_into(buf, 0, _MAGIC, self.max_workers, self.capacity)
+        else:
+            # 创建者可能还没写入头部
+            for _ in range(50):
+                if _HEADER.unpack_from(buf, 0)[0] == _MAGIC:
+                    break
+                time.sleep(0.01)
+            if _HEADER.unpack_from(buf, 0) != (_MAGIC, self.max_workers, self.capacity):
+                logger.warning("共享计数内存段布局不匹配，跨进程计数已禁用，请重启所有 worker")
+                shm.close()
+                return False
+
+        self._shm = shm
+        self._buf = buf
+        self._partition = self._claim_partition()
+        if self._partition < 0:
+            logger.warning(f"共享计数没有空闲的 worker 分区（最多 {self.max_workers} 个），跨进程计数已禁用")
+            self.close()
+            return False
+
+        self._base = self._slots_offset + self._partition * self._partition_size
+        logger.info(f"共享计数已启用: {self.name}, 分区 {self._partition}/{self.max_workers}, 容量 {self.capacity}")
+        return True
+
+    def _claim_partition(self) -> int:
+        """认领一个空闲（或所属进程已退出）的分区，认领后清零该分区"""
+        lock_file = None
+        if fcntl is not None:
+            lock_file = open(os.path.join(settings.DATABASE_DIR, f".{self.name}.lock"), 'w')
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            pid = os.getpid()
+            now = _now_ms()
+            for partition in range(self.max_workers):
+                offset = self._workers_offset + partition * _WORKER.size
+                owner, heartbeat = _WORKER.unpack_from(self._buf, offset)
+                if owner and owner != pid and (now - heartbeat < _WORKER_STALE_MS or _pid_alive(owner)):
+                    continue
+
+                base = self._slots_offset + partition * self._partition_size
+                self._buf[base:base + self._partition_size] = bytes(self._partition_size)
+                _WORKER.pack_into(self._buf, offset, pid, now)
+                if lock_file is None:
+                    # 没有文件锁：写入后稍等再确认没有被其他进程覆盖
+                    time.sleep(0.05)
+                    if _WORKER.unpack_from(self._buf, offset)[0] != pid:
+                        continue
+                return partition
+            return -1
+        finally:
+            if lock_file is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+                lock_file.close()
+
+    def close(self):
+        """释放分区并断开共享内存（不删除内存段，其他 worker 仍在使用）"""
+        if self._buf is None:
+            return
+        if self._partition >= 0:
+            _WORKER.pack_into(self._buf, self._workers_offset + self._partition * _WORKER.size, 0, 0)
+        self._buf = None
+        try:
+            self._shm.close()
+        except BufferError:
+            pass
+        self._shm = None
+        self._partition = -1
+        self._live_expires = 0
+
+    @property
+    def active(self) -> bool:
+        return self._buf is not None
+
+    # ==================== 写入（本进程分区） ====================
+
+    def heartbeat(self):
+        """刷新本进程分区的心跳，并定期回收空闲的槽位"""
+        if self._buf is None:
+            return
+        now = _now_ms()
+        _INT64.pack_into(self._buf, self._workers_offset + self._partition * _WORKER.size + 8, now)
+        if now >= self._next_reclaim:
+            self._next_reclaim = now + _RECLAIM_INTERVAL_MS
+            self.reclaim(now)
+
+    def reclaim(self, now: int) -> int:
+        """把本分区中空闲的槽位标记为已回收，返回回收数量"""
+        reclaimed = 0
+        with self._lock:
+            for key_id, offset in list(self._index.items()):
+                if self._is_idle(offset, now):
+                    self._release_slot(offset)
+                    del self._index[key_id]
+                    reclaimed += 1
+        if reclaimed:
+            self._reclaimed += reclaimed
+            self._full_warned = False
+            logger.info(f"共享计数回收了 {reclaimed} 个空闲槽位")
+        return reclaimed
+
+    def _is_idle(self, offset: int, now: int) -> bool:
+        """槽位没有进行中的请求，且 _SLOT_IDLE_MS 内没有更新"""
+        buf = self._buf
+        return (_INT64.unpack_from(buf, offset + _FIELD_INFLIGHT)[0] <= 0
+                and now - _INT64.unpack_from(buf, offset + _FIELD_UPDATED)[0] >= _SLOT_IDLE_MS)
+
+    def _release_slot(self, offset: int):
+        """槽位标记为已回收并清零计数（先写墓碑，读者不会把清零后的计数算到原来的 Key 上），调用方持有锁"""
+        _INT64.pack_into(self._buf, offset, _TOMBSTONE)
+        self._buf[offset + 8:offset + _SLOT.size] = bytes(_SLOT.size - 8)
+
+    def _slot(self, key_id: int) -> int:
+        """本分区中 key_id 的槽位偏移（不存在时插入，探测范围内没有可用槽位时返回 -1），调用方持有锁"""
+        offset = self._index.get(key_id)
+        if offset is not None:
+            return offset
+
+        # 本进程写入的 Key 都在 _index 中，这里只需要找插入位置：第一个墓碑，或者第一个空槽位
+        buf = self._buf
+        start = _hash(key_id) % self.capacity
+        free = -1
+        idle = -1
+        now = _now_ms()
+        for i in range(min(_MAX_PROBE, self.capacity)):
+            offset = self._base + ((start + i) % self.capacity) * _SLOT.size
+            tag = _INT64.unpack_from(buf, offset)[0]
+            if tag == _EMPTY:
+                if free < 0:
+                    free = offset
+                break
+            if tag == _TOMBSTONE:
+                if free < 0:
+                    free = offset
+            elif idle < 0 and self._is_idle(offset, now):
+                idle = offset
+
+        if free < 0 and idle >= 0:
+            # 探测范围内都被占用：复用其中空闲的槽位
+            self._index.pop(_INT64.unpack_from(buf, idle)[0], None)
+            self._release_slot(idle)
+            self._reclaimed += 1
+            free = idle
+
+        if free >= 0:
+            _INT64.pack_into(buf, free, key_id)
+            self._index[key_id] = free
+            return free
+
+        if not self._full_warned:
+            self._full_warned = True
+            logger.warning(
+                f"共享计数分区探测范围内没有可用槽位（容量 {self.capacity}，最多探测 {_MAX_PROBE} 个），"
+                f"新 Key 暂不计数，请调大 SHARED_COUNTER_CAPACITY"
+            )
+        return -1
+
+    def add(self, key_id: int, *changes):
+        """本进程分区中指定 Key 的字段累加，changes 为 (字段偏移, 增量) 对"""
+        if self._buf is None or not key_id:
+            return
+        with self._lock:
+            offset = self._slot(key_id)
+            if offset < 0:
+                return
+            buf = self._buf
+            for field, delta in changes:
+                value = _INT64.unpack_from(buf, offset + field)[0]
+                _INT64.pack_into(buf, offset + field, value + delta)
+            _INT64.pack_into(buf, offset + _FIELD_UPDATED, _now_ms())
+
+    # ==================== 读取（所有分区） ====================
+
+    def _live_partitions(self) -> List[int]:
+        """存活 worker 的分区（缓存 _LIVE_CACHE_MS，避免每次读取都扫描 worker 表）"""
+        now = _now_ms()
+        if now < self._live_expires:
+            return self._live
+        partitions = []
+        for partition in range(self.max_workers):
+            owner, heartbeat = _WORKER.unpack_from(self._buf, self._workers_offset + partition * _WORKER.size)
+            if owner and (partition == self._partition or now - heartbeat < _WORKER_STALE_MS):
+                partitions.append(partition)
+        self._live = partitions
+        self._live_expires = now + _LIVE_CACHE_MS
+        return partitions
+
+    def _find(self, partition: int, key_id: int) -> int:
+        """在指定分区中查找 key_id 的槽位偏移（不存在时返回 -1）"""
+        if partition == self._partition:
+            return self._index.get(key_id, -1)
+
+        buf = self._buf
+        base = self._slots_offset + partition * self._partition_size
+        start = _hash(key_id) % self.capacity
+        for i in range(min(_MAX_PROBE, self.capacity)):
+            offset = base + ((start + i) % self.capacity) * _SLOT.size
+            tag = _INT64.unpack_from(buf, offset)[0]
+            if tag == key_id:
+                return offset
+            if tag == _EMPTY:
+                return -1
+        return -1
+
+    def get_inflight(self, key_id: int) -> int:
+        """所有存活 worker 中该 Key 的进行中请求数之和"""
+        if self._buf is None:
+            return 0
+        total = 0
+        for partition in self._live_partitions():
+            offset = self._find(partition, key_id)
+            if offset >= 0:
+                total += _INT64.unpack_from(self._buf, offset + _FIELD_INFLIGHT)[0]
+        return max(total, 0)
+
+    def snapshot(self) -> dict:
+        """汇总所有存活 worker 的计数"""
+        keys: Dict[int, dict] = {}
+        workers = []
+        buf = self._buf
+        for partition in self._live_partitions():
+            owner, heartbeat = _WORKER.unpack_from(buf, self._workers_offset + partition * _WORKER.size)
+            base = self._slots_offset + partition * self._partition_size
+            used = 0
+            for slot in range(self.capacity):
+                key_id, inflight, requests, errors, spend, updated = _SLOT.unpack_from(buf, base + slot * _SLOT.size)
+                if key_id <= 0:
+                    continue
+                used += 1
+                item = keys.get(key_id)
+                if item is None:
+                    item = keys[key_id] = {'key_id': key_id, 'inflight': 0, 'requests': 0, 'errors': 0, 'spend': 0.0, 'updated_at': 0}
+                item['inflight'] += inflight
+                item['requests'] += requests
+                item['errors'] += errors
+                item['spend'] += spend / 1_000_000
+                item['updated_at'] = max(item['updated_at'], updated)
+            workers.append({
+                'partition': partition,
+                'pid': owner,
+                'heartbeat_age_ms': _now_ms() - heartbeat,
+                'used_slots': used,
+                'self': partition == self._partition,
+            })
+
+        for item in keys.values():
+            item['spend'] = round(item['spend'], 6)
+            item['updated_at'] = item['updated_at'] / 1000
+        return {
+            'name': self.name,
+            'partition': self._partition,
+            'capacity': self.capacity,
+            'max_workers': self.max_workers,
+            'reclaimed_slots': self._reclaimed,
+            'workers': workers,
+            'keys': sorted(keys.values(), key=lambda x: (-x['inflight'], -x['requests'])),
+        }
+
+
+def _now_ms() -> int:
+    return int(time.time() * 1000)
+
+
+def _hash(key_id: int) -> int:
+    # 乘法哈希：连续的 key_id 在分区中分散开
+    return (key_id * 0x9E3779B1) & 0xFFFFFFFF
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except (PermissionError, OSError):
+        return True
+    return True
+
+
+def _untrack(shm):
+    """
+    不让 resource_tracker 接管共享内存段（Python 3.13 以前，任一进程退出时 resource_tracker 会删除它创建或连接的内存段，
+    其他 worker 之后启动时就会创建新的内存段，互相看不到计数）
+    """
+    try:
+        from multiprocessing import resource_tracker
+        resource_tracker.unregister(shm._name, 'shared_memory')
+    except Exception:
+        pass
+
+
+def _segment_name() -> str:
+    """同一个数据库文件的 worker 使用同一个内存段"""
+    digest = hashlib.sha1(settings.DATABASE_PATH.encode('utf-8')).hexdigest()[:12]
+    return f"sgpool_{digest}"
+
+
+# 全局共享计数表实例（start() 之前及未启用时所有操作都是空操作）
+_counters = SharedKeyCounters(
+    name=_segment_name(),
+    max_workers=settings.SHARED_COUNTER_MAX_WORKERS,
+    capacity=settings.SHARED_COUNTER_CAPACITY,
+)
+
+
+def start():
+    """连接共享内存并认领分区（在应用启动时调用）"""
+    if not settings.SHARED_COUNTERS_ENABLED or _counters.active:
+        return
+    try:
+        _counters.open()
+    except Exception as e:
+        logger.warning(f"共享计数初始化失败，跨进程计数已禁用: {str(e)}")
+
+
+def stop():
+    """释放分区（在应用关闭时调用）"""
+    _counters.close()
+
+
+def heartbeat():
+    """刷新本进程分区的心跳（由协调任务定期调用）"""
+    _counters.heartbeat()
+
+
+def on_acquire(key_id: int):
+    """Key 被选中：进行中请求数和请求数加 1"""
+    _counters.add(key_id, (_FIELD_INFLIGHT, 1), (_FIELD_REQUESTS, 1))
+
+
+def on_release(key_id: int):
+    """Key 的请求结束：进行中请求数减 1"""
+    _counters.add(key_id, (_FIELD_INFLIGHT, -1))
+
+
+def record_result(context: RequestContext, success: bool):
+    """记录一次尝试的结果（可重试的失败计为 Key 的错误）"""
+    if success or not context.retryable:
+        return
+    if context.api_key_from_pool and context.api_key_entity:
+        _counters.add(context.api_key_entity.id, (_FIELD_ERRORS, 1))
+
+
+def record_spend(key_id: int, amount):
+    """记录 Key 的一次花费"""
+    if not key_id or not amount:
+        return
+    _counters.add(key_id, (_FIELD_SPEND, int(round(float(amount) * 1_000_000))))
+
+
+def get_inflight(key_id: int) -> int:
+    """所有 worker 中该 Key 的进行中请求数之和（未启用时返回 0）"""
+    return _counters.get_inflight(key_id)
+
+
+def is_active() -> bool:
+    """是否已启用跨进程计数"""
+    return _counters.active
+
+
+def get_stats() -> dict:
+    """获取所有 worker 的 Key 计数"""
+    if not _counters.active:
+        return {'enabled': False, 'keys': [], 'workers': []}
+    return {'enabled': True, **_counters.snapshot()}
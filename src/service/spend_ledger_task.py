@@ -0,0 +1,276 @@
+"""Key 花费账本 - 请求花费先在内存中按 Key 累加，定期批量写入 spent / balance；余额耗尽的 Key 立即移出缓存"""
+
+import asyncio
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+from sqlalchemy.orm import Session
+
+from configs.config import settings
+from entity.context import KeyRecord
+from entity.databases.database import SessionLocal
+from service import cache_service, key_event_service, log_writer_service
+from service.databases import key_service
+from utils.logger import logger
+
+
+class SpendLedger:
+    """
+    Key 花费账本
+    
+    - 记录日志时 record() 把花费累加到内存中的 key_id -> 待写入花费（O(1)，不查库）
+    - 剩余余额 = 缓存中 Key 的余额 - 尚未写入的花费；降到 0 及以下时立即发布余额变更事件（缓存池移除该 Key，
+      补充任务补充），并提前唤醒一次写入
+    - 每隔 flush_interval 秒把累计的花费一次性写入数据库（spent += 花费，balance -= 花费，一条批量 UPDATE），
+      写入后用新的余额发布变更事件：本进程缓存更新余额，协调任务同步给其他 worker
+    - 写入失败时花费放回账本，下一次重试
+    - 统计任务不再从请求日志全量重算余额，只做 balance = total_balance - spent 的校正
+    - 全量对账（reconcile()）期间暂停写入：记录花费和提交日志在同一次 log() 调用中完成，
+      对账开始时取出的待写入花费正好对应已提交的日志，这些日志入库后从日志重算 spent（已计入，丢弃这部分花费），
+      之后记录的花费照常写入
+    
+    注意：record() 和写入后的状态更新只在事件循环线程中执行，不需要加锁；数据库写入在线程中执行
+    """
+    
+    def __init__(self, flush_interval: float):
+        """
+        初始化花费账本
+        
+        Args:
+            flush_interval: 写入数据库的间隔（秒）
+        """
+        self.flush_interval = flush_interval
+        self._task: Optional[asyncio.Task] = None
+        self._running = False
+        self._event: Optional[asyncio.Event] = None
+        self._lock = asyncio.Lock()  # 写入和全量对账互斥
+        
+        self._pending: Dict[int, float] = {}  # 尚未写入的花费
+        self._flushing: Dict[int, float] = {}  # 正在写入的花费（写入完成前仍计入剩余余额）
+        self._exhausted: set = set()  # 已因余额耗尽移出缓存、尚未写入的 Key（避免重复发布事件）
+        
+        # 统计信息
+        self._recorded = 0
+        self._recorded_amount = 0.0
+        self._evictions = 0
+        self._flushes = 0
+        self._flushed_keys = 0
+        self._flush_errors = 0
+        self._last_flush_ms = 0
+        self._reconciles = 0
+        self._reconciled_amount = 0.0
+    
+    async def start(self):
+        """启动定时写入任务"""
+        if self._running:
+            logger.warning("花费账本已经在运行中")
+            return
+        
+        self._running = True
+        self._event = asyncio.Event()
+        self._task = asyncio.create_task(self._run_loop())
+        logger.info(f"花费账本已启动，写入间隔: {self.flush_interval}秒")
+    
+    async def stop(self):
+        """停止定时写入任务（等待当前写入完成，再写入剩余的花费）"""
+        if not self._running:
+            return
+        
+        self._running = False
+        if self._task:
+            self._event.set()
+            await self._task
+        
+        await self.flush()
+        logger.info("花费账本已停止")
+    
+    def record(self, key_id: int, amount: float):
+        """记录一次花费（事件循环线程中调用）"""
+        self._pending[key_id] = self._pending.get(key_id, 0.0) + amount
+        self._recorded += 1
+        self._recorded_amount += amount
+        self._check_exhausted(key_id)
+    
+    def _check_exhausted(self, key_id: int):
+        """剩余余额（缓存中的余额 - 尚未写入的花费）降到 0 及以下时立即移出缓存"""
+        if key_id in self._exhausted:
+            return
+        record = cache_service.get_key(key_id)
+        if record is None or record.balance is None:
+            return
+        if float(record.balance) - self.unflushed(key_id) > 0:
+            return
+        
+        # 余额耗尽：立即移出缓存，并尽快写入数据库（其他 worker 和补充任务以数据库中的余额为准）
+        self._exhausted.add(key_id)
+        self._evictions += 1
+        logger.warning(f"💸 Key 余额耗尽，移出缓存: id={key_id}, name={record.name}, 余额: ${float(record.balance):.4f}, 待写入花费: ${self.unflushed(key_id):.4f}")
+        key_event_service.publish(key_event_service.KEY_BALANCE_CHANGED, key_id, None, record)
+        if self._event is not None:
+            self._event.set()
+    
+    def unflushed(self, key_id: int) -> float:
+        """尚未写入数据库的花费"""
+        return self._pending.get(key_id, 0.0) + self._flushing.get(key_id, 0.0)
+    
+    def max_unflushed(self) -> float:
+        """单个 Key 尚未写入的花费的上界"""
+        return max(self._pending.values(), default=0.0) + max(self._flushing.values(), default=0.0)
+    
+    async def _run_loop(self):
+        """任务循环：定时写入，余额耗尽时提前写入"""
+        while self._running:
+            try:
+                try:
+                    await asyncio.wait_for(self._event.wait(), timeout=self.flush_interval)
+                except asyncio.TimeoutError:
+                    pass
+                self._event.clear()
+                await self.flush()
+            
+            except asyncio.CancelledError:
+                break
+            except Exception as e:
+                logger.error(f"花费账本写入失败: {str(e)}")
+                logger.exception(e)
+                # 出错后等待一段时间再重试
+                await asyncio.sleep(5)
+    
+    async def flush(self):
+        """把累计的花费写入数据库，并用新的余额发布变更事件"""
+        async with self._lock:
+            await self._flush()
+    
+    async def _flush(self):
+        if not self._pending or self._flushing:
+            return
+        
+        self._flushing, self._pending = self._pending, {}
+        started = time.monotonic()
+        try:
+            records = await asyncio.to_thread(self._apply, dict(self._flushing))
+        except Exception:
+            # 写入失败：花费放回账本，下一次重试
+            self._flush_errors += 1
+            for key_id, amount in self._flushing.items():
+                self._pending[key_id] = self._pending.get(key_id, 0.0) + amount
+            self._flushing = {}
+            raise
+        
+        flushed = self._flushing
+        self._flushing = {}
+        self._flushes += 1
+        self._flushed_keys += len(flushed)
+        self._last_flush_ms = int((time.monotonic() - started) * 1000)
+        
+        # 批量写入缓存：所有 Key 的新余额只发布一次缓存快照
+        with cache_service.batch():
+            for key_id, record in records:
+                self._exhausted.discard(key_id)
+                key_event_service.publish(key_event_service.KEY_BALANCE_CHANGED, key_id, record)
+        # 写入期间又有新的花费：按新的余额重新检查（批量结束、新快照发布后才能读到新的余额）
+        for key_id, _ in records:
+            if key_id in self._pending:
+                self._check_exhausted(key_id)
+    
+    async def reconcile(self, fn: Callable[[Session], dict]) -> dict:
+        """
+        全量对账：等待当前写入完成并暂停写入，本进程之前提交的日志全部入库后，在日志写入线程中执行 fn(db)
+        （从请求日志重算 spent / balance），成功后丢弃对账开始前记录的待写入花费（已计入日志）
+        
+        数据库不可用或对账失败时，取出的花费放回账本，照常写入
+        
+        Args:
+            fn: 对账函数，返回 update_all_keys_balance 格式的统计信息
+        """
+        async with self._lock:
+            # 对账完成前这部分花费仍计入剩余余额
+            self._flushing, self._pending = self._pending, {}
+            counted = self._flushing
+            try:
+                stats = await asyncio.to_thread(log_writer_service.run_exclusive, fn)
+            except Exception:
+                self._flushing = {}
+                self._restore(counted)
+                raise
+            self._flushing = {}
+            if stats['errors']:
+                self._restore(counted)
+                return stats
+            
+            self._reconciles += 1
+            self._reconciled_amount += sum(counted.values())
+            for key_id in counted:
+                # 对账已按日志中的花费发布新的余额；之后又有新的花费时按新的余额重新检查
+                self._exhausted.discard(key_id)
+                if key_id in self._pending:
+                    self._check_exhausted(key_id)
+            return stats
+    
+    def _restore(self, amounts: Dict[int, float]):
+        """取出的花费放回账本"""
+        for key_id, amount in amounts.items():
+            self._pending[key_id] = self._pending.get(key_id, 0.0) + amount
+    
+    @staticmethod
+    def _apply(amounts: Dict[int, float]) -> List[Tuple[int, Optional[KeyRecord]]]:
+        """写入数据库（在线程中执行，使用独立的数据库 session）"""
+        db = SessionLocal()
+        try:
+            return key_service.apply_key_spend(db, amounts)
+        finally:
+            db.close()
+    
+    def get_stats(self) -> dict:
+        """获取花费账本统计信息"""
+        return {
+            'running': self._running,
+            'flush_interval': self.flush_interval,
+            'pending_keys': len(self._pending),
+            'pending_amount': round(sum(self._pending.values()), 6),
+            'flushing_keys': len(self._flushing),
+            'exhausted_keys': sorted(self._exhausted),
+            'recorded': self._recorded,
+            'recorded_amount': round(self._recorded_amount, 6),
+            'evictions': self._evictions,
+            'flushes': self._flushes,
+            'flushed_keys': self._flushed_keys,
+            'flush_errors': self._flush_errors,
+            'last_flush_ms': self._last_flush_ms,
+            'reconciles': self._reconciles,
+            'reconciled_amount': round(self._reconciled_amount, 6),
+        }
+
+
+# 全局单例
+_ledger: Optional[SpendLedger] = None
+
+
+def get_ledger() -> SpendLedger:
+    """获取全局花费账本实例"""
+    global _ledger
+    if _ledger is None:
+        _ledger = SpendLedger(flush_interval=settings.KEY_SPEND_FLUSH_INTERVAL)
+    return _ledger
+
+
+def record_spend(key_id: int, amount):
+    """记录 Key 的一次计费花费"""
+    if not key_id or not amount:
+        return
+    get_ledger().record(key_id, float(amount))
+
+
+async def reconcile_balances() -> dict:
+    """从请求日志全量对账所有可用 Key 的花费和余额（与花费账本、日志写入对齐，见 SpendLedger.reconcile）"""
+    return await get_ledger().reconcile(key_service.update_all_keys_balance)
+
+
+async def start_ledger_task():
+    """启动花费账本（在应用启动时调用）"""
+    await get_ledger().start()
+
+
+async def stop_ledger_task():
+    """停止花费账本并写入剩余花费（在应用关闭时调用）"""
+    await get_ledger().stop()
@@ -5,6 +5,7 @@ from datetime import date, datetime
 from typing import Optional
 
 from entity.databases.database import SessionLocal
+from service import spend_ledger_task
 from service.databases import stats_service, key_service
 from utils.logger import logger
 
@@ -89,9 +90,14 @@ class StatsTask:
                 logger.info(f"统计上一小时数据: {current_hour - 1}时...")
                 stats_service.calculate_and_save_stats(db, today, target_hour=current_hour - 1)
             
-            # 4. 更新所有可用 Key 的余额
-            logger.info("更新所有可用 Key 的余额...")
-            balance_stats = key_service.update_all_keys_balance(db)
+            # 4. 刷新所有可用 Key 的余额（根据累计花费，不扫描请求日志；累计花费尚未初始化时从请求日志全量对账一次）
+            uninitialized = key_service.count_uninitialized_spent(db)
+            if uninitialized:
+                logger.info(f"{uninitialized} 个 Key 的累计花费尚未初始化，从请求日志全量对账")
+                balance_stats = await spend_ledger_task.reconcile_balances()
+            else:
+                logger.info("刷新所有可用 Key 的余额...")
+                balance_stats = key_service.refresh_keys_balance(db)
             logger.info(
                 f"余额更新完成: 总计 {balance_stats['total_keys']} 个 Key, "
                 f"成功 {balance_stats['updated_keys']} 个, "
@@ -1,15 +1,115 @@
 """响应处理工具"""
 
+import asyncio
 import json
+import weakref
 
-from fastapi.responses import StreamingResponse, JSONResponse
+import anyio
+from fastapi.responses import Response, StreamingResponse, JSONResponse
 
 from constants import PROVIDER_ANTHROPIC
-from service import log_service
+from service import log_service, api_service
 from utils.convert_utils import convert_anthropic_response, convert_anthropic_stream_chunk
+from utils.sse_utils import StreamUsage, AnthropicSSEScanner, OpenAISSEScanner
 from utils.logger import logger
 
 
+# SSE 响应头
+_SSE_HEADERS = {
+    "Cache-Control": "no-cache",
+    "Connection": "keep-alive",
+    "X-Accel-Buffering": "no",
+}
+
+
+async def _close_upstream(response):
+    """
+    关闭上游流，把连接归还给连接池
+    
+    客户端断开时生成器在已取消的作用域中执行 finally，需要屏蔽取消才能完成关闭
+    - SDK AsyncStream: close() 为协程
+    - httpx.Response（透传模式）: aclose() 为协程，close() 为同步方法
+    """
+    close = getattr(response, 'aclose', None) or getattr(response, 'close', None)
+    if close is None:
+        return
+    try:
+        with anyio.CancelScope(shield=True):
+            await close()
+    except Exception as e:
+        logger.warning(f"关闭上游流失败: {str(e)}")
+
+
+def _finish_stream(context, usage, accumulated_content, label: str):
+    """流结束后保存 usage / 响应内容并记录日志（安全处理，不抛出异常；幂等，只执行一次）"""
+    if context.stream_finished:
+        return
+    context.stream_finished = True
+    
+    try:
+        if usage is not None:
+            context.stream_usage = usage
+            logger.debug(f"{label}流式响应 token 统计: {usage}")
+        else:
+            logger.warning(f"{label}流式响应未能获取 token 统计 (provider={context.provider})")
+    except Exception as e:
+        logger.warning(f"保存{label}流式 usage 信息失败: {str(e)}")
+    
+    # 保存累积的响应内容
+    try:
+        if accumulated_content:
+            context.stream_content = ''.join(accumulated_content)
+    except Exception as e:
+        logger.warning(f"保存{label}流式响应内容失败: {str(e)}")
+    
+    # 记录日志并释放 Key 并发名额和调度名额
+    try:
+        log_service.log(context)
+    except Exception as e:
+        logger.error(f"记录{label}流式请求日志失败: {str(e)}")
+    api_service.release_request(context)
+
+
+async def _abandon_stream(context, label: str):
+    """响应体没有开始迭代（客户端提前断开）：关闭上游流、记录日志并释放名额（已结束时不做任何事）"""
+    if context.stream_finished:
+        return
+    logger.warning(f"{label}流式响应未开始发送，客户端已断开: request_id={context.request_id}")
+    context.error = context.error or "Client disconnected before the stream started"
+    await _close_upstream(context.response)
+    _finish_stream(context, None, None, label)
+
+
+def _abandon_stream_later(context, loop, label: str):
+    """终结器：响应对象未被调用就被回收时，在事件循环中补上清理"""
+    if context.stream_finished or loop.is_closed():
+        return
+    loop.call_soon_threadsafe(lambda: loop.create_task(_abandon_stream(context, label)))
+
+
+class _SSEStreamingResponse(StreamingResponse):
+    """
+    SSE 流式响应：保证请求占用的资源（调度名额、Key 并发名额、预留、上游流）一定会释放
+    
+    - 正常情况下由生成器的 finally 关闭上游流、记录日志并释放
+    - 客户端在开始迭代响应体之前断开时生成器不会执行：__call__ 结束时关闭生成器并补上清理
+    - 响应对象没有被调用就被回收时（请求在返回响应后被取消），由终结器补上清理
+    """
+    
+    def __init__(self, context, content, label: str = ""):
+        super().__init__(content, media_type="text/event-stream", headers=_SSE_HEADERS)
+        self._context = context
+        self._label = label
+        weakref.finalize(self, _abandon_stream_later, context, asyncio.get_running_loop(), label)
+    
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            await self.body_iterator.aclose()
+            await _abandon_stream(self._context, self._label)
+
+
 def handle_openai_compatible_stream(context) -> StreamingResponse:
     """
     处理 OpenAI 兼容格式的流式响应
@@ -17,76 +117,63 @@ def handle_openai_compatible_stream(context) -> StreamingResponse:
     支持：
     - OpenAI 原生格式
     - Anthropic 转换为 OpenAI 格式
+    
+    生成器为异步生成器，直接 async for 迭代上游流，每个事件只写一次，不经过线程池
     """
-    def generate():
+    is_anthropic = context.provider == PROVIDER_ANTHROPIC
+    
+    async def generate():
         last_chunk = None
         # Anthropic: 保存第一个 chunk 的 id 和 model
         saved_id = None
         saved_model = None
         # Anthropic: 累积 usage 信息（分散在多个事件中）
-        input_tokens = 0
-        output_tokens = 0
-        cache_creation_tokens = 0
-        cache_read_tokens = 0
-        credits = 0  # 累积 credits
+        stream_usage = StreamUsage()
         # 累积响应内容
         accumulated_content = []
         
         try:
-            for chunk in context.response:
+            async for chunk in context.response:
                 last_chunk = chunk
                 
-                if context.provider == PROVIDER_ANTHROPIC:
-                    chunk_type = chunk.type if hasattr(chunk, 'type') else None
+                if is_anthropic:
+                    chunk_type = getattr(chunk, 'type', None)
                     
-                    # 1. message_start: 包含 usage (input_tokens)
+                    # 1. message_start: 包含 id / model / 初始 usage
                     if chunk_type == "message_start" and hasattr(chunk, 'message'):
-                        if hasattr(chunk.message, 'id'):
-                            saved_id = chunk.message.id
-                        if hasattr(chunk.message, 'model'):
-                            saved_model = chunk.message.model
+                        saved_id = getattr(chunk.message, 'id', None)
+                        saved_model = getattr(chunk.message, 'model', None)
+                        if saved_model:
                             # 保存模型信息到 context，用于日志记录
-                            context.stream_model = chunk.message.model
-                        # message_start 可能包含初始 usage
-                        if hasattr(chunk.message, 'usage') and chunk.message.usage:
-                            usage = chunk.message.usage
-                            if hasattr(usage, 'input_tokens') and usage.input_tokens:
-                                input_tokens = usage.input_tokens
-                            if hasattr(usage, 'cache_creation_input_tokens') and usage.cache_creation_input_tokens:
-                                cache_creation_tokens = usage.cache_creation_input_tokens
-                            if hasattr(usage, 'cache_read_input_tokens') and usage.cache_read_input_tokens:
-                                cache_read_tokens = usage.cache_read_input_tokens
+                            context.stream_model = saved_model
+                        stream_usage.add_message_start(getattr(chunk.message, 'usage', None))
                     
                     # 2. message_delta: 包含增量 usage (output_tokens, credits)
-                    elif chunk_type == "message_delta" and hasattr(chunk, 'usage') and chunk.usage:
-                        usage = chunk.usage
-                        if hasattr(usage, 'output_tokens') and usage.output_tokens:
-                            output_tokens = usage.output_tokens
-                        if hasattr(usage, 'credits') and usage.credits is not None:
-                            credits = usage.credits
+                    elif chunk_type == "message_delta":
+                        stream_usage.add_message_delta(getattr(chunk, 'usage', None))
+                    
+                    # 3. content_block_delta: 累积内容
+                    elif chunk_type == "content_block_delta" and hasattr(chunk, 'delta'):
+                        text = getattr(chunk.delta, 'text', None)
+                        if text:
+                            accumulated_content.append(text)
                     
                     # Anthropic: 转换为 OpenAI 格式
                     chunk_data = convert_anthropic_stream_chunk(chunk, saved_id, saved_model)
                     yield f"data: {chunk_data}\n\n"
-                    
-                    # 累积内容（从 content_block_delta 事件）
-                    if chunk_type == "content_block_delta" and hasattr(chunk, 'delta'):
-                        if hasattr(chunk.delta, 'text'):
-                            accumulated_content.append(chunk.delta.text)
                 else:
                     # OpenAI: 直接使用 SDK 格式
-                    chunk_json = chunk.model_dump_json()
-                    yield f"data: {chunk_json}\n\n"
+                    yield f"data: {chunk.model_dump_json()}\n\n"
                     
                     # OpenAI: 保存模型信息到 context（从第一个 chunk）
-                    if hasattr(chunk, 'model') and chunk.model and not hasattr(context, 'stream_model'):
+                    if chunk.model and not hasattr(context, 'stream_model'):
                         context.stream_model = chunk.model
                     
                     # 累积内容（从 choices[0].delta.content）
-                    if hasattr(chunk, 'choices') and len(chunk.choices) > 0:
-                        delta = chunk.choices[0].delta
-                        if hasattr(delta, 'content') and delta.content:
-                            accumulated_content.append(delta.content)
+                    if chunk.choices:
+                        content = getattr(chunk.choices[0].delta, 'content', None)
+                        if content:
+                            accumulated_content.append(content)
             
             # 发送结束标记
             yield "data: [DONE]\n\n"
@@ -97,55 +184,16 @@ def handle_openai_compatible_stream(context) -> StreamingResponse:
             yield error_msg
             context.error = str(e)
         finally:
-            # 保存 usage 信息（安全处理）
-            try:
-                # Anthropic: 构建累积的 usage 对象
-                if context.provider == PROVIDER_ANTHROPIC and (input_tokens > 0 or output_tokens > 0):
-                    # 创建一个简单的对象来存储累积的 usage
-                    class CumulativeUsage:
-                        def __init__(self, input_tokens, output_tokens, cache_creation, cache_read, credits):
-                            self.input_tokens = input_tokens
-                            self.output_tokens = output_tokens
-                            self.cache_creation_input_tokens = cache_creation
-                            self.cache_read_input_tokens = cache_read
-                            self.credits = credits  # 添加 credits 字段
-                        
-                        def __repr__(self):
-                            return f"CumulativeUsage(input={self.input_tokens}, output={self.output_tokens}, cache_creation={self.cache_creation_input_tokens}, cache_read={self.cache_read_input_tokens}, credits={self.credits})"
-                    
-                    context.stream_usage = CumulativeUsage(input_tokens, output_tokens, cache_creation_tokens, cache_read_tokens, credits)
-                    logger.debug(f"流式响应 token 统计: input={input_tokens}, output={output_tokens}, cache_creation={cache_creation_tokens}, cache_read={cache_read_tokens}, credits={credits}")
-                # OpenAI: 从 last_chunk 获取 usage
-                elif last_chunk and hasattr(last_chunk, 'usage') and last_chunk.usage:
-                    context.stream_usage = last_chunk.usage
-                    logger.debug(f"流式响应 token 统计: {last_chunk.usage}")
-                else:
-                    logger.warning(f"流式响应未能获取 token 统计 (provider={context.provider})")
-            except Exception as e:
-                logger.warning(f"保存流式 usage 信息失败: {str(e)}")
-            
-            # 保存累积的响应内容
-            try:
-                if accumulated_content:
-                    context.stream_content = ''.join(accumulated_content)
-            except Exception as e:
-                logger.warning(f"保存流式响应内容失败: {str(e)}")
+            await _close_upstream(context.response)
             
-            # 记录日志（安全处理，不抛出异常）
-            try:
-                log_service.log(context)
-            except Exception as e:
-                logger.error(f"记录流式请求日志失败: {str(e)}")
+            # Anthropic: 使用累积的 usage；OpenAI: 从 last_chunk 获取 usage
+            if is_anthropic:
+                usage = stream_usage if stream_usage.has_tokens() else None
+            else:
+                usage = getattr(last_chunk, 'usage', None) if last_chunk else None
+            _finish_stream(context, usage, accumulated_content, "")
     
-    return StreamingResponse(
-        generate(),
-        media_type="text/event-stream",
-        headers={
-            "Cache-Control": "no-cache",
-            "Connection": "keep-alive",
-            "X-Accel-Buffering": "no",
-        }
-    )
+    return _SSEStreamingResponse(context, generate(), "")
 
 
 def handle_openai_compatible_response(context) -> JSONResponse:
@@ -163,11 +211,12 @@ def handle_openai_compatible_response(context) -> JSONResponse:
         else:
             response_data = context.response.model_dump()
         
-        # 记录日志（安全处理）
+        # 记录日志（安全处理）并释放 Key 并发名额和调度名额
         try:
             log_service.log(context)
         except Exception as log_err:
             logger.error(f"记录非流式请求日志失败: {str(log_err)}")
+        api_service.release_request(context)
         
         return JSONResponse(content=response_data)
         
@@ -179,6 +228,7 @@ def handle_openai_compatible_response(context) -> JSONResponse:
             log_service.log(context)
         except:
             pass
+        api_service.release_request(context)
         
         return JSONResponse(
             status_code=502,
@@ -198,57 +248,35 @@ def handle_anthropic_native_stream(context) -> StreamingResponse:
     
     直接返回 Anthropic SDK 的原生格式，不做转换
     """
-    def generate():
-        last_chunk = None
+    async def generate():
         # Anthropic: 累积 usage 信息（分散在多个事件中）
-        input_tokens = 0
-        output_tokens = 0
-        cache_creation_tokens = 0
-        cache_read_tokens = 0
-        credits = 0  # 累积 credits
+        stream_usage = StreamUsage()
         # 累积响应内容
         accumulated_content = []
         
         try:
-            for chunk in context.response:
-                last_chunk = chunk
-                # Anthropic: 直接使用原生格式
-                chunk_json = chunk.model_dump_json()
+            async for chunk in context.response:
+                chunk_type = getattr(chunk, 'type', None)
                 
-                chunk_type = chunk.type if hasattr(chunk, 'type') else None
-                
-                # 1. message_start: 包含 usage (input_tokens)
+                # 1. message_start: 包含 model 和 usage (input_tokens)
                 if chunk_type == "message_start" and hasattr(chunk, 'message'):
                     # 保存模型信息到 context
-                    if hasattr(chunk.message, 'model') and chunk.message.model:
+                    if getattr(chunk.message, 'model', None):
                         context.stream_model = chunk.message.model
-                    
-                    if hasattr(chunk.message, 'usage') and chunk.message.usage:
-                        usage = chunk.message.usage
-                        if hasattr(usage, 'input_tokens') and usage.input_tokens:
-                            input_tokens = usage.input_tokens
-                        if hasattr(usage, 'cache_creation_input_tokens') and usage.cache_creation_input_tokens:
-                            cache_creation_tokens = usage.cache_creation_input_tokens
-                        if hasattr(usage, 'cache_read_input_tokens') and usage.cache_read_input_tokens:
-                            cache_read_tokens = usage.cache_read_input_tokens
+                    stream_usage.add_message_start(getattr(chunk.message, 'usage', None))
                 
                 # 2. message_delta: 包含增量 usage (output_tokens, credits)
-                elif chunk_type == "message_delta" and hasattr(chunk, 'usage') and chunk.usage:
-                    usage = chunk.usage
-                    if hasattr(usage, 'output_tokens') and usage.output_tokens:
-                        output_tokens = usage.output_tokens
-                    if hasattr(usage, 'credits') and usage.credits is not None:
-                        credits = usage.credits
+                elif chunk_type == "message_delta":
+                    stream_usage.add_message_delta(getattr(chunk, 'usage', None))
                 
-                # Anthropic 流式格式: event: type\ndata: {...}\n\n
-                event_type = chunk.type if hasattr(chunk, 'type') else "unknown"
-                yield f"event: {event_type}\n"
-                yield f"data: {chunk_json}\n\n"
+                # 3. content_block_delta: 累积内容
+                elif chunk_type == "content_block_delta" and hasattr(chunk, 'delta'):
+                    text = getattr(chunk.delta, 'text', None)
+                    if text:
+                        accumulated_content.append(text)
                 
-                # 累积内容（从 content_block_delta 事件）
-                if chunk_type == "content_block_delta" and hasattr(chunk, 'delta'):
-                    if hasattr(chunk.delta, 'text'):
-                        accumulated_content.append(chunk.delta.text)
+                # Anthropic 流式格式: event: type\ndata: {...}\n\n（合并为一次写入）
+                yield f"event: {chunk_type or 'unknown'}\ndata: {chunk.model_dump_json()}\n\n"
             
         except Exception as e:
             logger.error(f"Anthropic 流式响应错误: {str(e)}")
@@ -259,55 +287,94 @@ def handle_anthropic_native_stream(context) -> StreamingResponse:
                     "message": str(e)
                 }
             }
-            yield f"event: error\n"
-            yield f"data: {json.dumps(error_data)}\n\n"
+            yield f"event: error\ndata: {json.dumps(error_data)}\n\n"
             context.error = str(e)
         finally:
-            # 保存 usage 信息（安全处理）
-            try:
-                # Anthropic: 构建累积的 usage 对象
-                if input_tokens > 0 or output_tokens > 0:
-                    # 创建一个简单的对象来存储累积的 usage
-                    class CumulativeUsage:
-                        def __init__(self, input_tokens, output_tokens, cache_creation, cache_read, credits):
-                            self.input_tokens = input_tokens
-                            self.output_tokens = output_tokens
-                            self.cache_creation_input_tokens = cache_creation
-                            self.cache_read_input_tokens = cache_read
-                            self.credits = credits  # 添加 credits 字段
-                        
-                        def __repr__(self):
-                            return f"CumulativeUsage(input={self.input_tokens}, output={self.output_tokens}, cache_creation={self.cache_creation_input_tokens}, cache_read={self.cache_read_input_tokens}, credits={self.credits})"
-                    
-                    context.stream_usage = CumulativeUsage(input_tokens, output_tokens, cache_creation_tokens, cache_read_tokens, credits)
-                    logger.debug(f"Anthropic 流式响应 token 统计: input={input_tokens}, output={output_tokens}, cache_creation={cache_creation_tokens}, cache_read={cache_read_tokens}, credits={credits}")
-                else:
-                    logger.warning(f"Anthropic 流式响应未能获取 token 统计")
-            except Exception as e:
-                logger.warning(f"保存 Anthropic 流式 usage 信息失败: {str(e)}")
-            
-            # 保存累积的响应内容
-            try:
-                if accumulated_content:
-                    context.stream_content = ''.join(accumulated_content)
-            except Exception as e:
-                logger.warning(f"保存 Anthropic 流式响应内容失败: {str(e)}")
+            await _close_upstream(context.response)
+            usage = stream_usage if stream_usage.has_tokens() else None
+            _finish_stream(context, usage, accumulated_content, "Anthropic ")
+    
+    return _SSEStreamingResponse(context, generate(), "Anthropic ")
+
+
+def _passthrough_stream(context, scanner, error_event, label: str) -> StreamingResponse:
+    """
+    透传模式的流式响应（OpenAI / Anthropic 共用）
+    
+    context.response 为未读取的 httpx.Response，上游 SSE 字节原样转发给客户端，
+    不解析为 SDK 对象也不重新序列化；usage / model 由扫描器在旁路增量提取
+    
+    Args:
+        scanner: SSE 扫描器（AnthropicSSEScanner / OpenAISSEScanner）
+        error_event: 上游流中断时发给客户端的错误事件构造函数
+        label: 日志前缀
+    """
+    async def generate():
+        try:
+            async for chunk in context.response.aiter_bytes():
+                scanner.feed(chunk)
+                yield chunk
             
-            # 记录日志（安全处理，不抛出异常）
-            try:
-                log_service.log(context)
-            except Exception as e:
-                logger.error(f"记录 Anthropic 流式请求日志失败: {str(e)}")
+        except Exception as e:
+            logger.error(f"{label}透传流式响应错误: {str(e)}")
+            yield error_event(str(e))
+            context.error = str(e)
+        finally:
+            await _close_upstream(context.response)
+            model = scanner.model
+            if model:
+                context.stream_model = model
+            _finish_stream(context, scanner.usage, scanner.content, label)
     
-    return StreamingResponse(
-        generate(),
-        media_type="text/event-stream",
-        headers={
-            "Cache-Control": "no-cache",
-            "Connection": "keep-alive",
-            "X-Accel-Buffering": "no",
+    return _SSEStreamingResponse(context, generate(), label)
+
+
+def _anthropic_error_event(message: str) -> str:
+    error_data = {
+        "type": "error",
+        "error": {
+            "type": "api_error",
+            "message": message
         }
-    )
+    }
+    return f"event: error\ndata: {json.dumps(error_data)}\n\n"
+
+
+def _openai_error_event(message: str) -> str:
+    return f"data: {json.dumps({'error': f'Stream error: {message}'})}\n\n"
+
+
+def handle_anthropic_passthrough_stream(context) -> StreamingResponse:
+    """处理 Anthropic 原生格式的流式响应（字节透传模式）"""
+    from configs.global_config import global_config
+    
+    scanner = AnthropicSSEScanner(collect_content=global_config.should_log_conversation_content)
+    return _passthrough_stream(context, scanner, _anthropic_error_event, "Anthropic ")
+
+
+def handle_openai_passthrough_stream(context) -> StreamingResponse:
+    """处理 OpenAI 格式的流式响应（字节透传模式，上游自带 data: [DONE] 结束标记）"""
+    from configs.global_config import global_config
+    
+    scanner = OpenAISSEScanner(collect_content=global_config.should_log_conversation_content)
+    return _passthrough_stream(context, scanner, _openai_error_event, "")
+
+
+def handle_openai_passthrough_response(context) -> Response:
+    """
+    处理 OpenAI 格式的非流式响应（透传模式）
+    
+    context.response 为 RawJSONResponse，上游 JSON 字节直接写回，
+    不经过 SDK 解析、model_dump() 和 JSONResponse 二次编码
+    """
+    # 记录日志（安全处理，model / usage 在这里才惰性解析）并释放 Key 并发名额和调度名额
+    try:
+        log_service.log(context)
+    except Exception as log_err:
+        logger.error(f"记录非流式请求日志失败: {str(log_err)}")
+    api_service.release_request(context)
+    
+    return Response(content=context.response.content, media_type="application/json")
 
 
 def handle_anthropic_native_response(context) -> JSONResponse:
@@ -320,11 +387,12 @@ def handle_anthropic_native_response(context) -> JSONResponse:
         # Anthropic: 直接返回原生格式
         response_data = context.response.model_dump()
         
-        # 记录日志（安全处理）
+        # 记录日志（安全处理）并释放 Key 并发名额和调度名额
         try:
             log_service.log(context)
         except Exception as log_err:
             logger.error(f"记录 Anthropic 非流式请求日志失败: {str(log_err)}")
+        api_service.release_request(context)
         
         return JSONResponse(content=response_data)
         
@@ -336,6 +404,7 @@ def handle_anthropic_native_response(context) -> JSONResponse:
             log_service.log(context)
         except:
             pass
+        api_service.release_request(context)
         
         return JSONResponse(
             status_code=502,
@@ -349,7 +418,7 @@ def handle_anthropic_native_response(context) -> JSONResponse:
         )
 
 
-def build_error_response(status_code: int, error_type: str, message: str, code: str = None, format: str = "openai") -> JSONResponse:
+def build_error_response(status_code: int, error_type: str, message: str, code: str = None, format: str = "openai", headers: dict = None) -> JSONResponse:
     """
     构建错误响应
     
@@ -359,6 +428,7 @@ def build_error_response(status_code: int, error_type: str, message: str, code:
         message: 错误消息
         code: 错误代码（可选）
         format: 响应格式 ("openai" 或 "anthropic")
+        headers: 额外的响应头（可选，如 Retry-After）
     """
     if format == "anthropic":
         # Anthropic 错误格式
@@ -380,5 +450,5 @@ def build_error_response(status_code: int, error_type: str, message: str, code:
         if code:
             content["error"]["code"] = code
     
-    return JSONResponse(status_code=status_code, content=content)
+    return JSONResponse(status_code=status_code, content=content, headers=headers)
 
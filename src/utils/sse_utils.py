@@ -0,0 +1,244 @@
+"""SSE 流处理工具"""
+
+import json
+from types import SimpleNamespace
+from typing import Optional
+
+from utils.logger import logger
+
+
+def _get(obj, name: str):
+    """同时支持 SDK 对象（属性）和 JSON 字典（键）"""
+    if isinstance(obj, dict):
+        return obj.get(name)
+    return getattr(obj, name, None)
+
+
+class StreamUsage:
+    """流式响应累积的 usage（Anthropic 的 usage 分散在 message_start 和 message_delta 事件中）"""
+
+    __slots__ = ('input_tokens', 'output_tokens', 'cache_creation_input_tokens', 'cache_read_input_tokens', 'credits')
+
+    def __init__(self):
+        self.input_tokens = 0
+        self.output_tokens = 0
+        self.cache_creation_input_tokens = 0
+        self.cache_read_input_tokens = 0
+        self.credits = 0
+
+    def add_message_start(self, usage):
+        """message_start: 包含 input_tokens 和缓存 token"""
+        if not usage:
+            return
+        if _get(usage, 'input_tokens'):
+            self.input_tokens = _get(usage, 'input_tokens')
+        if _get(usage, 'cache_creation_input_tokens'):
+            self.cache_creation_input_tokens = _get(usage, 'cache_creation_input_tokens')
+        if _get(usage, 'cache_read_input_tokens'):
+            self.cache_read_input_tokens = _get(usage, 'cache_read_input_tokens')
+
+    def add_message_delta(self, usage):
+        """message_delta: 包含 output_tokens 和 credits"""
+        if not usage:
+            return
+        if _get(usage, 'output_tokens'):
+            self.output_tokens = _get(usage, 'output_tokens')
+        if _get(usage, 'credits') is not None:
+            self.credits = _get(usage, 'credits')
+
+    def has_tokens(self) -> bool:
+        return self.input_tokens > 0 or self.output_tokens > 0
+
+    def __repr__(self):
+        return (f"StreamUsage(input={self.input_tokens}, output={self.output_tokens}, "
+                f"cache_creation={self.cache_creation_input_tokens}, cache_read={self.cache_read_input_tokens}, "
+                f"credits={self.credits})")
+
+
+class _SSEScanner:
+    """
+    SSE 字节流增量扫描器基类
+
+    透传模式下上游字节原样转发给客户端，扫描器只在旁路按事件边界（空行）切分，
+    由子类决定哪些事件需要解析
+    """
+
+    def __init__(self, collect_content: bool = False):
+        self.collect_content = collect_content
+        self.content = []
+        self._buffer = b""
+
+    def feed(self, chunk: bytes):
+        """输入一段上游字节（可能包含半个事件，剩余部分留到下一次）"""
+        buffer = self._buffer + chunk if self._buffer else chunk
+        # 兼容 CRLF 换行（\r\n 可能被拆在两个 chunk 之间，所以在拼接后处理）
+        if b"\r" in buffer:
+            buffer = buffer.replace(b"\r\n", b"\n")
+
+        start = 0
+        while True:
+            end = buffer.find(b"\n\n", start)
+            if end < 0:
+                break
+            self._handle_event(buffer, start, end)
+            start = end + 2
+
+        self._buffer = buffer[start:]
+
+    def _handle_event(self, buffer: bytes, start: int, end: int):
+        """处理一个完整事件 buffer[start:end]"""
+        raise NotImplementedError
+
+    @staticmethod
+    def _event_data(buffer: bytes, start: int, end: int) -> bytes:
+        """拼接事件中所有 data: 行的内容"""
+        return b"".join(
+            line[5:].lstrip()
+            for line in buffer[start:end].split(b"\n")
+            if line.startswith(b"data:")
+        )
+
+
+class AnthropicSSEScanner(_SSEScanner):
+    """
+    Anthropic SSE 扫描器
+
+    - 只解析 message_start（model / input usage）和 message_delta（output usage / credits）事件的 JSON
+    - 开启 collect_content 时额外解析 content_block_delta 以累积响应内容
+    - 其余事件只做一次前缀比较，不做 JSON 解析
+    """
+
+    _MESSAGE_START = b"message_start"
+    _MESSAGE_DELTA = b"message_delta"
+    _CONTENT_BLOCK_DELTA = b"content_block_delta"
+
+    def __init__(self, collect_content: bool = False):
+        super().__init__(collect_content)
+        self.model = None
+        self._usage = StreamUsage()
+
+    def _handle_event(self, buffer: bytes, start: int, end: int):
+        if not buffer.startswith(b"event:", start):
+            return
+
+        line_end = buffer.find(b"\n", start, end)
+        if line_end < 0:
+            return
+        name = buffer[start + 6:line_end].strip()
+
+        if name == self._CONTENT_BLOCK_DELTA:
+            if not self.collect_content:
+                return
+        elif name != self._MESSAGE_START and name != self._MESSAGE_DELTA:
+            return
+
+        try:
+            payload = json.loads(self._event_data(buffer, line_end + 1, end))
+        except Exception as e:
+            logger.warning(f"解析 SSE 事件失败: event={name!r}, error={str(e)}")
+            return
+
+        if name == self._MESSAGE_START:
+            message = payload.get('message') or {}
+            self.model = message.get('model') or self.model
+            self._usage.add_message_start(message.get('usage'))
+        elif name == self._MESSAGE_DELTA:
+            self._usage.add_message_delta(payload.get('usage'))
+        else:
+            text = (payload.get('delta') or {}).get('text')
+            if text:
+                self.content.append(text)
+
+    @property
+    def usage(self) -> Optional[StreamUsage]:
+        return self._usage if self._usage.has_tokens() else None
+
+
+class OpenAISSEScanner(_SSEScanner):
+    """
+    OpenAI SSE 扫描器
+
+    model 在第一个 chunk，usage 在最后一个 chunk，中间的 chunk 只保留原始字节引用、不解析；
+    model / usage 在首次访问时才解析（开启 collect_content 时才逐个解析 delta 内容）
+    """
+
+    _DONE = b"[DONE]"
+
+    def __init__(self, collect_content: bool = False):
+        super().__init__(collect_content)
+        self._first = None
+        self._last = None
+
+    def _handle_event(self, buffer: bytes, start: int, end: int):
+        data = self._event_data(buffer, start, end)
+        if not data or data == self._DONE:
+            return
+
+        if self._first is None:
+            self._first = data
+        self._last = data
+
+        if self.collect_content:
+            try:
+                choices = json.loads(data).get('choices') or []
+                content = (choices[0].get('delta') or {}).get('content') if choices else None
+                if content:
+                    self.content.append(content)
+            except Exception as e:
+                logger.warning(f"解析 SSE chunk 失败: {str(e)}")
+
+    @property
+    def model(self) -> Optional[str]:
+        return _loads(self._first).get('model')
+
+    @property
+    def usage(self):
+        return _as_attrs(_loads(self._last).get('usage'))
+
+
+class RawJSONResponse:
+    """
+    透传模式下的非流式响应：保存上游原始 JSON 字节，直接写回客户端
+
+    提供与 SDK 响应对象相同的 model / usage / model_dump() 访问方式（供日志使用），
+    首次访问时才解析 JSON
+    """
+
+    def __init__(self, content: bytes):
+        self.content = content
+        self._data = None
+
+    def _parsed(self) -> dict:
+        if self._data is None:
+            self._data = _loads(self.content)
+        return self._data
+
+    @property
+    def model(self) -> Optional[str]:
+        return self._parsed().get('model')
+
+    @property
+    def usage(self):
+        return _as_attrs(self._parsed().get('usage'))
+
+    def model_dump(self) -> dict:
+        return self._parsed()
+
+
+def _loads(data: Optional[bytes]) -> dict:
+    """解析 JSON 对象（失败时返回空字典）"""
+    if not data:
+        return {}
+    try:
+        result = json.loads(data)
+        return result if isinstance(result, dict) else {}
+    except Exception as e:
+        logger.warning(f"解析上游 JSON 失败: {str(e)}")
+        return {}
+
+
+def _as_attrs(data: Optional[dict]):
+    """把 usage 字典转为属性访问对象（兼容 context_utils 中的 getattr 提取逻辑）"""
+    if not data:
+        return None
+    return SimpleNamespace(**data)